@@ -1,24 +1,49 @@
 import requests
 import logging
 import time
+import gzip
+import hashlib
+import json
+import os
 from typing import Dict, Any, Optional
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_ATTEMPTS = 3
 
 
 class APIClient:
     """TMS Server API client"""
     
-    def __init__(self, server_url: str, api_key: Optional[str] = None):
+    def __init__(self, server_url: str, api_key: Optional[str] = None,
+                 compress_threshold: int = 1024, payload_format: str = 'json'):
         """
         Initialize API client
         
         Args:
             server_url: TMS server URL
             api_key: API authentication key
+            compress_threshold: Gzip request bodies larger than this many bytes (0 disables)
+            payload_format: 'json' or 'msgpack' (needs the msgpack package)
         """
         self.logger = logging.getLogger(__name__)
         self.server_url = server_url.rstrip('/')
         self.api_key = api_key
+        self.backoff_until = {}
+        # PeerNetwork sharing firmware on the store LAN (None: server only)
+        self.peers = None
+        self.compress_threshold = compress_threshold
+        self.payload_format = payload_format
+        if payload_format == 'msgpack' and msgpack is None:
+            self.logger.warning("msgpack is not installed, sending JSON")
+            self.payload_format = 'json'
         self.session = requests.Session()
         self.session.headers.update({
             'Content-Type': 'application/json',
@@ -42,6 +67,106 @@ class APIClient:
             'Authorization': f'Bearer {api_key}'
         })
     
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """
+        Parse a Retry-After header
+        
+        Args:
+            value: Header value (seconds or HTTP date)
+            
+        Returns:
+            Seconds to wait, or None if absent or invalid
+        """
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return None
+    
+    def retry_wait(self, endpoint: str) -> float:
+        """
+        Seconds left before the server accepts requests to an endpoint again
+        
+        Args:
+            endpoint: Endpoint path, e.g. 'agent/logs'
+            
+        Returns:
+            Remaining back-off in seconds (0 if none)
+        """
+        return max(self.backoff_until.get(endpoint, 0) - time.monotonic(), 0)
+    
+    def encode_body(self, payload: Any) -> tuple:
+        """
+        Encode a request body in the configured format
+        
+        Args:
+            payload: JSON-serializable data
+            
+        Returns:
+            (body bytes, extra headers)
+        """
+        if self.payload_format == 'msgpack':
+            body = msgpack.packb(payload, default=str)
+            headers = {'Content-Type': 'application/msgpack'}
+        else:
+            body = json.dumps(payload, default=str).encode('utf-8')
+            headers = {'Content-Type': 'application/json'}
+        
+        if self.compress_threshold and len(body) > self.compress_threshold:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        
+        return body, headers
+    
+    def _request(self, method: str, endpoint: str, **kwargs) -> Optional[requests.Response]:
+        """
+        Send a request unless the server asked us to back off
+        
+        429/503 responses with Retry-After block the endpoint until then. An
+        encoded body refused with 415 is sent once more as plain JSON.
+        
+        Returns:
+            Response, or None while backing off
+        """
+        wait = self.retry_wait(endpoint)
+        if wait > 0:
+            self.logger.debug(f"Skipping {endpoint}: server asked to retry in {wait:.0f}s")
+            return None
+        
+        payload = kwargs.pop('json', None)
+        if payload is None:
+            response = self.session.request(method, f'{self.server_url}/{endpoint}', **kwargs)
+        else:
+            body, headers = self.encode_body(payload)
+            response = self.session.request(
+                method, f'{self.server_url}/{endpoint}', data=body, headers=headers, **kwargs
+            )
+            
+            # Servers without MessagePack or gzip support answer 415; resend
+            # this request as plain JSON and keep the configured format
+            if response.status_code == 415 and headers != {'Content-Type': 'application/json'}:
+                self.logger.warning(f"Server rejected {headers} on {endpoint}, resending as plain JSON")
+                response = self.session.request(
+                    method, f'{self.server_url}/{endpoint}',
+                    data=json.dumps(payload, default=str).encode('utf-8'),
+                    headers={'Content-Type': 'application/json'}, **kwargs
+                )
+        
+        if response.status_code in (429, 503):
+            delay = self.parse_retry_after(response.headers.get('Retry-After'))
+            if delay is not None:
+                self.backoff_until[endpoint] = time.monotonic() + delay
+                self.logger.warning(f"Server throttled {endpoint}, retrying in {delay:.0f}s")
+        
+        return response
+    
     def register(self, registration_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Register agent with server
@@ -53,8 +178,14 @@ class APIClient:
             Registration response
         """
         try:
-            url = f'{self.server_url}/agent/register'
-            response = self.session.post(url, json=registration_data, timeout=30)
+            response = self._request('POST', 'agent/register', json=registration_data, timeout=30)
+            
+            if response is None:
+                return {
+                    'status': 'error',
+                    'message': 'Throttled by server',
+                    'retry_after': self.retry_wait('agent/register')
+                }
             
             if response.status_code == 200:
                 data = response.json()
@@ -93,13 +224,21 @@ class APIClient:
             Server response with commands
         """
         try:
-            url = f'{self.server_url}/agent/heartbeat'
-            response = self.session.post(url, json=heartbeat_data, timeout=30)
+            response = self._request('POST', 'agent/heartbeat', json=heartbeat_data, timeout=30)
+            
+            if response is None or response.status_code in (429, 503):
+                # Come back when the server is ready instead of on our own schedule
+                wait = self.retry_wait('agent/heartbeat')
+                return {'next_heartbeat': wait} if wait > 0 else {}
             
             if response.status_code == 200:
                 data = response.json()
                 self.logger.debug("Heartbeat sent successfully")
                 return data
+            elif response.status_code == 409:
+                # Server lost our delta state; the caller resends a full heartbeat
+                self.logger.info("Server requested a full heartbeat")
+                return {'resync': True}
             else:
                 self.logger.warning(f"Heartbeat failed: {response.status_code}")
                 return {}
@@ -108,6 +247,38 @@ class APIClient:
             self.logger.error(f"Heartbeat error: {e}")
             return {}
     
+    def wait_for_commands(self, serial_number: str, timeout: int) -> Optional[list]:
+        """
+        Long-poll the server for queued commands
+        
+        Args:
+            serial_number: Terminal serial number
+            timeout: Seconds the server may hold the request
+            
+        Returns:
+            List of commands (empty on timeout), or None on error
+        """
+        try:
+            response = self._request(
+                'GET',
+                'agent/commands/wait',
+                params={'serial_number': serial_number, 'timeout': timeout},
+                timeout=timeout + 15
+            )
+            
+            if response is None:
+                return None
+            
+            if response.status_code == 200:
+                return response.json().get('commands', [])
+            else:
+                self.logger.warning(f"Command wait failed: {response.status_code}")
+                return None
+        
+        except Exception as e:
+            self.logger.error(f"Command wait error: {e}")
+            return None
+    
     def send_logs(self, logs: list) -> bool:
         """
         Send logs to server
@@ -119,8 +290,10 @@ class APIClient:
             True if successful
         """
         try:
-            url = f'{self.server_url}/agent/logs'
-            response = self.session.post(url, json={'logs': logs}, timeout=30)
+            response = self._request('POST', 'agent/logs', json={'logs': logs}, timeout=30)
+            
+            if response is None:
+                return False
             
             if response.status_code == 200:
                 self.logger.debug("Logs sent successfully")
@@ -145,8 +318,10 @@ class APIClient:
         """
         try:
             command_id = result.get('command_id')
-            url = f'{self.server_url}/agent/commands/{command_id}/result'
-            response = self.session.post(url, json=result, timeout=30)
+            response = self._request('POST', f'agent/commands/{command_id}/result', json=result, timeout=30)
+            
+            if response is None:
+                return False
             
             if response.status_code == 200:
                 self.logger.debug(f"Command result sent: {command_id}")
@@ -209,33 +384,124 @@ class APIClient:
             self.logger.error(f"Event transmission error: {e}")
             return False
     
-    def download_firmware(self, download_url: str, save_path: str) -> str:
+    def download_firmware(self, download_url: str, save_path: str,
+                          checksum: Optional[str] = None, size: Optional[int] = None) -> str:
         """
-        Download firmware file
+        Download firmware file, resuming interrupted downloads
+        
+        Bytes are written to ``<save_path>.part``. A partial file left by an
+        earlier attempt is continued with a Range request; If-Range carries
+        the expected checksum (the server's ETag), so a different image starts
+        over. SHA-256 is computed while writing, so the image is not read a
+        second time (a resumed prefix is hashed once from disk).
+        
+        With ``peers`` set and a checksum given, agents on the LAN that have
+        the file are tried first (each download is verified the same way),
+        and a finished download is shared with them.
         
         Args:
-            download_url: Firmware download URL
+            download_url: Firmware download URL (absolute, or relative to the server)
             save_path: Path to save firmware
+            checksum: Expected digest, 'sha256:<hex>'
+            size: Expected size in bytes
             
         Returns:
             Path to downloaded file
         """
+        url = urljoin(f'{self.server_url}/', download_url)
+        expected = checksum.split(':', 1)[-1].lower() if checksum else None
+        part_path = f'{save_path}.part'
+        
+        claimed = False
+        if self.peers is not None and expected:
+            sources, claimed = self.peers.find(expected)
+            for host, port in sources:
+                peer_url = f'http://{host}:{port}/blobs/{expected}'
+                self.logger.info(f"Downloading firmware from peer {host}:{port}")
+                try:
+                    digest, length = self._download_part(peer_url, part_path, expected)
+                except requests.RequestException as e:
+                    self.logger.warning(f"Peer download failed ({e})")
+                    continue
+                if digest == expected and (size is None or length == size):
+                    return self._finish_download(part_path, save_path, expected)
+                self.logger.warning(f"Peer sent a different file: sha256 {digest}, {length} bytes")
+                os.remove(part_path)
+        
         try:
-            self.logger.info(f"Downloading firmware from {download_url}")
+            self.logger.info(f"Downloading firmware from {url}")
+            for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+                try:
+                    digest, length = self._download_part(url, part_path, expected)
+                    break
+                except requests.RequestException as e:
+                    if attempt == DOWNLOAD_ATTEMPTS:
+                        self.logger.error(f"Firmware download error: {e}")
+                        raise
+                    self.logger.warning(f"Firmware download interrupted ({e}), resuming")
             
-            response = requests.get(download_url, stream=True, timeout=300)
+            if (expected and digest != expected) or (size is not None and length != size):
+                os.remove(part_path)
+                raise ValueError(f"Firmware verification failed: sha256 {digest}, {length} bytes")
+        finally:
+            if claimed:
+                self.peers.release(expected)
+        
+        return self._finish_download(part_path, save_path, expected)
+    
+    def _finish_download(self, part_path: str, save_path: str, sha256: Optional[str]) -> str:
+        """Move a verified download into place and share it with peers"""
+        os.replace(part_path, save_path)
+        self.logger.info(f"Firmware downloaded: {save_path}")
+        if self.peers is not None and sha256:
+            self.peers.share(save_path, sha256)
+        return save_path
+    
+    def _download_part(self, url: str, part_path: str, etag_hash: Optional[str]):
+        """
+        Fetch the bytes missing from ``part_path``
+        
+        Returns:
+            (sha256 hex digest, size) of the whole file
+        """
+        sha256 = hashlib.sha256()
+        offset = 0
+        if os.path.exists(part_path):
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+                    offset += len(chunk)
+        
+        # Identity encoding keeps byte offsets meaningful
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if etag_hash:
+                headers['If-Range'] = f'"{etag_hash}"'
+        
+        with requests.get(url, headers=headers, stream=True, timeout=300) as response:
+            if response.status_code == 416:
+                if response.headers.get('Content-Range') == f'bytes */{offset}':
+                    return sha256.hexdigest(), offset
+                os.remove(part_path)
+                return self._download_part(url, part_path, etag_hash)
             response.raise_for_status()
             
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
+            resumed = (
+                response.status_code == 206
+                and response.headers.get('Content-Range', '').startswith(f'bytes {offset}-')
+            )
+            if not resumed:
+                # Range ignored or the image changed: start over
+                sha256 = hashlib.sha256()
+                offset = 0
+            with open(part_path, 'ab' if resumed else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                     f.write(chunk)
-            
-            self.logger.info(f"Firmware downloaded: {save_path}")
-            return save_path
+                    sha256.update(chunk)
+                    offset += len(chunk)
         
-        except Exception as e:
-            self.logger.error(f"Firmware download error: {e}")
-            raise
+        return sha256.hexdigest(), offset
     
     def check_firmware_update(self, serial_number: str) -> Optional[Dict[str, Any]]:
         """
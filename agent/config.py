@@ -28,12 +28,16 @@ class Config:
         """Create default configuration file"""
         self.config['Server'] = {
             'url': 'https://tms-api.techcore.com/api/v1',
-            'timeout': '30'
+            'timeout': '30',
+            'compress_threshold': '1024',
+            'payload_format': 'json'
         }
         
         self.config['Agent'] = {
             'version': '1.0.0',
             'heartbeat_interval': '300',
+            'command_wait_timeout': '0',
+            'metric_deadband': '5',
             'auto_update_enabled': 'true',
             'log_level': 'INFO'
         }
@@ -50,6 +54,14 @@ class Config:
             'temp_dir': 'temp'
         }
         
+        self.config['Peers'] = {
+            'enabled': 'true',
+            'multicast_group': '239.255.77.77',
+            'multicast_port': '47777',
+            'interface': '0.0.0.0',
+            'http_port': '0'
+        }
+        
         with open(self.config_file, 'w') as f:
             self.config.write(f)
     
@@ -57,9 +69,13 @@ class Config:
         """Load configuration values"""
         self.server_url = self.config.get('Server', 'url')
         self.server_timeout = self.config.getint('Server', 'timeout')
+        self.compress_threshold = self.config.getint('Server', 'compress_threshold', fallback=1024)
+        self.payload_format = self.config.get('Server', 'payload_format', fallback='json')
         
         self.agent_version = self.config.get('Agent', 'version')
         self.heartbeat_interval = self.config.getint('Agent', 'heartbeat_interval')
+        self.command_wait_timeout = self.config.getint('Agent', 'command_wait_timeout', fallback=0)
+        self.metric_deadband = self.config.getint('Agent', 'metric_deadband', fallback=5)
         self.auto_update_enabled = self.config.getboolean('Agent', 'auto_update_enabled')
         self.log_level = self.config.get('Agent', 'log_level')
         
@@ -71,6 +87,12 @@ class Config:
         self.data_dir = self.config.get('Paths', 'data_dir')
         self.temp_dir = self.config.get('Paths', 'temp_dir')
         
+        self.peers_enabled = self.config.getboolean('Peers', 'enabled', fallback=True)
+        self.peers_group = self.config.get('Peers', 'multicast_group', fallback='239.255.77.77')
+        self.peers_port = self.config.getint('Peers', 'multicast_port', fallback=47777)
+        self.peers_interface = self.config.get('Peers', 'interface', fallback='0.0.0.0')
+        self.peers_http_port = self.config.getint('Peers', 'http_port', fallback=0)
+        
         self._ensure_directories()
         
         self.api_key = self._load_api_key()
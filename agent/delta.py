@@ -0,0 +1,69 @@
+import gzip
+import hashlib
+import struct
+from typing import Tuple
+
+MAGIC = b'TMSDELTA1'
+COPY, DATA, END = b'C', b'D', b'E'
+CHUNK_SIZE = 64 * 1024
+_HEADER = struct.Struct('>32s32sQ')
+_COPY = struct.Struct('>QQ')
+_DATA = struct.Struct('>I')
+
+
+def _read_exact(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated patch")
+    return data
+
+
+def apply_delta(source_path: str, delta_path: str, output_path: str) -> Tuple[str, int]:
+    """
+    Rebuild an image from the installed image and a patch
+    
+    Patches are built by the server (terminals/patches.py), gzip-compressed:
+    MAGIC, source/target sha256 and target size, then COPY (offset, length
+    from the installed image) and DATA (literal bytes) operations until END.
+    
+    Args:
+        source_path: Installed firmware image the patch was built against
+        delta_path: Downloaded patch file
+        output_path: Where to write the rebuilt image
+    
+    Returns:
+        (sha256 hex digest, size) of the rebuilt image
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(source_path, 'rb') as source, gzip.open(delta_path, 'rb') as stream, \
+            open(output_path, 'wb') as out:
+        if _read_exact(stream, len(MAGIC)) != MAGIC:
+            raise ValueError("Not a firmware patch")
+        _read_exact(stream, _HEADER.size)
+        
+        while True:
+            op = _read_exact(stream, 1)
+            if op == END:
+                break
+            if op == COPY:
+                offset, length = _COPY.unpack(_read_exact(stream, _COPY.size))
+                source.seek(offset)
+                while length:
+                    chunk = source.read(min(CHUNK_SIZE, length))
+                    if not chunk:
+                        raise ValueError("Patch reads past the installed image")
+                    length -= len(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            elif op == DATA:
+                (length,) = _DATA.unpack(_read_exact(stream, _DATA.size))
+                chunk = _read_exact(stream, length)
+                sha256.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+            else:
+                raise ValueError(f"Unknown patch operation {op!r}")
+    
+    return sha256.hexdigest(), size
@@ -1,7 +1,10 @@
+import os
 import sys
 import time
+import random
 import signal
 import logging
+import shutil
 import threading
 from datetime import datetime
 from pathlib import Path
@@ -10,6 +13,8 @@ from config import Config
 from terminal_controller import TerminalController
 from api_client import APIClient
 from monitoring import SystemMonitor
+from delta import apply_delta
+from peers import PeerCache, PeerNetwork
 
 
 class TMSAgent:
@@ -23,11 +28,21 @@ class TMSAgent:
         self.logger = logging.getLogger(__name__)
         
         self.terminal = TerminalController(self.config.dll_path)
-        self.api = APIClient(self.config.server_url, self.config.api_key)
+        self.api = APIClient(
+            self.config.server_url,
+            self.config.api_key,
+            compress_threshold=self.config.compress_threshold,
+            payload_format=self.config.payload_format
+        )
         self.monitor = SystemMonitor()
         
         self.running = False
         self.threads = []
+        self.command_lock = threading.Lock()
+        
+        # Delta heartbeats: last state the server acknowledged (None = send full)
+        self.heartbeat_seq = 0
+        self.heartbeat_baseline = None
         
         signal.signal(signal.SIGINT, self.shutdown)
         signal.signal(signal.SIGTERM, self.shutdown)
@@ -59,6 +74,7 @@ class TMSAgent:
             self.logger.error("Server registration failed")
             return False
         
+        self.start_peer_sharing()
         self.start_monitoring_threads()
         
         try:
@@ -124,6 +140,24 @@ class TMSAgent:
             self.logger.error(f"Registration error: {e}")
             return False
     
+    def start_peer_sharing(self):
+        """Share firmware downloads with agents on the store LAN"""
+        if not self.config.peers_enabled:
+            return
+        try:
+            peers = PeerNetwork(
+                PeerCache(Path(self.config.data_dir) / 'peer-cache'),
+                group=self.config.peers_group,
+                port=self.config.peers_port,
+                interface=self.config.peers_interface,
+                http_port=self.config.peers_http_port
+            )
+        except OSError as e:
+            self.logger.warning(f"Peer firmware sharing unavailable: {e}")
+            return
+        peers.start()
+        self.api.peers = peers
+    
     def start_monitoring_threads(self):
         """Start monitoring threads"""
         heartbeat_thread = threading.Thread(
@@ -140,6 +174,14 @@ class TMSAgent:
         terminal_thread.start()
         self.threads.append(terminal_thread)
         
+        if self.config.command_wait_timeout > 0:
+            command_thread = threading.Thread(
+                target=self.command_wait_loop,
+                daemon=True
+            )
+            command_thread.start()
+            self.threads.append(command_thread)
+        
         self.logger.info("Monitoring threads started")
     
     def heartbeat_loop(self):
@@ -165,17 +207,106 @@ class TMSAgent:
                     "ip_address": self.monitor.get_ip_address()
                 }
                 
-                response = self.api.send_heartbeat(heartbeat_data)
+                response = self.send_heartbeat(heartbeat_data)
+                if response.get('resync'):
+                    response = self.send_heartbeat(heartbeat_data)
                 
                 if 'commands' in response:
                     self.process_commands(response['commands'])
                 
+                delay = response.get('next_heartbeat')
                 self.logger.debug("Heartbeat transmission complete")
             
             except Exception as e:
                 self.logger.error(f"Heartbeat error: {e}")
+                self.heartbeat_baseline = None
+                delay = None
+            
+            time.sleep(self.next_heartbeat_delay(delay))
+    
+    def send_heartbeat(self, snapshot):
+        """
+        Send a heartbeat, as a delta against the last acknowledged one if possible
+        
+        Anything other than an acknowledgement (including a resync request)
+        drops the baseline, so the next heartbeat is a full snapshot.
+        """
+        self.heartbeat_seq += 1
+        payload, state = self.build_heartbeat(snapshot)
+        response = self.api.send_heartbeat(payload)
+        self.heartbeat_baseline = state if response.get('status') == 'acknowledged' else None
+        return response
+    
+    def build_heartbeat(self, snapshot):
+        """
+        Returns (payload, state the server holds once it accepts the payload)
+        
+        Deltas carry changed fields only; metrics are sent once they move
+        at least metric_deadband away from the last value sent.
+        """
+        baseline = self.heartbeat_baseline
+        if baseline is None:
+            return {**snapshot, "seq": self.heartbeat_seq}, snapshot
+        
+        payload = {
+            "serial_number": snapshot["serial_number"],
+            "seq": self.heartbeat_seq,
+            "full": False,
+            "timestamp": snapshot["timestamp"]
+        }
+        for field, value in snapshot.items():
+            if field not in payload and field != "metrics" and baseline.get(field) != value:
+                payload[field] = value
+        
+        moved = {
+            name: value for name, value in snapshot["metrics"].items()
+            if self.metric_moved(baseline["metrics"].get(name), value)
+        }
+        if moved:
+            payload["metrics"] = moved
+        
+        state = {**baseline, **payload, "metrics": {**baseline["metrics"], **moved}}
+        return payload, state
+    
+    def metric_moved(self, previous, current):
+        """True when a metric changed by at least the configured deadband"""
+        if previous is None or current is None:
+            return previous != current
+        return abs(current - previous) >= self.config.metric_deadband
+    
+    def next_heartbeat_delay(self, server_delay):
+        """
+        Seconds to wait before the next heartbeat
+        
+        The server spreads the fleet over the interval and returns the delay
+        in next_heartbeat. Without it, jitter keeps agents from re-aligning.
+        """
+        if isinstance(server_delay, (int, float)) and server_delay > 0:
+            return server_delay
+        return self.config.heartbeat_interval * random.uniform(0.8, 1.2)
+    
+    def command_wait_loop(self):
+        """Long-poll loop delivering commands between heartbeats"""
+        retry_delay = 5
+        
+        while self.running:
+            try:
+                serial_number = self.terminal.get_device_info().get('serial_number')
+                commands = self.api.wait_for_commands(serial_number, self.config.command_wait_timeout)
+                
+                if commands is None:
+                    # Back off while the server is unreachable
+                    time.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, self.config.heartbeat_interval)
+                    continue
+                
+                retry_delay = 5
+                if commands:
+                    self.process_commands(commands)
             
-            time.sleep(self.config.heartbeat_interval)
+            except Exception as e:
+                self.logger.error(f"Command wait error: {e}")
+                time.sleep(retry_delay)
     
     def terminal_monitor_loop(self):
         """Terminal monitoring loop"""
@@ -227,7 +358,11 @@ class TMSAgent:
             time.sleep(30)
     
     def process_commands(self, commands):
-        """Process remote commands"""
+        """Process remote commands (heartbeat and command-wait loops share this)"""
+        with self.command_lock:
+            self._process_commands(commands)
+    
+    def _process_commands(self, commands):
         for command in commands:
             try:
                 self.logger.info(f"Executing command: {command.get('type')}")
@@ -271,15 +406,22 @@ class TMSAgent:
         try:
             self.logger.info(f"Starting firmware update: {update_info.get('version')}")
             
-            firmware_file = Path(self.config.temp_dir) / 'firmware.bin'
+            # Per-version name so an interrupted download is only resumed for the same image
+            firmware_file = Path(self.config.temp_dir) / f"firmware-{update_info.get('version')}.bin"
             
-            if update_info.get('url'):
-                self.api.download_firmware(update_info['url'], str(firmware_file))
+            # A delta patch from the installed image, when offered, saves most of the download
+            rebuilt = update_info.get('delta') and self.apply_firmware_delta(update_info, firmware_file)
+            if not rebuilt and update_info.get('url'):
+                self.api.download_firmware(
+                    update_info['url'], str(firmware_file),
+                    checksum=update_info.get('checksum'), size=update_info.get('size')
+                )
             
             result = self.terminal.update_firmware(str(firmware_file))
             
             if result.get('success'):
                 self.logger.info("Firmware update complete")
+                self.keep_current_firmware(firmware_file, update_info.get('checksum'))
                 
                 self.api.send_update_result({
                     "serial_number": self.terminal.serial_number,
@@ -301,6 +443,59 @@ class TMSAgent:
                 "timestamp": datetime.now().isoformat()
             })
     
+    def current_firmware(self):
+        """Installed firmware image kept for delta updates, and its checksum sidecar"""
+        directory = Path(self.config.data_dir) / 'firmware'
+        return directory / 'current.bin', directory / 'current.sha256'
+    
+    def apply_firmware_delta(self, update_info, firmware_file):
+        """
+        Rebuild the new image from the installed one and a delta patch
+        
+        Returns False (the caller downloads the full image) when the installed
+        image is not the patch's source or the rebuilt image does not verify.
+        """
+        delta = update_info['delta']
+        current, sidecar = self.current_firmware()
+        try:
+            if not current.is_file() or sidecar.read_text().strip() != delta.get('source_checksum'):
+                return False
+            
+            delta_file = Path(self.config.temp_dir) / f"firmware-{update_info.get('version')}.delta"
+            self.api.download_firmware(
+                delta['url'], str(delta_file), checksum=delta.get('checksum'), size=delta.get('size')
+            )
+            try:
+                digest, size = apply_delta(str(current), str(delta_file), str(firmware_file))
+            finally:
+                os.remove(delta_file)
+            
+            expected = (update_info.get('checksum') or '').split(':', 1)[-1].lower()
+            if digest != expected or (update_info.get('size') is not None and size != update_info['size']):
+                raise ValueError(f"Rebuilt image does not verify: sha256 {digest}, {size} bytes")
+            
+            self.logger.info(f"Firmware rebuilt from delta of {delta.get('source_version')}")
+            return True
+        
+        except Exception as e:
+            self.logger.warning(f"Delta update unavailable ({e}), downloading full image")
+            if firmware_file.exists():
+                os.remove(firmware_file)
+            return False
+    
+    def keep_current_firmware(self, firmware_file, checksum):
+        """Keep the installed image as the source of the next delta update"""
+        if not checksum:
+            return
+        try:
+            current, sidecar = self.current_firmware()
+            current.parent.mkdir(parents=True, exist_ok=True)
+            sidecar.unlink(missing_ok=True)
+            shutil.move(str(firmware_file), str(current))
+            sidecar.write_text(checksum)
+        except OSError as e:
+            self.logger.warning(f"Could not keep installed firmware image: {e}")
+    
     def update_configuration(self, config_params):
         """Update configuration"""
         try:
@@ -323,6 +518,9 @@ class TMSAgent:
         for thread in self.threads:
             thread.join(timeout=5)
         
+        if self.api.peers is not None:
+            self.api.peers.stop()
+        
         try:
             self.api.send_event({
                 "type": "agent_shutdown",
@@ -0,0 +1,324 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import socket
+import struct
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+RANGE_RE = re.compile(r'^bytes=(\d+)-$')
+PEER_CHUNK_SIZE = 64 * 1024
+# Seconds between "want" queries while a peer is fetching, and how many
+# unanswered queries mean that peer is gone
+POLL_INTERVAL = 2
+POLL_MISSES = 3
+
+
+class PeerCache:
+    """Firmware blobs this agent shares with peers, keyed by SHA-256"""
+    
+    def __init__(self, directory: str, max_blobs: int = 3):
+        """
+        Initialize peer cache
+        
+        Args:
+            directory: Cache directory
+            max_blobs: Blobs kept; the oldest are dropped first
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_blobs = max_blobs
+    
+    def path(self, sha256: str) -> Optional[Path]:
+        """Path of a cached blob, or None if it is not cached"""
+        if not SHA256_RE.match(sha256 or ''):
+            return None
+        path = self.directory / sha256
+        return path if path.is_file() else None
+    
+    def add(self, file_path: str, sha256: str):
+        """
+        Cache a verified file
+        
+        Args:
+            file_path: File whose SHA-256 was already checked
+            sha256: Its SHA-256 hex digest
+        """
+        if not SHA256_RE.match(sha256) or self.path(sha256):
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        os.remove(temp_path)
+        try:
+            # A hard link costs no space; the installer may move the original
+            os.link(file_path, temp_path)
+        except OSError:
+            shutil.copyfile(file_path, temp_path)
+        os.replace(temp_path, self.directory / sha256)
+        
+        blobs = sorted(
+            (path for path in self.directory.iterdir() if SHA256_RE.match(path.name)),
+            key=lambda path: path.stat().st_mtime
+        )
+        for path in blobs[:-self.max_blobs]:
+            path.unlink(missing_ok=True)
+
+
+class _BlobRequestHandler(BaseHTTPRequestHandler):
+    """Serves GET /blobs/<sha256>, resuming with single open-ended ranges"""
+    
+    server_version = 'TMS-Agent-Peer/1.0'
+    
+    def do_GET(self):
+        cache = self.server.cache
+        name = self.path.rsplit('/', 1)[-1]
+        path = cache.path(name) if self.path.startswith('/blobs/') else None
+        if path is None:
+            self.send_error(404)
+            return
+        
+        size = path.stat().st_size
+        etag = f'"{name}"'
+        start = 0
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) == etag:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        
+        with open(path, 'rb') as f:
+            self.send_response(206 if start else 200)
+            if start:
+                self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(size - start))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            f.seek(start)
+            shutil.copyfileobj(f, self.wfile, PEER_CHUNK_SIZE)
+    
+    def log_message(self, format, *args):
+        self.server.logger.debug("Peer request: " + format, *args)
+
+
+class PeerNetwork:
+    """
+    Firmware sharing between agents on the same LAN
+    
+    Agents talk over UDP multicast with small JSON messages:
+    
+    - want <sha256>: asked before downloading; holders answer "have" and an
+      agent downloading it from the origin answers "fetching"
+    - have <sha256>, <http port>: the blob can be fetched from the sender
+    - fetching <sha256>: the sender is downloading it from the origin
+    
+    When nobody has the blob, the agent claims it with "fetching"; of agents
+    claiming at the same time the smallest node id wins and the others wait
+    for its "have", so a site downloads each image over the WAN once. Blobs
+    are served by a small HTTP server; downloaders verify the SHA-256 before
+    use, so a peer is never trusted.
+    """
+    
+    def __init__(self, cache: PeerCache, group: str = '239.255.77.77', port: int = 47777,
+                 interface: str = '0.0.0.0', http_port: int = 0,
+                 claim_window: float = 0.5, fetch_wait: float = 600):
+        """
+        Initialize peer network
+        
+        Args:
+            cache: Blobs served to peers
+            group: Multicast group
+            port: Multicast UDP port (shared by every agent on the LAN)
+            interface: Local address for multicast ('127.0.0.1' for agents on one host)
+            http_port: Port of the blob server (0 picks a free one)
+            claim_window: Seconds to wait for answers and competing claims
+            fetch_wait: Longest wait for a peer downloading from the origin
+        """
+        self.logger = logging.getLogger(__name__)
+        self.cache = cache
+        self.group = group
+        self.port = port
+        self.interface = interface
+        self.claim_window = claim_window
+        self.fetch_wait = fetch_wait
+        self.node = uuid.uuid4().hex
+        
+        self.condition = threading.Condition()
+        self.sources = {}    # sha256 -> {node: (host, port)}
+        self.fetchers = {}   # sha256 -> {node: last seen}
+        self.fetching = set()
+        self.running = False
+        
+        self.http = ThreadingHTTPServer(
+            ('' if interface == '0.0.0.0' else interface, http_port), _BlobRequestHandler
+        )
+        self.http.daemon_threads = True
+        self.http.cache = cache
+        self.http.logger = self.logger
+        self.http_port = self.http.server_address[1]
+        self.socket = self._multicast_socket()
+    
+    def _multicast_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            # Lets several agents on one host share the port
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.port))
+        interface = socket.inet_aton(self.interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                        struct.pack('4s4s', socket.inet_aton(self.group), interface))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.settimeout(1)
+        return sock
+    
+    def start(self):
+        """Start the listener and the blob server"""
+        self.running = True
+        for target in (self._listen, self.http.serve_forever):
+            threading.Thread(target=target, daemon=True).start()
+        self.logger.info(f"Sharing firmware with peers on port {self.http_port}")
+    
+    def stop(self):
+        """Stop sharing"""
+        self.running = False
+        self.http.shutdown()
+        self.http.server_close()
+        self.socket.close()
+    
+    def _send(self, kind: str, sha256: str):
+        message = json.dumps({
+            'type': kind, 'sha256': sha256, 'node': self.node, 'port': self.http_port
+        }).encode()
+        try:
+            # Answers go to the group too: agents on one host share the port,
+            # so a unicast reply would reach any one of them
+            self.socket.sendto(message, (self.group, self.port))
+        except OSError as e:
+            self.logger.debug(f"Peer message not sent: {e}")
+    
+    def _listen(self):
+        while self.running:
+            try:
+                data, address = self.socket.recvfrom(4096)
+                message = json.loads(data)
+                kind, sha256, node = message['type'], message['sha256'], message['node']
+            except socket.timeout:
+                continue
+            except (OSError, ValueError, KeyError, TypeError):
+                if not self.running:
+                    break
+                continue
+            if node == self.node:
+                continue
+            
+            if kind == 'want':
+                if self.cache.path(sha256):
+                    self._send('have', sha256)
+                elif sha256 in self.fetching:
+                    self._send('fetching', sha256)
+                continue
+            with self.condition:
+                if kind == 'have':
+                    self.sources.setdefault(sha256, {})[node] = (address[0], int(message['port']))
+                    self.fetchers.get(sha256, {}).pop(node, None)
+                elif kind == 'fetching':
+                    self.fetchers.setdefault(sha256, {})[node] = time.monotonic()
+                self.condition.notify_all()
+    
+    def _ask(self, sha256: str, timeout: float) -> Tuple[List[Tuple[str, int]], List[str]]:
+        """Query the LAN; returns (peers that have the blob, nodes fetching it)"""
+        asked = time.monotonic()
+        self._send('want', sha256)
+        with self.condition:
+            self.condition.wait_for(lambda: self.sources.get(sha256), timeout=timeout)
+            sources = list(self.sources.get(sha256, {}).values())
+            fetchers = [node for node, seen in self.fetchers.get(sha256, {}).items() if seen >= asked]
+        return sources, fetchers
+    
+    def find(self, sha256: str) -> Tuple[List[Tuple[str, int]], bool]:
+        """
+        Peers to download a blob from
+        
+        Waits while another agent downloads it from the origin.
+        
+        Returns:
+            (peer addresses, claimed): with no peers and claimed True, this
+            agent downloads from the origin and must call release() after
+        """
+        started = time.monotonic()
+        deadline = started + self.fetch_wait
+        sources, fetchers = self._ask(sha256, self.claim_window)
+        if sources:
+            return sources, False
+        
+        if not fetchers:
+            # Nobody has it: claim the download, yielding to a smaller node id
+            with self.condition:
+                self.fetching.add(sha256)
+            self._send('fetching', sha256)
+            time.sleep(self.claim_window)
+            with self.condition:
+                rivals = [
+                    node for node, seen in self.fetchers.get(sha256, {}).items()
+                    if seen >= started and node < self.node
+                ]
+                if not rivals:
+                    return [], True
+                self.fetching.discard(sha256)
+        
+        misses = 0
+        while time.monotonic() < deadline and misses < POLL_MISSES:
+            sources, fetchers = self._ask(sha256, POLL_INTERVAL)
+            if sources:
+                return sources, False
+            misses = 0 if fetchers else misses + 1
+        self.logger.info("No peer finished the firmware download, using the server")
+        return [], False
+    
+    def release(self, sha256: str):
+        """End a claimed download (the blob is announced by share())"""
+        with self.condition:
+            self.fetching.discard(sha256)
+    
+    def share(self, file_path: str, sha256: str):
+        """Cache a verified download and announce it"""
+        try:
+            self.cache.add(file_path, sha256)
+        except OSError as e:
+            self.logger.warning(f"Could not share firmware with peers: {e}")
+            return
+        self.release(sha256)
+        self._send('have', sha256)
+
+
+if __name__ == '__main__':
+    # Manual test: start several of these at once on one host, e.g.
+    #   for i in 1 2 3; do python peers.py http://server/firmware.bin <sha256> /tmp/peer$i & done
+    # Only one should download from the URL; the others fetch from it.
+    import sys
+    from api_client import APIClient
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(message)s')
+    url, sha256, directory = sys.argv[1:4]
+    client = APIClient(url)
+    client.peers = PeerNetwork(PeerCache(Path(directory) / 'peer-cache'), interface='127.0.0.1')
+    client.peers.start()
+    client.download_firmware(url, str(Path(directory) / 'firmware.bin'), checksum=f'sha256:{sha256}')
+    # Keep serving peers that are still downloading
+    time.sleep(float(sys.argv[4]) if len(sys.argv) > 4 else 10)
+    client.peers.stop()
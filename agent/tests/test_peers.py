@@ -0,0 +1,255 @@
+import hashlib
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+import peers
+from api_client import APIClient
+from peers import PeerCache, PeerNetwork
+
+FIRMWARE = os.urandom(200 * 1024)
+FIRMWARE_SHA256 = hashlib.sha256(FIRMWARE).hexdigest()
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class _OriginHandler(BaseHTTPRequestHandler):
+    """Firmware download endpoint of the server"""
+    
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(FIRMWARE)))
+        self.end_headers()
+        self.wfile.write(FIRMWARE)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class PeerTestCase(unittest.TestCase):
+    """Agents sharing one multicast port on the loopback interface"""
+    
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.port = free_udp_port()
+        self.networks = []
+    
+    def tearDown(self):
+        for network in self.networks:
+            network.stop()
+    
+    def network(self, name, **kwargs):
+        kwargs.setdefault('claim_window', 0.2)
+        network = PeerNetwork(
+            PeerCache(self.directory / name), port=self.port, interface='127.0.0.1', **kwargs
+        )
+        network.start()
+        self.networks.append(network)
+        return network
+    
+    def write(self, name, data):
+        path = self.directory / name
+        path.write_bytes(data)
+        return str(path)
+    
+    def origin(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _OriginHandler)
+        server.daemon_threads = True
+        server.requests = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+    
+    def client(self, origin, network):
+        client = APIClient(f'http://127.0.0.1:{origin.server_address[1]}')
+        client.peers = network
+        return client
+
+
+class PeerServingTest(PeerTestCase):
+    """Blob server test"""
+    
+    def test_serves_shared_blob(self):
+        """A shared blob is found over multicast and served with its hash"""
+        holder = self.network('holder')
+        holder.share(self.write('firmware.bin', FIRMWARE), FIRMWARE_SHA256)
+        
+        sources, claimed = self.network('seeker').find(FIRMWARE_SHA256)
+        
+        self.assertEqual(sources, [('127.0.0.1', holder.http_port)])
+        self.assertFalse(claimed)
+        response = requests.get(f'http://127.0.0.1:{holder.http_port}/blobs/{FIRMWARE_SHA256}', timeout=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], f'"{FIRMWARE_SHA256}"')
+        self.assertEqual(hashlib.sha256(response.content).hexdigest(), FIRMWARE_SHA256)
+    
+    def test_resumes_with_range(self):
+        """A Range request returns the rest of the blob unless If-Range names another one"""
+        holder = self.network('holder')
+        holder.share(self.write('firmware.bin', FIRMWARE), FIRMWARE_SHA256)
+        url = f'http://127.0.0.1:{holder.http_port}/blobs/{FIRMWARE_SHA256}'
+        
+        response = requests.get(url, headers={'Range': 'bytes=1000-', 'If-Range': f'"{FIRMWARE_SHA256}"'}, timeout=5)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], f'bytes 1000-{len(FIRMWARE) - 1}/{len(FIRMWARE)}')
+        self.assertEqual(response.content, FIRMWARE[1000:])
+        
+        response = requests.get(url, headers={'Range': 'bytes=1000-', 'If-Range': '"other"'}, timeout=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, FIRMWARE)
+        
+        response = requests.get(url, headers={'Range': f'bytes={len(FIRMWARE)}-'}, timeout=5)
+        self.assertEqual(response.status_code, 416)
+    
+    def test_unknown_blob_is_not_found(self):
+        holder = self.network('holder')
+        
+        response = requests.get(f'http://127.0.0.1:{holder.http_port}/blobs/{FIRMWARE_SHA256}', timeout=5)
+        
+        self.assertEqual(response.status_code, 404)
+    
+    def test_download_from_peer(self):
+        """A verified peer download skips the server and is shared in turn"""
+        holder = self.network('holder')
+        holder.share(self.write('firmware.bin', FIRMWARE), FIRMWARE_SHA256)
+        origin = self.origin()
+        seeker = self.network('seeker')
+        save_path = str(self.directory / 'downloaded.bin')
+        
+        self.client(origin, seeker).download_firmware(
+            '/firmware.bin', save_path, checksum=f'sha256:{FIRMWARE_SHA256}', size=len(FIRMWARE)
+        )
+        
+        self.assertEqual(Path(save_path).read_bytes(), FIRMWARE)
+        self.assertEqual(origin.requests, 0)
+        self.assertIsNotNone(seeker.cache.path(FIRMWARE_SHA256))
+
+
+class PeerFallbackTest(PeerTestCase):
+    """Server fallback test"""
+    
+    def test_wrong_hash_falls_back_to_server(self):
+        """A peer serving other bytes under the hash is ignored"""
+        liar = self.network('liar')
+        # Bypass share(): the cache trusts that its files were verified
+        Path(liar.cache.directory, FIRMWARE_SHA256).write_bytes(b'tampered' * 1000)
+        origin = self.origin()
+        seeker = self.network('seeker')
+        save_path = str(self.directory / 'downloaded.bin')
+        
+        self.client(origin, seeker).download_firmware(
+            '/firmware.bin', save_path, checksum=f'sha256:{FIRMWARE_SHA256}'
+        )
+        
+        self.assertEqual(Path(save_path).read_bytes(), FIRMWARE)
+        self.assertEqual(origin.requests, 1)
+        self.assertFalse(Path(f'{save_path}.part').exists())
+        # Only the verified download is shared
+        self.assertEqual(seeker.cache.path(FIRMWARE_SHA256).read_bytes(), FIRMWARE)
+    
+    def test_unreachable_peer_falls_back_to_server(self):
+        """A peer that answers "have" but refuses connections is skipped"""
+        dead = self.network('dead')
+        dead.share(self.write('firmware.bin', FIRMWARE), FIRMWARE_SHA256)
+        dead.http.shutdown()
+        dead.http.server_close()
+        origin = self.origin()
+        save_path = str(self.directory / 'downloaded.bin')
+        
+        self.client(origin, self.network('seeker')).download_firmware(
+            '/firmware.bin', save_path, checksum=f'sha256:{FIRMWARE_SHA256}'
+        )
+        
+        self.assertEqual(Path(save_path).read_bytes(), FIRMWARE)
+        self.assertEqual(origin.requests, 1)
+    
+    def test_mismatched_server_download_fails(self):
+        """The server download is verified too"""
+        origin = self.origin()
+        save_path = str(self.directory / 'downloaded.bin')
+        
+        with self.assertRaises(ValueError):
+            self.client(origin, self.network('seeker')).download_firmware(
+                '/firmware.bin', save_path, checksum=f'sha256:{"0" * 64}'
+            )
+        
+        self.assertFalse(Path(save_path).exists())
+        self.assertFalse(Path(f'{save_path}.part').exists())
+
+
+@mock.patch.object(peers, 'POLL_INTERVAL', 0.2)
+class PeerTimeoutTest(PeerTestCase):
+    """Peer discovery timeout test"""
+    
+    def test_claims_when_nobody_answers(self):
+        """With no peers the agent claims the download after the claim window"""
+        seeker = self.network('seeker')
+        
+        started = time.monotonic()
+        sources, claimed = seeker.find(FIRMWARE_SHA256)
+        
+        self.assertEqual(sources, [])
+        self.assertTrue(claimed)
+        self.assertLess(time.monotonic() - started, 2)
+        seeker.release(FIRMWARE_SHA256)
+        self.assertNotIn(FIRMWARE_SHA256, seeker.fetching)
+    
+    def test_waits_for_fetching_peer(self):
+        """A peer claiming the download is waited for until it shares the blob"""
+        fetcher = self.network('fetcher')
+        sources, claimed = fetcher.find(FIRMWARE_SHA256)
+        self.assertTrue(claimed)
+        threading.Timer(
+            0.5, fetcher.share, (self.write('firmware.bin', FIRMWARE), FIRMWARE_SHA256)
+        ).start()
+        
+        sources, claimed = self.network('seeker').find(FIRMWARE_SHA256)
+        
+        self.assertEqual(sources, [('127.0.0.1', fetcher.http_port)])
+        self.assertFalse(claimed)
+    
+    def test_gives_up_after_fetch_wait(self):
+        """A peer that never finishes its download is waited for fetch_wait at most"""
+        fetcher = self.network('fetcher')
+        self.assertTrue(fetcher.find(FIRMWARE_SHA256)[1])
+        seeker = self.network('seeker', fetch_wait=1)
+        
+        started = time.monotonic()
+        sources, claimed = seeker.find(FIRMWARE_SHA256)
+        
+        self.assertEqual((sources, claimed), ([], False))
+        self.assertGreaterEqual(time.monotonic() - started, 1)
+        self.assertLess(time.monotonic() - started, 3)
+    
+    def test_gives_up_on_silent_fetcher(self):
+        """A fetching peer that stops answering is dropped after POLL_MISSES queries"""
+        fetcher = self.network('fetcher')
+        self.assertTrue(fetcher.find(FIRMWARE_SHA256)[1])
+        seeker = self.network('seeker', fetch_wait=60)
+        # The fetcher goes away without releasing its claim
+        threading.Timer(0.5, fetcher.fetching.discard, (FIRMWARE_SHA256,)).start()
+        
+        started = time.monotonic()
+        sources, claimed = seeker.find(FIRMWARE_SHA256)
+        
+        self.assertEqual((sources, claimed), ([], False))
+        self.assertLess(time.monotonic() - started, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
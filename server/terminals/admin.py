@@ -1,8 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import (
-    TMSUser, Customer, Terminal, Alert, FirmwareVersion,
-    UpdateTask, TerminalLog, AuditLog
+    TMSUser, Customer, Terminal, Alert, FirmwareVersion, FirmwarePatch,
+    Deployment, UpdateTask, TerminalLog, AuditLog
 )
 
 
@@ -119,8 +119,8 @@ class TerminalAdmin(admin.ModelAdmin):
 @admin.register(Alert)
 class AlertAdmin(admin.ModelAdmin):
     """Admin configuration for Alert"""
-    list_display = ['terminal', 'alert_type', 'severity', 'title', 
-                    'is_acknowledged', 'is_resolved', 'created_at']
+    list_display = ['terminal', 'alert_type', 'severity', 'title', 'occurrence_count',
+                    'is_acknowledged', 'is_resolved', 'created_at', 'last_seen_at']
     list_filter = ['alert_type', 'severity', 'is_acknowledged', 'is_resolved', 
                    'auto_resolved', 'created_at']
     search_fields = ['terminal__serial_number', 'title', 'message', 
@@ -139,13 +139,17 @@ class AlertAdmin(admin.ModelAdmin):
             'fields': ('is_resolved', 'resolved_by', 'resolved_at', 
                       'resolution_notes', 'auto_resolved')
         }),
+        ('Deduplication', {
+            'fields': ('fingerprint', 'occurrence_count', 'last_seen_at'),
+            'classes': ('collapse',)
+        }),
         ('Timestamps', {
             'fields': ('created_at',),
             'classes': ('collapse',)
         }),
     )
     
-    readonly_fields = ['created_at']
+    readonly_fields = ['created_at', 'fingerprint', 'occurrence_count', 'last_seen_at']
     
     def get_queryset(self, request):
         """Optimize queryset with select_related"""
@@ -188,6 +192,28 @@ class FirmwareVersionAdmin(admin.ModelAdmin):
     file_size_mb.short_description = 'File Size'
 
 
+@admin.register(FirmwarePatch)
+class FirmwarePatchAdmin(admin.ModelAdmin):
+    """Admin configuration for FirmwarePatch"""
+    list_display = ['source', 'target', 'status', 'file_size', 'created_at', 'built_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['source__version', 'target__version', 'file_hash']
+    ordering = ['-created_at']
+    readonly_fields = ['file_size', 'file_hash', 'error_message', 'created_at', 'built_at']
+
+
+@admin.register(Deployment)
+class DeploymentAdmin(admin.ModelAdmin):
+    """Admin configuration for Deployment"""
+    list_display = ['firmware_version', 'target_type', 'status', 'current_wave', 'total_terminals',
+                    'scheduled_at', 'materialized_at', 'created_at']
+    list_filter = ['status', 'target_type', 'created_at']
+    search_fields = ['firmware_version__version', 'created_by']
+    ordering = ['-created_at']
+    readonly_fields = ['total_terminals', 'last_terminal_id', 'materialized_at', 'current_wave',
+                       'materialized_wave', 'wave_started_at', 'accepted_failures', 'created_at']
+
+
 @admin.register(UpdateTask)
 class UpdateTaskAdmin(admin.ModelAdmin):
     """Admin configuration for UpdateTask"""
@@ -201,7 +227,7 @@ class UpdateTaskAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Task Information', {
-            'fields': ('terminal', 'task_type', 'firmware_version', 'parameters')
+            'fields': ('terminal', 'task_type', 'firmware_version', 'deployment', 'parameters')
         }),
         ('Status', {
             'fields': ('status', 'priority', 'progress')
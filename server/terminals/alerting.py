@@ -0,0 +1,158 @@
+"""
+Alert deduplication engine.
+
+Every alert gets a fingerprint built from its terminal, ``alert_type`` and a
+normalized message (numbers, hex values and UUIDs masked). While an unresolved
+alert with the same fingerprint exists, new occurrences increment its
+``occurrence_count`` and refresh ``last_seen_at`` instead of inserting a row;
+a unique constraint on open fingerprints keeps concurrent producers from
+opening the same alert twice. All alert producers should go through
+``raise_alerts``.
+"""
+import hashlib
+import re
+
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .counters import alerts_changed
+from .models import Alert
+
+# Higher is more severe
+SEVERITY_RANK = {severity: rank for rank, (severity, _) in enumerate(reversed(Alert.SEVERITY_CHOICES))}
+
+_NORMALIZERS = [
+    (re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b'), '<uuid>'),
+    (re.compile(r'\b0x[0-9a-f]+\b'), '<hex>'),
+    (re.compile(r'\d+'), '<n>'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize_message(message):
+    """Mask volatile parts so repeats of the same fault compare equal"""
+    normalized = (message or '').lower()
+    for pattern, replacement in _NORMALIZERS:
+        normalized = pattern.sub(replacement, normalized)
+    return normalized.strip()
+
+
+def alert_fingerprint(terminal_id, alert_type, message):
+    """SHA-256 fingerprint of terminal, alert type and normalized message"""
+    key = f'{terminal_id}|{alert_type}|{normalize_message(message)}'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _open_alerts(fingerprints):
+    """``{fingerprint: (id, severity, created_at)}`` of the open alerts with these fingerprints"""
+    rows = Alert.objects.filter(
+        fingerprint__in=list(fingerprints), is_resolved=False
+    ).exclude(fingerprint='').values_list('fingerprint', 'id', 'severity', 'created_at')
+    return {fingerprint: tuple(values) for fingerprint, *values in rows}
+
+
+def _outranked_by(severity):
+    return [other for other, rank in SEVERITY_RANK.items() if rank < SEVERITY_RANK[severity]]
+
+
+def _fold(open_alerts, grouped, now):
+    """
+    Add the occurrences of the ``grouped`` alerts to their open rows and raise
+    the severity of rows a repeat outranks, in one UPDATE. Returns the counter
+    changes of the escalated rows.
+    """
+    escalated = {
+        alert_id: (grouped[fingerprint], severity)
+        for fingerprint, (alert_id, severity, _) in open_alerts.items()
+        if SEVERITY_RANK[grouped[fingerprint].severity] > SEVERITY_RANK.get(severity, 0)
+    }
+    updates = {}
+    if escalated:
+        updates['severity'] = Case(
+            *[
+                When(id=alert_id, severity__in=_outranked_by(alert.severity), then=Value(alert.severity))
+                for alert_id, (alert, _) in escalated.items()
+            ],
+            default=F('severity'),
+        )
+    Alert.objects.filter(id__in=[alert_id for alert_id, _, _ in open_alerts.values()]).update(
+        occurrence_count=F('occurrence_count') + Case(
+            *[
+                When(id=alert_id, then=Value(grouped[fingerprint].occurrence_count))
+                for fingerprint, (alert_id, _, _) in open_alerts.items()
+            ],
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        last_seen_at=now,
+        **updates,
+    )
+    return [
+        ((alert.terminal_id, severity), (alert.terminal_id, alert.severity))
+        for alert, severity in escalated.values()
+    ]
+
+
+def raise_alerts(alerts, now=None):
+    """
+    Create or fold a list of unsaved Alert instances.
+
+    Uses a fixed number of queries regardless of the number of alerts: one
+    lookup over the open-fingerprint index, one UPDATE for repeats, one bulk
+    INSERT for new fingerprints and one lookup of what it opened. A repeat
+    with a higher severity escalates the open alert. Returns ``{'created': n,
+    'folded': n}``.
+
+    The unique constraint on open fingerprints makes concurrent producers
+    safe: an insert that loses the race to another producer is skipped and
+    folded into the alert the other one opened.
+    """
+    now = now or timezone.now()
+
+    # Fold repeats inside the batch first
+    grouped = {}
+    for alert in alerts:
+        fingerprint = alert_fingerprint(alert.terminal_id, alert.alert_type, alert.message)
+        if fingerprint in grouped:
+            first = grouped[fingerprint]
+            first.occurrence_count += 1
+            if SEVERITY_RANK[alert.severity] > SEVERITY_RANK[first.severity]:
+                first.severity = alert.severity
+            continue
+        alert.fingerprint = fingerprint
+        alert.occurrence_count = 1
+        alert.last_seen_at = now
+        grouped[fingerprint] = alert
+
+    if not grouped:
+        return {'created': 0, 'folded': 0}
+
+    existing = _open_alerts(grouped)
+    changes = _fold(existing, grouped, now) if existing else []
+
+    new_alerts = [alert for fingerprint, alert in grouped.items() if fingerprint not in existing]
+    created = []
+    if new_alerts:
+        Alert.objects.bulk_create(new_alerts, ignore_conflicts=True)
+        opened = _open_alerts(alert.fingerprint for alert in new_alerts)
+        conflicts = {}
+        for alert in new_alerts:
+            row = opened.get(alert.fingerprint)
+            if row is None:
+                continue
+            if row[2] == alert.created_at:
+                created.append(alert)
+            else:
+                # Another producer opened this fingerprint first
+                conflicts[alert.fingerprint] = row
+        if conflicts:
+            changes += _fold(conflicts, grouped, now)
+
+    alerts_changed([(None, (alert.terminal_id, alert.severity)) for alert in created] + changes)
+
+    return {'created': len(created), 'folded': len(alerts) - len(created)}
+
+
+def raise_alert(**fields):
+    """Create or fold a single alert built from model field values"""
+    return raise_alerts([Alert(**fields)])
@@ -0,0 +1,317 @@
+"""
+Async agent endpoints, meant to be served through ``tms_server.asgi``.
+
+The heartbeat, logs and command result endpoints have async variants of the
+DRF views in ``terminals.views`` with the same URLs, request/response formats,
+parsers and admission control. ``terminals.urls`` routes to them when
+``settings.TMS_AGENT_ASYNC_VIEWS`` is set, which ``tms_server.asgi`` does by
+default; UI and admin views stay synchronous either way.
+
+Single statements use the async ORM. Work that needs a transaction (log
+ingestion, command claiming) runs as one ``sync_to_async`` call, since
+transactions are not available in async code. Django runs async ORM queries
+on one database thread per process, so metric samples are group-committed
+(``metrics.asave_sample``) rather than inserted one request at a time.
+"""
+import asyncio
+import io
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.utils.mediatypes import media_type_matches
+
+from .deployments import materialize_for, may_need_materialization, record_task_result
+from .dispatch import claim_commands, mark_pending, terminals_with_pending_work
+from .exceptions import rate_limit_error
+from .liveness import get_store as get_liveness_store
+from .longpoll import CommandWaiter
+from .metrics import asave_sample, build_sample
+from .models import Terminal, UpdateTask
+from .parsers import AGENT_PARSER_CLASSES
+from .resolver import get_resolver
+from .scheduling import get_scheduler
+from .serializers import (
+    AgentHeartbeatSerializer, AgentHeartbeatDeltaSerializer, AgentLogsEnvelopeSerializer,
+    CommandResultSerializer
+)
+from .throttling import AgentAdmissionThrottle, admission_wait
+from .views import (
+    _apply_command_result, _apply_delta, _identity_changed, _identity_values, _is_delta,
+    _liveness_values, _store_agent_logs
+)
+
+
+def _csrf_exempt(view):
+    """
+    ``csrf_exempt`` for async views: agents send no CSRF cookie. Django 4.2's
+    decorator wraps views in a synchronous function, so set its marker instead.
+    """
+    view.csrf_exempt = True
+    return view
+
+
+def _error(code, message, status, **extra):
+    return JsonResponse({'error': {'code': code, 'message': message, **extra}}, status=status)
+
+
+def _validation_error(field_errors):
+    return _error('VAL_001', 'Validation error', 422, field_errors=field_errors)
+
+
+def _terminal_not_found(serial_number):
+    return _error(
+        'RES_001', 'Terminal not found', 404,
+        details=f'Terminal with serial number {serial_number} does not exist'
+    )
+
+
+def _parse_body(request):
+    """Parse the body with the agent parsers, as DRF would for the sync views"""
+    if not request.body:
+        return {}
+    content_type = request.META.get('CONTENT_TYPE', '')
+    for parser_class in AGENT_PARSER_CLASSES:
+        if media_type_matches(parser_class.media_type, content_type):
+            return parser_class().parse(io.BytesIO(request.body), content_type, {'request': request})
+    raise UnsupportedMediaType(content_type)
+
+
+async def _claim_commands(terminal_id, now=None):
+    """
+    ``claim_commands`` for one terminal. The marker check stays off the ORM's
+    database thread, so idle terminals do not queue behind other requests' queries.
+    """
+    if not await sync_to_async(terminals_with_pending_work, thread_sensitive=False)([terminal_id]):
+        return []
+    return (await sync_to_async(claim_commands)([terminal_id], now))[terminal_id]
+
+
+async def _agent_request(request, name):
+    """
+    Parse and admit a POST to the agent endpoint named ``name``.
+
+    Returns ``(data, None)``, or ``(None, error response)``.
+    """
+    if request.method != 'POST':
+        return None, _error('VAL_001', 'Method not allowed', 405)
+    try:
+        data = _parse_body(request)
+    except (ParseError, UnsupportedMediaType) as e:
+        return None, JsonResponse({'detail': str(e.detail)}, status=e.status_code)
+    
+    serial_number = request.META.get('HTTP_X_TERMINAL_SERIAL')
+    if not serial_number and hasattr(data, 'get'):
+        serial_number = data.get('serial_number')
+    response = await _admit(request, name, serial_number)
+    if response is not None:
+        return None, response
+    return data, None
+
+
+async def _admit(request, name, serial_number):
+    """Admission control as ``AgentAdmissionThrottle``; returns a 429 response or None"""
+    def caller():
+        return serial_number or AgentAdmissionThrottle().get_ident(request)
+    
+    wait = await sync_to_async(admission_wait, thread_sensitive=False)(name, caller)
+    if not wait:
+        return None
+    retry_after, body = rate_limit_error(wait)
+    response = JsonResponse(body, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+@_csrf_exempt
+async def agent_heartbeat_view(request):
+    """Agent heartbeat endpoint (async variant of ``views.agent_heartbeat_view``)"""
+    started = time.monotonic()
+    data, response = await _agent_request(request, 'agent-heartbeat')
+    if response is not None:
+        return response
+    
+    delta = _is_delta(data)
+    serializer_class = AgentHeartbeatDeltaSerializer if delta else AgentHeartbeatSerializer
+    serializer = serializer_class(data=data)
+    if not serializer.is_valid():
+        return _validation_error(serializer.errors)
+    
+    data = serializer.validated_data
+    serial_number = data['serial_number']
+    
+    resolver = get_resolver()
+    ref = await resolver.aresolve(serial_number)
+    if ref is None:
+        return _terminal_not_found(serial_number)
+    
+    now = timezone.now()
+    store = get_liveness_store()
+    previous = (await sync_to_async(store.get_many, thread_sensitive=False)([ref.terminal_id])).get(
+        ref.terminal_id, {}
+    )
+    write_sample = True
+    if delta:
+        expected = previous.get('heartbeat_seq')
+        if expected is None or data['seq'] != expected + 1:
+            details = f'No heartbeat state for {serial_number} continues this delta'
+            if expected is not None:
+                details += f' (expected seq {expected + 1})'
+            return _error('SYNC_001', 'Full heartbeat required', 409, details=details)
+        write_sample = 'metrics' in data
+        data = _apply_delta(previous, data)
+    
+    identity = _identity_values(data)
+    try:
+        # Independent writes, no transaction needed; samples are group-committed
+        if _identity_changed(previous, identity):
+            await Terminal.objects.filter(pk=ref.terminal_id).aupdate(**identity)
+        if write_sample:
+            await asave_sample(build_sample(ref.terminal_id, data['metrics'], now))
+    except IntegrityError:
+        await sync_to_async(resolver.invalidate)(serial_number)
+        return _terminal_not_found(serial_number)
+    
+    await sync_to_async(store.record, thread_sensitive=False)(ref.terminal_id, {
+        **_liveness_values(data, now), **identity, 'heartbeat_seq': data.get('seq')
+    })
+    
+    if may_need_materialization(now):
+        await sync_to_async(materialize_for)([ref], now)
+    commands = await _claim_commands(ref.terminal_id, now)
+    
+    scheduler = get_scheduler()
+    scheduler.record_latency(time.monotonic() - started)
+    
+    return JsonResponse({
+        'status': 'acknowledged',
+        'server_time': timezone.now().isoformat(),
+        'commands': commands,
+        'next_heartbeat': scheduler.next_delay(ref.terminal_id, ref.heartbeat_interval, now.timestamp())
+    })
+
+
+@_csrf_exempt
+async def agent_logs_view(request):
+    """Agent logs submission endpoint (async variant of ``views.agent_logs_view``)"""
+    data, response = await _agent_request(request, 'agent-logs')
+    if response is not None:
+        return response
+    
+    serializer = AgentLogsEnvelopeSerializer(data=data)
+    if not serializer.is_valid():
+        return _validation_error(serializer.errors)
+    
+    serial_number = serializer.validated_data['serial_number']
+    raw_logs = serializer.validated_data['logs']
+    
+    max_size = settings.TMS_AGENT_LOGS_MAX_BATCH_SIZE
+    if len(raw_logs) > max_size:
+        return _error(
+            'VAL_002', 'Batch too large', 413,
+            details=f'At most {max_size} log entries are accepted per request'
+        )
+    
+    resolver = get_resolver()
+    ref = await resolver.aresolve(serial_number)
+    if ref is None:
+        return _terminal_not_found(serial_number)
+    
+    try:
+        log_ids, field_errors = await sync_to_async(_store_agent_logs)(ref.terminal_id, raw_logs)
+    except IntegrityError:
+        await sync_to_async(resolver.invalidate)(serial_number)
+        return _terminal_not_found(serial_number)
+    
+    if field_errors:
+        return _validation_error(field_errors)
+    
+    return JsonResponse({
+        'status': 'received',
+        'count': len(log_ids),
+        'log_ids': log_ids
+    })
+
+
+@_csrf_exempt
+async def agent_command_result_view(request, command_id):
+    """Agent command result endpoint (async variant of ``views.agent_command_result_view``)"""
+    data, response = await _agent_request(request, 'agent-command-result')
+    if response is not None:
+        return response
+    
+    serializer = CommandResultSerializer(data=data)
+    if not serializer.is_valid():
+        return _validation_error(serializer.errors)
+    
+    try:
+        task = await UpdateTask.objects.select_related('firmware_version', 'deployment').aget(id=command_id)
+    except UpdateTask.DoesNotExist:
+        return _error('RES_001', 'Command not found', 404)
+    
+    installed_version = _apply_command_result(task, serializer.validated_data)
+    if installed_version:
+        await Terminal.objects.filter(pk=task.terminal_id).aupdate(firmware_version=installed_version)
+    
+    await task.asave()
+    if task.status == 'pending':
+        # Autocommit: the retry is visible already, no on_commit needed
+        await sync_to_async(mark_pending)([task.terminal_id])
+    if task.deployment_id:
+        await sync_to_async(record_task_result)(task)
+    
+    return JsonResponse({'status': 'acknowledged'})
+
+
+@_csrf_exempt
+async def agent_command_wait_view(request):
+    """
+    Agent long-poll endpoint: returns as soon as a command is queued for the
+    terminal, or with an empty list once ``timeout`` seconds have passed.
+    Only routed under ASGI (see ``terminals.urls``).
+    """
+    if request.method != 'GET':
+        return _error('VAL_001', 'Method not allowed', 405)
+    
+    serial_number = request.GET.get('serial_number')
+    response = await _admit(request, 'agent-command-wait', serial_number)
+    if response is not None:
+        return response
+    config = settings.TMS_COMMAND_WAIT
+    try:
+        timeout = min(max(int(request.GET.get('timeout', config['MAX_WAIT'])), 0), config['MAX_WAIT'])
+    except ValueError:
+        timeout = None
+    if not serial_number or timeout is None:
+        return _error('VAL_001', 'Validation error', 422, field_errors={
+            'serial_number': [] if serial_number else ['This field is required.'],
+            'timeout': [] if timeout is not None else ['A valid integer is required.'],
+        })
+    
+    ref = await sync_to_async(get_resolver().resolve)(serial_number)
+    if ref is None:
+        return _error(
+            'RES_001', 'Terminal not found', 404,
+            details=f'Terminal with serial number {serial_number} does not exist'
+        )
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with CommandWaiter(ref.terminal_id) as waiter:
+        while True:
+            # Idle terminals cost one cache read per tick, no database query
+            commands = await _claim_commands(ref.terminal_id)
+            remaining = deadline - loop.time()
+            if commands or remaining <= 0:
+                break
+            await waiter.wait(min(config['POLL_INTERVAL'], remaining))
+    
+    return JsonResponse({
+        'status': 'ok',
+        'server_time': timezone.now().isoformat(),
+        'commands': commands
+    })
@@ -0,0 +1,289 @@
+"""
+Terminal availability rollups.
+
+``TerminalAvailability`` holds, per terminal and local day, the seconds the
+terminal was online out of the seconds it was expected to be.
+``Terminal.availability_until`` marks how far each terminal has been
+accounted, so every span is counted once:
+
+- heartbeat arrivals: ``LivenessStore.flush`` accounts up to each new
+  heartbeat, online when it reports ``online`` within the sweeper's threshold
+  of the previous one, offline otherwise (``account_heartbeats``)
+- offline transitions: ``sweeper.sweep_offline`` accounts swept terminals up
+  to the sweep as offline, and rolls terminals that stay offline forward once
+  a day, so silent days still count as expected (``account_offline``)
+- terminals in maintenance mode move forward without expected time
+
+Rollup rows are read, added to and written back in bulk, inside the caller's
+transaction. ``availability_report`` sums the rows of a scope per day, week or
+month with one grouped query. ``rebuild_availability`` recomputes closed days
+from metric history for the ``backfill_availability`` command.
+"""
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Terminal, TerminalAvailability, TerminalMetricRollup, TerminalMetricSample
+
+GRANULARITIES = {
+    'daily': F('day'),
+    'weekly': TruncWeek('day'),
+    'monthly': TruncMonth('day'),
+}
+
+# Part of [start, end) to add to one terminal's rollups
+Span = namedtuple('Span', ['terminal_id', 'customer_id', 'start', 'end', 'online'])
+
+
+def online_threshold(heartbeat_interval):
+    """Longest heartbeat gap still counted as online (the sweeper's threshold)"""
+    return timedelta(seconds=(
+        settings.TMS_OFFLINE_SWEEP['MISSED_HEARTBEATS'] * heartbeat_interval
+        + settings.TMS_LIVENESS['FLUSH_INTERVAL']
+    ))
+
+
+def day_start(day):
+    """Aware start of a local day"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def split_days(start, end):
+    """Yield ``(local date, seconds)`` for each day ``[start, end)`` touches"""
+    start = timezone.localtime(start)
+    while start < end:
+        day = start.date()
+        stop = min(day_start(day + timedelta(days=1)), end)
+        yield day, (stop - start).total_seconds()
+        start = timezone.localtime(stop)
+
+
+def accrue(spans):
+    """Add spans to the daily rollups; returns the number of rows touched"""
+    totals = {}
+    for span in spans:
+        for day, seconds in split_days(span.start, span.end):
+            entry = totals.setdefault((span.terminal_id, day), [span.customer_id, 0.0, 0.0])
+            entry[1] += seconds if span.online else 0
+            entry[2] += seconds
+    if not totals:
+        return 0
+
+    with transaction.atomic():
+        existing = {
+            (row.terminal_id, row.day): row
+            for row in TerminalAvailability.objects.select_for_update().filter(
+                terminal_id__in={terminal_id for terminal_id, _ in totals},
+                day__in={day for _, day in totals}
+            )
+        }
+        updated, created = [], []
+        for (terminal_id, day), (customer_id, online, expected) in totals.items():
+            row = existing.get((terminal_id, day))
+            if row is None:
+                created.append(TerminalAvailability(
+                    terminal_id=terminal_id, customer_id=customer_id, day=day,
+                    online_seconds=round(online), expected_seconds=round(expected)
+                ))
+            else:
+                row.online_seconds += round(online)
+                row.expected_seconds += round(expected)
+                updated.append(row)
+        TerminalAvailability.objects.bulk_update(updated, ['online_seconds', 'expected_seconds'], batch_size=500)
+        TerminalAvailability.objects.bulk_create(created, batch_size=500)
+    return len(totals)
+
+
+def account_heartbeats(pending):
+    """
+    Account flushed heartbeats (``{terminal_id: liveness values}``) against
+    the database rows they are about to replace.
+
+    Returns ``{terminal_id: availability_until}`` to write with the flush.
+    """
+    rows = Terminal.objects.filter(id__in=list(pending)).order_by().values_list(
+        'id', 'customer_id', 'last_heartbeat', 'status', 'heartbeat_interval',
+        'maintenance_mode', 'availability_until'
+    )
+    spans = []
+    accounted = {}
+    for terminal_id, customer_id, previous, status, interval, maintenance, until in rows:
+        values = pending[terminal_id]
+        heartbeat = values.get('last_heartbeat')
+        accounted[terminal_id] = until
+        if heartbeat is None or (until is not None and heartbeat <= until):
+            continue
+        accounted[terminal_id] = heartbeat
+        if until is None or maintenance:
+            continue
+        online = (
+            values.get('status') == 'online' and status != 'offline' and previous is not None
+            and heartbeat - previous <= online_threshold(interval)
+        )
+        spans.append(Span(terminal_id, customer_id, until, heartbeat, online))
+    accrue(spans)
+    return accounted
+
+
+def account_offline(terminal_ids, now):
+    """
+    Account terminals as offline up to ``now``. The caller sets their
+    ``availability_until`` to ``now`` in the same transaction.
+    """
+    rows = Terminal.objects.filter(
+        id__in=list(terminal_ids), maintenance_mode=False, availability_until__lt=now
+    ).order_by().values_list('id', 'customer_id', 'availability_until')
+    return accrue([
+        Span(terminal_id, customer_id, until, now, False) for terminal_id, customer_id, until in rows
+    ])
+
+
+def roll_offline(now, batch_size=1000):
+    """Account terminals offline since before today up to ``now``; returns how many"""
+    today = day_start(timezone.localdate(now))
+    terminal_ids = list(Terminal.objects.filter(
+        status='offline', availability_until__lt=today
+    ).order_by().values_list('id', flat=True))
+    with transaction.atomic():
+        for offset in range(0, len(terminal_ids), batch_size):
+            batch = terminal_ids[offset:offset + batch_size]
+            account_offline(batch, now)
+            Terminal.objects.filter(id__in=batch).update(availability_until=now)
+    return len(terminal_ids)
+
+
+def _rate(online, expected):
+    return round(online / expected * 100, 2) if expected else None
+
+
+def availability_report(start, end, granularity='daily', customer_id=None, terminal_id=None):
+    """
+    Availability between the ``start`` and ``end`` days (inclusive) per
+    ``granularity`` period, for the fleet, one customer or one terminal.
+    """
+    rows = TerminalAvailability.objects.filter(day__gte=start, day__lte=end)
+    if customer_id is not None:
+        rows = rows.filter(customer_id=customer_id)
+    if terminal_id is not None:
+        rows = rows.filter(terminal_id=terminal_id)
+    periods = rows.annotate(period=GRANULARITIES[granularity]).values('period').annotate(
+        online=Sum('online_seconds'), expected=Sum('expected_seconds'),
+        terminals=Count('terminal_id', distinct=True)
+    ).order_by('period')
+
+    data = [
+        {
+            'period': period['period'],
+            'terminals': period['terminals'],
+            'online_seconds': period['online'],
+            'expected_seconds': period['expected'],
+            'availability': _rate(period['online'], period['expected']),
+        }
+        for period in periods
+    ]
+    rates = [point['availability'] for point in data if point['availability'] is not None]
+    online = sum(point['online_seconds'] for point in data)
+    expected = sum(point['expected_seconds'] for point in data)
+    return {
+        'data': data,
+        'summary': {
+            'average_availability': _rate(online, expected),
+            'min_availability': min(rates, default=None),
+            'max_availability': max(rates, default=None),
+        }
+    }
+
+
+def _history(terminal_ids, since, until):
+    """
+    Heartbeat evidence per terminal from metric history, finest tier first:
+    raw samples as ``(time, None)`` and older buckets as ``(start, (length, samples))``.
+    """
+    raw_oldest = TerminalMetricSample.objects.order_by('recorded_at').values_list('recorded_at', flat=True).first()
+    hourly_oldest = TerminalMetricRollup.objects.filter(resolution='hour').order_by(
+        'bucket_start').values_list('bucket_start', flat=True).first()
+    raw_from = raw_oldest or until
+    hourly_from = min(hourly_oldest or raw_from, raw_from)
+
+    history = {terminal_id: [] for terminal_id in terminal_ids}
+    samples = TerminalMetricSample.objects.filter(
+        terminal_id__in=terminal_ids, recorded_at__gte=max(since, raw_from), recorded_at__lt=until
+    ).order_by('terminal_id', 'recorded_at').values_list('terminal_id', 'recorded_at')
+    for terminal_id, recorded_at in samples.iterator():
+        history[terminal_id].append((recorded_at, None))
+
+    tiers = [('hour', timedelta(hours=1), hourly_from, raw_from), ('day', timedelta(days=1), since, hourly_from)]
+    for resolution, length, tier_from, tier_until in tiers:
+        buckets = TerminalMetricRollup.objects.filter(
+            terminal_id__in=terminal_ids, resolution=resolution,
+            bucket_start__gte=max(since, tier_from), bucket_start__lt=min(until, tier_until)
+        ).values_list('terminal_id', 'bucket_start', 'sample_count')
+        for terminal_id, bucket_start, sample_count in buckets:
+            history[terminal_id].append((bucket_start, (length, sample_count)))
+    return history
+
+
+def _online_spans(evidence, interval):
+    """Online ``(start, end)`` spans from one terminal's heartbeat evidence"""
+    threshold = online_threshold(interval)
+    previous = None
+    for moment, bucket in sorted(evidence, key=lambda item: item[0]):
+        if bucket is not None:
+            # Rollups only keep counts: each sample stands for one interval
+            length, sample_count = bucket
+            yield moment, moment + min(length, timedelta(seconds=sample_count * interval))
+            previous = None
+            continue
+        if previous is not None and moment - previous <= threshold:
+            yield previous, moment
+        previous = moment
+
+
+def rebuild_availability(terminal_ids, start, end):
+    """
+    Recompute the rollups of ``terminal_ids`` for the closed days ``start`` to
+    ``end`` (inclusive) from metric history; returns the number of rows.
+
+    Expected time runs from the terminal's creation; online time from
+    heartbeat gaps within the sweeper's threshold (raw samples) or the sample
+    counts of older hourly and daily buckets.
+    """
+    since, until = day_start(start), day_start(end + timedelta(days=1))
+    terminals = Terminal.objects.filter(id__in=terminal_ids).order_by().values_list(
+        'id', 'customer_id', 'heartbeat_interval', 'created_at', 'availability_until'
+    )
+    history = _history(list(terminal_ids), since, until)
+
+    rows = []
+    advanced = []
+    for terminal_id, customer_id, interval, created_at, accounted_until in terminals:
+        days = {}
+        for day, seconds in split_days(max(since, created_at), until):
+            days[day] = [0.0, seconds]
+        for span_start, span_end in _online_spans(history[terminal_id], interval):
+            for day, seconds in split_days(max(span_start, since, created_at), min(span_end, until)):
+                if day in days:
+                    days[day][0] += seconds
+        rows.extend(
+            TerminalAvailability(
+                terminal_id=terminal_id, customer_id=customer_id, day=day,
+                online_seconds=round(min(online, expected)), expected_seconds=round(expected)
+            )
+            for day, (online, expected) in days.items()
+        )
+        if accounted_until is None or accounted_until < until:
+            advanced.append(terminal_id)
+
+    with transaction.atomic():
+        TerminalAvailability.objects.bulk_create(
+            rows, batch_size=500, update_conflicts=True,
+            unique_fields=['terminal', 'day'], update_fields=['customer', 'online_seconds', 'expected_seconds']
+        )
+        # Incremental accounting continues where the rebuilt days end
+        Terminal.objects.filter(id__in=advanced).update(availability_until=until)
+    return len(rows)
@@ -0,0 +1,166 @@
+"""
+Content-addressed firmware blob store.
+
+Blobs live under ``settings.TMS_FIRMWARE_DOWNLOADS['ROOT']`` as
+``sha256/<first two hex digits>/<sha256>``, so identical images are stored
+once. Uploads are streamed by ``BlobUploadHandler``: each chunk is written to
+a temporary file inside the store and fed to SHA-256 as it arrives, so memory
+use stays flat whatever the image size and the file is never read back.
+``BlobStore.commit`` then moves the file into place with an atomic rename
+(the temporary directory is on the same filesystem), or drops it when the
+blob already exists.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# A finished upload not yet committed to the store
+PendingBlob = namedtuple('PendingBlob', ['temp_path', 'sha256', 'size'])
+
+
+class BlobWriter:
+    """Temporary blob file that hashes and counts what is written to it"""
+
+    def __init__(self, store):
+        store.temp_dir.mkdir(parents=True, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=store.temp_dir, suffix='.upload')
+        self.file = os.fdopen(fd, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def close(self):
+        """Flush to disk and return the ``PendingBlob``"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        return PendingBlob(self.temp_path, self.hash.hexdigest(), self.size)
+
+    def abort(self):
+        self.file.close()
+        discard(self.temp_path)
+
+
+def discard(temp_path):
+    try:
+        os.unlink(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+class BlobStore:
+    """Blobs on the local filesystem, keyed by SHA-256"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.temp_dir = self.root / 'tmp'
+
+    def path(self, sha256):
+        """Where the blob lives (it may not exist); None for a malformed hash"""
+        if not sha256 or not SHA256_RE.match(sha256):
+            return None
+        return self.root / 'sha256' / sha256[:2] / sha256
+
+    def exists(self, sha256):
+        path = self.path(sha256)
+        return path is not None and path.is_file()
+
+    def writer(self):
+        return BlobWriter(self)
+
+    def commit(self, pending):
+        """Move an upload into place; returns False if the blob was already stored"""
+        path = self.path(pending.sha256)
+        if path.is_file():
+            discard(pending.temp_path)
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(pending.temp_path, path)
+        return True
+
+    def delete(self, sha256):
+        path = self.path(sha256)
+        if path is not None:
+            discard(path)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """Return the process-wide blob store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BlobStore(settings.TMS_FIRMWARE_DOWNLOADS['ROOT'])
+    return _store
+
+
+@receiver(setting_changed)
+def _reset_blob_store(setting, **kwargs):
+    global _store
+    if setting == 'TMS_FIRMWARE_DOWNLOADS':
+        _store = None
+
+
+class UploadedBlob(UploadedFile):
+    """Uploaded file that was streamed into the blob store (see ``pending``)"""
+
+    def __init__(self, pending, name, content_type, charset=None, content_type_extra=None):
+        super().__init__(None, name, content_type, pending.size, charset, content_type_extra)
+        self.pending = pending
+
+
+class BlobUploadHandler(FileUploadHandler):
+    """
+    Upload handler writing files straight to the blob store.
+
+    Must be the request's only upload handler, set before ``request.POST`` or
+    ``request.FILES`` is read. Files larger than
+    ``settings.TMS_FIRMWARE_MAX_UPLOAD_BYTES`` abort the upload.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.writer = get_blob_store().writer()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.writer.write(raw_data)
+        if self.writer.size > settings.TMS_FIRMWARE_MAX_UPLOAD_BYTES:
+            self.writer.abort()
+            self.writer = None
+            raise StopUpload(connection_reset=True)
+        return None
+
+    def file_complete(self, file_size):
+        writer, self.writer = self.writer, None
+        return UploadedBlob(
+            writer.close(), self.file_name, self.content_type, self.charset, self.content_type_extra
+        )
+
+    def upload_interrupted(self):
+        if getattr(self, 'writer', None) is not None:
+            self.writer.abort()
+            self.writer = None
+
+    def upload_complete(self):
+        # A file cut short by the end of the body never reached file_complete
+        self.upload_interrupted()
@@ -0,0 +1,12 @@
+"""
+Template context processors for the terminals app.
+"""
+from .counters import alert_counts
+
+
+def alert_badge(request):
+    """Unresolved alert count for the navigation badge, read from the fleet counters"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_alerts_count': alert_counts()['total']}
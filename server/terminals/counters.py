@@ -0,0 +1,226 @@
+"""
+Live fleet counters kept in the cache.
+
+Pages refreshed constantly (dashboard, reports, the alert badge) read
+terminal counts by status and unresolved alert counts by severity, for the
+fleet and per customer, from cache keys instead of counting rows. Every path
+that changes them adjusts the keys with atomic ``cache.incr`` once its
+transaction commits:
+
+- terminal status transitions: ``LivenessStore.flush`` and the offline sweeper
+  (see ``terminals.uptime``)
+- alerts created by ``raise_alerts``
+- model saves and deletes of terminals, alerts and customers (see
+  ``terminals.signals``)
+
+Counters follow the database, so unflushed heartbeats show up after the next
+liveness flush. A missing key (cache restart, eviction) is counted again from
+the database on the next read. Anything that bypasses these paths (raw SQL,
+``QuerySet.update``) leaves drift that the ``verify_counters`` command finds
+and corrects in a shared cache. A per-process cache (``locmem``, the default
+without ``REDIS_URL``) cannot be reached from the command and misses changes
+made by other processes, so there counters expire after
+``TMS_COUNTERS['VERIFY_INTERVAL']`` seconds and each process counts them again.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Alert, Customer, Terminal
+from .stats import STATUSES, FleetStatus, count_by_customer
+
+TERMINAL_KEY = 'tms:counters:terminals:{}:{}'
+ALERT_KEY = 'tms:counters:alerts:{}:{}'
+FLEET = 'fleet'
+
+TERMINAL_FIELDS = ('total',) + STATUSES
+ALERT_FIELDS = ('total',) + tuple(severity for severity, _ in Alert.SEVERITY_CHOICES)
+
+
+def cache_is_shared():
+    """Whether every server process sees the same counters"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _timeout():
+    return None if cache_is_shared() else settings.TMS_COUNTERS['VERIFY_INTERVAL']
+
+
+def _keys(template, fields, scopes):
+    return {template.format(scope, field): (scope, field) for scope in scopes for field in fields}
+
+
+def _adjust(deltas):
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Not loaded: the next read counts it from the database
+            pass
+
+
+def _adjust_on_commit(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if deltas:
+        transaction.on_commit(lambda: _adjust(deltas))
+
+
+def terminals_changed(changes):
+    """
+    Count terminal changes once the transaction commits: ``(before, after)``
+    pairs of ``(customer_id, status)``, None for a created or deleted terminal.
+    """
+    deltas = Counter()
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            customer_id, status = state
+            for scope in (FLEET, customer_id):
+                deltas[TERMINAL_KEY.format(scope, 'total')] += sign
+                if status in STATUSES:
+                    deltas[TERMINAL_KEY.format(scope, status)] += sign
+    _adjust_on_commit(deltas)
+
+
+def alerts_changed(changes):
+    """
+    Count unresolved alert changes once the transaction commits: ``(before,
+    after)`` pairs of ``(terminal_id, severity)``, None when not unresolved.
+    """
+    changes = [(before, after) for before, after in changes if before != after]
+    if changes:
+        transaction.on_commit(lambda: _adjust_alerts(changes))
+
+
+def _adjust_alerts(changes):
+    terminal_ids = {state[0] for change in changes for state in change if state is not None}
+    customers = dict(Terminal.objects.filter(id__in=terminal_ids).values_list('id', 'customer_id'))
+    deltas = Counter()
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            terminal_id, severity = state
+            for scope in (FLEET, customers.get(terminal_id)):
+                if scope is None:
+                    continue
+                deltas[ALERT_KEY.format(scope, 'total')] += sign
+                deltas[ALERT_KEY.format(scope, severity)] += sign
+    _adjust(deltas)
+
+
+def _customer_keys(customer_id):
+    return [*_keys(TERMINAL_KEY, TERMINAL_FIELDS, [customer_id]), *_keys(ALERT_KEY, ALERT_FIELDS, [customer_id])]
+
+
+def _add_zeros(keys):
+    for key in keys:
+        cache.add(key, 0, timeout=_timeout())
+
+
+def customer_added(customer_id):
+    """A new customer starts with zero counters, so the first changes count"""
+    keys = _customer_keys(customer_id)
+    transaction.on_commit(lambda: _add_zeros(keys))
+
+
+def customer_removed(customer_id):
+    keys = _customer_keys(customer_id)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _count_terminals(scopes):
+    """Database counts for the given scopes (all of them in one grouped query)"""
+    terminals = Terminal.objects.all()
+    if FLEET not in scopes:
+        terminals = terminals.filter(customer_id__in=scopes)
+    by_customer = count_by_customer(terminals)
+    counts = {scope: by_customer.get(scope, dict.fromkeys(TERMINAL_FIELDS, 0)) for scope in scopes}
+    if FLEET in scopes:
+        counts[FLEET] = {field: sum(row[field] for row in by_customer.values()) for field in TERMINAL_FIELDS}
+    return counts
+
+
+def _count_alerts(scopes):
+    alerts = Alert.objects.filter(is_resolved=False)
+    if FLEET not in scopes:
+        alerts = alerts.filter(terminal__customer_id__in=scopes)
+    counts = {scope: dict.fromkeys(ALERT_FIELDS, 0) for scope in scopes}
+    fleet = dict.fromkeys(ALERT_FIELDS, 0)
+    rows = alerts.order_by().values_list('terminal__customer_id', 'severity').annotate(count=Count('id'))
+    for customer_id, severity, count in rows:
+        for entry in (counts.get(customer_id), fleet):
+            if entry is not None and severity in entry:
+                entry[severity] += count
+                entry['total'] += count
+    if FLEET in scopes:
+        counts[FLEET] = fleet
+    return counts
+
+
+def _read(template, fields, scopes, count):
+    keys = _keys(template, fields, scopes)
+    values = cache.get_many(list(keys))
+    missing = sorted({scope for key, (scope, _) in keys.items() if key not in values}, key=str)
+    if missing:
+        counted = count(missing)
+        loaded = {
+            template.format(scope, field): counted[scope][field]
+            for scope in counted for field in fields
+        }
+        cache.set_many(loaded, timeout=_timeout())
+        values.update(loaded)
+    result = {scope: {} for scope in scopes}
+    for key, (scope, field) in keys.items():
+        result[scope][field] = values[key]
+    return result
+
+
+def fleet_counts(customer_ids=()):
+    """
+    Terminal counts by status as a ``FleetStatus``: ``overall`` for the fleet
+    and ``by_customer`` for the given customers.
+    """
+    customer_ids = list(customer_ids)
+    counts = _read(TERMINAL_KEY, TERMINAL_FIELDS, [FLEET, *customer_ids], _count_terminals)
+    return FleetStatus(counts[FLEET], {customer_id: counts[customer_id] for customer_id in customer_ids})
+
+
+def alert_counts(customer_id=None):
+    """Unresolved alerts by severity (and ``total``), for the fleet or one customer"""
+    scope = FLEET if customer_id is None else customer_id
+    return _read(ALERT_KEY, ALERT_FIELDS, [scope], _count_alerts)[scope]
+
+
+def verify_counters():
+    """
+    Recount every counter from the database and overwrite the ones that
+    drifted; returns ``{key: (cached, actual)}`` for each corrected key.
+    Missing keys are loaded without being reported. Only corrects the cache
+    of the calling process unless ``cache_is_shared()``.
+    """
+    scopes = [FLEET, *Customer.objects.order_by('id').values_list('id', flat=True)]
+    drift = {}
+    corrected = {}
+    for template, fields, count in (
+        (TERMINAL_KEY, TERMINAL_FIELDS, _count_terminals),
+        (ALERT_KEY, ALERT_FIELDS, _count_alerts),
+    ):
+        actual = count(scopes)
+        keys = _keys(template, fields, scopes)
+        cached = cache.get_many(list(keys))
+        for key, (scope, field) in keys.items():
+            if cached.get(key) != actual[scope][field]:
+                corrected[key] = actual[scope][field]
+                if key in cached:
+                    drift[key] = (cached[key], actual[scope][field])
+    cache.set_many(corrected, timeout=_timeout())
+    return drift
@@ -0,0 +1,512 @@
+"""
+Firmware deployment campaigns.
+
+``create_deployment`` stores the target selector and schedule of a rollout in
+one ``Deployment`` row, so the deploy request costs a constant number of
+queries however many terminals it targets. Per-terminal ``UpdateTask`` rows
+are materialized lazily, once the deployment is due:
+
+- on contact: the heartbeat paths call ``materialize_for`` for the terminals
+  they just heard from, so a terminal gets its task on its next heartbeat
+- in bulk: the ``materialize_deployments`` command creates the remaining
+  tasks in batches and marks the deployment fully materialized
+
+The unique (deployment, terminal) constraint on ``UpdateTask`` makes both paths
+idempotent. Progress is one aggregate query over the deployment's tasks
+(``annotate_progress``).
+
+Rollouts go out in waves. A terminal's wave follows from its golden-ratio slot
+(``scheduling.slot_fraction``), which spreads any id range evenly, so wave
+membership needs no ranking query: the canary holds the terminals whose slot
+falls below ``canary_percent``, each later wave ``wave_growth`` times more.
+Only tasks of waves up to ``current_wave`` are created. ``evaluate_wave`` runs
+after every final command result and on each worker pass: it pauses the rollout
+when the wave's failure rate exceeds ``max_failure_rate``, and opens the next
+wave once the current one is fully created, finished, and has soaked for
+``schedule['interval_minutes']``. Terminals that never report back cannot stall
+a rollout: the worker requeues tasks running without a result for
+``TMS_DEPLOYMENTS['TASK_TIMEOUT']`` (``reclaim_stale_tasks``), and a wave still
+unfinished after ``WAVE_TIMEOUT`` opens the next one when
+``WAVE_COMPLETION_PERCENT`` of it finished, or pauses the rollout with the
+count of missing terminals. Download concurrency is capped at claim time
+(see ``terminals.dispatch``), and ``request_deployment_patches`` queues the
+delta packages open deployments can use (see ``terminals.patches``).
+
+A wave cannot finish before a ``materialize_deployments`` pass has created
+all of its tasks, so rollouts depend on those passes. Without Redis the
+server process owning the local liveness store runs them on its flusher
+thread (see ``terminals.liveness``). With Redis the ``materialize_deployments
+--loop`` worker is required, and it must share the server's cache: pending
+markers it sets in another cache stay unseen by heartbeats until the idle
+markers expire.
+"""
+import bisect
+import functools
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db.models import Count, F, Max, Q
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .dispatch import mark_pending, mark_pending_on_commit
+from .models import Deployment, Terminal, UpdateTask
+from .patches import request_patches
+from .scheduling import slot_fraction
+
+TASK_STATUSES = [status for status, _ in UpdateTask.STATUS_CHOICES]
+
+# Set once a terminal's task for a deployment exists, so contact skips the INSERT
+CONTACT_KEY = 'tms:deployment-task:{}:{}'
+
+# Everything past this many waves goes out in the last one
+MAX_WAVES = 20
+
+DueDeployment = namedtuple('DueDeployment', [
+    'id', 'firmware_version_id', 'target_type', 'target_ids', 'priority',
+    'scheduled_at', 'last_terminal_id', 'created_by',
+    'canary_percent', 'wave_growth', 'current_wave',
+])
+
+
+@functools.lru_cache(maxsize=64)
+def wave_limits(canary_percent, wave_growth):
+    """Upper slot bound of each wave; the last one is 1.0"""
+    limits = []
+    size = canary_percent / 100
+    end = 0.0
+    while end + size < 1 and len(limits) < MAX_WAVES - 1:
+        end += size
+        limits.append(end)
+        size *= wave_growth
+    limits.append(1.0)
+    return tuple(limits)
+
+
+def wave_count(deployment):
+    return len(wave_limits(deployment.canary_percent, deployment.wave_growth))
+
+
+def wave_of(deployment, terminal_id):
+    """Wave (0 = canary) the terminal is rolled out in"""
+    limits = wave_limits(deployment.canary_percent, deployment.wave_growth)
+    return bisect.bisect_right(limits, slot_fraction(terminal_id))
+
+
+def _selector(target_type, target_ids):
+    if target_type == 'customer':
+        return Q(customer_id__in=target_ids)
+    if target_type == 'selected':
+        return Q(id__in=target_ids)
+    return Q()
+
+
+def target_terminals(deployment):
+    """Terminals a deployment targets"""
+    return Terminal.objects.filter(
+        _selector(deployment.target_type, deployment.target_ids),
+        id__lte=deployment.last_terminal_id
+    )
+
+
+def request_deployment_patches():
+    """
+    Queue firmware patches from the versions installed on the targets of
+    open deployments to their firmware; returns the number of pairs queued
+    (already known pairs included).
+    """
+    created = 0
+    deployments = Deployment.objects.filter(
+        status__in=['scheduled', 'active', 'paused']
+    ).select_related('firmware_version')
+    for deployment in deployments:
+        installed = target_terminals(deployment).exclude(
+            firmware_version=deployment.firmware_version.version
+        ).values_list('firmware_version', flat=True).distinct()
+        created += len(request_patches(deployment.firmware_version, installed))
+    return created
+
+
+def create_deployment(firmware, target_type, target_ids=(), schedule=None, created_by='', now=None, **rollout):
+    """
+    Record a deployment; one aggregate and one INSERT, no per-terminal rows
+
+    ``rollout`` may set ``canary_percent``, ``wave_growth``, ``max_concurrent``
+    and ``max_failure_rate``; missing ones come from ``TMS_DEPLOYMENTS``.
+    """
+    now = now or timezone.now()
+    defaults = settings.TMS_DEPLOYMENTS
+    rollout = {
+        'canary_percent': defaults['CANARY_PERCENT'],
+        'wave_growth': defaults['WAVE_GROWTH'],
+        'max_concurrent': defaults['MAX_CONCURRENT'],
+        'max_failure_rate': defaults['MAX_FAILURE_RATE'],
+        **{key: value for key, value in rollout.items() if value is not None},
+    }
+    schedule = dict(schedule or {})
+    scheduled_at = now if schedule.get('type', 'immediate') == 'immediate' else schedule.pop('start_at', None)
+    schedule.pop('start_at', None)
+
+    # Pin the target set to terminals that exist now
+    targets = Terminal.objects.filter(_selector(target_type, list(target_ids))).aggregate(
+        total=Count('id'), last_id=Max('id')
+    )
+    started = scheduled_at is None or scheduled_at <= now
+    return Deployment.objects.create(
+        firmware_version=firmware,
+        target_type=target_type,
+        target_ids=list(target_ids),
+        schedule=schedule,
+        scheduled_at=scheduled_at,
+        status='active' if started else 'scheduled',
+        total_terminals=targets['total'],
+        last_terminal_id=targets['last_id'] or 0,
+        wave_started_at=(scheduled_at or now) if started else None,
+        created_by=created_by,
+        **rollout,
+    )
+
+
+def annotate_progress(queryset):
+    """Per-status task counts for each deployment, in the same query"""
+    return queryset.annotate(
+        created_tasks=Count('tasks'),
+        **{
+            f'{status}_tasks': Count('tasks', filter=Q(tasks__status=status))
+            for status in TASK_STATUSES
+        }
+    )
+
+
+def deployment_progress(deployment):
+    """Progress dict from a deployment annotated by ``annotate_progress``"""
+    counts = {status: getattr(deployment, f'{status}_tasks') for status in TASK_STATUSES}
+    finished = counts['completed'] + counts['failed'] + counts['cancelled']
+    total = deployment.total_terminals
+    return {
+        'total': total,
+        'not_started': max(total - deployment.created_tasks, 0),
+        **counts,
+        'percent': round(finished * 100 / total, 1) if total else 100.0,
+    }
+
+
+def _build_task(deployment, terminal_id, wave):
+    return UpdateTask(
+        terminal_id=terminal_id,
+        task_type='firmware',
+        firmware_version_id=deployment.firmware_version_id,
+        deployment_id=deployment.id,
+        wave=wave,
+        status='pending',
+        priority=deployment.priority,
+        scheduled_at=deployment.scheduled_at,
+        created_by=deployment.created_by,
+    )
+
+
+class _DueDeploymentCache:
+    """Per-process memo of deployments that are not fully materialized yet"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = None
+        self._expires = 0
+
+    def fresh(self):
+        return self._rows is not None and self._expires > time.monotonic()
+
+    def due(self, now):
+        if not self.fresh():
+            rows = [
+                DueDeployment(**{**values, 'target_ids': frozenset(values['target_ids'])})
+                for values in Deployment.objects.filter(
+                    status__in=['scheduled', 'active'], materialized_at__isnull=True
+                ).values(*DueDeployment._fields)
+            ]
+            with self._lock:
+                self._rows = rows
+                self._expires = time.monotonic() + settings.TMS_DEPLOYMENTS['CACHE_TTL']
+        return [row for row in self._rows if row.scheduled_at is None or row.scheduled_at <= now]
+
+    def has_due(self, now):
+        """Without IO: False only when the memo is fresh and nothing in it is due"""
+        rows = self._rows
+        if not self.fresh():
+            return True
+        return any(row.scheduled_at is None or row.scheduled_at <= now for row in rows)
+
+    def clear(self):
+        with self._lock:
+            self._rows = None
+
+
+_due_cache = _DueDeploymentCache()
+
+
+def forget_due_deployments():
+    """Drop this process's memo (called when deployments change)"""
+    _due_cache.clear()
+
+
+def may_need_materialization(now=None):
+    """Cheap pre-check for async callers; see ``materialize_for``"""
+    return _due_cache.has_due(now or timezone.now())
+
+
+def _targets(deployment, ref):
+    if ref.terminal_id > deployment.last_terminal_id:
+        return False
+    if wave_of(deployment, ref.terminal_id) > deployment.current_wave:
+        return False
+    if deployment.target_type == 'customer':
+        return ref.customer_id in deployment.target_ids
+    if deployment.target_type == 'selected':
+        return ref.terminal_id in deployment.target_ids
+    return True
+
+
+def materialize_for(refs, now=None):
+    """
+    Create the tasks of due deployments for terminals that made contact
+    and whose wave is open.
+
+    ``refs`` are ``TerminalRef`` tuples. Costs no query while no deployment is
+    due, one cache read when every task exists already, and one bulk INSERT
+    otherwise. Returns the ids of terminals that got tasks (marked pending).
+    """
+    now = now or timezone.now()
+    deployments = _due_cache.due(now)
+    if not deployments:
+        return []
+
+    wanted = {
+        CONTACT_KEY.format(deployment.id, ref.terminal_id): (deployment, ref.terminal_id)
+        for deployment in deployments for ref in refs if _targets(deployment, ref)
+    }
+    if not wanted:
+        return []
+    known = cache.get_many(list(wanted))
+    missing = {key: pair for key, pair in wanted.items() if key not in known}
+    if not missing:
+        return []
+
+    UpdateTask.objects.bulk_create(
+        [
+            _build_task(deployment, terminal_id, wave_of(deployment, terminal_id))
+            for deployment, terminal_id in missing.values()
+        ],
+        ignore_conflicts=True
+    )
+    cache.set_many(
+        {key: True for key in missing}, timeout=settings.TMS_DEPLOYMENTS['CONTACT_MARKER_TTL']
+    )
+    Deployment.objects.filter(
+        id__in={deployment.id for deployment, _ in missing.values()}, status='scheduled'
+    ).update(status='active', wave_started_at=now)
+
+    terminal_ids = sorted({terminal_id for _, terminal_id in missing.values()})
+    mark_pending_on_commit(terminal_ids)
+    return terminal_ids
+
+
+def _wave_counts(deployment):
+    return deployment.tasks.filter(wave=deployment.current_wave).aggregate(
+        tasks=Count('id'),
+        open=Count('id', filter=Q(status__in=['pending', 'running'])),
+        failed=Count('id', filter=Q(status='failed')),
+    )
+
+
+def pause_deployment(deployment, reason):
+    """Stop handing out the deployment's tasks; running ones finish"""
+    paused = Deployment.objects.filter(pk=deployment.pk, status__in=['scheduled', 'active']).update(
+        status='paused', paused_reason=reason[:200]
+    )
+    forget_due_deployments()
+    return bool(paused)
+
+
+def resume_deployment(deployment):
+    """
+    Continue a paused deployment.
+
+    Failures seen so far in the current wave are accepted, so the gate only
+    trips again on new ones, and the wave's clock restarts, so a wave paused
+    at its deadline gets another ``WAVE_TIMEOUT``. Terminals with queued tasks
+    are re-marked.
+    """
+    accepted = _wave_counts(deployment)['failed']
+    resumed = Deployment.objects.filter(pk=deployment.pk, status='paused').update(
+        status='active', paused_reason='', accepted_failures=accepted, wave_started_at=timezone.now()
+    )
+    forget_due_deployments()
+    if resumed:
+        mark_pending_on_commit(
+            deployment.tasks.filter(status='pending').values_list('terminal_id', flat=True).distinct()
+        )
+    return bool(resumed)
+
+
+def evaluate_wave(deployment, now=None):
+    """
+    Gate the current wave of an active deployment.
+
+    Pauses the rollout when more than ``max_failure_rate`` percent of the
+    wave's finished tasks failed (judged once ``MIN_WAVE_SAMPLE`` tasks, or the
+    whole wave, finished). Otherwise opens the next wave when every task of
+    the current one exists and has finished, and the soak interval passed.
+
+    A wave with open tasks after ``WAVE_TIMEOUT`` counts as finished when
+    ``WAVE_COMPLETION_PERCENT`` of its tasks did (stragglers keep their tasks
+    for their next contact); below that the rollout pauses.
+    Returns ``'paused'``, ``'advanced'`` or None.
+    """
+    if deployment.status != 'active':
+        return None
+    now = now or timezone.now()
+    counts = _wave_counts(deployment)
+    failed = counts['failed'] - deployment.accepted_failures
+    finished = counts['tasks'] - counts['open'] - deployment.accepted_failures
+    sample = min(counts['tasks'] - deployment.accepted_failures, settings.TMS_DEPLOYMENTS['MIN_WAVE_SAMPLE'])
+
+    if deployment.max_failure_rate is not None and finished > 0 and finished >= sample:
+        if failed * 100 > deployment.max_failure_rate * finished:
+            reason = (
+                f'Wave {deployment.current_wave + 1}: {failed} of {finished} updates failed '
+                f'(limit {deployment.max_failure_rate:g}%)'
+            )
+            return 'paused' if pause_deployment(deployment, reason) else None
+
+    if deployment.materialized_wave < deployment.current_wave:
+        return None
+    if counts['open']:
+        timeout = settings.TMS_DEPLOYMENTS['WAVE_TIMEOUT']
+        if not deployment.wave_started_at or now < deployment.wave_started_at + timedelta(seconds=timeout):
+            return None
+        done = counts['tasks'] - counts['open']
+        if done * 100 < settings.TMS_DEPLOYMENTS['WAVE_COMPLETION_PERCENT'] * counts['tasks']:
+            reason = (
+                f'Wave {deployment.current_wave + 1}: {counts["open"]} of {counts["tasks"]} updates '
+                f'unfinished after {timeout // 60} minutes'
+            )
+            return 'paused' if pause_deployment(deployment, reason) else None
+    if deployment.current_wave + 1 >= wave_count(deployment):
+        return None  # Last wave: the worker completes the deployment
+    soak = timedelta(minutes=(deployment.schedule or {}).get('interval_minutes') or 0)
+    if deployment.wave_started_at and now < deployment.wave_started_at + soak:
+        return None
+
+    advanced = Deployment.objects.filter(
+        pk=deployment.pk, status='active', current_wave=deployment.current_wave
+    ).update(current_wave=F('current_wave') + 1, wave_started_at=now, accepted_failures=0)
+    forget_due_deployments()
+    return 'advanced' if advanced else None
+
+
+def record_task_result(task, now=None):
+    """Re-evaluate the rollout after one of its tasks finished (command result views)"""
+    if not task.deployment_id or task.status not in ('completed', 'failed'):
+        return None
+    deployment = task.deployment
+    if task.wave != deployment.current_wave:
+        return None
+    return evaluate_wave(deployment, now)
+
+
+def reclaim_stale_tasks(now=None):
+    """
+    Take back rollout tasks that ran for ``TASK_TIMEOUT`` without a result
+    (the agent died or lost the command): they go back to pending while they
+    have retries left, like a reported failure, and fail otherwise.
+
+    Returns ``{'requeued': n, 'failed': n}``.
+    """
+    now = now or timezone.now()
+    timeout = settings.TMS_DEPLOYMENTS['TASK_TIMEOUT']
+    stale = UpdateTask.objects.filter(
+        deployment__isnull=False, status='running', started_at__lt=now - timedelta(seconds=timeout)
+    )
+    message = f'No result within {timeout} seconds'
+    retry = stale.filter(retry_count__lt=F('max_retries'))
+    terminal_ids = list(retry.values_list('terminal_id', flat=True).distinct())
+    requeued = retry.update(status='pending', retry_count=F('retry_count') + 1, error_message=message)
+    failed = stale.update(status='failed', completed_at=now, error_message=message)
+    if requeued:
+        mark_pending_on_commit(terminal_ids)
+    return {'requeued': requeued, 'failed': failed}
+
+
+def materialize_deployments(now=None, batch_size=None):
+    """
+    Background pass: reclaim stale tasks, gate each rollout's current wave,
+    create every missing task of open waves in batches, then close
+    deployments whose tasks have all finished.
+
+    Returns ``{'deployments': n, 'tasks': n, 'requeued': n, 'failed': n,
+    'advanced': n, 'paused': n, 'completed': n}``.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.TMS_DEPLOYMENTS['BATCH_SIZE']
+    result = {'deployments': 0, 'tasks': 0, 'advanced': 0, 'paused': 0, 'completed': 0}
+    result.update(reclaim_stale_tasks(now))
+
+    due = Deployment.objects.filter(
+        Q(scheduled_at__isnull=True) | Q(scheduled_at__lte=now),
+        status__in=['scheduled', 'active'],
+        materialized_at__isnull=True,
+    )
+    for deployment in due:
+        outcome = evaluate_wave(deployment, now)
+        if outcome:
+            result[outcome] += 1
+            if outcome == 'paused':
+                continue
+            deployment.refresh_from_db()
+        if deployment.materialized_wave >= deployment.current_wave:
+            continue
+
+        missing = target_terminals(deployment).exclude(
+            update_tasks__deployment=deployment
+        ).order_by('id').values_list('id', flat=True)
+        last_id = 0
+        while True:
+            batch = list(missing.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+            waves = {terminal_id: wave_of(deployment, terminal_id) for terminal_id in batch}
+            batch = [terminal_id for terminal_id, wave in waves.items() if wave <= deployment.current_wave]
+            if not batch:
+                continue
+            UpdateTask.objects.bulk_create(
+                [_build_task(deployment, terminal_id, waves[terminal_id]) for terminal_id in batch],
+                ignore_conflicts=True
+            )
+            mark_pending(batch)
+            result['tasks'] += len(batch)
+
+        last_wave = deployment.current_wave + 1 >= wave_count(deployment)
+        Deployment.objects.filter(pk=deployment.pk).update(
+            materialized_wave=deployment.current_wave, materialized_at=now if last_wave else None
+        )
+        Deployment.objects.filter(pk=deployment.pk, status='scheduled').update(status='active', wave_started_at=now)
+        result['deployments'] += 1
+
+    result['completed'] = Deployment.objects.filter(
+        status='active', materialized_at__isnull=False
+    ).exclude(tasks__status__in=['pending', 'running']).update(status='completed')
+
+    forget_due_deployments()
+    return result
+
+
+@receiver(setting_changed)
+def _reset_due_deployments(setting, **kwargs):
+    if setting == 'TMS_DEPLOYMENTS':
+        forget_due_deployments()
@@ -0,0 +1,218 @@
+"""
+Command dispatch for the heartbeat path.
+
+Pending ``UpdateTask`` rows are claimed atomically: rows are locked with
+``select_for_update(skip_locked=True)`` so overlapping heartbeats never hand out
+the same task, and every claimed task is flipped to ``running`` with a single
+UPDATE. Firmware metadata comes in through ``select_related``.
+
+Most heartbeats have nothing to claim, so a per-terminal "pending work" marker
+is kept in the cache. Task producers call ``mark_pending_on_commit``; the
+heartbeat path only queries ``UpdateTask`` when the marker is set or unknown
+(e.g. after a cache restart). Setting the marker also wakes agents parked on
+the long-poll endpoint (see ``terminals.longpoll``). Idle markers expire after
+``settings.TMS_PENDING_MARKER_IDLE_TTL`` seconds, which bounds how long a task
+created without a marker (admin, raw SQL) can wait.
+
+Firmware commands carry a binary patch from the terminal's installed version
+when one is ready (see ``terminals.patches``); looking it up costs one query,
+only when firmware tasks are claimed.
+
+Deployment tasks are only handed out while their rollout is active and has a
+free download slot (``Deployment.max_concurrent`` running tasks at most, not
+counting tasks silent for longer than ``TMS_DEPLOYMENTS['TASK_TIMEOUT']``).
+Terminals left waiting for a slot re-check after
+``TMS_DEPLOYMENTS['SLOT_RETRY']`` seconds; the running count is read without
+locking, so concurrent claims can overshoot the cap slightly.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+from django.urls import reverse
+from django.utils import timezone
+
+from . import longpoll
+from .models import UpdateTask
+from .patches import ready_patches
+
+MAX_COMMANDS_PER_HEARTBEAT = 5
+
+PENDING_MARKER_KEY = 'tms:pending-commands:{}'
+
+
+def _marker_keys(terminal_ids):
+    return {PENDING_MARKER_KEY.format(terminal_id): terminal_id for terminal_id in terminal_ids}
+
+
+def mark_pending(terminal_ids):
+    """Flag terminals as having queued commands and wake parked long-polls"""
+    terminal_ids = list(terminal_ids)
+    cache.set_many({key: True for key in _marker_keys(terminal_ids)}, timeout=None)
+    longpoll.notify(terminal_ids)
+
+
+def mark_pending_on_commit(terminal_ids):
+    """Flag terminals once the transaction creating their tasks commits"""
+    terminal_ids = list(terminal_ids)
+    transaction.on_commit(lambda: mark_pending(terminal_ids))
+
+
+def _mark_idle(terminal_ids, timeout=None):
+    cache.set_many(
+        {key: False for key in _marker_keys(terminal_ids)},
+        timeout=timeout or settings.TMS_PENDING_MARKER_IDLE_TTL
+    )
+
+
+def terminals_with_pending_work(terminal_ids):
+    """Terminals whose marker is set or unknown (False means known idle)"""
+    keys = _marker_keys(terminal_ids)
+    markers = cache.get_many(list(keys))
+    return [terminal_id for key, terminal_id in keys.items() if markers.get(key) is not False]
+
+
+def build_command(task, patch=None):
+    """
+    Convert a claimed UpdateTask into the command payload sent to agents
+
+    ``patch`` is a ready FirmwarePatch from the terminal's installed version;
+    the agent rebuilds the image from it and falls back to ``url`` when the
+    result does not match ``checksum``.
+    """
+    command = {
+        'id': task.id,
+        'type': task.task_type,
+        'priority': 'high' if task.priority <= 3 else 'normal',
+        'parameters': task.parameters or {}
+    }
+
+    if task.task_type == 'firmware' and task.firmware_version:
+        command['parameters'].update({
+            'version': task.firmware_version.version,
+            # Images without an external URL are served by the agent download endpoint
+            'url': task.firmware_version.file_url or reverse(
+                'agent-firmware-download', args=[task.firmware_version_id]
+            ),
+            'checksum': f'sha256:{task.firmware_version.file_hash}',
+            'size': task.firmware_version.file_size
+        })
+        if patch is not None:
+            command['parameters']['delta'] = {
+                'source_version': patch.source.version,
+                'source_checksum': f'sha256:{patch.source.file_hash}',
+                'url': reverse('agent-firmware-patch-download', args=[patch.id]),
+                'checksum': f'sha256:{patch.file_hash}',
+                'size': patch.file_size
+            }
+
+    return command
+
+
+def _download_slots(tasks, now):
+    """
+    Free download slots per deployment of ``tasks`` (None: uncapped).
+
+    Tasks running for longer than ``TASK_TIMEOUT`` do not hold a slot: their
+    agent is presumed gone and the worker reclaims them.
+    """
+    deployments = {task.deployment_id: task.deployment for task in tasks if task.deployment_id}
+    capped = [
+        deployment.id for deployment in deployments.values()
+        if deployment.status == 'active' and deployment.max_concurrent
+    ]
+    running = {}
+    if capped:
+        running = dict(
+            UpdateTask.objects.filter(
+                deployment_id__in=capped, status='running',
+                started_at__gte=now - timedelta(seconds=settings.TMS_DEPLOYMENTS['TASK_TIMEOUT'])
+            )
+            .order_by().values('deployment_id').annotate(count=Count('id'))
+            .values_list('deployment_id', 'count')
+        )
+
+    slots = {}
+    for deployment in deployments.values():
+        if deployment.status != 'active':
+            slots[deployment.id] = 0
+        elif deployment.max_concurrent:
+            slots[deployment.id] = max(deployment.max_concurrent - running.get(deployment.id, 0), 0)
+        else:
+            slots[deployment.id] = None
+    return slots
+
+
+def claim_commands(terminal_ids, now=None, limit=MAX_COMMANDS_PER_HEARTBEAT):
+    """
+    Claim up to ``limit`` pending commands per terminal.
+
+    Costs a constant number of queries however many commands are returned,
+    and no ``UpdateTask`` query at all when every marker says idle.
+    Returns a dict mapping terminal id to its list of command payloads.
+    """
+    now = now or timezone.now()
+    terminal_ids = list(terminal_ids)
+    commands = {terminal_id: [] for terminal_id in terminal_ids}
+
+    candidates = terminals_with_pending_work(terminal_ids)
+    if not candidates:
+        return commands
+
+    # Mark idle before reading: a task queued concurrently re-sets the marker
+    # after this point, so it is never lost.
+    _mark_idle(candidates)
+    waiting = set()
+    try:
+        with transaction.atomic():
+            pending = UpdateTask.objects.select_for_update(
+                skip_locked=True, of=('self',)
+            ).filter(
+                terminal_id__in=candidates,
+                status='pending'
+            ).select_related('firmware_version', 'deployment').annotate(
+                installed_firmware=F('terminal__firmware_version')
+            ).order_by('terminal_id', 'priority', 'scheduled_at')
+            if len(candidates) == 1:
+                pending = pending[:limit]
+            pending = list(pending)
+            slots = _download_slots(pending, now)
+            patches = ready_patches(
+                (task.installed_firmware, task.firmware_version_id) for task in pending
+                if task.task_type == 'firmware' and task.firmware_version
+                and task.installed_firmware != task.firmware_version.version
+            )
+
+            claimed_ids = []
+            for task in pending:
+                if len(commands[task.terminal_id]) >= limit:
+                    continue
+                if task.deployment_id and slots[task.deployment_id] is not None:
+                    if not slots[task.deployment_id]:
+                        # Paused rollouts stay idle until resumed (which re-marks)
+                        if task.deployment.status == 'active':
+                            waiting.add(task.terminal_id)
+                        continue
+                    slots[task.deployment_id] -= 1
+                commands[task.terminal_id].append(
+                    build_command(task, patches.get((task.installed_firmware, task.firmware_version_id)))
+                )
+                claimed_ids.append(task.id)
+
+            if claimed_ids:
+                UpdateTask.objects.filter(id__in=claimed_ids).update(status='running', started_at=now)
+    except Exception:
+        mark_pending(candidates)
+        raise
+
+    # Terminals that hit the limit may still have queued work
+    saturated = [terminal_id for terminal_id in candidates if len(commands[terminal_id]) >= limit]
+    if saturated:
+        mark_pending(saturated)
+    waiting.difference_update(saturated)
+    if waiting:
+        _mark_idle(waiting, timeout=settings.TMS_DEPLOYMENTS['SLOT_RETRY'])
+
+    return commands
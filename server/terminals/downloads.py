@@ -0,0 +1,150 @@
+"""
+Firmware artifact downloads.
+
+Firmware images live under ``settings.TMS_FIRMWARE_DOWNLOADS['ROOT']``: in the
+content-addressed blob store by ``file_hash`` (see ``terminals.blobstore``), or
+as ``FirmwareVersion.file_name`` for images copied there by hand.
+``serve_firmware`` answers agents with:
+
+- a strong ``ETag`` built from ``file_hash``: ``If-None-Match`` gets 304, and
+  ``If-Range`` only resumes a download against the same image;
+- single ``Range`` requests (206, or 416 when unsatisfiable), so agents resume
+  interrupted downloads; multi-range requests get the whole file;
+- the file streamed by ``FileResponse`` without reading it into memory. WSGI
+  servers with a file wrapper (gunicorn) send it with ``sendfile``; with
+  ``ACCEL_REDIRECT`` set, nginx sends the file itself (``X-Accel-Redirect``)
+  and handles ranges.
+"""
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+
+from .blobstore import get_blob_store
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CONTENT_TYPE = 'application/octet-stream'
+
+
+def firmware_path(firmware):
+    """Path of the firmware image, or None if ``file_name`` leaves the root"""
+    blob = get_blob_store().path(firmware.file_hash)
+    if blob is not None and blob.is_file():
+        return blob
+    root = Path(settings.TMS_FIRMWARE_DOWNLOADS['ROOT']).resolve()
+    path = (root / firmware.file_name).resolve()
+    return path if root in path.parents else None
+
+
+def firmware_etag(firmware):
+    return f'"{firmware.file_hash}"'
+
+
+def parse_range(header, size):
+    """
+    Inclusive ``(start, end)`` of a single byte range, or None to send the
+    whole file (no header, several ranges or a malformed one).
+
+    Raises ValueError when the range is unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        if not int(last) or not size:
+            raise ValueError(header)
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise ValueError(header)
+    if end < start:
+        return None
+    return start, end
+
+
+class _FileRange:
+    """``length`` bytes of an open file, from its current position"""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # Lets the server's file wrapper sendfile() from the current offset,
+        # bounded by Content-Length
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def serve_firmware(request, firmware):
+    """Response streaming the firmware image, or None when it is not on disk"""
+    path = firmware_path(firmware)
+    if path is None or not path.is_file():
+        return None
+    return serve_file(request, path, firmware_etag(firmware), Path(firmware.file_name).name)
+
+
+def serve_file(request, path, etag, filename):
+    """Conditional, range-aware response streaming the file at ``path``"""
+
+    # If-None-Match -> 304 (If-Match -> 412)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    size = path.stat().st_size
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            response['ETag'] = etag
+            return response
+
+    accel = settings.TMS_FIRMWARE_DOWNLOADS['ACCEL_REDIRECT']
+    if accel:
+        response = HttpResponse(content_type=CONTENT_TYPE)
+        root = Path(settings.TMS_FIRMWARE_DOWNLOADS['ROOT']).resolve()
+        relative = path.resolve().relative_to(root).as_posix()
+        response['X-Accel-Redirect'] = f"{accel.rstrip('/')}/{quote(relative)}"
+        response['ETag'] = etag
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=CONTENT_TYPE)
+    else:
+        file = path.open('rb')
+        file.seek(start)
+        response = FileResponse(
+            _FileRange(file, length), content_type=CONTENT_TYPE,
+            as_attachment=True, filename=filename
+        )
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = length
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    return response
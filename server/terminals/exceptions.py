@@ -0,0 +1,28 @@
+import math
+
+from rest_framework.exceptions import Throttled
+from rest_framework.views import exception_handler
+
+
+def api_exception_handler(exc, context):
+    """DRF exception handler; reports throttling in the API error format"""
+    response = exception_handler(exc, context)
+    
+    if isinstance(exc, Throttled) and response is not None:
+        retry_after, response.data = rate_limit_error(exc.wait)
+        response['Retry-After'] = str(retry_after)
+    
+    return response
+
+
+def rate_limit_error(wait):
+    """(Retry-After seconds, RATE_001 body) for a request rejected for ``wait`` seconds"""
+    retry_after = math.ceil(wait) if wait is not None else 1
+    return retry_after, {
+        'error': {
+            'code': 'RATE_001',
+            'message': 'Rate limit exceeded',
+            'details': f'Please retry after {retry_after} seconds',
+            'retry_after': retry_after
+        }
+    }
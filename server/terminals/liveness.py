@@ -0,0 +1,444 @@
+"""
+Write-coalescing liveness store for heartbeat-driven terminal fields.
+
+Heartbeats only change a handful of columns on ``Terminal``. Instead of a full
+``terminal.save()`` per heartbeat, those values are written to a fast store and
+a flusher pushes every dirty terminal to the database with one ``bulk_update``.
+Readers overlay the store on top of database rows, so they never show values
+older than the last flush.
+
+Two backends are available (``settings.TMS_LIVENESS['BACKEND']``):
+
+- ``local``: in-process dictionary for a single server process
+- ``redis``: shared hashes in Redis through django-redis
+
+Nothing in a ``local`` store is visible to other processes: its buffered
+heartbeats, delta heartbeat sessions (``heartbeat_seq``, a delta reaching
+another process is answered with ``SYNC_001``) and ``forget`` calls. So one
+process owns it, enforced by ``claim_process``: the first server process to
+take ``TMS_LIVENESS['LOCK_FILE']`` buffers heartbeats and flushes, sweeps
+offline terminals and runs the deployment passes (rollout waves wait for
+them) from the flusher thread, and the ``flush_liveness`` and
+``sweep_offline`` commands refuse to run beside it. Other server processes
+(further gunicorn workers) write each heartbeat through to the database and
+read rows without an overlay, so several workers run without Redis but only
+the owner coalesces writes. Entries not written for ``TTL`` seconds are
+dropped once flushed, as Redis expires them.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development servers run one process
+    fcntl = None
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+LIVENESS_FIELDS = [
+    'last_heartbeat', 'status', 'cpu_usage', 'memory_usage', 'disk_usage', 'temperature',
+]
+
+
+class LocalLivenessBackend:
+    """In-process backend for a single server process (see ``claim_process``)"""
+
+    def __init__(self, ttl=86400):
+        self._lock = threading.Lock()
+        self._state = {}
+        self._dirty = set()
+        # Last write per terminal, oldest first
+        self._written = {}
+        self.ttl = ttl
+
+    def write_many(self, entries):
+        now = time.monotonic()
+        with self._lock:
+            for terminal_id, values in entries.items():
+                self._state.setdefault(terminal_id, {}).update(values)
+                self._dirty.add(terminal_id)
+                self._written.pop(terminal_id, None)
+                self._written[terminal_id] = now
+
+    def _evict(self):
+        """Drop flushed entries older than ``ttl`` (terminals gone quiet or deleted)"""
+        cutoff = time.monotonic() - self.ttl
+        while self._written:
+            terminal_id, written = next(iter(self._written.items()))
+            if written > cutoff or terminal_id in self._dirty:
+                break
+            del self._written[terminal_id]
+            del self._state[terminal_id]
+
+    def read_many(self, terminal_ids):
+        with self._lock:
+            return {
+                terminal_id: dict(self._state[terminal_id])
+                for terminal_id in terminal_ids
+                if terminal_id in self._state
+            }
+
+    def dirty_ids(self):
+        with self._lock:
+            return set(self._dirty)
+
+    def pop_dirty(self):
+        with self._lock:
+            self._evict()
+            dirty, self._dirty = self._dirty, set()
+            return {terminal_id: dict(self._state[terminal_id]) for terminal_id in dirty}
+
+    def mark_dirty(self, terminal_ids):
+        with self._lock:
+            self._dirty.update(terminal_id for terminal_id in terminal_ids if terminal_id in self._state)
+
+    def discard(self, terminal_ids):
+        with self._lock:
+            for terminal_id in terminal_ids:
+                self._state.pop(terminal_id, None)
+                self._dirty.discard(terminal_id)
+                self._written.pop(terminal_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._state.clear()
+            self._dirty.clear()
+            self._written.clear()
+
+
+class RedisLivenessBackend:
+    """Shared backend; any process (or a dedicated flusher) can flush"""
+
+    KEY_PREFIX = 'tms:liveness:'
+    DIRTY_KEY = 'tms:liveness-dirty'
+
+    def __init__(self, alias='default', ttl=86400):
+        from django_redis import get_redis_connection
+        self.client = get_redis_connection(alias)
+        self.ttl = ttl
+
+    def _key(self, terminal_id):
+        return f'{self.KEY_PREFIX}{terminal_id}'
+
+    @staticmethod
+    def _encode(values):
+        encoded = {}
+        for field, value in values.items():
+            if field == 'last_heartbeat' and value is not None:
+                value = value.isoformat()
+            encoded[field] = json.dumps(value)
+        return encoded
+
+    @staticmethod
+    def _decode(raw):
+        values = {}
+        for field, value in raw.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            value = json.loads(value)
+            if field == 'last_heartbeat' and value is not None:
+                value = parse_datetime(value)
+            values[field] = value
+        return values
+
+    def write_many(self, entries):
+        if not entries:
+            return
+        pipe = self.client.pipeline()
+        for terminal_id, values in entries.items():
+            pipe.hset(self._key(terminal_id), mapping=self._encode(values))
+            pipe.expire(self._key(terminal_id), self.ttl)
+        pipe.sadd(self.DIRTY_KEY, *entries)
+        pipe.execute()
+
+    def read_many(self, terminal_ids):
+        terminal_ids = list(terminal_ids)
+        if not terminal_ids:
+            return {}
+        pipe = self.client.pipeline()
+        for terminal_id in terminal_ids:
+            pipe.hgetall(self._key(terminal_id))
+        return {
+            terminal_id: self._decode(raw)
+            for terminal_id, raw in zip(terminal_ids, pipe.execute())
+            if raw
+        }
+
+    def dirty_ids(self):
+        return {int(terminal_id) for terminal_id in self.client.smembers(self.DIRTY_KEY)}
+
+    def pop_dirty(self):
+        count = self.client.scard(self.DIRTY_KEY)
+        if not count:
+            return {}
+        # SPOP is atomic, so concurrent flushers never take the same terminal
+        terminal_ids = [int(terminal_id) for terminal_id in self.client.spop(self.DIRTY_KEY, count)]
+        return self.read_many(terminal_ids)
+
+    def mark_dirty(self, terminal_ids):
+        terminal_ids = list(terminal_ids)
+        if terminal_ids:
+            self.client.sadd(self.DIRTY_KEY, *terminal_ids)
+
+    def discard(self, terminal_ids):
+        terminal_ids = list(terminal_ids)
+        if not terminal_ids:
+            return
+        pipe = self.client.pipeline()
+        pipe.delete(*[self._key(terminal_id) for terminal_id in terminal_ids])
+        pipe.srem(self.DIRTY_KEY, *terminal_ids)
+        pipe.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(f'{self.KEY_PREFIX}*'):
+            self.client.delete(key)
+        self.client.delete(self.DIRTY_KEY)
+
+
+class LivenessStore:
+    """Facade used by views: record heartbeats, overlay reads, flush to DB"""
+
+    def __init__(self, backend, flush_batch_size=500, write_through=False):
+        self.backend = backend
+        self.flush_batch_size = flush_batch_size
+        # Flush on every write (a process not owning a ``local`` store)
+        self.write_through = write_through
+
+    def record(self, terminal_id, values):
+        """Record liveness values for one terminal"""
+        self.record_many({terminal_id: values})
+
+    def record_many(self, entries):
+        """Record liveness values for many terminals ({terminal_id: values})"""
+        self.backend.write_many(entries)
+        if self.write_through:
+            self.flush()
+
+    def get_many(self, terminal_ids):
+        """Return the newest known liveness values keyed by terminal id"""
+        return self.backend.read_many(terminal_ids)
+
+    def apply(self, terminals):
+        """Overlay stored values onto Terminal instances in place"""
+        terminals = [terminal for terminal in terminals if terminal is not None]
+        if self.write_through:
+            # The database is newer than what this process wrote last
+            return terminals
+        live = self.get_many([terminal.id for terminal in terminals])
+        for terminal in terminals:
+            for field, value in live.get(terminal.id, {}).items():
+                if field in LIVENESS_FIELDS:
+                    setattr(terminal, field, value)
+        return terminals
+
+    def forget(self, terminal_ids):
+        """Drop stored values after the database was changed by another path"""
+        self.backend.discard(terminal_ids)
+
+    def flush(self):
+        """
+        Push every dirty terminal to the database; returns rows written.
+
+        The heartbeats are accounted in the availability rollups and their
+        status changes recorded in the same transaction (see
+        ``terminals.availability`` and ``terminals.uptime``).
+        """
+        from .availability import account_heartbeats
+        from .models import Terminal
+        from .uptime import record_heartbeat_changes
+
+        pending = self.backend.pop_dirty()
+        if not pending:
+            return 0
+
+        try:
+            with transaction.atomic():
+                accounted = account_heartbeats(pending)
+                record_heartbeat_changes(pending, self.flush_batch_size)
+                terminals = []
+                for terminal_id, values in pending.items():
+                    terminal = Terminal(id=terminal_id, availability_until=accounted.get(terminal_id))
+                    for field in LIVENESS_FIELDS:
+                        setattr(terminal, field, values.get(field))
+                    terminals.append(terminal)
+                Terminal.objects.bulk_update(
+                    terminals, LIVENESS_FIELDS + ['availability_until'], batch_size=self.flush_batch_size
+                )
+        except Exception:
+            self.backend.mark_dirty(pending)
+            raise
+
+        return len(terminals)
+
+    def clear(self):
+        self.backend.clear()
+
+
+class LivenessFlusher(threading.Thread):
+    """
+    Daemon thread that flushes the store every ``interval`` seconds, sweeps
+    offline terminals every ``sweep_interval`` seconds and runs a deployment
+    pass (``materialize_deployments``) every ``deployment_interval`` seconds
+    if given
+    """
+
+    def __init__(self, store, interval, sweep_interval=None, deployment_interval=None):
+        super().__init__(name='liveness-flusher', daemon=True)
+        self.store = store
+        self.interval = interval
+        self.sweep_interval = sweep_interval
+        self.deployment_interval = deployment_interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        next_sweep = time.monotonic() + (self.sweep_interval or 0)
+        next_deployments = time.monotonic() + (self.deployment_interval or 0)
+        while not self.stop_event.wait(self.interval):
+            try:
+                if self.sweep_interval and time.monotonic() >= next_sweep:
+                    from .sweeper import sweep_offline
+
+                    next_sweep = time.monotonic() + self.sweep_interval
+                    sweep_offline()  # flushes first
+                else:
+                    self.store.flush()
+            except Exception:
+                logger.exception('Liveness flush or offline sweep failed')
+            try:
+                if self.deployment_interval and time.monotonic() >= next_deployments:
+                    from .deployments import materialize_deployments
+
+                    next_deployments = time.monotonic() + self.deployment_interval
+                    materialize_deployments()
+            except Exception:
+                logger.exception('Deployment pass failed')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+_store = None
+_flusher = None
+_process_lock = None
+_write_through = False
+_lock = threading.Lock()
+
+
+def _is_local(config):
+    return config.get('BACKEND', 'local') != 'redis'
+
+
+def _build_backend(config):
+    if not _is_local(config):
+        return RedisLivenessBackend(config.get('REDIS_ALIAS', 'default'), config.get('TTL', 86400))
+    return LocalLivenessBackend(config.get('TTL', 86400))
+
+
+def claim_process():
+    """
+    Make this process the owner of the ``local`` store (no-op with ``redis``).
+
+    Holds an exclusive lock on ``TMS_LIVENESS['LOCK_FILE']`` until the
+    process exits. Raises ``ImproperlyConfigured`` while another process
+    owns it.
+    """
+    global _process_lock
+    config = settings.TMS_LIVENESS
+    if not _is_local(config) or fcntl is None:
+        return
+    with _lock:
+        if _process_lock is not None:
+            return
+        path = config['LOCK_FILE']
+        handle = open(path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            raise ImproperlyConfigured(
+                f'Another process owns the local liveness store ({path}); run a single server '
+                f'process or set TMS_LIVENESS_BACKEND=redis'
+            )
+        _process_lock = handle
+
+
+def _release_process():
+    global _process_lock
+    with _lock:
+        if _process_lock is not None:
+            _process_lock.close()
+            _process_lock = None
+
+
+def get_store():
+    """Return the process-wide liveness store"""
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                config = settings.TMS_LIVENESS
+                _store = LivenessStore(
+                    _build_backend(config), config.get('FLUSH_BATCH_SIZE', 500), _write_through
+                )
+    return _store
+
+
+def start_flusher():
+    """
+    Start the background flusher for this process (called by server
+    entrypoints). With the ``local`` backend the process claims the store
+    and sweeps offline terminals too, since no other process can, and runs
+    the deployment worker's passes, since its cache is the one heartbeats
+    read; when another process owns it, this one writes through and starts
+    no thread.
+    """
+    global _flusher, _store, _write_through
+    try:
+        claim_process()
+    except ImproperlyConfigured:
+        logger.info('Another process owns the local liveness store, writing heartbeats through')
+        with _lock:
+            _write_through = True
+            _store = None
+        return None
+    interval = settings.TMS_LIVENESS.get('FLUSH_INTERVAL', 10)
+    if interval <= 0:
+        return None
+    sweep_interval = deployment_interval = None
+    if _is_local(settings.TMS_LIVENESS):
+        sweep_interval = settings.TMS_OFFLINE_SWEEP['INTERVAL']
+        deployment_interval = settings.TMS_DEPLOYMENTS['INTERVAL']
+    store = get_store()
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = LivenessFlusher(store, interval, sweep_interval, deployment_interval)
+            _flusher.start()
+            atexit.register(_flush_at_exit)
+    return _flusher
+
+
+def _flush_at_exit():
+    try:
+        get_store().flush()
+    except Exception:
+        logger.exception('Liveness flush at exit failed')
+
+
+@receiver(setting_changed)
+def _reset_store(setting, **kwargs):
+    global _store, _write_through
+    if setting == 'TMS_LIVENESS':
+        _store = None
+        _write_through = False
+        _release_process()
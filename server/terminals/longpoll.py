@@ -0,0 +1,66 @@
+"""
+Wake-ups for agents parked on the long-poll command endpoint.
+
+``agent/commands/wait`` keeps an agent's request open until a command is
+queued for its terminal. Waiters in the same process are woken directly by
+``dispatch.mark_pending`` through ``notify``; waiters in other processes see
+the pending marker on their next poll tick
+(``settings.TMS_COMMAND_WAIT['POLL_INTERVAL']``). Serve the endpoint through
+``tms_server.asgi`` so parked requests do not hold worker threads.
+"""
+import asyncio
+import threading
+
+_waiters = {}
+_lock = threading.Lock()
+
+
+def notify(terminal_ids):
+    """Wake every waiter parked on one of the terminals (thread-safe)"""
+    with _lock:
+        targets = [waiter for terminal_id in terminal_ids for waiter in _waiters.get(terminal_id, ())]
+    for loop, event in targets:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # The waiter's loop already closed
+            pass
+
+
+class CommandWaiter:
+    """Async context manager registering one parked request for a terminal"""
+
+    def __init__(self, terminal_id):
+        self.terminal_id = terminal_id
+        self.event = asyncio.Event()
+        self._key = None
+
+    async def __aenter__(self):
+        self._key = (asyncio.get_running_loop(), self.event)
+        with _lock:
+            _waiters.setdefault(self.terminal_id, set()).add(self._key)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        with _lock:
+            waiters = _waiters.get(self.terminal_id)
+            if waiters is not None:
+                waiters.discard(self._key)
+                if not waiters:
+                    del _waiters[self.terminal_id]
+
+    async def wait(self, timeout):
+        """Sleep until notified or ``timeout`` seconds pass; True if notified"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.event.clear()
+        return True
+
+
+def waiting_count():
+    """Number of parked requests in this process"""
+    with _lock:
+        return sum(len(waiters) for waiters in _waiters.values())
@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from terminals.availability import rebuild_availability
+from terminals.models import Terminal
+
+
+def _init_worker():
+    # Forked workers must not share the parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    """
+    Rebuild daily availability rollups from metric history.
+    
+    Terminals are split into chunks rebuilt in parallel by a process pool;
+    each chunk costs a fixed number of queries. Days are rebuilt whole, so
+    the range should end before today (the default), which the heartbeat
+    and sweeper accounting keep current.
+    """
+
+    help = 'Rebuild TerminalAvailability rows from heartbeat metric history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Days to rebuild, ending yesterday')
+        parser.add_argument('--from-date', help='First day to rebuild (YYYY-MM-DD, overrides --days)')
+        parser.add_argument('--to-date', help='Last day to rebuild (YYYY-MM-DD, default: yesterday)')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes (1 runs in this process)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Terminals per task')
+
+    def handle(self, *args, **options):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        end = parse_date(options['to_date']) if options['to_date'] else yesterday
+        start = parse_date(options['from_date']) if options['from_date'] else end - timedelta(days=options['days'] - 1)
+        if start is None or end is None or start > end:
+            raise CommandError('Invalid date range')
+
+        terminal_ids = list(Terminal.objects.order_by('id').values_list('id', flat=True))
+        size = options['chunk_size']
+        chunks = [terminal_ids[offset:offset + size] for offset in range(0, len(terminal_ids), size)]
+
+        started = time.monotonic()
+        rows = 0
+        if options['workers'] <= 1:
+            for chunk in chunks:
+                rows += rebuild_availability(chunk, start, end)
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+                futures = [pool.submit(rebuild_availability, chunk, start, end) for chunk in chunks]
+                for future in as_completed(futures):
+                    rows += future.result()
+
+        self.stdout.write(
+            f"Rebuilt {rows} day(s) of availability for {len(terminal_ids)} terminal(s) "
+            f"from {start} to {end} in {time.monotonic() - started:.2f}s"
+        )
@@ -0,0 +1,92 @@
+import gzip
+import io
+import json
+import random
+import time
+
+import msgpack
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from terminals.parsers import AgentJSONParser, MessagePackParser
+
+
+class Command(BaseCommand):
+    """
+    Compare agent payload encodings.
+    
+    Reports bytes on the wire and server-side parse time (through the real
+    DRF parsers) for plain JSON, gzip JSON, MessagePack and gzip MessagePack.
+    """
+
+    help = 'Benchmark wire size and parse time of agent payload formats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=500, help='Log entries per batch')
+        parser.add_argument('--repeat', type=int, default=50, help='Parses per format')
+
+    def build_payloads(self, entries):
+        """A log batch and a diagnostics body shaped like the agent's"""
+        rng = random.Random(42)
+        logs = {
+            'serial_number': 'TC-200-BENCH0001',
+            'logs': [
+                {
+                    'timestamp': f'2025-11-24T12:{i // 60 % 60:02d}:{i % 60:02d}Z',
+                    'level': rng.choice(['INFO', 'INFO', 'INFO', 'WARNING', 'ERROR']),
+                    'type': rng.choice(['transaction', 'communication', 'system']),
+                    'message': f'Transaction {rng.randint(100000, 999999)} completed in {rng.randint(50, 900)} ms',
+                    'details': {'terminal_state': 'ready', 'reader': 'IC', 'retries': rng.randint(0, 3)},
+                }
+                for i in range(entries)
+            ]
+        }
+        diagnostics = {
+            'serial_number': 'TC-200-BENCH0001',
+            'logs': [{
+                'timestamp': '2025-11-24T12:00:00Z',
+                'level': 'INFO',
+                'type': 'system',
+                'message': 'Diagnostic results',
+                'details': {
+                    'checks': [
+                        {'name': f'check_{i}', 'status': 'passed', 'duration_ms': rng.randint(1, 50)}
+                        for i in range(entries)
+                    ]
+                },
+            }]
+        }
+        return {'log batch': logs, 'diagnostics': diagnostics}
+
+    def parse_time(self, parser, body, content_type, encoding, repeat):
+        headers = {'HTTP_CONTENT_ENCODING': encoding} if encoding else {}
+        request = RequestFactory().post('/', body, content_type=content_type, **headers)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            parser.parse(io.BytesIO(body), content_type, {'request': request})
+        return (time.perf_counter() - started) / repeat * 1000
+
+    def handle(self, *args, **options):
+        formats = [
+            ('json', AgentJSONParser(), 'application/json', False),
+            ('json+gzip', AgentJSONParser(), 'application/json', True),
+            ('msgpack', MessagePackParser(), 'application/msgpack', False),
+            ('msgpack+gzip', MessagePackParser(), 'application/msgpack', True),
+        ]
+        for name, payload in self.build_payloads(options['entries']).items():
+            self.stdout.write(f'{name} ({options["entries"]} entries)')
+            baseline = None
+            for label, parser, content_type, compressed in formats:
+                if content_type == 'application/json':
+                    body = json.dumps(payload).encode('utf-8')
+                else:
+                    body = msgpack.packb(payload)
+                if compressed:
+                    body = gzip.compress(body)
+                baseline = baseline or len(body)
+                parse_ms = self.parse_time(
+                    parser, body, content_type, 'gzip' if compressed else None, options['repeat']
+                )
+                self.stdout.write(
+                    f'  {label:<14}{len(body):>10,} bytes  {len(body) / baseline:>6.1%}  {parse_ms:>8.2f} ms/parse'
+                )
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.utils import timezone
+
+from terminals import async_views, views
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Customer, Terminal
+from terminals.resolver import get_resolver
+
+
+class Command(BaseCommand):
+    """
+    Compare heartbeat throughput of the sync and async agent views.
+
+    Simulates ``--agents`` terminals each sending ``--requests`` heartbeats as
+    fast as they are answered, against one worker: ``--threads`` threads for
+    the sync views (a gunicorn gthread worker), one event loop for the async
+    views (an ASGI worker). ``--latency-ms`` is added to every query to model a
+    database across the network. Runs against a throwaway test database with a
+    local cache and liveness store; middleware and admission control are not
+    part of the measurement.
+    """
+
+    help = 'Benchmark concurrent-agent heartbeat throughput, sync vs async views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agents', type=int, default=100, help='Concurrent agents')
+        parser.add_argument('--requests', type=int, default=10, help='Heartbeats per agent')
+        parser.add_argument('--threads', type=int, default=8, help='Threads of the sync worker')
+        parser.add_argument('--latency-ms', type=float, default=1.0, help='Added latency per query')
+
+    def payload(self, serial_number, seq):
+        return json.dumps({
+            'serial_number': serial_number,
+            'seq': seq,
+            'status': 'online',
+            'timestamp': timezone.now().isoformat(),
+            'metrics': {'cpu_usage': 10 + seq % 50, 'memory_usage': 40, 'disk_usage': 30},
+            'firmware_version': '1.0.0',
+            'agent_version': '1.0.0',
+        })
+
+    def latency(self, seconds):
+        def wrapper(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+        return wrapper
+
+    def run_sync(self, serials, repeat, threads, latency):
+        factory = RequestFactory()
+
+        def agent(serial_number):
+            with connection.execute_wrapper(latency):
+                for seq in range(1, repeat + 1):
+                    request = factory.post(
+                        '/agent/heartbeat', self.payload(serial_number, seq), content_type='application/json'
+                    )
+                    assert views.agent_heartbeat_view(request).status_code == 200
+            connection.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(agent, serials))
+
+    def run_async(self, serials, repeat, latency):
+        factory = AsyncRequestFactory()
+
+        async def agent(serial_number):
+            for seq in range(1, repeat + 1):
+                request = factory.post(
+                    '/agent/heartbeat', self.payload(serial_number, seq), content_type='application/json'
+                )
+                assert (await async_views.agent_heartbeat_view(request)).status_code == 200
+
+        async def fleet():
+            await asyncio.gather(*(agent(serial_number) for serial_number in serials))
+
+        # Thread-sensitive ORM calls run on this thread, inside the wrapper
+        with connection.execute_wrapper(latency):
+            async_to_sync(fleet)()
+
+    def handle(self, *args, **options):
+        agents, repeat = options['agents'], options['requests']
+        latency = self.latency(options['latency_ms'] / 1000)
+        bench_settings = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench'}},
+            TMS_LIVENESS={'BACKEND': 'local', 'FLUSH_INTERVAL': 0},
+            TMS_AGENT_ADMISSION={'RATES': {}, 'CONCURRENCY': {}},
+        )
+
+        old_name = connection.settings_dict['NAME']
+        with tempfile.TemporaryDirectory() as tmp, bench_settings:
+            if connection.vendor == 'sqlite':
+                # File-backed so worker threads wait on locks instead of failing
+                connection.settings_dict['TEST']['NAME'] = str(Path(tmp) / 'bench.sqlite3')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                customer = Customer.objects.create(
+                    company_name='Benchmark', contact_email='bench@example.com',
+                    contract_start_date=timezone.now().date()
+                )
+                serials = [f'TC-200-BENCH{i:05d}' for i in range(agents)]
+                Terminal.objects.bulk_create(
+                    Terminal(serial_number=serial_number, customer=customer, store_name='Benchmark')
+                    for serial_number in serials
+                )
+
+                self.stdout.write(
+                    f'{agents} agents x {repeat} heartbeats, {options["latency_ms"]:g} ms added per query'
+                )
+                runs = [
+                    (f'sync ({options["threads"]} threads)',
+                     lambda: self.run_sync(serials, repeat, options['threads'], latency)),
+                    ('async (1 event loop)', lambda: self.run_async(serials, repeat, latency)),
+                ]
+                for label, run in runs:
+                    # Both runs start cold: no cached serials, markers or liveness state
+                    cache.clear()
+                    get_resolver().clear()
+                    get_liveness_store().clear()
+                    started = time.perf_counter()
+                    run()
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f'  {label:<22}{agents * repeat / elapsed:>10,.0f} req/s  {elapsed:>8.2f} s'
+                    )
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
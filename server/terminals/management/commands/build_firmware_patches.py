@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from terminals.deployments import request_deployment_patches
+from terminals.models import FirmwarePatch
+from terminals.patches import build_patch
+
+
+class Command(BaseCommand):
+    """
+    Build binary delta packages between firmware versions.
+    
+    Each pass queues the patches open deployments can use (from the versions
+    their targets run to the deployed firmware) and builds the pending ones
+    into the blob store. Patches are cached per version pair, so each pair is
+    built once. Run it from cron/a scheduler, or keep it running with --loop.
+    """
+
+    help = 'Queue and build firmware delta patches for open deployments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running until interrupted')
+        parser.add_argument(
+            '--interval', type=int, default=None,
+            help='Seconds between passes with --loop (default: TMS_DEPLOYMENTS["INTERVAL"])'
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or settings.TMS_DEPLOYMENTS['INTERVAL']
+        while True:
+            started = time.monotonic()
+            queued = request_deployment_patches()
+            outcomes = {'ready': 0, 'skipped': 0, 'failed': 0}
+            pending = FirmwarePatch.objects.filter(status='pending').select_related('source', 'target')
+            for patch in pending.order_by('created_at'):
+                outcomes[build_patch(patch)] += 1
+            self.stdout.write(
+                f"Queued {queued} version pair(s), built {outcomes['ready']} patch(es), "
+                f"{outcomes['skipped']} skipped, {outcomes['failed']} failed, "
+                f"in {time.monotonic() - started:.2f}s"
+            )
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(interval)
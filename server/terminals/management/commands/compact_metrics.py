@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from terminals.metrics import compact_metrics
+from terminals.models import TerminalLog
+
+
+class Command(BaseCommand):
+    """Roll heartbeat metric samples into hourly/daily buckets and apply retention"""
+
+    help = 'Compact heartbeat metric samples into hourly and daily min/avg/max buckets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--purge-heartbeat-logs',
+            action='store_true',
+            help="Delete legacy TerminalLog rows with log_type='heartbeat'"
+        )
+
+    def handle(self, *args, **options):
+        summary = compact_metrics()
+        self.stdout.write(
+            f"Hourly buckets: {summary['hourly_buckets']}, daily buckets: {summary['daily_buckets']}, "
+            f"deleted: {summary['deleted']}"
+        )
+
+        if options['purge_heartbeat_logs']:
+            deleted, _ = TerminalLog.objects.filter(log_type='heartbeat').delete()
+            self.stdout.write(f'Deleted {deleted} legacy heartbeat log(s)')
@@ -0,0 +1,36 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from terminals.liveness import claim_process, get_store
+
+
+class Command(BaseCommand):
+    """
+    Flush coalesced heartbeat fields from the liveness store to the database.
+    
+    Meant for the redis backend; the local backend is flushed by the server
+    process that owns it, so the command refuses to run beside one.
+    """
+
+    help = 'Flush dirty terminals from the liveness store with one bulk_update'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep flushing until interrupted')
+        parser.add_argument('--interval', type=int, default=10, help='Seconds between flushes with --loop')
+
+    def handle(self, *args, **options):
+        try:
+            claim_process()
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+        store = get_store()
+        while True:
+            flushed = store.flush()
+            self.stdout.write(f'Flushed {flushed} terminal(s)')
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from terminals.deployments import materialize_deployments
+
+
+class Command(BaseCommand):
+    """
+    Create the per-terminal tasks of due firmware deployments.
+    
+    Terminals also get their task on their next heartbeat; this fills in the
+    rest (including offline terminals) in bulk. Each pass also gates rollout
+    waves, so waves without results (empty, soaking or overdue) still advance,
+    and requeues tasks whose terminal never reported a result. Run it
+    from cron/a scheduler, or keep it running with --loop; it is required
+    with the redis liveness backend (without Redis the server process runs
+    these passes) and needs the server's shared cache.
+    """
+
+    help = 'Materialize UpdateTask rows for due deployments, gate rollout waves and close finished ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running until interrupted')
+        parser.add_argument(
+            '--interval', type=int, default=None,
+            help='Seconds between passes with --loop (default: TMS_DEPLOYMENTS["INTERVAL"])'
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or settings.TMS_DEPLOYMENTS['INTERVAL']
+        while True:
+            started = time.monotonic()
+            result = materialize_deployments()
+            self.stdout.write(
+                f"Created {result['tasks']} task(s) for {result['deployments']} deployment(s), "
+                f"{result['requeued']} stale task(s) requeued and {result['failed']} failed, "
+                f"{result['advanced']} advanced, {result['paused']} paused, "
+                f"{result['completed']} completed, in {time.monotonic() - started:.2f}s"
+            )
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(interval)
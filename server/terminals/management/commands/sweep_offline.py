@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from terminals.liveness import claim_process
+from terminals.sweeper import sweep_offline
+
+
+class Command(BaseCommand):
+    """
+    Mark terminals offline when their heartbeats stop.
+    
+    Run it from cron/a scheduler, or keep it running with --loop. With the
+    local liveness backend the server process sweeps by itself, and the
+    command only runs while no server does.
+    """
+
+    help = 'Flip silent terminals to offline and raise connection_lost alerts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping until interrupted')
+        parser.add_argument(
+            '--interval', type=int, default=None,
+            help='Seconds between sweeps with --loop (default: TMS_OFFLINE_SWEEP["INTERVAL"])'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            claim_process()
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+        interval = options['interval'] or settings.TMS_OFFLINE_SWEEP['INTERVAL']
+        while True:
+            started = time.monotonic()
+            result = sweep_offline()
+            self.stdout.write(
+                f"Marked {result['offline']} terminal(s) offline, "
+                f"{result['alerts']['created']} new alert(s) in {time.monotonic() - started:.2f}s"
+            )
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(interval)
@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from terminals.counters import cache_is_shared, verify_counters
+
+
+class Command(BaseCommand):
+    """
+    Reconcile the cached fleet counters with the database.
+    
+    Run it from cron/a scheduler, or keep it running with --loop. Needs a
+    shared cache: with a per-process one the command would only see its own
+    counters, and server processes recount theirs as they expire.
+    """
+
+    help = 'Recount cached terminal and alert counters and correct drifted ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep verifying until interrupted')
+        parser.add_argument(
+            '--interval', type=int, default=None,
+            help='Seconds between runs with --loop (default: TMS_COUNTERS["VERIFY_INTERVAL"])'
+        )
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            raise CommandError(
+                'The default cache is per process, so the server counters are out of reach; '
+                'set REDIS_URL (server processes recount per-process counters every '
+                'TMS_COUNTERS["VERIFY_INTERVAL"] seconds)'
+            )
+        interval = options['interval'] or settings.TMS_COUNTERS['VERIFY_INTERVAL']
+        while True:
+            started = time.monotonic()
+            drift = verify_counters()
+            for key, (cached, actual) in sorted(drift.items()):
+                self.stdout.write(f"{key}: {cached} -> {actual}")
+            self.stdout.write(f"Corrected {len(drift)} counter(s) in {time.monotonic() - started:.2f}s")
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(interval)
@@ -0,0 +1,314 @@
+"""
+Heartbeat metric time series.
+
+Raw samples land in ``TerminalMetricSample``. ``compact_metrics`` rolls them
+into hourly buckets, hourly buckets into daily buckets, and applies each
+tier's retention (``settings.TMS_METRICS``). ``metric_history`` reads from the
+finest tier that still covers the requested range.
+"""
+import asyncio
+import weakref
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import TerminalMetricRollup, TerminalMetricSample
+
+METRICS = ['cpu', 'memory', 'disk', 'temperature']
+
+# Sample column for each metric
+SAMPLE_COLUMNS = {
+    'cpu': 'cpu_usage',
+    'memory': 'memory_usage',
+    'disk': 'disk_usage',
+    'temperature': 'temperature',
+}
+
+# Metrics a heartbeat may omit keep their own sample count per bucket
+NULLABLE_COUNTS = {'temperature': 'temperature_count'}
+
+ROLLUP_FIELDS = ['sample_count', *NULLABLE_COUNTS.values()] + [
+    f'{metric}_{stat}' for metric in METRICS for stat in ('min', 'avg', 'max')
+]
+
+# Ranges up to this span are served from the given tier (if retention allows)
+RAW_MAX_SPAN = timedelta(days=1)
+HOURLY_MAX_SPAN = timedelta(days=31)
+
+
+def build_sample(terminal_id, metrics, recorded_at):
+    """Build an unsaved sample from heartbeat ``metrics``"""
+    return TerminalMetricSample(
+        terminal_id=terminal_id,
+        recorded_at=recorded_at,
+        cpu_usage=metrics['cpu_usage'],
+        memory_usage=metrics['memory_usage'],
+        disk_usage=metrics['disk_usage'],
+        temperature=metrics.get('temperature'),
+    )
+
+
+def sample_time(reported_at, now):
+    """
+    Time to record a sample reported at ``reported_at``
+
+    Replayed heartbeats keep their own time, clamped to the raw tier's
+    retention so a wrong agent clock cannot write into the future or into
+    hours that were already compacted and dropped.
+    """
+    return min(max(reported_at, now - _retention('RAW')), now)
+
+
+class SampleWriter:
+    """
+    Group commit for samples saved from async views.
+
+    Samples arriving while an INSERT is in flight are written together by the
+    next one, so concurrent heartbeats share a statement instead of queueing
+    one by one for the ORM's database thread. If a batch hits an integrity
+    error (a terminal deleted meanwhile), its samples are retried one by one
+    so only the offending caller sees the error.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._flushing = None
+
+    async def save(self, sample):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((sample, future))
+        if self._flushing is None:
+            self._flushing = asyncio.ensure_future(self._flush())
+        await future
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    await TerminalMetricSample.objects.abulk_create([sample for sample, _ in batch])
+                except IntegrityError:
+                    for sample, future in batch:
+                        await self._save_one(sample, future)
+                except Exception as e:
+                    for _, future in batch:
+                        future.set_exception(e)
+                else:
+                    for _, future in batch:
+                        future.set_result(None)
+        finally:
+            self._flushing = None
+
+    async def _save_one(self, sample, future):
+        try:
+            await sample.asave()
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+
+_sample_writers = weakref.WeakKeyDictionary()
+
+
+async def asave_sample(sample):
+    """Save a sample from async code, batched with concurrent callers on this loop"""
+    loop = asyncio.get_running_loop()
+    writer = _sample_writers.get(loop)
+    if writer is None:
+        writer = _sample_writers[loop] = SampleWriter()
+    await writer.save(sample)
+
+
+def _retention(tier):
+    return timedelta(days=settings.TMS_METRICS[f'{tier}_RETENTION_DAYS'])
+
+
+def _upsert_rollups(rollups):
+    if rollups:
+        TerminalMetricRollup.objects.bulk_create(
+            rollups,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['terminal', 'resolution', 'bucket_start'],
+            update_fields=ROLLUP_FIELDS,
+        )
+    return len(rollups)
+
+
+def _watermark(resolution, default):
+    latest = TerminalMetricRollup.objects.filter(resolution=resolution).aggregate(
+        latest=Max('bucket_start')
+    )['latest']
+    # The newest bucket is recomputed so late samples are not lost
+    return latest or default
+
+
+def compact_hourly(until):
+    """Roll raw samples of complete hours before ``until`` into hourly buckets"""
+    oldest = TerminalMetricSample.objects.aggregate(oldest=Min('recorded_at'))['oldest']
+    if oldest is None:
+        return 0
+    since = _watermark('hour', oldest)
+
+    aggregates = {}
+    for metric, column in SAMPLE_COLUMNS.items():
+        aggregates[f'{metric}_min'] = Min(column)
+        aggregates[f'{metric}_avg'] = Avg(column)
+        aggregates[f'{metric}_max'] = Max(column)
+    for metric, count_field in NULLABLE_COUNTS.items():
+        aggregates[count_field] = Count(SAMPLE_COLUMNS[metric])
+
+    rows = TerminalMetricSample.objects.filter(
+        recorded_at__gte=since, recorded_at__lt=until
+    ).annotate(bucket=TruncHour('recorded_at')).values('terminal_id', 'bucket').annotate(
+        sample_count=Count('id'), **aggregates
+    ).order_by()
+
+    return _upsert_rollups([
+        TerminalMetricRollup(
+            terminal_id=row['terminal_id'],
+            resolution='hour',
+            bucket_start=row['bucket'],
+            **{field: row[field] for field in ROLLUP_FIELDS}
+        )
+        for row in rows
+    ])
+
+
+def compact_daily(until):
+    """Roll hourly buckets of complete days before ``until`` into daily buckets"""
+    hourly = TerminalMetricRollup.objects.filter(resolution='hour')
+    oldest = hourly.aggregate(oldest=Min('bucket_start'))['oldest']
+    if oldest is None:
+        return 0
+    since = _watermark('day', oldest)
+
+    # Aliases must not shadow the rollup columns they aggregate
+    aggregates = {'total_samples': Sum('sample_count')}
+    for metric in METRICS:
+        aggregates[f'{metric}_lowest'] = Min(f'{metric}_min')
+        aggregates[f'{metric}_highest'] = Max(f'{metric}_max')
+        # Sample-weighted mean of the hourly means
+        count_field = NULLABLE_COUNTS.get(metric, 'sample_count')
+        aggregates[f'{metric}_weighted'] = Sum(F(f'{metric}_avg') * F(count_field))
+        aggregates[f'{metric}_weight'] = Sum(count_field, filter=Q(**{f'{metric}_avg__isnull': False}))
+
+    rows = hourly.filter(
+        bucket_start__gte=since, bucket_start__lt=until
+    ).annotate(bucket=TruncDay('bucket_start')).values('terminal_id', 'bucket').annotate(
+        **aggregates
+    ).order_by()
+
+    rollups = []
+    for row in rows:
+        values = {'sample_count': row['total_samples']}
+        for metric in METRICS:
+            values[f'{metric}_min'] = row[f'{metric}_lowest']
+            values[f'{metric}_max'] = row[f'{metric}_highest']
+            weight = row[f'{metric}_weight']
+            values[f'{metric}_avg'] = row[f'{metric}_weighted'] / weight if weight else None
+        for metric, count_field in NULLABLE_COUNTS.items():
+            values[count_field] = row[f'{metric}_weight'] or 0
+        rollups.append(TerminalMetricRollup(
+            terminal_id=row['terminal_id'],
+            resolution='day',
+            bucket_start=row['bucket'],
+            **values
+        ))
+    return _upsert_rollups(rollups)
+
+
+def apply_retention(now):
+    """Delete samples and buckets older than their tier's retention"""
+    deleted = {}
+    # Raw samples are only dropped once their hour has been compacted
+    hourly_watermark = _watermark('hour', None)
+    raw_cutoff = now - _retention('RAW')
+    if hourly_watermark is not None:
+        raw_cutoff = min(raw_cutoff, hourly_watermark)
+        deleted['raw'] = TerminalMetricSample.objects.filter(recorded_at__lt=raw_cutoff).delete()[0]
+    else:
+        deleted['raw'] = 0
+
+    daily_watermark = _watermark('day', None)
+    hourly_cutoff = now - _retention('HOURLY')
+    if daily_watermark is not None:
+        hourly_cutoff = min(hourly_cutoff, daily_watermark)
+        deleted['hour'] = TerminalMetricRollup.objects.filter(
+            resolution='hour', bucket_start__lt=hourly_cutoff
+        ).delete()[0]
+    else:
+        deleted['hour'] = 0
+
+    deleted['day'] = TerminalMetricRollup.objects.filter(
+        resolution='day', bucket_start__lt=now - _retention('DAILY')
+    ).delete()[0]
+    return deleted
+
+
+def compact_metrics(now=None):
+    """Run one compaction pass; returns a summary dict"""
+    now = now or timezone.now()
+    local_now = timezone.localtime(now)
+    hour_start = local_now.replace(minute=0, second=0, microsecond=0)
+    day_start = hour_start.replace(hour=0)
+
+    with transaction.atomic():
+        hourly = compact_hourly(hour_start)
+        daily = compact_daily(day_start)
+        deleted = apply_retention(now)
+
+    return {'hourly_buckets': hourly, 'daily_buckets': daily, 'deleted': deleted}
+
+
+def _choose_resolution(start, end, now):
+    span = end - start
+    if span <= RAW_MAX_SPAN and start >= now - _retention('RAW'):
+        return 'raw'
+    if span <= HOURLY_MAX_SPAN and start >= now - _retention('HOURLY'):
+        return 'hour'
+    return 'day'
+
+
+def metric_history(terminal_id, start, end, resolution=None):
+    """
+    Metric history for one terminal between ``start`` and ``end``.
+
+    The tier is chosen from the requested span and each tier's retention
+    unless ``resolution`` ('raw', 'hour' or 'day') is given.
+    """
+    resolution = resolution or _choose_resolution(start, end, timezone.now())
+
+    points = []
+    if resolution == 'raw':
+        samples = TerminalMetricSample.objects.filter(
+            terminal_id=terminal_id, recorded_at__gte=start, recorded_at__lt=end
+        ).order_by('recorded_at')
+        for sample in samples:
+            point = {'timestamp': sample.recorded_at, 'samples': 1}
+            for metric, column in SAMPLE_COLUMNS.items():
+                value = getattr(sample, column)
+                point[metric] = {'min': value, 'avg': value, 'max': value}
+            points.append(point)
+    else:
+        rollups = TerminalMetricRollup.objects.filter(
+            terminal_id=terminal_id, resolution=resolution,
+            bucket_start__gte=start, bucket_start__lt=end
+        ).order_by('bucket_start')
+        for rollup in rollups:
+            point = {'timestamp': rollup.bucket_start, 'samples': rollup.sample_count}
+            for metric in METRICS:
+                avg = getattr(rollup, f'{metric}_avg')
+                point[metric] = {
+                    'min': getattr(rollup, f'{metric}_min'),
+                    'avg': round(avg, 1) if avg is not None else None,
+                    'max': getattr(rollup, f'{metric}_max'),
+                }
+            points.append(point)
+
+    return {'resolution': resolution, 'points': points}
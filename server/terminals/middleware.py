@@ -1,4 +1,7 @@
 import logging
+import threading
+from django.conf import settings
+from django.http import JsonResponse
 from django.utils.deprecation import MiddlewareMixin
 from django.utils import timezone
 from .models import AuditLog
@@ -77,3 +80,58 @@ class SecurityHeadersMiddleware(MiddlewareMixin):
         response['Referrer-Policy'] = 'strict-origin-when-cross-origin'
         
         return response
+
+
+class AgentConcurrencyLimitMiddleware(MiddlewareMixin):
+    """
+    Per-process concurrency caps for agent endpoints.
+    
+    Requests above ``settings.TMS_AGENT_ADMISSION['CONCURRENCY']`` for their
+    URL name are shed with 503 instead of queueing, so slow endpoints such as
+    log ingestion cannot take every worker away from heartbeats and the UI.
+    """
+    
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self._semaphores = {}
+        self._lock = threading.Lock()
+    
+    def get_semaphore(self, name):
+        limit = settings.TMS_AGENT_ADMISSION['CONCURRENCY'].get(name)
+        if not limit:
+            return None
+        with self._lock:
+            key = (name, limit)
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.BoundedSemaphore(limit)
+            return self._semaphores[key]
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Take a slot or shed the request"""
+        name = request.resolver_match.url_name if request.resolver_match else None
+        semaphore = self.get_semaphore(name)
+        if semaphore is None:
+            return None
+        
+        if not semaphore.acquire(blocking=False):
+            response = JsonResponse({
+                'error': {
+                    'code': 'SYS_003',
+                    'message': 'Server busy',
+                    'details': 'Too many concurrent requests for this endpoint',
+                    'retry_after': 1
+                }
+            }, status=503)
+            response['Retry-After'] = '1'
+            return response
+        
+        request._agent_concurrency_slot = semaphore
+        return None
+    
+    def process_response(self, request, response):
+        """Release the slot taken in process_view"""
+        semaphore = getattr(request, '_agent_concurrency_slot', None)
+        if semaphore is not None:
+            del request._agent_concurrency_slot
+            semaphore.release()
+        return response
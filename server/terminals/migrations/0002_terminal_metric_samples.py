@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminals', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerminalMetricSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField(verbose_name='Recorded At')),
+                ('cpu_usage', models.SmallIntegerField(verbose_name='CPU Usage (%)')),
+                ('memory_usage', models.SmallIntegerField(verbose_name='Memory Usage (%)')),
+                ('disk_usage', models.SmallIntegerField(verbose_name='Disk Usage (%)')),
+                ('temperature', models.SmallIntegerField(blank=True, null=True, verbose_name='Temperature (°C)')),
+                ('terminal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metric_samples', to='terminals.terminal', verbose_name='Terminal')),
+            ],
+            options={
+                'verbose_name': 'Terminal Metric Sample',
+                'verbose_name_plural': 'Terminal Metric Samples',
+                'ordering': ['-recorded_at'],
+                'indexes': [models.Index(fields=['terminal', 'recorded_at'], name='terminals_t_termina_f8e254_idx'), models.Index(fields=['recorded_at'], name='terminals_t_recorde_035ec5_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TerminalMetricRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4, verbose_name='Resolution')),
+                ('bucket_start', models.DateTimeField(verbose_name='Bucket Start')),
+                ('sample_count', models.IntegerField(verbose_name='Sample Count')),
+                ('cpu_min', models.SmallIntegerField(verbose_name='CPU Min (%)')),
+                ('cpu_avg', models.FloatField(verbose_name='CPU Avg (%)')),
+                ('cpu_max', models.SmallIntegerField(verbose_name='CPU Max (%)')),
+                ('memory_min', models.SmallIntegerField(verbose_name='Memory Min (%)')),
+                ('memory_avg', models.FloatField(verbose_name='Memory Avg (%)')),
+                ('memory_max', models.SmallIntegerField(verbose_name='Memory Max (%)')),
+                ('disk_min', models.SmallIntegerField(verbose_name='Disk Min (%)')),
+                ('disk_avg', models.FloatField(verbose_name='Disk Avg (%)')),
+                ('disk_max', models.SmallIntegerField(verbose_name='Disk Max (%)')),
+                ('temperature_min', models.SmallIntegerField(blank=True, null=True, verbose_name='Temperature Min (°C)')),
+                ('temperature_avg', models.FloatField(blank=True, null=True, verbose_name='Temperature Avg (°C)')),
+                ('temperature_max', models.SmallIntegerField(blank=True, null=True, verbose_name='Temperature Max (°C)')),
+                ('terminal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metric_rollups', to='terminals.terminal', verbose_name='Terminal')),
+            ],
+            options={
+                'verbose_name': 'Terminal Metric Rollup',
+                'verbose_name_plural': 'Terminal Metric Rollups',
+                'ordering': ['-bucket_start'],
+                'indexes': [models.Index(fields=['resolution', 'bucket_start'], name='terminals_t_resolut_7af6f2_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='terminalmetricrollup',
+            constraint=models.UniqueConstraint(fields=('terminal', 'resolution', 'bucket_start'), name='metric_rollup_bucket_uniq'),
+        ),
+    ]
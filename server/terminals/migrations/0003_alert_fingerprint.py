@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminals', '0002_terminal_metric_samples'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Fingerprint'),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last Seen At'),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='occurrence_count',
+            field=models.IntegerField(default=1, verbose_name='Occurrence Count'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('is_resolved', False)), fields=['fingerprint'], name='alert_fingerprint_open_idx'),
+        ),
+    ]
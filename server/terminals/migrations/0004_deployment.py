@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminals', '0003_alert_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Deployment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_type', models.CharField(choices=[('all', 'All Terminals'), ('customer', 'Customers'), ('selected', 'Selected Terminals')], default='all', max_length=20, verbose_name='Target')),
+                ('target_ids', models.JSONField(blank=True, default=list, verbose_name='Target IDs')),
+                ('schedule', models.JSONField(blank=True, default=dict, verbose_name='Schedule')),
+                ('scheduled_at', models.DateTimeField(blank=True, null=True, verbose_name='Scheduled At')),
+                ('priority', models.IntegerField(default=3, verbose_name='Priority')),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('active', 'Active'), ('paused', 'Paused'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='scheduled', max_length=20, verbose_name='Status')),
+                ('total_terminals', models.IntegerField(default=0, verbose_name='Target Terminals')),
+                ('last_terminal_id', models.BigIntegerField(default=0, verbose_name='Last Terminal ID at Deploy Time')),
+                ('materialized_at', models.DateTimeField(blank=True, null=True, verbose_name='All Tasks Created At')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('created_by', models.CharField(blank=True, max_length=50, verbose_name='Created By')),
+            ],
+            options={
+                'verbose_name': 'Deployment',
+                'verbose_name_plural': 'Deployments',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='firmware_version',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deployments', to='terminals.firmwareversion', verbose_name='Firmware Version'),
+        ),
+        migrations.AddField(
+            model_name='updatetask',
+            name='deployment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='terminals.deployment', verbose_name='Deployment'),
+        ),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(fields=['status', 'scheduled_at'], name='terminals_d_status_4bcf5c_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='updatetask',
+            constraint=models.UniqueConstraint(condition=models.Q(('deployment__isnull', False)), fields=('deployment', 'terminal'), name='updatetask_deployment_terminal_uniq'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:00
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminals', '0004_deployment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deployment',
+            name='accepted_failures',
+            field=models.IntegerField(default=0, verbose_name='Failures Accepted on Resume'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='canary_percent',
+            field=models.FloatField(default=100.0, validators=[django.core.validators.MinValueValidator(0.01), django.core.validators.MaxValueValidator(100)], verbose_name='Canary Wave (%)'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='current_wave',
+            field=models.IntegerField(default=0, verbose_name='Current Wave'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='materialized_wave',
+            field=models.IntegerField(default=-1, verbose_name='Last Fully Created Wave'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='max_concurrent',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Max Concurrent Downloads'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='max_failure_rate',
+            field=models.FloatField(blank=True, null=True, verbose_name='Max Failure Rate (%)'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='paused_reason',
+            field=models.CharField(blank=True, max_length=200, verbose_name='Pause Reason'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='wave_growth',
+            field=models.FloatField(default=2.0, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Wave Growth Factor'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='wave_started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Wave Started At'),
+        ),
+        migrations.AddField(
+            model_name='updatetask',
+            name='wave',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Rollout Wave'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminals', '0005_deployment_waves'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FirmwarePatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('skipped', 'Not Smaller Than Image'), ('failed', 'Failed')], default='pending', max_length=20, verbose_name='Status')),
+                ('file_size', models.BigIntegerField(blank=True, null=True, verbose_name='Patch Size (bytes)')),
+                ('file_hash', models.CharField(blank=True, max_length=64, verbose_name='Patch Hash (SHA256)')),
+                ('error_message', models.TextField(blank=True, verbose_name='Error Message')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('built_at', models.DateTimeField(blank=True, null=True, verbose_name='Built At')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patches_from', to='terminals.firmwareversion', verbose_name='From Version')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patches_to', to='terminals.firmwareversion', verbose_name='To Version')),
+            ],
+            options={
+                'verbose_name': 'Firmware Patch',
+                'verbose_name_plural': 'Firmware Patches',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='firmwarepatch',
+            constraint=models.UniqueConstraint(fields=('source', 'target'), name='firmwarepatch_source_target_uniq'),
+        ),
+    ]
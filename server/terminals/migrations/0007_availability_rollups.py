@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminals', '0006_firmwarepatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='terminal',
+            name='availability_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Availability Accounted Until'),
+        ),
+        migrations.CreateModel(
+            name='TerminalAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('online_seconds', models.IntegerField(default=0, verbose_name='Online Seconds')),
+                ('expected_seconds', models.IntegerField(default=0, verbose_name='Expected Seconds')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='terminals.customer', verbose_name='Customer')),
+                ('terminal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_days', to='terminals.terminal', verbose_name='Terminal')),
+            ],
+            options={
+                'verbose_name': 'Terminal Availability',
+                'verbose_name_plural': 'Terminal Availability',
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['day'], name='terminals_t_day_3f60a6_idx'), models.Index(fields=['customer', 'day'], name='terminals_t_custome_eb0cb5_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='terminalavailability',
+            constraint=models.UniqueConstraint(fields=('terminal', 'day'), name='terminal_availability_day_uniq'),
+        ),
+    ]
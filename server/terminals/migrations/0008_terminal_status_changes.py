@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminals', '0007_availability_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerminalStatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('online', 'Online'), ('offline', 'Offline'), ('error', 'Error'), ('maintenance', 'Under Maintenance')], max_length=20, verbose_name='From Status')),
+                ('to_status', models.CharField(choices=[('online', 'Online'), ('offline', 'Offline'), ('error', 'Error'), ('maintenance', 'Under Maintenance')], max_length=20, verbose_name='To Status')),
+                ('at', models.DateTimeField(verbose_name='Changed At')),
+                ('terminal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_changes', to='terminals.terminal', verbose_name='Terminal')),
+            ],
+            options={
+                'verbose_name': 'Terminal Status Change',
+                'verbose_name_plural': 'Terminal Status Changes',
+                'ordering': ['-at'],
+                'indexes': [models.Index(fields=['terminal', 'at'], name='terminals_t_termina_d72421_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:42
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+SEVERITY_ORDER = ['INFO', 'LOW', 'MEDIUM', 'HIGH', 'CRITICAL']
+
+
+def fold_duplicate_open_alerts(apps, schema_editor):
+    """Fold open alerts sharing a fingerprint into the oldest one before it becomes unique"""
+    Alert = apps.get_model('terminals', 'Alert')
+    open_alerts = Alert.objects.filter(is_resolved=False).exclude(fingerprint='')
+    duplicated = (
+        open_alerts.values('fingerprint').annotate(count=Count('id')).filter(count__gt=1)
+        .values_list('fingerprint', flat=True)
+    )
+    now = timezone.now()
+    for fingerprint in duplicated:
+        alerts = list(open_alerts.filter(fingerprint=fingerprint).order_by('created_at', 'id'))
+        keep, others = alerts[0], alerts[1:]
+        keep.occurrence_count = sum(alert.occurrence_count for alert in alerts)
+        keep.last_seen_at = max((alert.last_seen_at for alert in alerts if alert.last_seen_at), default=None)
+        keep.severity = max(
+            (alert.severity for alert in alerts),
+            key=lambda severity: SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else -1
+        )
+        keep.save(update_fields=['occurrence_count', 'last_seen_at', 'severity'])
+        Alert.objects.filter(id__in=[alert.id for alert in others]).update(
+            is_resolved=True, resolved_at=now, auto_resolved=True,
+            resolution_notes=f'Folded into alert {keep.id}'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminals', '0008_terminal_status_changes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='alert',
+            name='alert_fingerprint_open_idx',
+        ),
+        migrations.RunPython(fold_duplicate_open_alerts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='alert',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_resolved', False), models.Q(('fingerprint', ''), _negated=True)), fields=('fingerprint',), name='alert_fingerprint_open_uniq'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:03
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def count_existing_temperatures(apps, schema_editor):
+    """Existing buckets only know their total count; keep weighting them by it"""
+    TerminalMetricRollup = apps.get_model('terminals', 'TerminalMetricRollup')
+    TerminalMetricRollup.objects.filter(temperature_avg__isnull=False).update(temperature_count=F('sample_count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminals', '0009_alert_fingerprint_open_uniq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='terminalmetricrollup',
+            name='temperature_count',
+            field=models.IntegerField(default=0, verbose_name='Temperature Sample Count'),
+        ),
+        migrations.RunPython(count_existing_temperatures, migrations.RunPython.noop),
+    ]
@@ -121,6 +121,8 @@ class Terminal(models.Model):
     mac_address = models.CharField(max_length=17, blank=True, verbose_name='MAC Address')
     
     last_heartbeat = models.DateTimeField(null=True, blank=True, verbose_name='Last Heartbeat')
+    # Availability rollups cover this terminal up to here (see terminals.availability)
+    availability_until = models.DateTimeField(null=True, blank=True, verbose_name='Availability Accounted Until')
     installed_date = models.DateField(null=True, blank=True, verbose_name='Installation Date')
     warranty_end_date = models.DateField(null=True, blank=True, verbose_name='Warranty End Date')
     
@@ -208,6 +210,11 @@ class Alert(models.Model):
     resolution_notes = models.TextField(blank=True, verbose_name='Resolution Notes')
     auto_resolved = models.BooleanField(default=False, verbose_name='Auto Resolved')
     
+    # Deduplication (see terminals.alerting)
+    fingerprint = models.CharField(max_length=64, blank=True, verbose_name='Fingerprint')
+    occurrence_count = models.IntegerField(default=1, verbose_name='Occurrence Count')
+    last_seen_at = models.DateTimeField(null=True, blank=True, verbose_name='Last Seen At')
+    
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
     
     class Meta:
@@ -221,6 +228,14 @@ class Alert(models.Model):
             models.Index(fields=['severity'], condition=models.Q(is_resolved=False), name='alert_severity_unresolved_idx'),
             models.Index(fields=['alert_type']),
         ]
+        constraints = [
+            # One open alert per fingerprint; also serves the raise_alerts lookup
+            models.UniqueConstraint(
+                fields=['fingerprint'],
+                condition=models.Q(is_resolved=False) & ~models.Q(fingerprint=''),
+                name='alert_fingerprint_open_uniq'
+            ),
+        ]
     
     def __str__(self):
         return f'{self.get_severity_display()}: {self.title} - {self.terminal.serial_number}'
@@ -258,6 +273,136 @@ class FirmwareVersion(models.Model):
         return f'{self.model} v{self.version}'
 
 
+class FirmwarePatch(models.Model):
+    """
+    Binary delta from one firmware version to another.
+
+    Built by the build_firmware_patches worker (see ``terminals.patches``)
+    and stored in the blob store under ``file_hash``.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('skipped', 'Not Smaller Than Image'),
+        ('failed', 'Failed'),
+    ]
+    
+    source = models.ForeignKey(
+        FirmwareVersion,
+        on_delete=models.CASCADE,
+        related_name='patches_from',
+        verbose_name='From Version'
+    )
+    target = models.ForeignKey(
+        FirmwareVersion,
+        on_delete=models.CASCADE,
+        related_name='patches_to',
+        verbose_name='To Version'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Status')
+    file_size = models.BigIntegerField(null=True, blank=True, verbose_name='Patch Size (bytes)')
+    file_hash = models.CharField(max_length=64, blank=True, verbose_name='Patch Hash (SHA256)')
+    error_message = models.TextField(blank=True, verbose_name='Error Message')
+    
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
+    built_at = models.DateTimeField(null=True, blank=True, verbose_name='Built At')
+    
+    class Meta:
+        verbose_name = 'Firmware Patch'
+        verbose_name_plural = 'Firmware Patches'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'target'], name='firmwarepatch_source_target_uniq'),
+        ]
+    
+    def __str__(self):
+        return f'{self.source.version} -> {self.target.version} ({self.get_status_display()})'
+
+
+class Deployment(models.Model):
+    """
+    Firmware deployment campaign.
+
+    Stores the target selector instead of one task per terminal; tasks are
+    created lazily (see ``terminals.deployments``). Only terminals that
+    existed at deploy time (id up to ``last_terminal_id``) are targeted.
+
+    Terminals are rolled out in waves: a canary of ``canary_percent`` of the
+    targets, then cohorts growing by ``wave_growth``. At most
+    ``max_concurrent`` tasks run at once, and the rollout pauses when the
+    current wave's failure rate exceeds ``max_failure_rate`` percent.
+    ``create_deployment`` fills unset ones from ``settings.TMS_DEPLOYMENTS``
+    (by default a 5% canary doubling per wave, 200 concurrent downloads and a
+    10% failure gate); the field defaults, for rows created directly, roll out
+    to every terminal at once without a cap or gate.
+
+    A wave only finishes once a deployment pass (``materialize_deployments``)
+    created all of its tasks: the server process owning the local liveness
+    store runs them, otherwise the ``materialize_deployments --loop`` worker
+    must run, sharing the server's cache (see ``terminals.deployments``).
+    """
+    
+    TARGET_CHOICES = [
+        ('all', 'All Terminals'),
+        ('customer', 'Customers'),
+        ('selected', 'Selected Terminals'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('scheduled', 'Scheduled'),
+        ('active', 'Active'),
+        ('paused', 'Paused'),
+        ('completed', 'Completed'),
+        ('cancelled', 'Cancelled'),
+    ]
+    
+    firmware_version = models.ForeignKey(
+        FirmwareVersion,
+        on_delete=models.CASCADE,
+        related_name='deployments',
+        verbose_name='Firmware Version'
+    )
+    target_type = models.CharField(max_length=20, choices=TARGET_CHOICES, default='all', verbose_name='Target')
+    target_ids = models.JSONField(default=list, blank=True, verbose_name='Target IDs')
+    schedule = models.JSONField(default=dict, blank=True, verbose_name='Schedule')
+    scheduled_at = models.DateTimeField(null=True, blank=True, verbose_name='Scheduled At')
+    priority = models.IntegerField(default=3, verbose_name='Priority')
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='scheduled', verbose_name='Status')
+    total_terminals = models.IntegerField(default=0, verbose_name='Target Terminals')
+    last_terminal_id = models.BigIntegerField(default=0, verbose_name='Last Terminal ID at Deploy Time')
+    materialized_at = models.DateTimeField(null=True, blank=True, verbose_name='All Tasks Created At')
+    
+    canary_percent = models.FloatField(
+        default=100.0,
+        validators=[MinValueValidator(0.01), MaxValueValidator(100)],
+        verbose_name='Canary Wave (%)'
+    )
+    wave_growth = models.FloatField(default=2.0, validators=[MinValueValidator(1)], verbose_name='Wave Growth Factor')
+    max_concurrent = models.IntegerField(null=True, blank=True, verbose_name='Max Concurrent Downloads')
+    max_failure_rate = models.FloatField(null=True, blank=True, verbose_name='Max Failure Rate (%)')
+    current_wave = models.IntegerField(default=0, verbose_name='Current Wave')
+    materialized_wave = models.IntegerField(default=-1, verbose_name='Last Fully Created Wave')
+    wave_started_at = models.DateTimeField(null=True, blank=True, verbose_name='Wave Started At')
+    accepted_failures = models.IntegerField(default=0, verbose_name='Failures Accepted on Resume')
+    paused_reason = models.CharField(max_length=200, blank=True, verbose_name='Pause Reason')
+    
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
+    created_by = models.CharField(max_length=50, blank=True, verbose_name='Created By')
+    
+    class Meta:
+        verbose_name = 'Deployment'
+        verbose_name_plural = 'Deployments'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'scheduled_at']),
+        ]
+    
+    def __str__(self):
+        return f'{self.firmware_version} to {self.get_target_type_display()} ({self.get_status_display()})'
+
+
 class UpdateTask(models.Model):
     """Update tasks"""
     
@@ -290,6 +435,15 @@ class UpdateTask(models.Model):
         blank=True,
         verbose_name='Firmware Version'
     )
+    deployment = models.ForeignKey(
+        Deployment,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='tasks',
+        verbose_name='Deployment'
+    )
+    wave = models.IntegerField(null=True, blank=True, verbose_name='Rollout Wave')
     parameters = models.JSONField(null=True, blank=True, verbose_name='Parameters')
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Status')
@@ -321,6 +475,13 @@ class UpdateTask(models.Model):
             models.Index(fields=['scheduled_at'], condition=models.Q(status='pending'), name='updatetask_sched_pending_idx'),
             models.Index(fields=['priority', 'scheduled_at']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['deployment', 'terminal'],
+                condition=models.Q(deployment__isnull=False),
+                name='updatetask_deployment_terminal_uniq'
+            ),
+        ]
     
     def __str__(self):
         return f'{self.get_task_type_display()} - {self.terminal.serial_number} ({self.get_status_display()})'
@@ -374,6 +535,143 @@ class TerminalLog(models.Model):
         return f'{self.terminal.serial_number} - {self.get_log_level_display()}: {self.message[:50]}'
 
 
+class TerminalMetricSample(models.Model):
+    """Raw heartbeat metrics (narrow time-series row)"""
+    
+    terminal = models.ForeignKey(
+        Terminal,
+        on_delete=models.CASCADE,
+        related_name='metric_samples',
+        verbose_name='Terminal'
+    )
+    recorded_at = models.DateTimeField(verbose_name='Recorded At')
+    cpu_usage = models.SmallIntegerField(verbose_name='CPU Usage (%)')
+    memory_usage = models.SmallIntegerField(verbose_name='Memory Usage (%)')
+    disk_usage = models.SmallIntegerField(verbose_name='Disk Usage (%)')
+    temperature = models.SmallIntegerField(null=True, blank=True, verbose_name='Temperature (°C)')
+    
+    class Meta:
+        verbose_name = 'Terminal Metric Sample'
+        verbose_name_plural = 'Terminal Metric Samples'
+        ordering = ['-recorded_at']
+        indexes = [
+            models.Index(fields=['terminal', 'recorded_at']),
+            models.Index(fields=['recorded_at']),
+        ]
+    
+    def __str__(self):
+        return f'{self.terminal_id} @ {self.recorded_at}'
+
+
+class TerminalMetricRollup(models.Model):
+    """Downsampled heartbeat metrics (hourly and daily min/avg/max buckets)"""
+    
+    RESOLUTION_CHOICES = [
+        ('hour', 'Hourly'),
+        ('day', 'Daily'),
+    ]
+    
+    terminal = models.ForeignKey(
+        Terminal,
+        on_delete=models.CASCADE,
+        related_name='metric_rollups',
+        verbose_name='Terminal'
+    )
+    resolution = models.CharField(max_length=4, choices=RESOLUTION_CHOICES, verbose_name='Resolution')
+    bucket_start = models.DateTimeField(verbose_name='Bucket Start')
+    sample_count = models.IntegerField(verbose_name='Sample Count')
+    
+    cpu_min = models.SmallIntegerField(verbose_name='CPU Min (%)')
+    cpu_avg = models.FloatField(verbose_name='CPU Avg (%)')
+    cpu_max = models.SmallIntegerField(verbose_name='CPU Max (%)')
+    memory_min = models.SmallIntegerField(verbose_name='Memory Min (%)')
+    memory_avg = models.FloatField(verbose_name='Memory Avg (%)')
+    memory_max = models.SmallIntegerField(verbose_name='Memory Max (%)')
+    disk_min = models.SmallIntegerField(verbose_name='Disk Min (%)')
+    disk_avg = models.FloatField(verbose_name='Disk Avg (%)')
+    disk_max = models.SmallIntegerField(verbose_name='Disk Max (%)')
+    temperature_min = models.SmallIntegerField(null=True, blank=True, verbose_name='Temperature Min (°C)')
+    temperature_avg = models.FloatField(null=True, blank=True, verbose_name='Temperature Avg (°C)')
+    temperature_max = models.SmallIntegerField(null=True, blank=True, verbose_name='Temperature Max (°C)')
+    # Not every heartbeat reports a temperature
+    temperature_count = models.IntegerField(default=0, verbose_name='Temperature Sample Count')
+    
+    class Meta:
+        verbose_name = 'Terminal Metric Rollup'
+        verbose_name_plural = 'Terminal Metric Rollups'
+        ordering = ['-bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['terminal', 'resolution', 'bucket_start'], name='metric_rollup_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'bucket_start']),
+        ]
+    
+    def __str__(self):
+        return f'{self.terminal_id} {self.resolution} @ {self.bucket_start}'
+
+
+class TerminalAvailability(models.Model):
+    """Daily availability rollup: seconds online out of seconds expected"""
+    
+    terminal = models.ForeignKey(
+        Terminal,
+        on_delete=models.CASCADE,
+        related_name='availability_days',
+        verbose_name='Terminal'
+    )
+    # Copied from the terminal so customer reports read one index range
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Customer'
+    )
+    day = models.DateField(verbose_name='Day')
+    online_seconds = models.IntegerField(default=0, verbose_name='Online Seconds')
+    expected_seconds = models.IntegerField(default=0, verbose_name='Expected Seconds')
+    
+    class Meta:
+        verbose_name = 'Terminal Availability'
+        verbose_name_plural = 'Terminal Availability'
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['terminal', 'day'], name='terminal_availability_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+            models.Index(fields=['customer', 'day']),
+        ]
+    
+    def __str__(self):
+        return f'{self.terminal_id} {self.day}: {self.online_seconds}/{self.expected_seconds}s'
+
+
+class TerminalStatusChange(models.Model):
+    """Terminal status transition, written only when the status changes"""
+
+    terminal = models.ForeignKey(
+        Terminal,
+        on_delete=models.CASCADE,
+        related_name='status_changes',
+        verbose_name='Terminal'
+    )
+    from_status = models.CharField(max_length=20, choices=Terminal.STATUS_CHOICES, verbose_name='From Status')
+    to_status = models.CharField(max_length=20, choices=Terminal.STATUS_CHOICES, verbose_name='To Status')
+    at = models.DateTimeField(verbose_name='Changed At')
+
+    class Meta:
+        verbose_name = 'Terminal Status Change'
+        verbose_name_plural = 'Terminal Status Changes'
+        ordering = ['-at']
+        indexes = [
+            models.Index(fields=['terminal', 'at']),
+        ]
+
+    def __str__(self):
+        return f'{self.terminal_id}: {self.from_status} -> {self.to_status} at {self.at}'
+
+
 class AuditLog(models.Model):
     """Audit logs for security tracking"""
     
@@ -0,0 +1,80 @@
+"""
+Request parsers for the agent endpoints.
+
+Agents may send request bodies as JSON or MessagePack (``application/msgpack``),
+optionally gzip-compressed with ``Content-Encoding: gzip``. Plain JSON keeps
+working unchanged. Decompressed bodies are capped at
+``settings.TMS_AGENT_MAX_DECODED_BYTES`` so a small compressed payload cannot
+expand without bound.
+
+MessagePack support needs the optional ``msgpack`` package; without it the
+parser is left out of ``AGENT_PARSER_CLASSES`` and such requests get 415.
+"""
+import io
+import zlib
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.parsers import BaseParser, JSONParser
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def _gunzip(stream, limit):
+    """Decompress a gzip stream, refusing output larger than ``limit`` bytes"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    output = bytearray()
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        try:
+            output += decompressor.decompress(chunk, limit + 1 - len(output))
+        except zlib.error as e:
+            raise ParseError(f'Invalid gzip body - {e}')
+        if len(output) > limit or decompressor.unconsumed_tail:
+            raise ParseError(f'Decoded body exceeds {limit} bytes')
+    if not decompressor.eof:
+        raise ParseError('Truncated gzip body')
+    return bytes(output)
+
+
+class ContentEncodingMixin:
+    """Undo ``Content-Encoding`` before the media type is parsed"""
+
+    def decode_stream(self, stream, parser_context):
+        request = (parser_context or {}).get('request')
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower() if request else ''
+        if encoding in ('', 'identity'):
+            return stream
+        if encoding == 'gzip':
+            return io.BytesIO(_gunzip(stream, settings.TMS_AGENT_MAX_DECODED_BYTES))
+        raise UnsupportedMediaType(f'Content-Encoding {encoding}')
+
+
+class AgentJSONParser(ContentEncodingMixin, JSONParser):
+    """JSON, plain or gzip-compressed"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return super().parse(self.decode_stream(stream, parser_context), media_type, parser_context)
+
+
+class MessagePackParser(ContentEncodingMixin, BaseParser):
+    """MessagePack, plain or gzip-compressed"""
+
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        stream = self.decode_stream(stream, parser_context)
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as e:
+            raise ParseError(f'MessagePack parse error - {e}')
+
+
+AGENT_PARSER_CLASSES = [AgentJSONParser] + ([MessagePackParser] if msgpack is not None else [])
@@ -0,0 +1,245 @@
+"""
+Binary delta packages between firmware versions.
+
+Consecutive images mostly share content, so terminals whose installed version
+has a ``ready`` ``FirmwarePatch`` to the target download the patch instead of
+the full image (see ``dispatch.build_command``). Patches are cached per
+version pair: ``request_patches`` queues the pairs running deployments need,
+and the ``build_firmware_patches`` worker builds them into the blob store.
+
+Patch format (gzip-compressed, mirrored by the agent's ``delta.apply_delta``)::
+
+    MAGIC, source sha256 (32 bytes), target sha256 (32 bytes), target size (>Q)
+    then operations until END:
+      COPY  b'C' offset (>Q) length (>Q)   bytes from the source image
+      DATA  b'D' length (>I) bytes         literal bytes
+      END   b'E'
+
+The encoder works like rsync: every ``BLOCK_SIZE`` block of the source is
+indexed by Adler-32 and a strong digest, and a rolling Adler-32 slides over
+the target byte by byte, so blocks are found again after inserted or removed
+bytes shift them. Memory stays flat (one index entry per source block and at
+most ``MAX_LITERAL`` of buffered target). Each
+patch is applied once after building and only kept if it reproduces the
+target hash and is meaningfully smaller than the image.
+"""
+import gzip
+import hashlib
+import struct
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+
+from .blobstore import discard, get_blob_store
+from .downloads import firmware_path
+from .models import FirmwarePatch, FirmwareVersion
+
+MAGIC = b'TMSDELTA1'
+BLOCK_SIZE = 4096
+MAX_LITERAL = 1024 * 1024
+COPY, DATA, END = b'C', b'D', b'E'
+_HEADER = struct.Struct('>32s32sQ')
+_COPY = struct.Struct('>QQ')
+_DATA = struct.Struct('>I')
+_ADLER_MOD = 65521
+
+
+def _blocks(file, size=BLOCK_SIZE):
+    return iter(lambda: file.read(size), b'')
+
+
+def _digest(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def _roll(weak, out_byte, in_byte):
+    """Slide the Adler-32 of a ``BLOCK_SIZE`` window by one byte"""
+    a, b = weak & 0xffff, weak >> 16
+    a = (a - out_byte + in_byte) % _ADLER_MOD
+    b = (b - BLOCK_SIZE * out_byte + a - 1) % _ADLER_MOD
+    return (b << 16) | a
+
+
+class _Encoder:
+    """Writes COPY/DATA operations, merging adjacent copies"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.copy = None
+
+    def copy_block(self, offset):
+        if self.copy and self.copy[0] + self.copy[1] == offset:
+            self.copy[1] += BLOCK_SIZE
+        else:
+            self.flush()
+            self.copy = [offset, BLOCK_SIZE]
+
+    def data(self, literal):
+        if literal:
+            self.flush()
+            self.stream.write(DATA + _DATA.pack(len(literal)) + literal)
+
+    def flush(self):
+        if self.copy:
+            self.stream.write(COPY + _COPY.pack(*self.copy))
+            self.copy = None
+
+
+def encode_delta(source, target, out, source_sha256, target_sha256, target_size):
+    """Write the patch turning ``source`` into ``target`` (open binary files) to ``out``"""
+    index = {}
+    offset = 0
+    for block in _blocks(source):
+        if len(block) == BLOCK_SIZE:
+            index.setdefault(zlib.adler32(block), {}).setdefault(_digest(block), offset)
+        offset += len(block)
+
+    with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as stream:
+        stream.write(MAGIC + _HEADER.pack(
+            bytes.fromhex(source_sha256), bytes.fromhex(target_sha256), target_size
+        ))
+        encoder = _Encoder(stream)
+        # window is buffer[pos:pos + BLOCK_SIZE]; buffer[:pos] is pending literal
+        buffer = bytearray()
+        pos = 0
+        weak = None
+        eof = False
+        while True:
+            if len(buffer) < pos + BLOCK_SIZE + 1 and not eof:
+                chunk = target.read(MAX_LITERAL)
+                eof = not chunk
+                buffer += chunk
+                continue
+            if len(buffer) < pos + BLOCK_SIZE:
+                break
+            if weak is None:
+                weak = zlib.adler32(buffer[pos:pos + BLOCK_SIZE])
+            candidates = index.get(weak)
+            match = candidates and candidates.get(_digest(buffer[pos:pos + BLOCK_SIZE]))
+            if match is not None:
+                encoder.data(buffer[:pos])
+                encoder.copy_block(match)
+                del buffer[:pos + BLOCK_SIZE]
+                pos, weak = 0, None
+            elif pos >= MAX_LITERAL:
+                encoder.data(buffer[:pos])
+                del buffer[:pos]
+                pos = 0
+            elif len(buffer) > pos + BLOCK_SIZE:
+                weak = _roll(weak, buffer[pos], buffer[pos + BLOCK_SIZE])
+                pos += 1
+            else:
+                break
+        encoder.data(buffer)
+        encoder.flush()
+        stream.write(END)
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated patch')
+    return data
+
+
+def apply_delta(source, patch, out=None):
+    """
+    Rebuild the target image from ``source`` and ``patch`` (open binary
+    files), writing it to ``out`` if given.
+
+    Returns ``(sha256 hex digest, size)`` of the rebuilt image.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with gzip.GzipFile(fileobj=patch, mode='rb') as stream:
+        if _read_exact(stream, len(MAGIC)) != MAGIC:
+            raise ValueError('Not a firmware patch')
+        _read_exact(stream, _HEADER.size)
+        while True:
+            op = _read_exact(stream, 1)
+            if op == END:
+                break
+            if op == COPY:
+                offset, length = _COPY.unpack(_read_exact(stream, _COPY.size))
+                source.seek(offset)
+                chunks = (source.read(min(BLOCK_SIZE * 16, length - done))
+                          for done in range(0, length, BLOCK_SIZE * 16))
+            elif op == DATA:
+                (length,) = _DATA.unpack(_read_exact(stream, _DATA.size))
+                chunks = (_read_exact(stream, length),)
+            else:
+                raise ValueError(f'Unknown patch operation {op!r}')
+            for chunk in chunks:
+                if not chunk:
+                    raise ValueError('Patch reads past the source image')
+                digest.update(chunk)
+                size += len(chunk)
+                if out is not None:
+                    out.write(chunk)
+    return digest.hexdigest(), size
+
+
+def request_patches(target, source_versions):
+    """Queue patches to ``target`` from the given installed version strings"""
+    sources = FirmwareVersion.objects.filter(
+        version__in=[version for version in source_versions if version]
+    ).exclude(pk=target.pk).values_list('pk', flat=True)
+    return FirmwarePatch.objects.bulk_create(
+        [FirmwarePatch(source_id=source_id, target=target) for source_id in sources],
+        ignore_conflicts=True
+    )
+
+
+def build_patch(patch):
+    """Build one queued patch into the blob store and record the outcome"""
+    source_path, target_path = firmware_path(patch.source), firmware_path(patch.target)
+    if not (source_path and source_path.is_file() and target_path and target_path.is_file()):
+        return _finish(patch, 'failed', error_message='Firmware image not on disk')
+
+    store = get_blob_store()
+    writer = store.writer()
+    try:
+        with source_path.open('rb') as source, target_path.open('rb') as target:
+            encode_delta(source, target, writer, patch.source.file_hash, patch.target.file_hash,
+                         target_path.stat().st_size)
+        pending = writer.close()
+        with source_path.open('rb') as source, open(pending.temp_path, 'rb') as built:
+            rebuilt, _ = apply_delta(source, built)
+    except Exception as e:
+        writer.abort()
+        return _finish(patch, 'failed', error_message=str(e))
+
+    if rebuilt != patch.target.file_hash:
+        discard(pending.temp_path)
+        return _finish(patch, 'failed', error_message=f'Patch rebuilds sha256 {rebuilt}')
+    if pending.size > target_path.stat().st_size * settings.TMS_FIRMWARE_PATCH_MAX_RATIO:
+        discard(pending.temp_path)
+        return _finish(patch, 'skipped', file_size=pending.size)
+
+    store.commit(pending)
+    return _finish(patch, 'ready', file_size=pending.size, file_hash=pending.sha256)
+
+
+def _finish(patch, status, **fields):
+    FirmwarePatch.objects.filter(pk=patch.pk).update(status=status, built_at=timezone.now(), **fields)
+    return status
+
+
+def ready_patches(pairs):
+    """
+    Ready patches for ``(installed version, target firmware id)`` pairs, in
+    one query: ``{pair: FirmwarePatch}``.
+    """
+    pairs = {(version, target_id) for version, target_id in pairs if version}
+    if not pairs:
+        return {}
+    patches = FirmwarePatch.objects.filter(
+        status='ready',
+        target_id__in={target_id for _, target_id in pairs},
+        source__version__in={version for version, _ in pairs},
+    ).select_related('source')
+    return {
+        (patch.source.version, patch.target_id): patch
+        for patch in patches if (patch.source.version, patch.target_id) in pairs
+    }
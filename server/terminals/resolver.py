@@ -0,0 +1,160 @@
+"""
+Serial number to terminal resolution cache for the agent endpoints.
+
+Agents identify themselves by ``serial_number``. ``SerialResolver`` maps a
+serial to a ``TerminalRef`` through a bounded per-process LRU, an optional
+shared tier in the Django cache, and finally the database, so agent writes can
+go straight to the primary key. Entries are invalidated by ``post_save`` and
+``post_delete`` on ``Terminal`` (see ``terminals.signals``); local entries also
+expire after ``LOCAL_TTL`` seconds so other processes converge.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+TerminalRef = namedtuple('TerminalRef', ['terminal_id', 'heartbeat_interval', 'maintenance_mode', 'customer_id'])
+
+# Versioned with the TerminalRef fields, so old shared entries are never unpacked
+SHARED_KEY = 'tms:serial:v2:{}'
+
+
+class SerialResolver:
+    """Bounded LRU (per process) with an optional shared cache tier"""
+
+    def __init__(self, max_size=20000, local_ttl=60, shared_timeout=3600):
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.shared_timeout = shared_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _store_local(self, serial_number, ref):
+        expires = time.monotonic() + self.local_ttl
+        with self._lock:
+            self._entries[serial_number] = (ref, expires)
+            self._entries.move_to_end(serial_number)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def resolve(self, serial_number):
+        """Return the TerminalRef for a serial, or None if unknown"""
+        return self.resolve_many([serial_number]).get(serial_number)
+
+    async def aresolve(self, serial_number):
+        """Async ``resolve``; local hits are answered without leaving the event loop"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(serial_number)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(serial_number)
+                self.hits += 1
+                return entry[0]
+        return await sync_to_async(self.resolve)(serial_number)
+
+    def resolve_many(self, serial_numbers):
+        """Resolve many serials with at most one database query"""
+        from .models import Terminal
+
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for serial_number in dict.fromkeys(serial_numbers):
+                entry = self._entries.get(serial_number)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(serial_number)
+                    found[serial_number] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.append(serial_number)
+
+        if missing and self.shared_timeout:
+            shared = cache.get_many([SHARED_KEY.format(serial_number) for serial_number in missing])
+            still_missing = []
+            for serial_number in missing:
+                value = shared.get(SHARED_KEY.format(serial_number))
+                if value is None:
+                    still_missing.append(serial_number)
+                    continue
+                ref = TerminalRef(*value)
+                found[serial_number] = ref
+                self._store_local(serial_number, ref)
+                self.shared_hits += 1
+            missing = still_missing
+
+        if missing:
+            self.misses += len(missing)
+            rows = Terminal.objects.filter(serial_number__in=missing).values_list(
+                'serial_number', 'id', 'heartbeat_interval', 'maintenance_mode', 'customer_id'
+            )
+            loaded = {}
+            for serial_number, *values in rows:
+                ref = TerminalRef(*values)
+                found[serial_number] = ref
+                loaded[SHARED_KEY.format(serial_number)] = tuple(ref)
+                self._store_local(serial_number, ref)
+            if loaded and self.shared_timeout:
+                cache.set_many(loaded, timeout=self.shared_timeout)
+
+        return found
+
+    def invalidate(self, *serial_numbers):
+        """Drop cached entries (both tiers)"""
+        serial_numbers = [serial_number for serial_number in serial_numbers if serial_number]
+        with self._lock:
+            for serial_number in serial_numbers:
+                self._entries.pop(serial_number, None)
+        if self.shared_timeout and serial_numbers:
+            cache.delete_many([SHARED_KEY.format(serial_number) for serial_number in serial_numbers])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        """Hit/miss counters for tuning (this process only)"""
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.shared_hits) / lookups, 4) if lookups else None,
+        }
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """Return the process-wide serial resolver"""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                config = settings.TMS_SERIAL_CACHE
+                _resolver = SerialResolver(
+                    max_size=config.get('MAX_SIZE', 20000),
+                    local_ttl=config.get('LOCAL_TTL', 60),
+                    shared_timeout=config.get('SHARED_TIMEOUT', 3600),
+                )
+    return _resolver
+
+
+@receiver(setting_changed)
+def _reset_resolver(setting, **kwargs):
+    global _resolver
+    if setting == 'TMS_SERIAL_CACHE':
+        _resolver = None
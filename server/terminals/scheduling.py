@@ -0,0 +1,92 @@
+"""
+Server-computed heartbeat scheduling.
+
+``next_heartbeat`` in heartbeat responses is a delay in seconds chosen so the
+fleet is spread evenly over the interval instead of beating in lockstep (for
+example after a server restart or a network outage):
+
+- every terminal owns a slot offset inside its interval, taken from the
+  golden-ratio sequence of its id, which spreads any set of ids evenly;
+- the delay points at the terminal's next slot, so agents that came back at
+  the same moment drift apart within one interval;
+- when the ingest latency EWMA climbs above ``TARGET_LATENCY_MS`` the interval
+  is stretched (up to ``MAX_STRETCH``) to shed load.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+GOLDEN_RATIO_FRACTION = (math.sqrt(5) - 1) / 2
+
+# A delay shorter than this fraction of the interval skips to the next slot
+MIN_DELAY_FRACTION = 0.25
+
+
+def slot_fraction(terminal_id):
+    """Position of the terminal's slot inside its interval, in [0, 1)"""
+    return (terminal_id * GOLDEN_RATIO_FRACTION) % 1.0
+
+
+class HeartbeatScheduler:
+    """Per-process latency tracker and slot calculator"""
+
+    def __init__(self, target_latency_ms=200, max_stretch=2.0, ewma_alpha=0.1):
+        self.target_latency = target_latency_ms / 1000
+        self.max_stretch = max_stretch
+        self.ewma_alpha = ewma_alpha
+        self.latency = None
+        self._lock = threading.Lock()
+
+    def record_latency(self, seconds):
+        """Feed one ingest latency sample into the EWMA"""
+        with self._lock:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += self.ewma_alpha * (seconds - self.latency)
+
+    def stretch(self):
+        """Interval multiplier: 1.0 while latency is on target"""
+        if not self.latency or self.latency <= self.target_latency:
+            return 1.0
+        return min(self.latency / self.target_latency, self.max_stretch)
+
+    def next_delay(self, terminal_id, interval, now=None):
+        """Seconds until the terminal's next heartbeat slot"""
+        now = time.time() if now is None else now
+        period = interval * self.stretch()
+        offset = slot_fraction(terminal_id) * period
+        delay = period - ((now - offset) % period)
+        if delay < period * MIN_DELAY_FRACTION:
+            delay += period
+        return max(1, round(delay))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide heartbeat scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                config = settings.TMS_HEARTBEAT_SCHEDULE
+                _scheduler = HeartbeatScheduler(
+                    target_latency_ms=config.get('TARGET_LATENCY_MS', 200),
+                    max_stretch=config.get('MAX_STRETCH', 2.0),
+                    ewma_alpha=config.get('EWMA_ALPHA', 0.1),
+                )
+    return _scheduler
+
+
+@receiver(setting_changed)
+def _reset_scheduler(setting, **kwargs):
+    global _scheduler
+    if setting == 'TMS_HEARTBEAT_SCHEDULE':
+        _scheduler = None
@@ -2,7 +2,7 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate
 from .models import (
     TMSUser, Customer, Terminal, Alert, FirmwareVersion,
-    UpdateTask, TerminalLog, AuditLog
+    Deployment, UpdateTask, TerminalLog, AuditLog
 )
 
 
@@ -104,8 +104,8 @@ class AlertSerializer(serializers.ModelSerializer):
         fields = ['id', 'terminal', 'alert_type', 'severity', 'title', 'message',
                   'details', 'is_acknowledged', 'acknowledged_by', 'acknowledged_at',
                   'is_resolved', 'resolved_by', 'resolved_at', 'resolution_notes',
-                  'auto_resolved', 'created_at']
-        read_only_fields = ['id', 'created_at']
+                  'auto_resolved', 'occurrence_count', 'last_seen_at', 'created_at']
+        read_only_fields = ['id', 'occurrence_count', 'last_seen_at', 'created_at']
     
     def get_terminal(self, obj):
         return {
@@ -185,6 +185,49 @@ class FirmwareVersionSerializer(serializers.ModelSerializer):
         return round(obj.file_size / (1024 * 1024), 2)
 
 
+class DeploymentScheduleSerializer(serializers.Serializer):
+    """Serializer for a deployment schedule"""
+    type = serializers.ChoiceField(choices=['immediate', 'scheduled', 'maintenance_window'], default='immediate')
+    start_at = serializers.DateTimeField(required=False, allow_null=True)
+    batch_size = serializers.IntegerField(required=False, min_value=1)
+    interval_minutes = serializers.IntegerField(required=False, min_value=0)
+
+
+class FirmwareDeploySerializer(serializers.Serializer):
+    """Serializer for a firmware deploy request"""
+    target_terminals = serializers.ChoiceField(choices=['all', 'customer', 'selected'], default='all')
+    customer_ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    terminal_ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    schedule = DeploymentScheduleSerializer(required=False, default=dict)
+    canary_percent = serializers.FloatField(required=False, min_value=0.01, max_value=100)
+    wave_growth = serializers.FloatField(required=False, min_value=1)
+    max_concurrent = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+    max_failure_rate = serializers.FloatField(required=False, allow_null=True, min_value=0, max_value=100)
+
+
+class DeploymentSerializer(serializers.ModelSerializer):
+    """Serializer for Deployment (expects ``deployments.annotate_progress``)"""
+    firmware_version = serializers.CharField(source='firmware_version.version', read_only=True)
+    progress = serializers.SerializerMethodField()
+    waves = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Deployment
+        fields = ['id', 'firmware_version', 'target_type', 'target_ids', 'schedule', 'scheduled_at',
+                  'status', 'paused_reason', 'total_terminals', 'materialized_at', 'progress',
+                  'canary_percent', 'wave_growth', 'max_concurrent', 'max_failure_rate',
+                  'current_wave', 'waves', 'wave_started_at', 'created_at', 'created_by']
+        read_only_fields = fields
+    
+    def get_progress(self, obj):
+        from .deployments import deployment_progress
+        return deployment_progress(obj)
+    
+    def get_waves(self, obj):
+        from .deployments import wave_count
+        return wave_count(obj)
+
+
 class UpdateTaskSerializer(serializers.ModelSerializer):
     """Serializer for UpdateTask model"""
     terminal = TerminalListSerializer(read_only=True)
@@ -192,7 +235,7 @@ class UpdateTaskSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = UpdateTask
-        fields = ['id', 'terminal', 'task_type', 'firmware_version', 'parameters',
+        fields = ['id', 'terminal', 'task_type', 'firmware_version', 'deployment', 'parameters',
                   'status', 'priority', 'scheduled_at', 'started_at', 'completed_at',
                   'retry_count', 'max_retries', 'error_message', 'progress',
                   'created_at', 'created_by']
@@ -242,6 +285,35 @@ class AgentHeartbeatSerializer(serializers.Serializer):
     uptime_seconds = serializers.IntegerField(required=False)
     last_transaction = serializers.DateTimeField(required=False, allow_null=True)
     transaction_count = serializers.IntegerField(required=False)
+    seq = serializers.IntegerField(required=False, min_value=0)
+
+
+class AgentHeartbeatDeltaSerializer(AgentHeartbeatSerializer):
+    """
+    Serializer for delta heartbeats (``"full": false``)
+
+    Only serial_number, seq and timestamp are required; every other field,
+    including individual metrics, is sent only when it changed.
+    """
+    REQUIRED_FIELDS = ('serial_number', 'seq', 'timestamp')
+
+    def __init__(self, *args, **kwargs):
+        kwargs['partial'] = True
+        super().__init__(*args, **kwargs)
+
+    def validate(self, attrs):
+        missing = {
+            field: [self.fields[field].error_messages['required']]
+            for field in self.REQUIRED_FIELDS if field not in attrs
+        }
+        if missing:
+            raise serializers.ValidationError(missing)
+        return attrs
+
+
+class AgentHeartbeatBatchSerializer(serializers.Serializer):
+    """Serializer for batched agent heartbeats (store gateways, replaying agents)"""
+    heartbeats = AgentHeartbeatSerializer(many=True, allow_empty=False)
 
 
 class AgentLogSerializer(serializers.Serializer):
@@ -259,6 +331,17 @@ class AgentLogsSerializer(serializers.Serializer):
     logs = AgentLogSerializer(many=True)
 
 
+class AgentLogsEnvelopeSerializer(serializers.Serializer):
+    """
+    Envelope of an agent logs submission.
+    
+    Entries are left unvalidated so they can be validated chunk by chunk with
+    AgentLogSerializer instead of materializing one huge validated list.
+    """
+    serial_number = serializers.CharField(max_length=50)
+    logs = serializers.ListField(child=serializers.DictField())
+
+
 class CommandResultSerializer(serializers.Serializer):
     """Serializer for command execution result"""
     serial_number = serializers.CharField(max_length=50)
@@ -0,0 +1,98 @@
+"""
+Model signal receivers for the terminals app.
+"""
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import counters
+from .deployments import forget_due_deployments
+from .liveness import get_store as get_liveness_store
+from .models import Alert, Customer, Deployment, Terminal
+from .resolver import get_resolver
+
+
+@receiver(post_init, sender=Terminal)
+def remember_loaded_serial(sender, instance, **kwargs):
+    """Keep the serial a terminal was loaded with, so a rename drops the old entry"""
+    # Read through __dict__ so deferred loads (.only()) do not trigger a query
+    instance._loaded_serial_number = instance.__dict__.get('serial_number')
+
+
+@receiver(post_save, sender=Terminal)
+def invalidate_serial_on_save(sender, instance, **kwargs):
+    get_resolver().invalidate(instance._loaded_serial_number, instance.serial_number)
+    instance._loaded_serial_number = instance.serial_number
+
+
+@receiver(post_delete, sender=Terminal)
+def invalidate_serial_on_delete(sender, instance, **kwargs):
+    get_resolver().invalidate(instance._loaded_serial_number, instance.serial_number)
+    get_liveness_store().forget([instance.id])
+
+
+def _loaded_state(instance, *fields):
+    """Loaded field values, None if any was deferred"""
+    if any(field not in instance.__dict__ for field in fields):
+        return None
+    return tuple(instance.__dict__[field] for field in fields)
+
+
+def _open_alert(state):
+    """``(terminal_id, severity)`` of an unresolved alert's loaded state"""
+    return None if state is None or state[2] else state[:2]
+
+
+@receiver(post_init, sender=Terminal)
+def remember_loaded_counted_state(sender, instance, **kwargs):
+    instance._loaded_counted_state = _loaded_state(instance, 'customer_id', 'status')
+
+
+@receiver(post_save, sender=Terminal)
+def count_terminal_on_save(sender, instance, created, **kwargs):
+    before = instance._loaded_counted_state
+    after = _loaded_state(instance, 'customer_id', 'status')
+    if created or (before is not None and before != after):
+        counters.terminals_changed([(None if created else before, after)])
+    instance._loaded_counted_state = after
+
+
+@receiver(post_delete, sender=Terminal)
+def count_terminal_on_delete(sender, instance, **kwargs):
+    if instance._loaded_counted_state is not None:
+        counters.terminals_changed([(instance._loaded_counted_state, None)])
+
+
+@receiver(post_init, sender=Alert)
+def remember_loaded_alert_state(sender, instance, **kwargs):
+    instance._loaded_alert_state = _loaded_state(instance, 'terminal_id', 'severity', 'is_resolved')
+
+
+@receiver(post_save, sender=Alert)
+def count_alert_on_save(sender, instance, created, **kwargs):
+    before = instance._loaded_alert_state
+    after = _loaded_state(instance, 'terminal_id', 'severity', 'is_resolved')
+    if created or before is not None:
+        counters.alerts_changed([(None if created else _open_alert(before), _open_alert(after))])
+    instance._loaded_alert_state = after
+
+
+@receiver(post_delete, sender=Alert)
+def count_alert_on_delete(sender, instance, **kwargs):
+    counters.alerts_changed([(_open_alert(instance._loaded_alert_state), None)])
+
+
+@receiver(post_save, sender=Customer)
+def count_new_customer(sender, instance, created, **kwargs):
+    if created:
+        counters.customer_added(instance.id)
+
+
+@receiver(post_delete, sender=Customer)
+def forget_customer_counters(sender, instance, **kwargs):
+    counters.customer_removed(instance.id)
+
+
+@receiver(post_save, sender=Deployment)
+@receiver(post_delete, sender=Deployment)
+def forget_deployments_on_change(sender, **kwargs):
+    forget_due_deployments()
@@ -0,0 +1,43 @@
+"""
+Fleet status statistics.
+
+``count_by_customer`` counts terminals by status per customer in one grouped
+query (``values('customer').annotate(Count(..., filter=Q(...)))``), however
+many customers there are. It is the source of truth for the cached counters
+of ``terminals.counters``, which seed and verify from it; pages read those as
+a ``FleetStatus``.
+"""
+from collections import namedtuple
+
+from django.db.models import Count, Q
+
+STATUSES = ('online', 'offline', 'error')
+
+
+def _empty():
+    return dict.fromkeys(('total',) + STATUSES, 0)
+
+
+def rate(count, total):
+    """Percentage of ``total``, rounded to one decimal (0 when empty)"""
+    return round((count / total * 100) if total > 0 else 0, 1)
+
+
+class FleetStatus(namedtuple('FleetStatus', ['overall', 'by_customer'])):
+    """
+    Status counts: ``overall`` and ``by_customer`` (customer id -> counts),
+    each a dict with ``total``, ``online``, ``offline`` and ``error``.
+    """
+
+    def customer(self, customer_id):
+        """Counts of one customer (zeros when it has no terminals)"""
+        return self.by_customer.get(customer_id) or _empty()
+
+
+def count_by_customer(terminals):
+    """``{customer_id: counts}`` of a terminal queryset, as stored in the database"""
+    rows = terminals.order_by().values('customer').annotate(
+        total=Count('id'),
+        **{status: Count('id', filter=Q(status=status)) for status in STATUSES}
+    )
+    return {row.pop('customer'): row for row in rows}
@@ -0,0 +1,118 @@
+"""
+Offline sweeper.
+
+Terminal status only changes when an agent reports it, so a terminal that
+stops sending heartbeats would stay ``online`` forever. ``sweep_offline``
+marks terminals offline once they have been silent for more than
+``MISSED_HEARTBEATS`` x ``heartbeat_interval`` seconds and raises a
+``connection_lost`` alert for each of them.
+
+Candidates come from a range scan on the ``last_heartbeat`` index using the
+shortest interval in the fleet; the per-terminal threshold is then checked in
+Python, so the cost follows the number of silent terminals, not fleet size.
+Swept terminals are accounted as offline in the availability rollups (see
+``terminals.availability``) and get an offline status change at their last
+heartbeat (see ``terminals.uptime``). Swept terminals are dropped from the
+liveness store; with the ``local`` backend the sweep runs in the server
+process that owns it (see ``terminals.liveness``), so that reaches the
+overlays readers see.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .alerting import raise_alerts
+from .availability import account_offline, roll_offline
+from .liveness import get_store as get_liveness_store
+from .models import Alert, Terminal, TerminalStatusChange
+from .uptime import record_changes
+
+SWEPT_STATUSES = ['online', 'error']
+
+
+def _silent_terminals(now, missed, grace):
+    """(terminal_id, customer_id, status, last_heartbeat) for every terminal past its own threshold"""
+    active = Terminal.objects.filter(status__in=SWEPT_STATUSES, maintenance_mode=False)
+    shortest = active.aggregate(shortest=Min('heartbeat_interval'))['shortest']
+    if shortest is None:
+        return []
+
+    coarse_cutoff = now - timedelta(seconds=missed * shortest) - grace
+    candidates = active.filter(
+        Q(last_heartbeat__lt=coarse_cutoff) | Q(last_heartbeat__isnull=True)
+    ).order_by().values_list('id', 'customer_id', 'status', 'heartbeat_interval', 'last_heartbeat')
+
+    return [
+        (terminal_id, customer_id, status, last_heartbeat)
+        for terminal_id, customer_id, status, interval, last_heartbeat in candidates
+        if last_heartbeat is None or last_heartbeat < now - timedelta(seconds=missed * interval) - grace
+    ]
+
+
+def _connection_lost_alert(terminal_id, last_heartbeat, now):
+    if last_heartbeat is None:
+        message = 'No heartbeat has been received from this terminal'
+    else:
+        silent_minutes = int((now - last_heartbeat).total_seconds() // 60)
+        message = f'No heartbeat received for {silent_minutes} minutes'
+    return Alert(
+        terminal_id=terminal_id,
+        alert_type='connection_lost',
+        severity='HIGH',
+        title='Connection lost',
+        message=message,
+        details={'last_heartbeat': last_heartbeat.isoformat() if last_heartbeat else None}
+    )
+
+
+def sweep_offline(now=None):
+    """
+    Mark silent terminals offline; returns a summary dict.
+
+    Uses one UPDATE per ``BATCH_SIZE`` terminals plus the fixed queries of
+    ``raise_alerts``, whatever the fleet size.
+    """
+    now = now or timezone.now()
+    config = settings.TMS_OFFLINE_SWEEP
+    store = get_liveness_store()
+
+    # Push buffered heartbeats first so last_heartbeat is current; the flush
+    # interval of other processes is covered by the grace period.
+    store.flush()
+    grace = timedelta(seconds=settings.TMS_LIVENESS['FLUSH_INTERVAL'])
+
+    # Terminals that stay offline still count as expected time each day
+    roll_offline(now, config['BATCH_SIZE'])
+
+    silent = _silent_terminals(now, config['MISSED_HEARTBEATS'], grace)
+    if not silent:
+        return {'offline': 0, 'alerts': {'created': 0, 'folded': 0}}
+
+    terminal_ids = [terminal_id for terminal_id, _, _, _ in silent]
+    batch_size = config['BATCH_SIZE']
+    offline = 0
+    with transaction.atomic():
+        for offset in range(0, len(terminal_ids), batch_size):
+            batch = terminal_ids[offset:offset + batch_size]
+            account_offline(batch, now)
+            offline += Terminal.objects.filter(
+                id__in=batch,
+                status__in=SWEPT_STATUSES
+            ).update(status='offline', updated_at=now, availability_until=now)
+        # The terminal stopped answering after its last heartbeat
+        record_changes([
+            TerminalStatusChange(terminal_id=terminal_id, from_status=status, to_status='offline',
+                                 at=last_heartbeat or now)
+            for terminal_id, _, status, last_heartbeat in silent
+        ], {terminal_id: customer_id for terminal_id, customer_id, _, _ in silent}, batch_size)
+        alerts = raise_alerts(
+            [_connection_lost_alert(terminal_id, last_heartbeat, now) for terminal_id, _, _, last_heartbeat in silent],
+            now
+        )
+
+    # Stale overlays would otherwise show the terminals online again
+    store.forget(terminal_ids)
+    return {'offline': offline, 'alerts': alerts}
@@ -0,0 +1,123 @@
+from unittest import mock
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+from django.utils import timezone
+from terminals import alerting
+from terminals.alerting import alert_fingerprint, normalize_message, raise_alert, raise_alerts
+from terminals.counters import alert_counts
+from terminals.models import Alert, Customer, Terminal
+
+
+class AlertDeduplicationTest(TestCase):
+    """Alert deduplication engine test"""
+    
+    def setUp(self):
+        cache.clear()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=self.customer,
+            store_name="Shibuya Store"
+        )
+    
+    def alert(self, message="Card reader error 0x1F at slot 3"):
+        return Alert(
+            terminal=self.terminal,
+            alert_type='error',
+            severity='HIGH',
+            title='ERROR: system',
+            message=message
+        )
+    
+    def test_normalization_masks_volatile_values(self):
+        """Numbers and hex codes do not change the fingerprint"""
+        self.assertEqual(normalize_message("Error 0x1F  at slot 3"), "error <hex> at slot <n>")
+        self.assertEqual(
+            alert_fingerprint(self.terminal.id, 'error', "Timeout after 30s"),
+            alert_fingerprint(self.terminal.id, 'error', "Timeout after 45s")
+        )
+        self.assertNotEqual(
+            alert_fingerprint(self.terminal.id, 'error', "Timeout"),
+            alert_fingerprint(self.terminal.id, 'offline', "Timeout")
+        )
+    
+    def test_repeats_increment_occurrence_count(self):
+        """Repeats of an open alert fold into one row"""
+        raise_alerts([self.alert(), self.alert("Card reader error 0x2A at slot 4")])
+        result = raise_alert(
+            terminal=self.terminal, alert_type='error', severity='HIGH',
+            title='ERROR: system', message="Card reader error 0x3B at slot 5"
+        )
+        
+        self.assertEqual(result, {'created': 0, 'folded': 1})
+        alert = Alert.objects.get()
+        self.assertEqual(alert.occurrence_count, 3)
+        self.assertIsNotNone(alert.last_seen_at)
+    
+    def test_resolved_alert_is_not_reused(self):
+        """A new occurrence after resolution opens a new alert"""
+        raise_alerts([self.alert()])
+        Alert.objects.update(is_resolved=True)
+        
+        raise_alerts([self.alert()])
+        
+        self.assertEqual(Alert.objects.count(), 2)
+        self.assertEqual(Alert.objects.filter(is_resolved=False).count(), 1)
+    
+    def test_query_count_is_constant(self):
+        """Lookup, update and insert cost does not grow with the batch"""
+        raise_alerts([self.alert("existing fault")])
+        batch = [self.alert("existing fault")] + [self.alert(f"new fault {c}") for c in "abcdef"]
+        
+        with self.assertNumQueries(4):  # lookup, fold, insert, lookup of the inserted
+            result = raise_alerts(batch)
+        
+        self.assertEqual(result, {'created': 6, 'folded': 1})
+    
+    def test_concurrent_insert_is_folded(self):
+        """An alert opened by another producer after the lookup is folded into, not duplicated"""
+        raise_alerts([self.alert()])
+        opened_meanwhile = alerting._open_alerts([Alert.objects.get().fingerprint])
+        
+        # The other producer's alert was not committed yet when this one looked
+        with mock.patch.object(alerting, '_open_alerts', side_effect=[{}, opened_meanwhile]):
+            result = raise_alerts([self.alert()])
+        
+        self.assertEqual(result, {'created': 0, 'folded': 1})
+        alert = Alert.objects.get()
+        self.assertEqual(alert.occurrence_count, 2)
+    
+    def test_open_fingerprint_is_unique(self):
+        """The database refuses a second open alert with the same fingerprint"""
+        raise_alerts([self.alert()])
+        duplicate = self.alert()
+        duplicate.fingerprint = Alert.objects.get().fingerprint
+        
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            duplicate.save()
+        Alert.objects.update(is_resolved=True)
+        duplicate.save()
+    
+    def test_repeat_escalates_severity(self):
+        """A more severe repeat raises the open alert's severity, a milder one leaves it"""
+        self.assertEqual(alert_counts()['HIGH'], 0)  # load the counters
+        with self.captureOnCommitCallbacks(execute=True):
+            raise_alerts([self.alert()])
+        critical = self.alert()
+        critical.severity = 'CRITICAL'
+        low = self.alert()
+        low.severity = 'LOW'
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            raise_alerts([critical])
+            raise_alerts([low])
+        
+        alert = Alert.objects.get()
+        self.assertEqual((alert.severity, alert.occurrence_count), ('CRITICAL', 3))
+        counts = alert_counts()
+        self.assertEqual((counts['total'], counts['HIGH'], counts['CRITICAL']), (1, 0, 1))
@@ -1,9 +1,16 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import IntegrityError, connection
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from terminals.models import Customer, Terminal, TMSUser
+from unittest import mock
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Alert, Customer, Terminal, TMSUser, TerminalLog, TerminalMetricSample, UpdateTask
 import json
+from datetime import timedelta
 
 
 class HeartbeatAPITest(APITestCase):
@@ -82,6 +89,224 @@ class HeartbeatAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class HeartbeatBatchAPITest(APITestCase):
+    """Batched heartbeat API test"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.url = reverse('agent-heartbeat-batch')
+        cache.clear()
+        get_liveness_store().clear()
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def make_terminals(self, count, prefix):
+        terminals = []
+        for i in range(count):
+            terminal = Terminal.objects.create(
+                serial_number=f"{prefix}{i:03d}",
+                customer=self.customer,
+                store_name=f"Store {i}"
+            )
+            UpdateTask.objects.create(terminal=terminal, task_type='reboot', status='pending')
+            terminals.append(terminal)
+        return terminals
+    
+    def heartbeat(self, serial_number, cpu_usage=10):
+        return {
+            "serial_number": serial_number,
+            "status": "online",
+            "timestamp": "2025-11-24T12:00:00Z",
+            "metrics": {"cpu_usage": cpu_usage, "memory_usage": 20, "disk_usage": 30},
+            "firmware_version": "1.0.1",
+            "agent_version": "1.0.0"
+        }
+    
+    def post_batch(self, heartbeats):
+        return self.client.post(self.url, {"heartbeats": heartbeats}, format='json')
+    
+    def test_batch_updates_terminals_and_returns_commands(self):
+        """Each known terminal is updated and receives its pending commands"""
+        terminals = self.make_terminals(2, "TC-200-B")
+        heartbeats = [self.heartbeat(t.serial_number, cpu_usage=55) for t in terminals]
+        heartbeats.append(self.heartbeat("UNKNOWN-001"))
+        
+        response = self.post_batch(heartbeats)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['accepted'], 2)
+        self.assertEqual(response.data['rejected'], 1)
+        results = {r['serial_number']: r for r in response.data['results']}
+        self.assertEqual(results["UNKNOWN-001"]['error']['code'], 'RES_001')
+        get_liveness_store().flush()
+        for terminal in terminals:
+            self.assertEqual(len(results[terminal.serial_number]['commands']), 1)
+            terminal.refresh_from_db()
+            self.assertEqual(terminal.status, "online")
+            self.assertEqual(terminal.cpu_usage, 55)
+            self.assertEqual(terminal.firmware_version, "1.0.1")
+        self.assertEqual(TerminalMetricSample.objects.count(), 2)
+        self.assertFalse(TerminalLog.objects.filter(log_type='heartbeat').exists())
+        self.assertFalse(UpdateTask.objects.filter(status='pending').exists())
+    
+    def test_replayed_heartbeats_keep_their_metrics(self):
+        """Every replayed beat becomes a sample at its own time; the newest sets liveness"""
+        terminal = self.make_terminals(1, "TC-200-R")[0]
+        now = timezone.now()
+        reported = {
+            now - timedelta(minutes=10): 11,
+            now - timedelta(minutes=5): 22,
+            now - timedelta(days=30): 33,
+            now + timedelta(days=1): 44,
+        }
+        heartbeats = []
+        for timestamp, cpu_usage in reported.items():
+            heartbeat = self.heartbeat(terminal.serial_number, cpu_usage=cpu_usage)
+            heartbeat['timestamp'] = timestamp.isoformat()
+            heartbeats.append(heartbeat)
+        
+        response = self.post_batch(heartbeats)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['accepted'], 1)
+        samples = dict(TerminalMetricSample.objects.values_list('cpu_usage', 'recorded_at'))
+        self.assertEqual(set(samples), {11, 22, 33, 44})
+        self.assertEqual(samples[11], now - timedelta(minutes=10))
+        self.assertEqual(samples[22], now - timedelta(minutes=5))
+        # Clamped to the raw tier's window
+        self.assertGreaterEqual(samples[33], now - timedelta(days=2))
+        self.assertLessEqual(samples[44], timezone.now())
+        get_liveness_store().flush()
+        terminal.refresh_from_db()
+        self.assertEqual(terminal.cpu_usage, 44)
+    
+    def test_batch_query_count_is_constant(self):
+        """Query count does not grow with the number of terminals in the batch"""
+        small = self.make_terminals(2, "TC-200-S")
+        large = self.make_terminals(8, "TC-200-L")
+        # Warm the per-process deployment memo
+        self.post_batch([self.heartbeat(t.serial_number) for t in self.make_terminals(1, "TC-200-W")])
+        
+        with CaptureQueriesContext(connection) as small_ctx:
+            self.post_batch([self.heartbeat(t.serial_number) for t in small])
+        with CaptureQueriesContext(connection) as large_ctx:
+            self.post_batch([self.heartbeat(t.serial_number) for t in large])
+        
+        self.assertEqual(len(small_ctx.captured_queries), len(large_ctx.captured_queries))
+    
+    def test_terminal_deleted_elsewhere_is_resolved_again(self):
+        """A terminal deleted by another process gets RES_001, the rest of the batch goes through"""
+        kept = self.make_terminals(1, "TC-200-K")[0]
+        gone = Terminal.objects.create(serial_number="TC-200-GONE", customer=self.customer)
+        self.post_batch([self.heartbeat(kept.serial_number), self.heartbeat(gone.serial_number)])
+        TerminalMetricSample.objects.all().delete()
+        # Deleted by another process: this one's resolver still has the serial
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM terminals_terminal WHERE id = %s', [gone.id])
+        bulk_create = TerminalMetricSample.objects.bulk_create
+        
+        def fails_once(samples, *args, **kwargs):
+            if not fails_once.failed:
+                fails_once.failed = True
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return bulk_create(samples, *args, **kwargs)
+        fails_once.failed = False
+        
+        with mock.patch.object(TerminalMetricSample.objects, 'bulk_create', side_effect=fails_once):
+            response = self.post_batch([self.heartbeat(kept.serial_number), self.heartbeat(gone.serial_number)])
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['accepted'], response.data['rejected']), (1, 1))
+        results = {r['serial_number']: r for r in response.data['results']}
+        self.assertEqual(results[gone.serial_number]['error']['code'], 'RES_001')
+        self.assertEqual(list(TerminalMetricSample.objects.values_list('terminal_id', flat=True)), [kept.id])
+    
+    def test_repeated_integrity_error_is_reported(self):
+        """When retrying does not help, the agent gets an API error instead of a bare 500"""
+        terminal = self.make_terminals(1, "TC-200-K")[0]
+        
+        with mock.patch.object(TerminalMetricSample.objects, 'bulk_create', side_effect=IntegrityError):
+            response = self.post_batch([self.heartbeat(terminal.serial_number)])
+        
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.data['error']['code'], 'SYS_001')
+
+
+@override_settings(TMS_AGENT_LOGS_CHUNK_SIZE=4, TMS_AGENT_LOGS_MAX_BATCH_SIZE=50)
+class AgentLogsAPITest(APITestCase):
+    """Agent logs API test"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=self.customer,
+            store_name="Shibuya Store"
+        )
+        self.url = reverse('agent-logs')
+    
+    def entry(self, level='INFO', message='Transaction completed'):
+        return {
+            "timestamp": "2025-11-24T12:00:00Z",
+            "level": level,
+            "type": "transaction",
+            "message": message
+        }
+    
+    def post_logs(self, logs):
+        return self.client.post(self.url, {"serial_number": "TC-200-TEST001", "logs": logs}, format='json')
+    
+    def test_logs_and_alerts_are_inserted(self):
+        """Entries are stored across chunks and errors raise alerts"""
+        logs = [self.entry() for _ in range(9)] + [self.entry('ERROR', 'Card reader failure')]
+        
+        response = self.post_logs(logs)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 10)
+        self.assertEqual(
+            sorted(response.data['log_ids']),
+            sorted(TerminalLog.objects.values_list('id', flat=True))
+        )
+        self.assertEqual(Alert.objects.get().severity, 'HIGH')
+    
+    def test_query_count_grows_per_chunk_not_per_entry(self):
+        """Insert cost depends on the number of chunks, not entries"""
+        self.post_logs([self.entry('ERROR')])  # warm the serial resolver and open the alert
+        with CaptureQueriesContext(connection) as few:
+            self.post_logs([self.entry('ERROR')])
+        with CaptureQueriesContext(connection) as many:
+            self.post_logs([self.entry('ERROR') for _ in range(4)])
+        
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+    
+    def test_invalid_entry_rolls_back_batch(self):
+        """An invalid entry in a later chunk rejects the whole submission"""
+        logs = [self.entry() for _ in range(6)] + [{"level": "INFO"}]
+        
+        response = self.post_logs(logs)
+        
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertIn('6', response.data['error']['field_errors']['logs'])
+        self.assertFalse(TerminalLog.objects.exists())
+    
+    def test_batch_size_limit(self):
+        """Submissions above the configured maximum are rejected"""
+        response = self.post_logs([self.entry() for _ in range(51)])
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
 class TerminalAPITest(APITestCase):
     """Terminal API test"""
     
@@ -0,0 +1,248 @@
+import asyncio
+import gzip
+import json
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from terminals import async_views
+from terminals.liveness import get_store as get_liveness_store
+from terminals.metrics import asave_sample, build_sample
+from terminals.models import (
+    Alert, Customer, Deployment, FirmwareVersion, Terminal, TerminalLog, TerminalMetricSample, UpdateTask
+)
+from terminals.resolver import get_resolver
+from terminals.throttling import get_bucket_store
+
+urlpatterns = [
+    path('agent/heartbeat', async_views.agent_heartbeat_view, name='agent-heartbeat'),
+    path('agent/logs', async_views.agent_logs_view, name='agent-logs'),
+    path('agent/commands/<int:command_id>/result', async_views.agent_command_result_view,
+         name='agent-command-result'),
+]
+
+HEARTBEAT = {
+    "serial_number": "TC-200-TEST001",
+    "seq": 1,
+    "status": "online",
+    "timestamp": "2025-11-24T12:00:00Z",
+    "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30},
+    "firmware_version": "1.0.0",
+    "agent_version": "1.0.0"
+}
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncAgentViewsTest(TestCase):
+    """Async agent ingestion endpoint test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_resolver().clear()
+        get_bucket_store().clear()
+        get_liveness_store().clear()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=self.customer,
+            store_name="Shibuya Store"
+        )
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def post(self, url, payload, **headers):
+        return self.async_client.post(url, payload, content_type='application/json', **headers)
+    
+    async def test_heartbeat(self):
+        """Heartbeats are buffered, sampled and acknowledged"""
+        response = await self.post('/agent/heartbeat', HEARTBEAT)
+        
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['status'], 'acknowledged')
+        self.assertEqual(body['commands'], [])
+        self.assertGreater(body['next_heartbeat'], 0)
+        live = get_liveness_store().get_many([self.terminal.id])[self.terminal.id]
+        self.assertEqual((live['status'], live['cpu_usage'], live['heartbeat_seq']), ('online', 10, 1))
+        self.assertEqual(await TerminalMetricSample.objects.acount(), 1)
+        terminal = await Terminal.objects.aget(pk=self.terminal.id)
+        self.assertEqual(terminal.firmware_version, "1.0.0")
+    
+    def test_concurrent_samples_share_an_insert(self):
+        """Samples saved concurrently are group-committed"""
+        metrics = {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30}
+        
+        async def save_five():
+            await asyncio.gather(*(
+                asave_sample(build_sample(self.terminal.id, metrics, timezone.now())) for _ in range(5)
+            ))
+        
+        with CaptureQueriesContext(connection) as ctx:
+            async_to_sync(save_five)()
+        
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertLessEqual(len(inserts), 2)
+        self.assertEqual(TerminalMetricSample.objects.count(), 5)
+    
+    async def test_heartbeat_delta_and_resync(self):
+        """Deltas continue the recorded seq; gaps get SYNC_001"""
+        await self.post('/agent/heartbeat', HEARTBEAT)
+        
+        ok = await self.post('/agent/heartbeat', {
+            "serial_number": "TC-200-TEST001", "seq": 2, "full": False, "timestamp": "2025-11-24T12:05:00Z"
+        })
+        gap = await self.post('/agent/heartbeat', {
+            "serial_number": "TC-200-TEST001", "seq": 9, "full": False, "timestamp": "2025-11-24T12:10:00Z"
+        })
+        
+        self.assertEqual(ok.status_code, 200)
+        self.assertEqual(await TerminalMetricSample.objects.acount(), 1)
+        self.assertEqual(gap.status_code, 409)
+        self.assertEqual(gap.json()['error']['code'], 'SYNC_001')
+    
+    async def test_agent_posts_skip_csrf_checks(self):
+        """Cookieless agents are not rejected by the CSRF middleware"""
+        client = AsyncClient(enforce_csrf_checks=True)
+        
+        response = await client.post('/agent/heartbeat', HEARTBEAT, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(asyncio.iscoroutinefunction(async_views.agent_heartbeat_view))
+    
+    async def test_heartbeat_errors(self):
+        """Validation errors and unknown serials use the sync views' format"""
+        invalid = await self.post('/agent/heartbeat', {"serial_number": "TC-200-TEST001"})
+        unknown = await self.post('/agent/heartbeat', {**HEARTBEAT, "serial_number": "TC-200-UNKNOWN"})
+        wrong_method = await self.async_client.get('/agent/heartbeat')
+        
+        self.assertEqual(invalid.status_code, 422)
+        self.assertIn('metrics', invalid.json()['error']['field_errors'])
+        self.assertEqual(unknown.status_code, 404)
+        self.assertEqual(unknown.json()['error']['code'], 'RES_001')
+        self.assertEqual(wrong_method.status_code, 405)
+    
+    async def test_gzip_body(self):
+        """Compressed bodies go through the agent parsers"""
+        response = await self.async_client.post(
+            '/agent/heartbeat', gzip.compress(json.dumps(HEARTBEAT).encode()),
+            content_type='application/json', headers={'Content-Encoding': 'gzip'}
+        )
+        self.assertEqual(response.status_code, 200)
+    
+    @override_settings(TMS_AGENT_ADMISSION={
+        'RATES': {'agent-heartbeat': {'PER_SERIAL': ('1/min', 1), 'GLOBAL': None}},
+        'CONCURRENCY': {},
+    })
+    async def test_admission_control(self):
+        """Callers over their rate get RATE_001 with Retry-After"""
+        await self.post('/agent/heartbeat', HEARTBEAT)
+        response = await self.post('/agent/heartbeat', HEARTBEAT)
+        
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['error']['code'], 'RATE_001')
+        self.assertTrue(response.has_header('Retry-After'))
+    
+    async def test_logs(self):
+        """Log batches are stored and error entries raise alerts"""
+        entry = {"timestamp": "2025-11-24T12:00:00Z", "type": "transaction", "message": "ok"}
+        response = await self.post('/agent/logs', {
+            "serial_number": "TC-200-TEST001",
+            "logs": [{**entry, "level": "INFO"}, {**entry, "level": "ERROR", "message": "Reader fault"}]
+        })
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(await TerminalLog.objects.acount(), 2)
+        self.assertEqual(await Alert.objects.acount(), 1)
+    
+    async def test_invalid_log_entry_inserts_nothing(self):
+        """One bad entry rejects the whole batch"""
+        response = await self.post('/agent/logs', {
+            "serial_number": "TC-200-TEST001",
+            "logs": [
+                {"timestamp": "2025-11-24T12:00:00Z", "level": "INFO", "type": "transaction", "message": "ok"},
+                {"level": "LOUD"}
+            ]
+        })
+        
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('1', response.json()['error']['field_errors']['logs'])
+        self.assertEqual(await TerminalLog.objects.acount(), 0)
+    
+    def create_firmware_task(self):
+        firmware = FirmwareVersion.objects.create(
+            version="2.0.0",
+            file_name="TC-200_2.0.0.bin",
+            file_size=1024,
+            file_hash="0" * 64,
+            released_date=timezone.now().date()
+        )
+        return UpdateTask.objects.create(
+            terminal=self.terminal, task_type='firmware', firmware_version=firmware, status='running'
+        )
+    
+    def result(self, task, status, **fields):
+        return self.post(f'/agent/commands/{task.id}/result', {
+            "serial_number": "TC-200-TEST001",
+            "command_id": task.id,
+            "status": status,
+            "started_at": "2025-11-24T12:00:00Z",
+            "completed_at": "2025-11-24T12:01:00Z",
+            **fields
+        })
+    
+    async def test_command_completed(self):
+        """A completed firmware update records the installed version"""
+        task = await sync_to_async(self.create_firmware_task)()
+        
+        response = await self.result(task, 'completed')
+        
+        self.assertEqual(response.status_code, 200)
+        await task.arefresh_from_db()
+        self.assertEqual((task.status, task.progress), ('completed', 100))
+        terminal = await Terminal.objects.aget(pk=self.terminal.id)
+        self.assertEqual(terminal.firmware_version, "2.0.0")
+    
+    async def test_command_failed_is_retried(self):
+        """Failures below max_retries go back to pending"""
+        task = await sync_to_async(self.create_firmware_task)()
+        
+        response = await self.result(task, 'failed', result={"message": "Flash error"})
+        
+        self.assertEqual(response.status_code, 200)
+        await task.arefresh_from_db()
+        self.assertEqual((task.status, task.retry_count, task.error_message), ('pending', 1, "Flash error"))
+    
+    async def test_command_failure_gates_rollout(self):
+        """A final failure in the current wave can pause the deployment"""
+        task = await sync_to_async(self.create_firmware_task)()
+        deployment = await Deployment.objects.acreate(
+            firmware_version_id=task.firmware_version_id, status='active', total_terminals=1,
+            last_terminal_id=self.terminal.id, max_failure_rate=0
+        )
+        await UpdateTask.objects.filter(pk=task.pk).aupdate(deployment=deployment, wave=0, max_retries=0)
+        
+        response = await self.result(task, 'failed', result={"message": "Flash error"})
+        
+        self.assertEqual(response.status_code, 200)
+        await deployment.arefresh_from_db()
+        self.assertEqual(deployment.status, 'paused')
+    
+    async def test_unknown_command(self):
+        """Unknown command ids get a 404"""
+        response = await self.post('/agent/commands/999999/result', {
+            "serial_number": "TC-200-TEST001",
+            "command_id": 999999,
+            "status": "completed",
+            "started_at": "2025-11-24T12:00:00Z",
+            "completed_at": "2025-11-24T12:01:00Z"
+        })
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,182 @@
+from datetime import datetime, time, timedelta
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.availability import split_days
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import (
+    Customer, Terminal, TerminalAvailability, TerminalMetricRollup, TerminalMetricSample
+)
+from terminals.sweeper import sweep_offline
+
+
+class AvailabilityTest(TestCase):
+    """Availability rollup test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_liveness_store().clear()
+        self.today = timezone.localdate()
+        self.start = timezone.make_aware(datetime.combine(self.today - timedelta(days=3), time(10)))
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=self.today
+        )
+        self.terminal = self.make_terminal("TC-200-A")
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def make_terminal(self, serial, customer=None):
+        return Terminal.objects.create(
+            serial_number=serial, customer=customer or self.customer, store_name="Shibuya Store",
+            status='offline', heartbeat_interval=300
+        )
+    
+    def heartbeat(self, at, terminal=None, status='online'):
+        store = get_liveness_store()
+        store.record((terminal or self.terminal).id, {
+            'last_heartbeat': at, 'status': status,
+            'cpu_usage': 10, 'memory_usage': 20, 'disk_usage': 30, 'temperature': None,
+        })
+        store.flush()
+    
+    def rollups(self, terminal=None):
+        return list(TerminalAvailability.objects.filter(terminal=terminal or self.terminal).order_by('day').values_list(
+            'day', 'online_seconds', 'expected_seconds'
+        ))
+    
+    def test_split_days(self):
+        """Spans are cut at local midnight"""
+        midnight = timezone.make_aware(datetime.combine(self.today, time.min))
+        self.assertEqual(
+            list(split_days(midnight - timedelta(minutes=10), midnight + timedelta(minutes=5))),
+            [(self.today - timedelta(days=1), 600), (self.today, 300)]
+        )
+    
+    def test_heartbeats_accrue_online_time(self):
+        """Regular heartbeats count as online; a long silence counts as expected only"""
+        self.heartbeat(self.start)
+        self.assertEqual(self.rollups(), [])
+        self.assertEqual(Terminal.objects.get().availability_until, self.start)
+        
+        self.heartbeat(self.start + timedelta(minutes=5))
+        self.heartbeat(self.start + timedelta(minutes=10))
+        self.heartbeat(self.start + timedelta(minutes=70))
+        
+        self.assertEqual(self.rollups(), [(self.start.date(), 600, 4200)])
+    
+    def test_error_status_and_maintenance(self):
+        """Heartbeats reporting errors are not online; maintenance is not expected"""
+        self.heartbeat(self.start)
+        self.heartbeat(self.start + timedelta(minutes=5), status='error')
+        Terminal.objects.filter(id=self.terminal.id).update(maintenance_mode=True)
+        self.heartbeat(self.start + timedelta(minutes=10))
+        
+        self.assertEqual(self.rollups(), [(self.start.date(), 0, 300)])
+    
+    def test_offline_time_is_expected(self):
+        """Swept terminals count as offline up to the sweep, and each day after"""
+        self.heartbeat(self.start)
+        self.heartbeat(self.start + timedelta(minutes=5))
+        
+        swept_at = self.start + timedelta(hours=1)
+        self.assertEqual(sweep_offline(swept_at)['offline'], 1)
+        self.assertEqual(self.rollups(), [(self.start.date(), 300, 3600)])
+        
+        next_day = swept_at + timedelta(days=1)
+        sweep_offline(next_day)
+        sweep_offline(next_day + timedelta(minutes=1))
+        first_day_left = (timezone.make_aware(datetime.combine(self.start.date() + timedelta(days=1), time.min))
+                          - swept_at).total_seconds()
+        self.assertEqual(self.rollups(), [
+            (self.start.date(), 300, 3600 + first_day_left),
+            (self.start.date() + timedelta(days=1), 0, 86400 - first_day_left),
+        ])
+        
+        # Back online: the gap since the last roll is offline, then heartbeats count again
+        back = next_day + timedelta(minutes=30)
+        self.heartbeat(back)
+        self.heartbeat(back + timedelta(minutes=5))
+        self.assertEqual(self.rollups()[-1], (self.start.date() + timedelta(days=1), 300, 86400 - first_day_left + 2100))
+    
+    def test_report(self):
+        """Daily, weekly and monthly periods for the fleet, a customer and a terminal"""
+        other_customer = Customer.objects.create(
+            company_name="Other Corporation", contact_email="other@example.com", contract_start_date=self.today
+        )
+        other = self.make_terminal("TC-200-B", customer=other_customer)
+        for days_ago, terminal, online in [(2, self.terminal, 86400), (1, self.terminal, 43200), (1, other, 0)]:
+            TerminalAvailability.objects.create(
+                terminal=terminal, customer=terminal.customer, day=self.today - timedelta(days=days_ago),
+                online_seconds=online, expected_seconds=86400
+            )
+        user = get_user_model().objects.create_user(username="operator", password="testpass123")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        url = reverse('reports-availability')
+        params = {'from_date': str(self.today - timedelta(days=7)), 'to_date': str(self.today)}
+        
+        with self.assertNumQueries(1):
+            daily = client.get(url, params).data
+        self.assertEqual([point['availability'] for point in daily['data']], [100.0, 25.0])
+        self.assertEqual(daily['summary'], {
+            'average_availability': 50.0, 'min_availability': 25.0, 'max_availability': 100.0
+        })
+        
+        customer = client.get(url, {**params, 'customer_id': self.customer.id}).data
+        self.assertEqual([point['availability'] for point in customer['data']], [100.0, 50.0])
+        terminal = client.get(url, {**params, 'terminal_id': other.id, 'granularity': 'monthly'}).data
+        self.assertEqual([(point['terminals'], point['availability']) for point in terminal['data']], [(1, 0.0)])
+        weekly = client.get(url, {**params, 'granularity': 'weekly'}).data
+        self.assertEqual(sum(point['expected_seconds'] for point in weekly['data']), 3 * 86400)
+        
+        self.assertEqual(client.get(url, {**params, 'granularity': 'hourly'}).status_code, 400)
+        self.assertEqual(client.get(url, {**params, 'from_date': 'yesterday'}).status_code, 400)
+    
+    def test_backfill_from_history(self):
+        """Closed days are rebuilt from raw samples and older buckets"""
+        Terminal.objects.filter(id=self.terminal.id).update(created_at=self.start - timedelta(days=30))
+        day = self.today - timedelta(days=1)
+        morning = timezone.make_aware(datetime.combine(day, time(9)))
+        for minute in range(0, 65, 5):
+            TerminalMetricSample.objects.create(
+                terminal=self.terminal, recorded_at=morning + timedelta(minutes=minute),
+                cpu_usage=10, memory_usage=20, disk_usage=30
+            )
+        older = timezone.make_aware(datetime.combine(day - timedelta(days=1), time(9)))
+        TerminalMetricRollup.objects.create(
+            terminal=self.terminal, resolution='hour', bucket_start=older, sample_count=6,
+            cpu_min=10, cpu_avg=10, cpu_max=10, memory_min=20, memory_avg=20, memory_max=20,
+            disk_min=30, disk_avg=30, disk_max=30
+        )
+        
+        out = StringIO()
+        call_command('backfill_availability', days=2, workers=1, stdout=out)
+        
+        self.assertEqual(self.rollups(), [(day - timedelta(days=1), 1800, 86400), (day, 3600, 86400)])
+        self.assertEqual(Terminal.objects.get().availability_until,
+                         timezone.make_aware(datetime.combine(self.today, time.min)))
+        self.assertIn("Rebuilt 2 day(s)", out.getvalue())
+        
+        # Rebuilding is idempotent
+        call_command('backfill_availability', days=2, workers=1, stdout=out)
+        self.assertEqual(TerminalAvailability.objects.count(), 2)
+    
+    def test_dashboard_chart(self):
+        """The dashboard plots the last 7 days from the rollups"""
+        TerminalAvailability.objects.create(
+            terminal=self.terminal, customer=self.customer, day=self.today - timedelta(days=1),
+            online_seconds=43200, expected_seconds=86400
+        )
+        self.client.force_login(get_user_model().objects.create_user(username="viewer", password="testpass123"))
+        
+        response = self.client.get(reverse('dashboard'))
+        
+        self.assertEqual(response.context['chart_data'], '[null, null, null, null, null, 50.0, null]')
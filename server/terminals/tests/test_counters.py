@@ -0,0 +1,129 @@
+from datetime import timedelta
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from terminals.alerting import raise_alert
+from terminals.counters import alert_counts, fleet_counts, verify_counters
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Alert, Customer, Terminal
+from terminals.resolver import get_resolver
+from terminals.sweeper import sweep_offline
+
+
+class FleetCountersTest(TestCase):
+    """Cached fleet counters test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_resolver().clear()
+        get_liveness_store().clear()
+        self.now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer = Customer.objects.create(
+                company_name="Test Corporation",
+                contact_email="test@example.com",
+                contract_start_date=self.now.date()
+            )
+            self.terminals = [
+                Terminal.objects.create(
+                    serial_number=f"TC-200-{i}", customer=self.customer, store_name="Shibuya Store",
+                    status=status, heartbeat_interval=300, last_heartbeat=self.now
+                )
+                for i, status in enumerate(["online", "online", "offline"])
+            ]
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def counts(self):
+        return fleet_counts([self.customer.id])
+    
+    def test_reads_come_from_the_cache(self):
+        """The first read counts from the database, later ones do not query"""
+        self.assertEqual(self.counts().overall, {'total': 3, 'online': 2, 'offline': 1, 'error': 0})
+        alert_counts()
+        
+        with self.assertNumQueries(0):
+            stats = self.counts()
+            alerts = alert_counts()
+        
+        self.assertEqual(stats.customer(self.customer.id)['online'], 2)
+        self.assertEqual(alerts['total'], 0)
+    
+    def test_status_transitions(self):
+        """Flushed heartbeats, the sweeper and model saves move the counters"""
+        self.counts()
+        store = get_liveness_store()
+        with self.captureOnCommitCallbacks(execute=True):
+            store.record(self.terminals[2].id, {
+                'last_heartbeat': self.now, 'status': 'error',
+                'cpu_usage': 10, 'memory_usage': 20, 'disk_usage': 30, 'temperature': None,
+            })
+            store.flush()
+        self.assertEqual(self.counts().overall, {'total': 3, 'online': 2, 'offline': 0, 'error': 1})
+        
+        Terminal.objects.filter(id=self.terminals[0].id).update(last_heartbeat=self.now - timedelta(hours=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep_offline(self.now)
+            Terminal.objects.get(id=self.terminals[1].id).delete()
+        
+        self.assertEqual(self.counts().customer(self.customer.id), {'total': 2, 'online': 0, 'offline': 1, 'error': 1})
+    
+    def test_alert_counters_and_badge(self):
+        """Created and resolved alerts move the unresolved counts shown in the badge"""
+        self.assertEqual(alert_counts(self.customer.id)['total'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            raise_alert(terminal=self.terminals[0], alert_type='error', severity='HIGH',
+                        title='Printer', message='Paper jam')
+            raise_alert(terminal=self.terminals[1], alert_type='error', severity='CRITICAL',
+                        title='Drawer', message='Stuck')
+        self.assertEqual((alert_counts()['total'], alert_counts()['HIGH']), (2, 1))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            alert = Alert.objects.get(severity='HIGH')
+            alert.is_resolved = True
+            alert.save()
+        self.assertEqual(alert_counts(self.customer.id)['total'], 1)
+        
+        user = get_user_model().objects.create_user(username="operator", password="testpass123")
+        self.client.force_login(user)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['unread_alerts_count'], 1)
+    
+    def test_verifier_corrects_drift(self):
+        """Changes that bypass the counters are found and corrected"""
+        self.counts()
+        alert_counts()
+        Terminal.objects.filter(id=self.terminals[2].id).update(status='online')
+        
+        drift = verify_counters()
+        
+        self.assertEqual(len(drift), 4)
+        self.assertEqual(self.counts().overall['online'], 3)
+        out = StringIO()
+        with mock.patch('terminals.management.commands.verify_counters.cache_is_shared', return_value=True):
+            call_command('verify_counters', stdout=out)
+        self.assertIn('Corrected 0 counter(s)', out.getvalue())
+    
+    def test_verifier_needs_a_shared_cache(self):
+        """The command cannot reach the counters of server processes in a per-process cache"""
+        with self.assertRaisesMessage(CommandError, 'The default cache is per process'):
+            call_command('verify_counters', stdout=StringIO())
+    
+    @override_settings(TMS_COUNTERS={'VERIFY_INTERVAL': 60})
+    def test_per_process_counters_expire(self):
+        """Drift in a per-process cache lasts until the counters are counted again"""
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=1000):
+            self.counts()
+        Terminal.objects.filter(id=self.terminals[2].id).update(status='online')
+        
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=1030):
+            self.assertEqual(self.counts().overall['online'], 2)
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=1061):
+            self.assertEqual(self.counts().overall['online'], 3)
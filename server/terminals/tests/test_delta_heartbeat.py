@@ -0,0 +1,170 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.liveness import LocalLivenessBackend, get_store as get_liveness_store
+from terminals.models import Customer, Terminal, TerminalMetricSample
+from terminals.resolver import get_resolver
+
+
+class DeltaHeartbeatTest(TestCase):
+    """Delta heartbeat test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_resolver().clear()
+        get_liveness_store().clear()
+        self.client = APIClient()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=self.customer,
+            store_name="Shibuya Store"
+        )
+        self.url = reverse('agent-heartbeat')
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def full(self, seq=1, **fields):
+        return self.client.post(self.url, {
+            "serial_number": "TC-200-TEST001",
+            "seq": seq,
+            "status": "online",
+            "timestamp": "2025-11-24T12:00:00Z",
+            "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30, "temperature": 40},
+            "firmware_version": "1.0.0",
+            "agent_version": "1.0.0",
+            **fields
+        }, format='json')
+    
+    def delta(self, seq, **fields):
+        return self.client.post(self.url, {
+            "serial_number": "TC-200-TEST001",
+            "seq": seq,
+            "full": False,
+            "timestamp": "2025-11-24T12:05:00Z",
+            **fields
+        }, format='json')
+    
+    def live(self):
+        return get_liveness_store().get_many([self.terminal.id])[self.terminal.id]
+    
+    def test_delta_merges_changed_fields(self):
+        """Fields missing from a delta keep their last reported values"""
+        self.full()
+        
+        response = self.delta(2, status="error", metrics={"cpu_usage": 95})
+        
+        self.assertEqual(response.status_code, 200)
+        live = self.live()
+        self.assertEqual(live['status'], 'error')
+        self.assertEqual(
+            (live['cpu_usage'], live['memory_usage'], live['disk_usage'], live['temperature']),
+            (95, 20, 30, 40)
+        )
+        self.assertEqual(live['heartbeat_seq'], 2)
+        sample = TerminalMetricSample.objects.latest('recorded_at')
+        self.assertEqual((sample.cpu_usage, sample.memory_usage), (95, 20))
+    
+    def test_unchanged_delta_skips_database_writes(self):
+        """A delta with nothing but seq and timestamp only refreshes liveness"""
+        self.full()
+        before = self.live()['last_heartbeat']
+        
+        with self.assertNumQueries(0):
+            response = self.delta(2)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TerminalMetricSample.objects.count(), 1)
+        self.assertGreater(self.live()['last_heartbeat'], before)
+    
+    def test_identity_change_in_delta_is_written(self):
+        """Firmware reported in a delta reaches the terminal row"""
+        self.full()
+        self.delta(2, firmware_version="1.1.0")
+        
+        self.terminal.refresh_from_db()
+        self.assertEqual(self.terminal.firmware_version, "1.1.0")
+    
+    def test_gap_requests_resync(self):
+        """A missed seq or unknown state gets 409 until a full heartbeat"""
+        response = self.delta(1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['error']['code'], 'SYNC_001')
+        
+        self.full(seq=5)
+        self.assertEqual(self.delta(7).status_code, 409)
+        self.assertEqual(self.delta(6).status_code, 200)
+    
+    def test_heartbeat_without_seq_ends_delta_session(self):
+        """A legacy full heartbeat clears the seq, so old deltas cannot continue"""
+        self.full(seq=1)
+        self.client.post(self.url, {
+            "serial_number": "TC-200-TEST001",
+            "status": "online",
+            "timestamp": "2025-11-24T12:00:00Z",
+            "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30},
+            "firmware_version": "1.0.0",
+            "agent_version": "1.0.0"
+        }, format='json')
+        
+        self.assertEqual(self.delta(2).status_code, 409)
+    
+    def test_delta_requires_seq(self):
+        """Deltas without seq are rejected"""
+        self.full()
+        response = self.client.post(self.url, {
+            "serial_number": "TC-200-TEST001",
+            "full": False,
+            "timestamp": "2025-11-24T12:05:00Z"
+        }, format='json')
+        
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('seq', response.data['error']['field_errors'])
+    
+    def batch(self, **fields):
+        return self.client.post(reverse('agent-heartbeat-batch'), {"heartbeats": [{
+            "serial_number": "TC-200-TEST001",
+            "status": "online",
+            "timestamp": "2025-11-24T12:10:00Z",
+            "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30},
+            "firmware_version": "1.0.0",
+            "agent_version": "1.0.0",
+            **fields
+        }]}, format='json')
+    
+    def test_batched_heartbeat_records_seq(self):
+        """A batched heartbeat starts a delta session with its seq, or ends it without one"""
+        self.full(seq=1)
+        self.assertEqual(self.batch(seq=5).status_code, 200)
+        self.assertEqual(self.delta(2).status_code, 409)
+        self.assertEqual(self.delta(6).status_code, 200)
+        
+        self.batch()
+        self.assertIsNone(self.live()['heartbeat_seq'])
+        self.assertEqual(self.delta(7).status_code, 409)
+    
+    def test_delta_in_another_process_resyncs(self):
+        """With the local backend a worker without the session asks for a full heartbeat"""
+        store = get_liveness_store()
+        this_process = store.backend
+        self.full(seq=1)
+        
+        store.backend = LocalLivenessBackend()  # another worker's store
+        try:
+            self.assertEqual(self.delta(2).status_code, 409)
+            self.full(seq=3)
+            self.assertEqual(self.delta(4).status_code, 200)
+        finally:
+            store.backend = this_process
+        
+        # Back in the first worker, seq 1 is stale: deltas never apply to it
+        response = self.delta(5)
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('expected seq 2', response.data['error']['details'])
@@ -0,0 +1,326 @@
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.deployments import (
+    evaluate_wave, forget_due_deployments, materialize_deployments, materialize_for, wave_limits, wave_of
+)
+from terminals.dispatch import PENDING_MARKER_KEY
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Customer, Deployment, FirmwareVersion, Terminal, UpdateTask
+from terminals.resolver import get_resolver
+
+
+class DeploymentTest(TestCase):
+    """Firmware deployment campaign test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_resolver().clear()
+        get_liveness_store().clear()
+        forget_due_deployments()
+        self.user = get_user_model().objects.create_user(username="operator", password="testpass123")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.other_customer = Customer.objects.create(
+            company_name="Other Corporation",
+            contact_email="other@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.firmware = FirmwareVersion.objects.create(
+            version="2.1.0",
+            file_name="TC-200_2.1.0.bin",
+            file_size=1024,
+            file_hash="0" * 64,
+            released_date=timezone.now().date()
+        )
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+        forget_due_deployments()
+    
+    def make_terminals(self, count, prefix, customer=None):
+        return [
+            Terminal.objects.create(
+                serial_number=f"{prefix}{i:03d}",
+                customer=customer or self.customer,
+                store_name=f"Store {i}"
+            )
+            for i in range(count)
+        ]
+    
+    def deploy(self, **payload):
+        # One wave unless a test stages the rollout
+        payload.setdefault('canary_percent', 100)
+        return self.client.post(reverse('firmware-deploy', args=[self.firmware.id]), payload, format='json')
+    
+    def heartbeat(self, serial_number):
+        return APIClient().post(reverse('agent-heartbeat'), {
+            "serial_number": serial_number,
+            "status": "online",
+            "timestamp": "2025-11-24T12:00:00Z",
+            "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30},
+            "firmware_version": "2.0.0",
+            "agent_version": "1.0.0"
+        }, format='json')
+    
+    def report(self, task, result_status):
+        return APIClient().post(reverse('agent-command-result', args=[task.id]), {
+            "serial_number": task.terminal.serial_number,
+            "command_id": task.id,
+            "status": result_status,
+            "started_at": "2025-11-24T12:00:00Z",
+            "completed_at": "2025-11-24T12:05:00Z",
+            "result": {"message": "Checksum mismatch"}
+        }, format='json')
+    
+    def test_deploy_cost_is_constant(self):
+        """Deploying writes one row however many terminals are targeted"""
+        self.make_terminals(3, "TC-200-A")
+        with self.assertNumQueries(3):  # firmware, target aggregate, insert
+            small = self.deploy(target_terminals="all")
+        
+        self.make_terminals(30, "TC-200-B")
+        with self.assertNumQueries(3):
+            large = self.deploy(target_terminals="all")
+        
+        self.assertEqual(small.status_code, 201)
+        self.assertEqual((small.data['total_terminals'], large.data['total_terminals']), (3, 33))
+        self.assertEqual(large.data['status'], 'active')
+        self.assertFalse(UpdateTask.objects.exists())
+    
+    def test_invalid_target(self):
+        """Unknown selectors are rejected"""
+        response = self.deploy(target_terminals="everyone")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error']['code'], 'VAL_001')
+    
+    def test_heartbeat_materializes_and_delivers(self):
+        """A targeted terminal gets its task and the command on its next heartbeat"""
+        terminal, = self.make_terminals(1, "TC-200-A")
+        deployment_id = self.deploy(target_terminals="all").data['deployment_id']
+        
+        response = self.heartbeat(terminal.serial_number)
+        self.heartbeat(terminal.serial_number)
+        
+        commands = response.data['commands']
+        self.assertEqual([(c['type'], c['parameters']['version']) for c in commands], [('firmware', "2.1.0")])
+        task = UpdateTask.objects.get()
+        self.assertEqual((task.deployment_id, task.terminal_id, task.status), (deployment_id, terminal.id, 'running'))
+    
+    def test_customer_selector_and_late_terminals(self):
+        """Only terminals matching the selector at deploy time are targeted"""
+        ours, = self.make_terminals(1, "TC-200-A")
+        theirs, = self.make_terminals(1, "TC-200-B", customer=self.other_customer)
+        self.deploy(target_terminals="customer", customer_ids=[self.customer.id])
+        late, = self.make_terminals(1, "TC-200-C")
+        
+        for terminal in (ours, theirs, late):
+            self.heartbeat(terminal.serial_number)
+        
+        self.assertEqual(list(UpdateTask.objects.values_list('terminal_id', flat=True)), [ours.id])
+    
+    def test_scheduled_deployment_waits(self):
+        """Nothing is materialized before the scheduled start"""
+        terminal, = self.make_terminals(1, "TC-200-A")
+        start = timezone.now() + timedelta(hours=1)
+        response = self.deploy(target_terminals="all", schedule={"type": "scheduled", "start_at": start.isoformat()})
+        self.assertEqual(response.data['status'], 'scheduled')
+        ref = get_resolver().resolve(terminal.serial_number)
+        
+        self.assertEqual(materialize_for([ref]), [])
+        self.assertEqual(materialize_for([ref], start + timedelta(seconds=1)), [terminal.id])
+        self.assertEqual(Deployment.objects.get().status, 'active')
+    
+    @override_settings(TMS_DEPLOYMENTS={**settings.TMS_DEPLOYMENTS, 'BATCH_SIZE': 4, 'CONTACT_MARKER_TTL': 60})
+    def test_worker_materializes_in_batches_and_completes(self):
+        """The worker fills in the tasks contact did not create, then closes the deployment"""
+        terminals = self.make_terminals(10, "TC-200-A")
+        self.deploy(target_terminals="all")
+        self.heartbeat(terminals[0].serial_number)
+        
+        result = materialize_deployments()
+        
+        self.assertEqual((result['deployments'], result['tasks']), (1, 9))
+        self.assertEqual(UpdateTask.objects.filter(deployment__isnull=False).count(), 10)
+        self.assertIsNotNone(Deployment.objects.get().materialized_at)
+        self.assertEqual(materialize_deployments()['tasks'], 0)
+        
+        UpdateTask.objects.update(status='completed')
+        self.assertEqual(materialize_deployments()['completed'], 1)
+        self.assertEqual(Deployment.objects.get().status, 'completed')
+    
+    def test_progress_is_one_query(self):
+        """Progress comes from a single aggregate query"""
+        terminals = self.make_terminals(4, "TC-200-A")
+        deployment_id = self.deploy(target_terminals="all").data['deployment_id']
+        for terminal in terminals[:3]:
+            self.heartbeat(terminal.serial_number)
+        UpdateTask.objects.filter(terminal=terminals[0]).update(status='completed')
+        UpdateTask.objects.filter(terminal=terminals[1]).update(status='failed')
+        
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('deployment-detail', args=[deployment_id]))
+        
+        progress = response.data['progress']
+        self.assertEqual(
+            (progress['total'], progress['not_started'], progress['running'], progress['completed'], progress['failed']),
+            (4, 1, 1, 1, 1)
+        )
+        self.assertEqual(progress['percent'], 50.0)
+    
+    def test_wave_assignment(self):
+        """Waves grow from the canary and split any id range evenly"""
+        self.assertEqual([round(limit, 6) for limit in wave_limits(10, 2)], [0.1, 0.3, 0.7, 1.0])
+        self.assertEqual(wave_limits(100, 2), (1.0,))
+        
+        deployment = Deployment(canary_percent=10, wave_growth=2)
+        sizes = [0] * 4
+        for terminal_id in range(1000, 1100):
+            sizes[wave_of(deployment, terminal_id)] += 1
+        for size, expected in zip(sizes, [10, 20, 40, 30]):
+            self.assertAlmostEqual(size, expected, delta=1)
+    
+    def test_only_canary_gets_tasks(self):
+        """Contact creates tasks for terminals of open waves only"""
+        terminals = self.make_terminals(30, "TC-200-A")
+        response = self.deploy(target_terminals="all", canary_percent=10, wave_growth=2)
+        self.assertEqual(response.data['waves'], 4)
+        deployment = Deployment.objects.get()
+        
+        for terminal in terminals:
+            self.heartbeat(terminal.serial_number)
+        
+        canary = {terminal.id for terminal in terminals if wave_of(deployment, terminal.id) == 0}
+        self.assertTrue(canary)
+        self.assertEqual(set(UpdateTask.objects.values_list('terminal_id', flat=True)), canary)
+        self.assertEqual(set(UpdateTask.objects.values_list('wave', flat=True)), {0})
+    
+    def test_concurrent_downloads_are_capped(self):
+        """No more than max_concurrent tasks run; a finished one frees a slot"""
+        terminals = self.make_terminals(4, "TC-200-A")
+        self.deploy(target_terminals="all", max_concurrent=2)
+        
+        delivered = [bool(self.heartbeat(terminal.serial_number).data['commands']) for terminal in terminals]
+        
+        self.assertEqual(delivered, [True, True, False, False])
+        self.assertEqual(UpdateTask.objects.filter(status='running').count(), 2)
+        # Waiting terminals skip the task query until the slot retry expires
+        waiting = terminals[2]
+        self.assertIs(cache.get(PENDING_MARKER_KEY.format(waiting.id)), False)
+        
+        self.report(UpdateTask.objects.get(terminal=terminals[0]), 'completed')
+        cache.delete(PENDING_MARKER_KEY.format(waiting.id))
+        self.assertEqual(len(self.heartbeat(waiting.serial_number).data['commands']), 1)
+        self.assertFalse(self.heartbeat(terminals[3].serial_number).data['commands'])
+    
+    def test_failing_wave_pauses_rollout(self):
+        """Failures above the threshold pause the rollout until it is resumed"""
+        terminals = self.make_terminals(6, "TC-200-A")
+        deployment_id = self.deploy(target_terminals="all", max_failure_rate=10).data['deployment_id']
+        materialize_deployments()
+        UpdateTask.objects.update(max_retries=0)
+        for terminal in terminals[:5]:
+            self.heartbeat(terminal.serial_number)
+        
+        tasks = list(UpdateTask.objects.filter(status='running').select_related('terminal').order_by('id'))
+        for task in tasks[:4]:
+            self.report(task, 'completed')
+        self.assertEqual(Deployment.objects.get().status, 'active')
+        self.report(tasks[4], 'failed')
+        
+        deployment = Deployment.objects.get()
+        self.assertEqual(deployment.status, 'paused')
+        self.assertIn('1 of 5 updates failed', deployment.paused_reason)
+        self.assertFalse(self.heartbeat(terminals[5].serial_number).data['commands'])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('deployment-resume', args=[deployment_id]))
+        self.assertEqual(response.data['status'], 'active')
+        self.assertEqual(len(self.heartbeat(terminals[5].serial_number).data['commands']), 1)
+        self.assertEqual(self.client.post(reverse('deployment-resume', args=[deployment_id])).status_code, 422)
+    
+    def test_finished_wave_opens_next_after_soak(self):
+        """The next wave opens once the current one finished and soaked"""
+        terminals = self.make_terminals(30, "TC-200-A")
+        self.deploy(target_terminals="all", canary_percent=10, schedule={"interval_minutes": 30})
+        materialize_deployments()
+        canary = list(UpdateTask.objects.select_related('terminal'))
+        self.assertTrue(canary)
+        for task in canary:
+            self.heartbeat(task.terminal.serial_number)
+            self.report(task, 'completed')
+        
+        deployment = Deployment.objects.get()
+        self.assertEqual(deployment.current_wave, 0)
+        self.assertEqual(evaluate_wave(deployment, timezone.now() + timedelta(minutes=31)), 'advanced')
+        
+        result = materialize_deployments()
+        deployment = Deployment.objects.get()
+        second = {terminal.id for terminal in terminals if wave_of(deployment, terminal.id) == 1}
+        self.assertEqual(deployment.current_wave, 1)
+        self.assertEqual(result['tasks'], len(second))
+        self.assertEqual(set(UpdateTask.objects.filter(wave=1).values_list('terminal_id', flat=True)), second)
+        self.assertIsNone(deployment.materialized_at)
+    
+    def test_offline_terminal_does_not_stall_wave(self):
+        """A wave missing an offline terminal pauses at its deadline, or moves on past the threshold"""
+        self.make_terminals(30, "TC-200-A")
+        self.deploy(target_terminals="all", canary_percent=10)
+        materialize_deployments()
+        canary = list(UpdateTask.objects.select_related('terminal').order_by('id'))
+        self.assertGreater(len(canary), 1)
+        offline = canary[0]
+        for task in canary[1:]:
+            self.heartbeat(task.terminal.serial_number)
+            self.report(task, 'completed')
+        
+        timeout = timedelta(seconds=settings.TMS_DEPLOYMENTS['WAVE_TIMEOUT'])
+        deployment = Deployment.objects.get()
+        self.assertIsNone(evaluate_wave(deployment, timezone.now() + timedelta(hours=1)))
+        self.assertEqual(evaluate_wave(deployment, timezone.now() + timeout), 'paused')
+        deployment = Deployment.objects.get()
+        self.assertIn(f'1 of {len(canary)} updates unfinished', deployment.paused_reason)
+        
+        self.client.post(reverse('deployment-resume', args=[deployment.id]))
+        deployment = Deployment.objects.get()
+        with override_settings(TMS_DEPLOYMENTS={**settings.TMS_DEPLOYMENTS, 'WAVE_COMPLETION_PERCENT': 50}):
+            self.assertIsNone(evaluate_wave(deployment, timezone.now() + timedelta(hours=1)))
+            self.assertEqual(evaluate_wave(deployment, timezone.now() + timeout), 'advanced')
+        self.assertEqual(Deployment.objects.get().current_wave, 1)
+        # The straggler still gets its update when it comes back
+        self.assertEqual(UpdateTask.objects.get(id=offline.id).status, 'pending')
+        self.assertEqual(len(self.heartbeat(offline.terminal.serial_number).data['commands']), 1)
+    
+    def test_stale_running_task_is_reclaimed(self):
+        """A task without a result frees its slot and is requeued, then failed once out of retries"""
+        terminals = self.make_terminals(2, "TC-200-A")
+        self.deploy(target_terminals="all", max_concurrent=1)
+        self.assertEqual(len(self.heartbeat(terminals[0].serial_number).data['commands']), 1)
+        self.assertFalse(self.heartbeat(terminals[1].serial_number).data['commands'])
+        
+        stale = timezone.now() - timedelta(seconds=settings.TMS_DEPLOYMENTS['TASK_TIMEOUT'] + 1)
+        UpdateTask.objects.filter(terminal=terminals[0]).update(started_at=stale)
+        cache.delete(PENDING_MARKER_KEY.format(terminals[1].id))
+        self.assertEqual(len(self.heartbeat(terminals[1].serial_number).data['commands']), 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            result = materialize_deployments()
+        self.assertEqual((result['requeued'], result['failed']), (1, 0))
+        task = UpdateTask.objects.get(terminal=terminals[0])
+        self.assertEqual((task.status, task.retry_count), ('pending', 1))
+        self.assertIn('No result', task.error_message)
+        
+        UpdateTask.objects.filter(id=task.id).update(status='running', started_at=stale, max_retries=1)
+        result = materialize_deployments()
+        self.assertEqual((result['requeued'], result['failed']), (0, 1))
+        self.assertEqual(UpdateTask.objects.get(id=task.id).status, 'failed')
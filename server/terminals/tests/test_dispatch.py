@@ -0,0 +1,124 @@
+from datetime import date
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.dispatch import claim_commands, mark_pending
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Customer, FirmwareVersion, Terminal, UpdateTask
+
+
+class CommandDispatchTest(TestCase):
+    """Heartbeat command dispatch test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_liveness_store().clear()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=self.customer,
+            store_name="Shibuya Store"
+        )
+        self.firmware = FirmwareVersion.objects.create(
+            version="2.0.0",
+            file_name="tc200-2.0.0.bin",
+            file_size=1024,
+            file_hash="ab" * 32,
+            file_url="https://example.com/tc200-2.0.0.bin",
+            released_date=date(2025, 11, 1)
+        )
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def add_tasks(self, count):
+        for priority in range(count):
+            UpdateTask.objects.create(
+                terminal=self.terminal,
+                task_type='firmware',
+                firmware_version=self.firmware,
+                priority=priority
+            )
+        mark_pending([self.terminal.id])
+    
+    def heartbeat(self):
+        return APIClient().post(reverse('agent-heartbeat'), {
+            "serial_number": "TC-200-TEST001",
+            "status": "online",
+            "timestamp": "2025-11-24T12:00:00Z",
+            "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30},
+            "firmware_version": "1.0.0",
+            "agent_version": "1.0.0"
+        }, format='json')
+    
+    def test_claimed_tasks_are_running_and_not_redispatched(self):
+        """A claimed task is handed out exactly once"""
+        self.add_tasks(2)
+        
+        first = claim_commands([self.terminal.id])[self.terminal.id]
+        second = claim_commands([self.terminal.id])[self.terminal.id]
+        
+        self.assertEqual(len(first), 2)
+        self.assertEqual(second, [])
+        self.assertEqual(UpdateTask.objects.filter(status='running').count(), 2)
+        self.assertEqual(first[0]['parameters']['version'], "2.0.0")
+        self.assertEqual(first[0]['parameters']['checksum'], f"sha256:{'ab' * 32}")
+    
+    def test_claim_is_limited_per_terminal(self):
+        """At most five commands are claimed per heartbeat, in priority order"""
+        self.add_tasks(7)
+        commands = claim_commands([self.terminal.id])[self.terminal.id]
+        self.assertEqual(len(commands), 5)
+        self.assertEqual(UpdateTask.objects.filter(status='pending').count(), 2)
+    
+    def test_heartbeat_dispatch_query_count_is_constant(self):
+        """Heartbeat cost is the same for one command and for five"""
+        self.heartbeat()
+        self.add_tasks(1)
+        with CaptureQueriesContext(connection) as one:
+            response = self.heartbeat()
+        self.assertEqual(len(response.data['commands']), 1)
+        
+        self.add_tasks(5)
+        with CaptureQueriesContext(connection) as five:
+            response = self.heartbeat()
+        self.assertEqual(len(response.data['commands']), 5)
+        
+        self.assertEqual(len(one.captured_queries), len(five.captured_queries))
+    
+    def test_idle_heartbeat_skips_task_query(self):
+        """Once a terminal is known idle, heartbeats do not touch UpdateTask"""
+        self.heartbeat()
+        
+        with CaptureQueriesContext(connection) as ctx:
+            self.heartbeat()
+        
+        self.assertFalse(any('terminals_updatetask' in q['sql'] for q in ctx.captured_queries))
+    
+    def test_unknown_marker_falls_back_to_database(self):
+        """A lost cache never hides queued commands"""
+        self.add_tasks(1)
+        cache.clear()
+        self.assertEqual(len(self.heartbeat().data['commands']), 1)
+    
+    def test_command_api_sets_marker(self):
+        """Commands queued through the API wake up an idle terminal"""
+        self.heartbeat()
+        user = get_user_model().objects.create_user(username="operator", password="testpass123")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(reverse('terminal-commands', args=[self.terminal.id]), {"type": "reboot"}, format='json')
+        
+        commands = self.heartbeat().data['commands']
+        self.assertEqual([command['type'] for command in commands], ['reboot'])
@@ -0,0 +1,106 @@
+import hashlib
+import tempfile
+from pathlib import Path
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.dispatch import build_command
+from terminals.downloads import parse_range
+from terminals.models import FirmwareVersion, UpdateTask
+
+IMAGE = bytes(range(256)) * 40
+
+
+class FirmwareDownloadTest(TestCase):
+    """Firmware download endpoint test"""
+    
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(TMS_FIRMWARE_DOWNLOADS={'ROOT': self.root.name, 'ACCEL_REDIRECT': ''})
+        self.settings.enable()
+        Path(self.root.name, "TC-200_2.1.0.bin").write_bytes(IMAGE)
+        self.firmware = FirmwareVersion.objects.create(
+            version="2.1.0",
+            file_name="TC-200_2.1.0.bin",
+            file_size=len(IMAGE),
+            file_hash=hashlib.sha256(IMAGE).hexdigest(),
+            released_date=timezone.now().date()
+        )
+        self.etag = f'"{self.firmware.file_hash}"'
+        self.url = reverse('agent-firmware-download', args=[self.firmware.id])
+    
+    def tearDown(self):
+        self.settings.disable()
+        self.root.cleanup()
+    
+    def get(self, **headers):
+        return APIClient().get(self.url, **headers)
+    
+    def test_full_download(self):
+        """The whole image is streamed with its hash as ETag"""
+        response = self.get()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), IMAGE)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], str(len(IMAGE)))
+    
+    def test_range_resumes(self):
+        """Open-ended, bounded and suffix ranges get 206 with the right bytes"""
+        for header, expected in [("bytes=1000-", IMAGE[1000:]), ("bytes=10-19", IMAGE[10:20]),
+                                 ("bytes=-100", IMAGE[-100:])]:
+            response = self.get(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join(response.streaming_content), expected)
+            self.assertEqual(response['Content-Length'], str(len(expected)))
+        self.assertEqual(response['Content-Range'], f'bytes {len(IMAGE) - 100}-{len(IMAGE) - 1}/{len(IMAGE)}')
+    
+    def test_unsatisfiable_range(self):
+        """Ranges past the end get 416 with the image size"""
+        response = self.get(HTTP_RANGE=f"bytes={len(IMAGE)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(IMAGE)}')
+    
+    def test_conditional_requests(self):
+        """If-None-Match short-circuits, a stale If-Range sends the whole image"""
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=self.etag).status_code, 304)
+        
+        stale = self.get(HTTP_RANGE="bytes=100-", HTTP_IF_RANGE='"0000"')
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(b''.join(stale.streaming_content), IMAGE)
+        
+        fresh = self.get(HTTP_RANGE="bytes=100-", HTTP_IF_RANGE=self.etag)
+        self.assertEqual(fresh.status_code, 206)
+    
+    def test_missing_or_escaping_file(self):
+        """Images not under the download root are not found"""
+        FirmwareVersion.objects.filter(pk=self.firmware.pk).update(file_name="../outside.bin")
+        self.assertEqual(self.get().status_code, 404)
+        self.assertEqual(APIClient().get(reverse('agent-firmware-download', args=[999999])).status_code, 404)
+    
+    def test_accel_redirect(self):
+        """With ACCEL_REDIRECT, nginx is told to send the file"""
+        with override_settings(TMS_FIRMWARE_DOWNLOADS={'ROOT': self.root.name, 'ACCEL_REDIRECT': '/protected/'}):
+            response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/TC-200_2.1.0.bin')
+        self.assertEqual(response.content, b'')
+    
+    def test_parse_range(self):
+        """Malformed and multi-range headers fall back to the whole file"""
+        self.assertIsNone(parse_range("bytes=0-10,20-30", 100))
+        self.assertIsNone(parse_range("items=0-10", 100))
+        self.assertEqual(parse_range("bytes=90-200", 100), (90, 99))
+        with self.assertRaises(ValueError):
+            parse_range("bytes=-0", 100)
+    
+    def test_command_points_to_endpoint(self):
+        """Images without an external URL are downloaded from the server"""
+        task = UpdateTask(task_type='firmware', firmware_version=self.firmware)
+        self.assertEqual(build_command(task)['parameters']['url'], self.url)
+        
+        self.firmware.file_url = "https://cdn.example.com/TC-200_2.1.0.bin"
+        self.assertEqual(build_command(task)['parameters']['url'], self.firmware.file_url)
@@ -0,0 +1,103 @@
+import hashlib
+import tempfile
+import tracemalloc
+from pathlib import Path
+from django.contrib.auth import get_user_model
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import reverse
+from terminals.blobstore import get_blob_store
+from terminals.models import FirmwareVersion
+from terminals.web_views import firmware_upload_view
+
+
+class FirmwareUploadTest(TestCase):
+    """Streaming firmware upload test"""
+    
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(TMS_FIRMWARE_DOWNLOADS={'ROOT': self.root.name, 'ACCEL_REDIRECT': ''})
+        self.settings.enable()
+        self.user = get_user_model().objects.create_user(username="operator", password="testpass123")
+        self.client.force_login(self.user)
+    
+    def tearDown(self):
+        self.settings.disable()
+        self.root.cleanup()
+    
+    def upload(self, version, content, name="TC-200.bin"):
+        return self.client.post(reverse('firmware_upload'), {
+            "version": version,
+            "model": "TC-200",
+            "release_notes": "Fixes",
+            "file": SimpleUploadedFile(name, content),
+        })
+    
+    def stored_blobs(self):
+        return sorted(path.name for path in Path(self.root.name, 'sha256').rglob('*') if path.is_file())
+    
+    def test_upload_registers_firmware(self):
+        """Hash and size are computed from the stream and the blob is stored by hash"""
+        content = b"firmware image " * 10000
+        digest = hashlib.sha256(content).hexdigest()
+        
+        response = self.upload("2.1.0", content)
+        
+        self.assertRedirects(response, reverse('firmware_list'), fetch_redirect_response=False)
+        firmware = FirmwareVersion.objects.get()
+        self.assertEqual((firmware.file_hash, firmware.file_size), (digest, len(content)))
+        self.assertEqual((firmware.file_name, firmware.created_by), ("TC-200.bin", "operator"))
+        self.assertEqual(get_blob_store().path(digest).read_bytes(), content)
+        self.assertEqual(list(Path(self.root.name, 'tmp').iterdir()), [])
+        
+        download = self.client.get(reverse('agent-firmware-download', args=[firmware.id]))
+        self.assertEqual(b''.join(download.streaming_content), content)
+    
+    def test_identical_images_are_stored_once(self):
+        """A second version with the same bytes reuses the blob"""
+        self.upload("2.1.0", b"same bytes")
+        self.upload("2.1.1", b"same bytes")
+        
+        self.assertEqual(FirmwareVersion.objects.count(), 2)
+        self.assertEqual(self.stored_blobs(), [hashlib.sha256(b"same bytes").hexdigest()])
+    
+    def test_rejected_upload_leaves_nothing(self):
+        """A duplicate version or a missing field stores no row and no new blob"""
+        self.upload("2.1.0", b"first")
+        self.upload("2.1.0", b"second")
+        self.upload("", b"third")
+        
+        self.assertEqual(list(FirmwareVersion.objects.values_list('file_hash', flat=True)),
+                         [hashlib.sha256(b"first").hexdigest()])
+        self.assertEqual(self.stored_blobs(), [hashlib.sha256(b"first").hexdigest()])
+        self.assertEqual(list(Path(self.root.name, 'tmp').iterdir()), [])
+    
+    @override_settings(TMS_FIRMWARE_MAX_UPLOAD_BYTES=1024)
+    def test_oversized_upload_is_aborted(self):
+        """Images over the limit are dropped while streaming"""
+        self.upload("2.1.0", b"x" * 4096)
+        
+        self.assertFalse(FirmwareVersion.objects.exists())
+        self.assertEqual(list(Path(self.root.name, 'tmp').iterdir()), [])
+    
+    def test_memory_stays_flat(self):
+        """A large image is streamed chunk by chunk, not held in memory"""
+        content = b"\x5a" * (16 * 1024 * 1024)
+        body = encode_multipart(BOUNDARY, {"version": "3.0.0", "file": SimpleUploadedFile("big.bin", content)})
+        request = RequestFactory().generic('POST', reverse('firmware_upload'), body, MULTIPART_CONTENT)
+        request.user = self.user
+        request._messages = CookieStorage(request)
+        request._dont_enforce_csrf_checks = True
+        del body
+        
+        tracemalloc.start()
+        try:
+            firmware_upload_view(request)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        
+        self.assertEqual(FirmwareVersion.objects.get().file_size, len(content))
+        self.assertLess(peak, 2 * 1024 * 1024)
@@ -0,0 +1,188 @@
+import fcntl
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals import liveness
+from terminals.liveness import LivenessFlusher, LocalLivenessBackend, claim_process, get_store, start_flusher
+from terminals.models import Customer, Terminal
+
+
+class LivenessStoreTest(TestCase):
+    """Liveness store test"""
+    
+    def setUp(self):
+        self.store = get_store()
+        self.store.clear()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=self.customer,
+            store_name="Shibuya Store",
+            status="offline"
+        )
+    
+    def tearDown(self):
+        self.store.clear()
+    
+    def record(self, **overrides):
+        values = {
+            'last_heartbeat': timezone.now(),
+            'status': 'online',
+            'cpu_usage': 45,
+            'memory_usage': 60,
+            'disk_usage': 30,
+            'temperature': 40,
+        }
+        values.update(overrides)
+        self.store.record(self.terminal.id, values)
+    
+    def test_record_does_not_write_database(self):
+        """Recorded values stay in the store until flushed"""
+        self.record()
+        self.terminal.refresh_from_db()
+        self.assertEqual(self.terminal.status, "offline")
+        self.assertIsNone(self.terminal.last_heartbeat)
+    
+    def test_flush_coalesces_writes(self):
+        """Only the newest values are written, with a single query"""
+        self.record(cpu_usage=10)
+        self.record(cpu_usage=20)
+        
+        with CaptureQueriesContext(connection) as queries:
+            flushed = self.store.flush()
+        
+        # Besides the previous values read for availability accounting
+        writes = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(flushed, 1)
+        self.terminal.refresh_from_db()
+        self.assertEqual(self.terminal.status, "online")
+        self.assertEqual(self.terminal.cpu_usage, 20)
+        self.assertEqual(self.store.flush(), 0)
+    
+    def test_apply_overlays_unflushed_values(self):
+        """Readers see values newer than the database"""
+        self.record(cpu_usage=77)
+        terminal = Terminal.objects.get(id=self.terminal.id)
+        self.store.apply([terminal])
+        self.assertEqual(terminal.cpu_usage, 77)
+        self.assertEqual(terminal.status, "online")
+    
+    def test_terminal_api_reads_through_store(self):
+        """Terminal detail API shows unflushed heartbeat values"""
+        user = get_user_model().objects.create_user(username="viewer", password="testpass123")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        self.record(cpu_usage=88)
+        
+        response = client.get(reverse('terminal-detail', args=[self.terminal.id]))
+        
+        self.assertEqual(response.data['status'], 'online')
+        self.assertEqual(response.data['metrics']['cpu_usage'], 88)
+    
+    def test_local_backend_expires_quiet_entries(self):
+        """Flushed entries older than the TTL are dropped, unflushed ones kept"""
+        backend = LocalLivenessBackend(ttl=0)
+        backend.write_many({1: {'status': 'online'}, 2: {'status': 'online'}})
+        self.assertEqual(set(backend.pop_dirty()), {1, 2})
+        backend.write_many({2: {'status': 'error'}})
+        
+        self.assertEqual(backend.pop_dirty(), {2: {'status': 'error'}})
+        self.assertEqual(backend.read_many([1, 2]), {2: {'status': 'error'}})
+        backend.pop_dirty()
+        self.assertEqual(backend.read_many([1, 2]), {})
+    
+    def test_local_store_serves_one_process(self):
+        """Flushing or sweeping beside the process that owns the local store is refused"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'liveness.lock')
+            with override_settings(TMS_LIVENESS={**settings.TMS_LIVENESS, 'BACKEND': 'local', 'LOCK_FILE': path}):
+                with open(path, 'a') as other_process:
+                    fcntl.flock(other_process, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    with self.assertRaises(ImproperlyConfigured):
+                        claim_process()
+                    for command in ('flush_liveness', 'sweep_offline'):
+                        with self.assertRaisesMessage(CommandError, 'Another process owns the local liveness store'):
+                            call_command(command, stdout=io.StringIO())
+                
+                call_command('flush_liveness', stdout=io.StringIO())
+                with open(path, 'a') as other_process, self.assertRaises(BlockingIOError):
+                    fcntl.flock(other_process, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    
+    def test_flusher_runs_deployment_passes(self):
+        """The owning process advances rollouts without a separate worker"""
+        called = threading.Event()
+        flusher = LivenessFlusher(self.store, 0.01, deployment_interval=0.01)
+        with mock.patch('terminals.deployments.materialize_deployments', side_effect=called.set):
+            flusher.start()
+            try:
+                self.assertTrue(called.wait(5))
+            finally:
+                flusher.stop()
+                flusher.join(5)
+    
+    def test_other_processes_write_through(self):
+        """A server process that does not own the local store writes heartbeats to the database"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'liveness.lock')
+            with override_settings(TMS_LIVENESS={**settings.TMS_LIVENESS, 'BACKEND': 'local', 'LOCK_FILE': path}):
+                with open(path, 'a') as other_process:
+                    fcntl.flock(other_process, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self.assertIsNone(start_flusher())
+                    self.assertIsNone(liveness._flusher)
+                    self.store = get_store()
+                    self.assertTrue(self.store.write_through)
+                    
+                    self.record()
+                    
+                    self.terminal.refresh_from_db()
+                    self.assertEqual(self.terminal.status, 'online')
+                    self.assertEqual(self.store.backend.dirty_ids(), set())
+    
+    def test_server_starts_several_processes(self):
+        """Several WSGI workers start without Redis; one owns the store, the others write through"""
+        with tempfile.TemporaryDirectory() as directory:
+            env = {key: value for key, value in os.environ.items() if key != 'REDIS_URL'}
+            env.update({
+                'DJANGO_SETTINGS_MODULE': 'tms_server.settings',
+                'TMS_LIVENESS_BACKEND': 'local',
+                'TMS_LIVENESS_LOCK_FILE': os.path.join(directory, 'liveness.lock'),
+            })
+            script = (
+                'import sys, tms_server.wsgi; from terminals.liveness import get_store; '
+                'print(get_store().write_through, flush=True); sys.stdin.read()'
+            )
+            workers = [
+                subprocess.Popen(
+                    [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env,
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+                )
+                for _ in range(2)
+            ]
+            try:
+                started = [worker.stdout.readline().strip() for worker in workers]
+            finally:
+                for worker in workers:
+                    worker.communicate('', timeout=30)
+            
+            self.assertEqual(sorted(started), ['False', 'True'])
+            self.assertEqual([worker.returncode for worker in workers], [0, 0])
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import NoReverseMatch, path, reverse
+from django.utils import timezone
+from terminals import async_views
+from terminals.dispatch import mark_pending
+from terminals.models import Customer, Terminal, UpdateTask
+from terminals.resolver import get_resolver
+from terminals.throttling import get_bucket_store
+
+# terminals.urls routes the long-poll only with TMS_AGENT_ASYNC_VIEWS (ASGI)
+urlpatterns = [
+    path('agent/commands/wait', async_views.agent_command_wait_view, name='agent-command-wait'),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__, TMS_COMMAND_WAIT={'MAX_WAIT': 10, 'POLL_INTERVAL': 30})
+class CommandWaitTest(TestCase):
+    """Long-poll command delivery test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_resolver().clear()
+        get_bucket_store().clear()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=self.customer,
+            store_name="Shibuya Store"
+        )
+        self.url = reverse('agent-command-wait')
+    
+    def queue_reboot(self):
+        UpdateTask.objects.create(terminal=self.terminal, task_type='reboot')
+        mark_pending([self.terminal.id])
+    
+    async def test_returns_queued_command_immediately(self):
+        """Commands already queued are returned without waiting"""
+        await sync_to_async(self.queue_reboot)()
+        
+        response = await self.async_client.get(self.url, {'serial_number': "TC-200-TEST001"})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([command['type'] for command in response.json()['commands']], ['reboot'])
+    
+    async def test_times_out_with_empty_list(self):
+        """An idle terminal gets an empty list once the timeout passes"""
+        response = await self.async_client.get(self.url, {'serial_number': "TC-200-TEST001", 'timeout': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['commands'], [])
+    
+    async def test_enqueue_wakes_parked_request(self):
+        """A command queued while the agent waits is delivered within seconds"""
+        started = time.monotonic()
+        request = asyncio.ensure_future(
+            self.async_client.get(self.url, {'serial_number': "TC-200-TEST001", 'timeout': 10})
+        )
+        await asyncio.sleep(0.3)
+        await sync_to_async(self.queue_reboot)()
+        
+        response = await request
+        
+        self.assertEqual([command['type'] for command in response.json()['commands']], ['reboot'])
+        self.assertLess(time.monotonic() - started, 5)
+    
+    async def test_unknown_serial(self):
+        """Unknown serial numbers get a 404"""
+        response = await self.async_client.get(self.url, {'serial_number': "TC-200-UNKNOWN", 'timeout': 0})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['error']['code'], 'RES_001')
+    
+    @override_settings(TMS_AGENT_ADMISSION={
+        'RATES': {'agent-command-wait': {'PER_SERIAL': ('1/min', 1), 'GLOBAL': None}},
+        'CONCURRENCY': {},
+    })
+    async def test_admission_control(self):
+        """Agents reconnecting faster than their rate get RATE_001"""
+        await self.async_client.get(self.url, {'serial_number': "TC-200-TEST001", 'timeout': 0})
+        response = await self.async_client.get(self.url, {'serial_number': "TC-200-TEST001", 'timeout': 0})
+        
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['error']['code'], 'RATE_001')
+    
+    @override_settings(TMS_AGENT_ADMISSION={'RATES': {}, 'CONCURRENCY': {'agent-command-wait': 1}})
+    async def test_parked_requests_are_capped(self):
+        """Requests over the concurrency cap are shed instead of parked"""
+        parked = asyncio.ensure_future(
+            self.async_client.get(self.url, {'serial_number': "TC-200-TEST001", 'timeout': 10})
+        )
+        await asyncio.sleep(0.3)
+        
+        response = await self.async_client.get(self.url, {'serial_number': "TC-200-TEST001", 'timeout': 0})
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['error']['code'], 'SYS_003')
+        await sync_to_async(self.queue_reboot)()
+        self.assertEqual((await parked).status_code, 200)
+
+
+class CommandWaitRoutingTest(TestCase):
+    """Long-poll routing test"""
+    
+    def test_not_routed_under_wsgi(self):
+        """Without the async views a parked request would hold a worker thread"""
+        with self.assertRaises(NoReverseMatch):
+            reverse('agent-command-wait')
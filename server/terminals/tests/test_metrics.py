@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from terminals.metrics import build_sample, compact_metrics, metric_history
+from terminals.models import Customer, Terminal, TerminalMetricRollup, TerminalMetricSample
+
+
+@override_settings(TMS_METRICS={
+    'RAW_RETENTION_DAYS': 2,
+    'HOURLY_RETENTION_DAYS': 10,
+    'DAILY_RETENTION_DAYS': 100,
+})
+class MetricCompactionTest(TestCase):
+    """Metric time series compaction test"""
+    
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=self.customer,
+            store_name="Shibuya Store"
+        )
+        self.day = timezone.make_aware(datetime(2025, 11, 20))
+    
+    def add_sample(self, recorded_at, cpu_usage, temperature=40):
+        metrics = {'cpu_usage': cpu_usage, 'memory_usage': 50, 'disk_usage': 30, 'temperature': temperature}
+        build_sample(self.terminal.id, metrics, recorded_at).save()
+    
+    def test_hourly_and_daily_buckets(self):
+        """Samples roll into hourly buckets and hourly into sample-weighted daily buckets"""
+        self.add_sample(self.day + timedelta(hours=1, minutes=5), 10)
+        self.add_sample(self.day + timedelta(hours=1, minutes=35), 30)
+        self.add_sample(self.day + timedelta(hours=2, minutes=5), 80)
+        
+        summary = compact_metrics(now=self.day + timedelta(days=1, hours=1))
+        
+        self.assertEqual(summary['hourly_buckets'], 2)
+        self.assertEqual(summary['daily_buckets'], 1)
+        first_hour = TerminalMetricRollup.objects.get(resolution='hour', bucket_start=self.day + timedelta(hours=1))
+        self.assertEqual((first_hour.cpu_min, first_hour.cpu_avg, first_hour.cpu_max), (10, 20, 30))
+        daily = TerminalMetricRollup.objects.get(resolution='day')
+        self.assertEqual(daily.bucket_start, self.day)
+        self.assertEqual(daily.sample_count, 3)
+        self.assertEqual((daily.cpu_min, daily.cpu_max), (10, 80))
+        self.assertAlmostEqual(daily.cpu_avg, 40)
+    
+    def test_daily_temperature_ignores_missing_readings(self):
+        """The daily temperature mean is weighted by samples that reported one"""
+        self.add_sample(self.day + timedelta(hours=1, minutes=5), 10, temperature=30)
+        for minutes in (10, 20, 30):
+            self.add_sample(self.day + timedelta(hours=1, minutes=minutes), 10, temperature=None)
+        self.add_sample(self.day + timedelta(hours=2, minutes=5), 10, temperature=60)
+        self.add_sample(self.day + timedelta(hours=2, minutes=35), 10, temperature=60)
+        
+        compact_metrics(now=self.day + timedelta(days=1, hours=1))
+        
+        first_hour = TerminalMetricRollup.objects.get(resolution='hour', bucket_start=self.day + timedelta(hours=1))
+        self.assertEqual((first_hour.sample_count, first_hour.temperature_count), (4, 1))
+        daily = TerminalMetricRollup.objects.get(resolution='day')
+        self.assertEqual((daily.sample_count, daily.temperature_count), (6, 3))
+        self.assertAlmostEqual(daily.temperature_avg, 50)
+    
+    def test_compaction_is_idempotent(self):
+        """Running compaction twice does not duplicate buckets"""
+        self.add_sample(self.day + timedelta(hours=1), 10)
+        now = self.day + timedelta(hours=3)
+        compact_metrics(now=now)
+        compact_metrics(now=now)
+        self.assertEqual(TerminalMetricRollup.objects.filter(resolution='hour').count(), 1)
+    
+    def test_retention_per_tier(self):
+        """Each tier is pruned with its own retention, only after compaction"""
+        old = self.day + timedelta(hours=1)
+        self.add_sample(old, 10)
+        self.add_sample(self.day + timedelta(days=3), 20)
+        
+        compact_metrics(now=self.day + timedelta(days=5))
+        self.assertFalse(TerminalMetricSample.objects.filter(recorded_at=old).exists())
+        self.assertTrue(TerminalMetricRollup.objects.filter(resolution='hour', bucket_start=old).exists())
+        
+        compact_metrics(now=self.day + timedelta(days=20))
+        self.assertFalse(TerminalMetricRollup.objects.filter(resolution='hour', bucket_start=old).exists())
+        self.assertTrue(TerminalMetricRollup.objects.filter(resolution='day', bucket_start=self.day).exists())
+    
+    def test_history_reads_matching_tier(self):
+        """Short recent ranges read raw samples, long ranges read daily buckets"""
+        now = timezone.now()
+        self.add_sample(now - timedelta(minutes=10), 25)
+        
+        recent = metric_history(self.terminal.id, now - timedelta(hours=1), now)
+        self.assertEqual(recent['resolution'], 'raw')
+        self.assertEqual(recent['points'][0]['cpu']['avg'], 25)
+        
+        self.assertEqual(metric_history(self.terminal.id, now - timedelta(days=7), now)['resolution'], 'hour')
+        self.assertEqual(metric_history(self.terminal.id, now - timedelta(days=60), now)['resolution'], 'day')
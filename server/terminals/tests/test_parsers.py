@@ -0,0 +1,76 @@
+import gzip
+import json
+import msgpack
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Customer, Terminal, TerminalLog
+
+
+class AgentPayloadEncodingTest(TestCase):
+    """Compressed and MessagePack agent payload test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_liveness_store().clear()
+        customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        Terminal.objects.create(serial_number="TC-200-TEST001", customer=customer, store_name="Shibuya Store")
+        self.client = APIClient()
+        self.logs = {
+            "serial_number": "TC-200-TEST001",
+            "logs": [
+                {
+                    "timestamp": "2025-11-24T12:00:00Z",
+                    "type": "system",
+                    "level": "INFO",
+                    "message": f"Card reader poll {i}"
+                }
+                for i in range(20)
+            ]
+        }
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def post(self, body, content_type, encoding=None):
+        headers = {'HTTP_CONTENT_ENCODING': encoding} if encoding else {}
+        return self.client.generic('POST', reverse('agent-logs'), body, content_type=content_type, **headers)
+    
+    def test_gzip_json(self):
+        """gzip-compressed JSON is decoded transparently"""
+        body = gzip.compress(json.dumps(self.logs).encode())
+        response = self.post(body, 'application/json', 'gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TerminalLog.objects.count(), 20)
+    
+    def test_msgpack(self):
+        """MessagePack bodies are accepted, plain or compressed"""
+        body = msgpack.packb(self.logs)
+        self.assertEqual(self.post(body, 'application/msgpack').status_code, 200)
+        self.assertEqual(self.post(gzip.compress(body), 'application/msgpack', 'gzip').status_code, 200)
+        self.assertEqual(TerminalLog.objects.count(), 40)
+    
+    def test_plain_json_still_works(self):
+        """Agents that send plain JSON are unaffected"""
+        response = self.post(json.dumps(self.logs), 'application/json')
+        self.assertEqual(response.status_code, 200)
+    
+    @override_settings(TMS_AGENT_MAX_DECODED_BYTES=1024)
+    def test_decompression_limit(self):
+        """Bodies that expand beyond the limit are rejected"""
+        body = gzip.compress(json.dumps(self.logs).encode() + b' ' * 10000)
+        response = self.post(body, 'application/json', 'gzip')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TerminalLog.objects.exists())
+    
+    def test_unknown_encoding(self):
+        """Unsupported encodings get 415"""
+        response = self.post(json.dumps(self.logs), 'application/json', 'br')
+        self.assertEqual(response.status_code, 415)
@@ -0,0 +1,177 @@
+import hashlib
+import io
+import random
+import tempfile
+from io import StringIO
+from pathlib import Path
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.blobstore import get_blob_store
+from terminals.deployments import forget_due_deployments
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Customer, FirmwarePatch, FirmwareVersion, Terminal
+from terminals.patches import BLOCK_SIZE, apply_delta, build_patch, encode_delta, request_patches
+from terminals.resolver import get_resolver
+
+rng = random.Random(20)
+SOURCE = rng.randbytes(BLOCK_SIZE * 64)
+# Shifted, partly rewritten and extended: most blocks still come from SOURCE
+TARGET = b"header" + SOURCE[:BLOCK_SIZE * 20] + rng.randbytes(BLOCK_SIZE * 3) + SOURCE[BLOCK_SIZE * 30:] + b"tail"
+
+
+def encode(source, target):
+    out = io.BytesIO()
+    encode_delta(io.BytesIO(source), io.BytesIO(target), out, hashlib.sha256(source).hexdigest(),
+                 hashlib.sha256(target).hexdigest(), len(target))
+    return out.getvalue()
+
+
+class FirmwarePatchTest(TestCase):
+    """Firmware delta patch test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_resolver().clear()
+        get_liveness_store().clear()
+        forget_due_deployments()
+        self.root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(TMS_FIRMWARE_DOWNLOADS={'ROOT': self.root.name, 'ACCEL_REDIRECT': ''})
+        self.settings.enable()
+        self.source = self.firmware("2.0.0", SOURCE)
+        self.target = self.firmware("2.1.0", TARGET)
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+    
+    def tearDown(self):
+        self.settings.disable()
+        self.root.cleanup()
+        get_liveness_store().clear()
+        forget_due_deployments()
+    
+    def firmware(self, version, content):
+        Path(self.root.name, f"TC-200_{version}.bin").write_bytes(content)
+        return FirmwareVersion.objects.create(
+            version=version,
+            file_name=f"TC-200_{version}.bin",
+            file_size=len(content),
+            file_hash=hashlib.sha256(content).hexdigest(),
+            released_date=timezone.now().date()
+        )
+    
+    def ready_patch(self):
+        patch = FirmwarePatch.objects.create(source=self.source, target=self.target)
+        self.assertEqual(build_patch(patch), 'ready')
+        patch.refresh_from_db()
+        return patch
+    
+    def test_roundtrip(self):
+        """Applying a patch rebuilds the target exactly, for a fraction of its size"""
+        patch = encode(SOURCE, TARGET)
+        out = io.BytesIO()
+        
+        digest, size = apply_delta(io.BytesIO(SOURCE), io.BytesIO(patch), out)
+        
+        self.assertEqual(out.getvalue(), TARGET)
+        self.assertEqual((digest, size), (hashlib.sha256(TARGET).hexdigest(), len(TARGET)))
+        self.assertLess(len(patch), len(TARGET) // 5)
+    
+    def test_corrupt_patch_is_rejected(self):
+        """Patches that are not ours or reach past the source fail loudly"""
+        with self.assertRaises(ValueError):
+            apply_delta(io.BytesIO(SOURCE[:BLOCK_SIZE]), io.BytesIO(encode(SOURCE, TARGET)))
+        with self.assertRaises(OSError):
+            apply_delta(io.BytesIO(SOURCE), io.BytesIO(b"not a patch"))
+    
+    def test_build_patch(self):
+        """Built patches are stored by hash; unrelated images are not worth a patch"""
+        patch = self.ready_patch()
+        
+        with get_blob_store().path(patch.file_hash).open('rb') as stored:
+            self.assertEqual(apply_delta(io.BytesIO(SOURCE), stored)[0], self.target.file_hash)
+        self.assertEqual(patch.file_size, get_blob_store().path(patch.file_hash).stat().st_size)
+        
+        unrelated = self.firmware("3.0.0", rng.randbytes(BLOCK_SIZE * 8))
+        skipped = FirmwarePatch.objects.create(source=self.source, target=unrelated)
+        self.assertEqual(build_patch(skipped), 'skipped')
+        self.assertEqual(list(Path(self.root.name, 'tmp').iterdir()), [])
+        
+        Path(self.root.name, "TC-200_2.0.0.bin").unlink()
+        self.assertEqual(build_patch(skipped), 'failed')
+        self.assertEqual(FirmwarePatch.objects.get(pk=skipped.pk).error_message, "Firmware image not on disk")
+    
+    def test_heartbeat_offers_patch(self):
+        """Terminals on the patch's source version get it with the full image as fallback"""
+        patch = self.ready_patch()
+        on_source = Terminal.objects.create(serial_number="TC-200-A", customer=self.customer,
+                                            store_name="Store A", firmware_version="2.0.0")
+        elsewhere = Terminal.objects.create(serial_number="TC-200-B", customer=self.customer,
+                                            store_name="Store B", firmware_version="1.9.0")
+        user = get_user_model().objects.create_user(username="operator", password="testpass123")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        client.post(reverse('firmware-deploy', args=[self.target.id]),
+                    {"target_terminals": "all", "canary_percent": 100}, format='json')
+        
+        params = {}
+        for terminal in (on_source, elsewhere):
+            response = APIClient().post(reverse('agent-heartbeat'), {
+                "serial_number": terminal.serial_number,
+                "status": "online",
+                "timestamp": "2025-11-24T12:00:00Z",
+                "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30},
+                "firmware_version": terminal.firmware_version,
+                "agent_version": "1.0.0"
+            }, format='json')
+            params[terminal.serial_number], = [c['parameters'] for c in response.data['commands']]
+        
+        self.assertEqual(params["TC-200-A"]['delta'], {
+            'source_version': "2.0.0",
+            'source_checksum': f'sha256:{self.source.file_hash}',
+            'url': reverse('agent-firmware-patch-download', args=[patch.id]),
+            'checksum': f'sha256:{patch.file_hash}',
+            'size': patch.file_size
+        })
+        self.assertEqual(params["TC-200-A"]['checksum'], f'sha256:{self.target.file_hash}')
+        self.assertNotIn('delta', params["TC-200-B"])
+    
+    def test_patch_download(self):
+        """Only ready patches are served, with ranges like full images"""
+        patch = self.ready_patch()
+        url = reverse('agent-firmware-patch-download', args=[patch.id])
+        
+        response = APIClient().get(url)
+        self.assertEqual(response['ETag'], f'"{patch.file_hash}"')
+        self.assertEqual(b''.join(response.streaming_content), get_blob_store().path(patch.file_hash).read_bytes())
+        self.assertEqual(APIClient().get(url, HTTP_RANGE="bytes=10-").status_code, 206)
+        
+        FirmwarePatch.objects.filter(pk=patch.pk).update(status='skipped')
+        self.assertEqual(APIClient().get(url).data['error']['code'], 'RES_001')
+    
+    def test_worker_builds_patches_for_deployments(self):
+        """The worker queues each installed version once and builds it"""
+        for i, version in enumerate(["2.0.0", "2.0.0", "2.1.0", "0.9.0"]):
+            Terminal.objects.create(serial_number=f"TC-200-{i}", customer=self.customer,
+                                    store_name=f"Store {i}", firmware_version=version)
+        user = get_user_model().objects.create_user(username="operator", password="testpass123")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        client.post(reverse('firmware-deploy', args=[self.target.id]),
+                    {"target_terminals": "all", "canary_percent": 100}, format='json')
+        
+        out = StringIO()
+        call_command('build_firmware_patches', stdout=out)
+        call_command('build_firmware_patches', stdout=out)
+        
+        patch = FirmwarePatch.objects.get()
+        self.assertEqual((patch.source, patch.target, patch.status), (self.source, self.target, 'ready'))
+        self.assertIn("built 1 patch(es)", out.getvalue())
+        self.assertEqual(len(request_patches(self.target, ["2.0.0", "2.1.0"])), 1)
+        self.assertEqual(FirmwarePatch.objects.count(), 1)
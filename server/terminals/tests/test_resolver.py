@@ -0,0 +1,134 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Customer, Terminal
+from terminals.resolver import SerialResolver, get_resolver
+
+
+class SerialResolverTest(TestCase):
+    """Serial number resolution cache test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_resolver().clear()
+        get_liveness_store().clear()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=self.customer,
+            store_name="Shibuya Store",
+            heartbeat_interval=60
+        )
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def heartbeat(self):
+        return APIClient().post(reverse('agent-heartbeat'), {
+            "serial_number": "TC-200-TEST001",
+            "status": "online",
+            "timestamp": "2025-11-24T12:00:00Z",
+            "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30},
+            "firmware_version": "1.0.0",
+            "agent_version": "1.0.0"
+        }, format='json')
+    
+    def test_resolve_counts_hits_and_misses(self):
+        """The first lookup goes to the database, repeats are served locally"""
+        resolver = get_resolver()
+        
+        with self.assertNumQueries(1):
+            ref = resolver.resolve("TC-200-TEST001")
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve("TC-200-TEST001"), ref)
+        
+        self.assertEqual(ref.terminal_id, self.terminal.id)
+        self.assertEqual(ref.heartbeat_interval, 60)
+        self.assertFalse(ref.maintenance_mode)
+        self.assertIsNone(resolver.resolve("TC-200-UNKNOWN"))
+        
+        stats = resolver.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+    
+    def test_shared_tier_fills_other_processes(self):
+        """A fresh process resolves from the shared cache without a query"""
+        get_resolver().resolve("TC-200-TEST001")
+        
+        other = SerialResolver()
+        with self.assertNumQueries(0):
+            ref = other.resolve("TC-200-TEST001")
+        self.assertEqual(ref.terminal_id, self.terminal.id)
+        self.assertEqual(other.stats()['shared_hits'], 1)
+    
+    def test_lru_is_bounded(self):
+        """The least recently used serial is evicted first"""
+        resolver = SerialResolver(max_size=2, shared_timeout=0)
+        for serial in ["TC-200-TEST001", "TC-200-TEST002", "TC-200-TEST003"]:
+            Terminal.objects.get_or_create(serial_number=serial, defaults={'customer': self.customer})
+            resolver.resolve(serial)
+        self.assertEqual(resolver.stats()['size'], 2)
+        
+        with self.assertNumQueries(1):
+            resolver.resolve("TC-200-TEST001")
+    
+    def test_save_and_delete_invalidate(self):
+        """Terminal changes are visible on the next lookup"""
+        resolver = get_resolver()
+        resolver.resolve("TC-200-TEST001")
+        
+        self.terminal.heartbeat_interval = 120
+        self.terminal.maintenance_mode = True
+        self.terminal.save()
+        ref = resolver.resolve("TC-200-TEST001")
+        self.assertEqual((ref.heartbeat_interval, ref.maintenance_mode), (120, True))
+        
+        self.terminal.serial_number = "TC-200-RENAMED"
+        self.terminal.save()
+        self.assertIsNone(resolver.resolve("TC-200-TEST001"))
+        
+        self.terminal.delete()
+        self.assertIsNone(resolver.resolve("TC-200-RENAMED"))
+    
+    def test_warm_heartbeat_does_not_read_terminal(self):
+        """Heartbeats write by primary key once the serial is cached"""
+        self.heartbeat()
+        
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.heartbeat()
+        
+        # Scheduled from the cached 60s interval (slot offset, at most 2x stretch)
+        self.assertLessEqual(response.data['next_heartbeat'], 150)
+        terminal_selects = [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith('SELECT') and 'FROM "terminals_terminal"' in q['sql']
+        ]
+        self.assertEqual(terminal_selects, [])
+    
+    def test_identity_fields_written_on_change(self):
+        """Firmware/agent versions reach the database without a terminal read"""
+        self.heartbeat()
+        self.terminal.refresh_from_db()
+        self.assertEqual(self.terminal.firmware_version, "1.0.0")
+    
+    def test_stats_endpoint(self):
+        """Counters are exposed to operators"""
+        user = get_user_model().objects.create_user(username="operator", password="testpass123")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        self.heartbeat()
+        
+        response = client.get(reverse('agent-resolver-stats'))
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['misses'], 1)
+
@@ -0,0 +1,103 @@
+from collections import Counter
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Customer, Terminal
+from terminals.scheduling import HeartbeatScheduler, slot_fraction
+
+
+class HeartbeatSchedulerTest(TestCase):
+    """Heartbeat scheduler test"""
+    
+    def test_slots_spread_evenly(self):
+        """Any run of terminal ids fills the interval evenly"""
+        buckets = Counter(int(slot_fraction(terminal_id) * 10) for terminal_id in range(1, 1001))
+        self.assertEqual(len(buckets), 10)
+        self.assertLessEqual(max(buckets.values()) - min(buckets.values()), 10)
+    
+    def test_lockstep_fleet_is_spread(self):
+        """Terminals that beat at the same moment are sent to different slots"""
+        scheduler = HeartbeatScheduler()
+        now = 1_700_000_000
+        next_beats = Counter(
+            (now + scheduler.next_delay(terminal_id, 300, now)) % 300 // 30
+            for terminal_id in range(1, 1001)
+        )
+        self.assertEqual(len(next_beats), 10)
+        self.assertLessEqual(max(next_beats.values()), 120)
+    
+    def test_delay_bounds(self):
+        """Delays stay between a quarter and one and a quarter intervals"""
+        scheduler = HeartbeatScheduler()
+        for now in range(1_700_000_000, 1_700_000_300, 7):
+            delay = scheduler.next_delay(42, 300, now)
+            self.assertGreaterEqual(delay, 75)
+            self.assertLessEqual(delay, 375)
+    
+    def test_slot_is_stable(self):
+        """A terminal that follows its delay lands on the same slot again"""
+        scheduler = HeartbeatScheduler()
+        now = 1_700_000_123
+        first = now + scheduler.next_delay(7, 300, now)
+        second = first + scheduler.next_delay(7, 300, first)
+        self.assertEqual(second - first, 300)
+    
+    def test_latency_stretches_interval(self):
+        """High ingest latency stretches the interval, capped at MAX_STRETCH"""
+        scheduler = HeartbeatScheduler(target_latency_ms=100, max_stretch=2.0, ewma_alpha=0.5)
+        self.assertEqual(scheduler.stretch(), 1.0)
+        
+        scheduler.record_latency(0.15)
+        self.assertAlmostEqual(scheduler.stretch(), 1.5)
+        
+        for _ in range(20):
+            scheduler.record_latency(1.0)
+        self.assertEqual(scheduler.stretch(), 2.0)
+        
+        for _ in range(20):
+            scheduler.record_latency(0.01)
+        self.assertEqual(scheduler.stretch(), 1.0)
+
+
+@override_settings(TMS_HEARTBEAT_SCHEDULE={'TARGET_LATENCY_MS': 60000, 'MAX_STRETCH': 2.0, 'EWMA_ALPHA': 0.1})
+class HeartbeatScheduleAPITest(TestCase):
+    """Heartbeat response scheduling test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_liveness_store().clear()
+        customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        self.terminal = Terminal.objects.create(
+            serial_number="TC-200-TEST001",
+            customer=customer,
+            store_name="Shibuya Store",
+            heartbeat_interval=300
+        )
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def test_next_heartbeat_is_a_slot_delay(self):
+        """next_heartbeat points at the terminal's slot"""
+        response = APIClient().post(reverse('agent-heartbeat'), {
+            "serial_number": "TC-200-TEST001",
+            "status": "online",
+            "timestamp": "2025-11-24T12:00:00Z",
+            "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30},
+            "firmware_version": "1.0.0",
+            "agent_version": "1.0.0"
+        }, format='json')
+        
+        delay = response.data['next_heartbeat']
+        self.assertGreaterEqual(delay, 75)
+        self.assertLessEqual(delay, 375)
+        slot = (timezone.now().timestamp() + delay) % 300
+        expected = slot_fraction(self.terminal.id) * 300
+        self.assertLess(min(abs(slot - expected), 300 - abs(slot - expected)), 3)
@@ -0,0 +1,88 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Customer, Terminal
+from terminals.resolver import get_resolver
+from terminals.stats import count_by_customer
+
+
+class FleetStatusTest(TestCase):
+    """Fleet status statistics test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_resolver().clear()
+        get_liveness_store().clear()
+        self.user = get_user_model().objects.create_user(username="operator", password="testpass123")
+        self.client.force_login(self.user)
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+        self.customers = []
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def add_customers(self, count):
+        # Run the on-commit counter updates, as outside a test transaction
+        with self.captureOnCommitCallbacks(execute=True):
+            self._add_customers(count)
+    
+    def _add_customers(self, count):
+        for _ in range(count):
+            i = len(self.customers)
+            customer = Customer.objects.create(
+                company_name=f"Corporation {i}",
+                contact_email=f"c{i}@example.com",
+                contract_start_date=timezone.now().date()
+            )
+            for j, status in enumerate(["online", "online", "offline", "error"]):
+                Terminal.objects.create(
+                    serial_number=f"TC-200-{i:03d}-{j}", customer=customer,
+                    store_name=f"Store {j}", status=status
+                )
+            self.customers.append(customer)
+    
+    def query_counts(self):
+        counts = []
+        for request in (
+            lambda: self.client.get(reverse('dashboard')),
+            lambda: self.client.get(reverse('reports')),
+            lambda: self.client.get(reverse('customer_detail', args=[self.customers[0].id])),
+            lambda: self.api.get(reverse('reports-summary')),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(request().status_code, 200)
+            counts.append(len(queries))
+        return counts
+    
+    def test_counts(self):
+        """Per-customer counts come from one query"""
+        self.add_customers(2)
+        
+        with self.assertNumQueries(1):
+            counts = count_by_customer(Terminal.objects.all())
+        
+        self.assertEqual(counts, {
+            customer.id: {'total': 4, 'online': 2, 'offline': 1, 'error': 1} for customer in self.customers
+        })
+    
+    def test_views_cost_is_constant(self):
+        """Dashboard, reports, customer detail and summary do not query per customer"""
+        self.add_customers(2)
+        # The first reads count the cached counters from the database
+        self.query_counts()
+        few = self.query_counts()
+        
+        self.add_customers(10)
+        many = self.query_counts()
+        
+        self.assertEqual(few, many)
+        summary = self.api.get(reverse('reports-summary')).data
+        self.assertEqual(summary['statistics']['total_terminals'], 48)
+        self.assertEqual(summary['customer_breakdown'][0]['online_rate'], 50.0)
@@ -0,0 +1,100 @@
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Alert, Customer, Terminal
+from terminals.sweeper import sweep_offline
+
+
+class OfflineSweeperTest(TestCase):
+    """Offline sweeper test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_liveness_store().clear()
+        self.now = timezone.now()
+        self.customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=self.now.date()
+        )
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def make_terminal(self, serial, silent_for, interval=300, **fields):
+        return Terminal.objects.create(
+            serial_number=serial,
+            customer=self.customer,
+            store_name="Shibuya Store",
+            status=fields.pop('status', 'online'),
+            heartbeat_interval=interval,
+            last_heartbeat=self.now - timedelta(seconds=silent_for),
+            **fields
+        )
+    
+    def test_silent_terminals_go_offline(self):
+        """Terminals past k x their own interval are marked offline with an alert"""
+        silent = self.make_terminal("TC-200-SILENT", silent_for=1200)
+        alive = self.make_terminal("TC-200-ALIVE", silent_for=600)
+        fast = self.make_terminal("TC-200-FAST", silent_for=600, interval=60)
+        
+        result = sweep_offline(self.now)
+        
+        self.assertEqual(result['offline'], 2)
+        statuses = dict(Terminal.objects.values_list('serial_number', 'status'))
+        self.assertEqual(statuses, {"TC-200-SILENT": 'offline', "TC-200-ALIVE": 'online', "TC-200-FAST": 'offline'})
+        self.assertEqual(
+            set(Alert.objects.filter(alert_type='connection_lost').values_list('terminal_id', flat=True)),
+            {silent.id, fast.id}
+        )
+        self.assertNotIn(alive.id, Alert.objects.values_list('terminal_id', flat=True))
+    
+    def test_maintenance_and_offline_terminals_are_skipped(self):
+        """Terminals in maintenance or already offline are left alone"""
+        self.make_terminal("TC-200-MAINT", silent_for=5000, maintenance_mode=True)
+        self.make_terminal("TC-200-OFF", silent_for=5000, status='offline')
+        
+        self.assertEqual(sweep_offline(self.now)['offline'], 0)
+        self.assertFalse(Alert.objects.exists())
+    
+    def test_repeated_sweeps_do_not_duplicate_alerts(self):
+        """A terminal that stays silent keeps a single open alert"""
+        terminal = self.make_terminal("TC-200-SILENT", silent_for=1200)
+        sweep_offline(self.now)
+        Terminal.objects.filter(id=terminal.id).update(status='online')
+        sweep_offline(self.now + timedelta(minutes=5))
+        
+        alert = Alert.objects.get()
+        self.assertEqual(alert.occurrence_count, 2)
+    
+    def test_query_count_is_constant(self):
+        """Sweep cost does not grow with the number of silent terminals"""
+        for i in range(3):
+            self.make_terminal(f"TC-200-A{i:03d}", silent_for=1200)
+        with CaptureQueriesContext(connection) as few:
+            sweep_offline(self.now)
+        
+        for i in range(30):
+            self.make_terminal(f"TC-200-B{i:03d}", silent_for=1200)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(sweep_offline(self.now)['offline'], 30)
+        
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+    
+    def test_unflushed_heartbeat_keeps_terminal_online(self):
+        """Heartbeats still buffered in the liveness store count"""
+        terminal = self.make_terminal("TC-200-SILENT", silent_for=1200)
+        get_liveness_store().record(terminal.id, {
+            'last_heartbeat': self.now,
+            'status': 'online',
+            'cpu_usage': 10,
+            'memory_usage': 20,
+            'disk_usage': 30,
+            'temperature': None,
+        })
+        
+        self.assertEqual(sweep_offline(self.now)['offline'], 0)
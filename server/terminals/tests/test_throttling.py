@@ -0,0 +1,108 @@
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.liveness import get_store as get_liveness_store
+from terminals.middleware import AgentConcurrencyLimitMiddleware
+from terminals.models import Customer, Terminal
+from terminals.throttling import TokenBucketStore, get_bucket_store
+
+
+def admission(**rates):
+    config = dict(settings.TMS_AGENT_ADMISSION)
+    config['RATES'] = {**config['RATES'], **rates}
+    return override_settings(TMS_AGENT_ADMISSION=config)
+
+
+class AdmissionControlTest(TestCase):
+    """Agent endpoint admission control test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_bucket_store().clear()
+        get_liveness_store().clear()
+        customer = Customer.objects.create(
+            company_name="Test Corporation",
+            contact_email="test@example.com",
+            contract_start_date=timezone.now().date()
+        )
+        for serial in ["TC-200-TEST001", "TC-200-TEST002"]:
+            Terminal.objects.create(serial_number=serial, customer=customer, store_name="Shibuya Store")
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def heartbeat(self, serial="TC-200-TEST001"):
+        return APIClient().post(reverse('agent-heartbeat'), {
+            "serial_number": serial,
+            "status": "online",
+            "timestamp": "2025-11-24T12:00:00Z",
+            "metrics": {"cpu_usage": 10, "memory_usage": 20, "disk_usage": 30},
+            "firmware_version": "1.0.0",
+            "agent_version": "1.0.0"
+        }, format='json')
+    
+    @admission(**{'agent-heartbeat': {'PER_SERIAL': ('1/min', 2), 'GLOBAL': None}})
+    def test_per_serial_bucket(self):
+        """A serial beyond its burst gets 429 with Retry-After; others are unaffected"""
+        self.assertEqual(self.heartbeat().status_code, 200)
+        self.assertEqual(self.heartbeat().status_code, 200)
+        
+        response = self.heartbeat()
+        
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.data['error']['code'], 'RATE_001')
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(self.heartbeat("TC-200-TEST002").status_code, 200)
+    
+    @admission(**{'agent-heartbeat': {'PER_SERIAL': None, 'GLOBAL': ('1/min', 1)}})
+    def test_global_bucket(self):
+        """The endpoint-wide bucket is shared by every serial"""
+        self.assertEqual(self.heartbeat().status_code, 200)
+        self.assertEqual(self.heartbeat("TC-200-TEST002").status_code, 429)
+    
+    def test_bucket_refills(self):
+        """Tokens come back at the configured rate"""
+        store = TokenBucketStore()
+        buckets = {'test': (1.0, 1)}
+        self.assertEqual(store.consume(buckets, now=1000.0), 0)
+        self.assertAlmostEqual(store.consume(buckets, now=1000.5), 0.5)
+        self.assertEqual(store.consume(buckets, now=1001.0), 0)
+    
+    def test_local_fallback_when_cache_fails(self):
+        """Buckets keep working in process memory when the cache is down"""
+        store = TokenBucketStore()
+        buckets = {'test': (1.0, 1)}
+        with mock.patch('terminals.throttling.cache.get_many', side_effect=ConnectionError):
+            self.assertEqual(store.consume(buckets, now=1000.0), 0)
+            self.assertGreater(store.consume(buckets, now=1000.1), 0)
+
+
+class ConcurrencyLimitTest(TestCase):
+    """Per-endpoint concurrency cap test"""
+    
+    @override_settings(TMS_AGENT_ADMISSION={'RATES': {}, 'CONCURRENCY': {'agent-logs': 1}})
+    def test_requests_over_cap_are_shed(self):
+        """A second in-flight log upload is shed while heartbeats pass"""
+        middleware = AgentConcurrencyLimitMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+    
+        def request_for(name):
+            request = factory.post(reverse(name))
+            request.resolver_match = resolve(request.path)
+            return request
+        
+        first = request_for('agent-logs')
+        self.assertIsNone(middleware.process_view(first, None, (), {}))
+        
+        shed = middleware.process_view(request_for('agent-logs'), None, (), {})
+        self.assertEqual(shed.status_code, 503)
+        self.assertEqual(shed['Retry-After'], '1')
+        self.assertIsNone(middleware.process_view(request_for('agent-heartbeat'), None, (), {}))
+        
+        middleware.process_response(first, HttpResponse())
+        self.assertIsNone(middleware.process_view(request_for('agent-logs'), None, (), {}))
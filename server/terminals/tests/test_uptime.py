@@ -0,0 +1,159 @@
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from terminals.liveness import get_store as get_liveness_store
+from terminals.models import Customer, Terminal, TerminalStatusChange
+from terminals.sweeper import sweep_offline
+from terminals.uptime import sla_report, uptime
+
+
+class UptimeTest(TestCase):
+    """Status change history and uptime test"""
+    
+    def setUp(self):
+        cache.clear()
+        get_liveness_store().clear()
+        self.now = timezone.now()
+        self.basic = self.make_customer("Basic Corporation", 'basic')
+        self.premium = self.make_customer("Premium Corporation", 'premium')
+        self.terminal = self.make_terminal("TC-200-A", self.basic)
+    
+    def tearDown(self):
+        get_liveness_store().clear()
+    
+    def make_customer(self, name, contract_type):
+        return Customer.objects.create(
+            company_name=name, contact_email="test@example.com",
+            contract_type=contract_type, contract_start_date=self.now.date()
+        )
+    
+    def make_terminal(self, serial, customer, created_days_ago=30):
+        terminal = Terminal.objects.create(
+            serial_number=serial, customer=customer, store_name="Shibuya Store",
+            status='offline', heartbeat_interval=300
+        )
+        Terminal.objects.filter(id=terminal.id).update(created_at=self.now - timedelta(days=created_days_ago))
+        return terminal
+    
+    def heartbeat(self, at, status='online'):
+        store = get_liveness_store()
+        store.record(self.terminal.id, {
+            'last_heartbeat': at, 'status': status,
+            'cpu_usage': 10, 'memory_usage': 20, 'disk_usage': 30, 'temperature': None,
+        })
+        store.flush()
+    
+    def change(self, terminal, from_status, to_status, hours_ago):
+        TerminalStatusChange.objects.create(
+            terminal=terminal, from_status=from_status, to_status=to_status,
+            at=self.now - timedelta(hours=hours_ago)
+        )
+    
+    def changes(self):
+        return list(TerminalStatusChange.objects.filter(terminal=self.terminal).order_by('at').values_list(
+            'from_status', 'to_status', 'at'
+        ))
+    
+    def test_heartbeats_record_only_changes(self):
+        """Flushes write a row when the status differs from the database"""
+        first = self.now - timedelta(minutes=20)
+        self.heartbeat(first)
+        self.heartbeat(first + timedelta(minutes=5))
+        self.heartbeat(first + timedelta(minutes=10), status='error')
+        self.heartbeat(first + timedelta(minutes=15), status='error')
+        
+        self.assertEqual(self.changes(), [
+            ('offline', 'online', first),
+            ('online', 'error', first + timedelta(minutes=10)),
+        ])
+    
+    def test_api_edit_keeps_buffered_status_change(self):
+        """Saving a terminal through the API leaves heartbeat values to the flush"""
+        user = get_user_model().objects.create_user(username='admin', password='password', role='admin')
+        client = APIClient()
+        client.force_authenticate(user)
+        at = self.now - timedelta(minutes=5)
+        get_liveness_store().record(self.terminal.id, {
+            'last_heartbeat': at, 'status': 'online',
+            'cpu_usage': 10, 'memory_usage': 20, 'disk_usage': 30, 'temperature': None,
+        })
+        
+        response = client.patch(
+            reverse('terminal-detail', args=[self.terminal.id]), {'store_name': "Ebisu Store"}, format='json'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'online')
+        self.assertEqual(Terminal.objects.get(id=self.terminal.id).status, 'offline')
+        get_liveness_store().flush()
+        self.assertEqual(self.changes(), [('offline', 'online', at)])
+    
+    def test_sweeper_records_offline_at_last_heartbeat(self):
+        """Swept terminals go offline when they stopped answering"""
+        last = self.now - timedelta(hours=1)
+        self.heartbeat(last)
+        
+        sweep_offline(self.now)
+        
+        self.assertEqual(self.changes(), [('offline', 'online', last), ('online', 'offline', last)])
+    
+    def test_uptime_from_changes(self):
+        """The status before the window and the changes inside it split the window"""
+        self.change(self.terminal, 'offline', 'online', 30)
+        self.change(self.terminal, 'online', 'offline', 20)
+        self.change(self.terminal, 'offline', 'online', 18)
+        self.change(self.terminal, 'online', 'error', 6)
+        Terminal.objects.filter(id=self.terminal.id).update(status='error')
+        # Created inside the window, first seen going online
+        late = self.make_terminal("TC-200-B", self.basic, created_days_ago=0)
+        Terminal.objects.filter(id=late.id).update(created_at=self.now - timedelta(hours=12), status='online')
+        self.change(late, 'offline', 'online', 10)
+        # No history: the current status holds
+        idle = self.make_terminal("TC-200-C", self.basic)
+        
+        with self.assertNumQueries(2):
+            result = uptime(Terminal.objects.all(), self.now - timedelta(hours=24), self.now + timedelta(hours=1))
+        
+        hour = 3600
+        self.assertEqual(result[self.terminal.id], {'online_seconds': 16 * hour, 'expected_seconds': 24 * hour})
+        self.assertEqual(result[late.id], {'online_seconds': 10 * hour, 'expected_seconds': 12 * hour})
+        self.assertEqual(result[idle.id], {'online_seconds': 0, 'expected_seconds': 24 * hour})
+    
+    def test_sla_report(self):
+        """Uptime per contract type is compared with its target"""
+        start = timezone.localdate(self.now) - timedelta(days=10)
+        end = start + timedelta(days=4)
+        # Online throughout, except two hours offline for premium
+        self.change(self.terminal, 'offline', 'online', 24 * 20)
+        Terminal.objects.filter(id=self.terminal.id).update(status='online')
+        premium = self.make_terminal("TC-200-P", self.premium)
+        self.change(premium, 'offline', 'online', 24 * 20)
+        self.change(premium, 'online', 'offline', 24 * 8)
+        self.change(premium, 'offline', 'online', 24 * 8 - 2)
+        
+        report = {row['contract_type']: row for row in sla_report(start, end)}
+        
+        self.assertEqual(set(report), {'basic', 'premium'})
+        self.assertEqual(report['basic']['uptime'], 100.0)
+        self.assertTrue(report['basic']['met'])
+        self.assertEqual(report['premium']['uptime'], round((120 - 2) / 120 * 100, 3))
+        self.assertFalse(report['premium']['met'])
+        self.assertEqual(report['premium']['terminals_below_target'], 1)
+        self.assertEqual(report['premium']['customers'][0]['company_name'], "Premium Corporation")
+    
+    def test_sla_report_endpoint(self):
+        """The SLA report validates its dates"""
+        user = get_user_model().objects.create_user(username='admin', password='password', role='admin')
+        client = APIClient()
+        client.force_authenticate(user)
+        url = reverse('reports-sla')
+        
+        self.assertEqual(client.get(url, {'from_date': '2025-01-10', 'to_date': '2025-01-01'}).status_code, 400)
+        response = client.get(url, {'from_date': '2025-01-01', 'to_date': '2025-01-10',
+                                    'customer_id': self.basic.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['contract_type'] for row in response.data['data']], ['basic'])
@@ -0,0 +1,143 @@
+"""
+Admission control for the agent endpoints.
+
+Each agent endpoint (keyed by URL name in ``settings.TMS_AGENT_ADMISSION``)
+has a token bucket per serial number and one shared by every caller. Bucket
+state lives in the Django cache so all server processes share it; when the
+cache is unreachable, buckets fall back to process memory rather than letting
+every request through. Rejected requests get 429 ``RATE_001`` with a
+``Retry-After`` header (see ``terminals.exceptions``).
+
+Cache updates are read-modify-write, so concurrent requests can overshoot a
+bucket slightly; that is acceptable for load shedding.
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+BUCKET_KEY = 'tms:bucket:{}'
+
+_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'100/min' -> tokens per second (period units as in DRF rates)"""
+    count, period = rate.split('/')
+    return int(count) / _PERIODS[period[0]]
+
+
+class TokenBucketStore:
+    """Token buckets in the Django cache, with an in-process fallback"""
+
+    def __init__(self):
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def _take(self, states, buckets, now):
+        """Refill, then take one token from every bucket if all have one"""
+        wait = 0.0
+        refilled = {}
+        for key, (rate, capacity) in buckets.items():
+            tokens, stamp = states.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + max(now - stamp, 0) * rate)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+            refilled[key] = tokens
+        if not wait:
+            refilled = {key: tokens - 1 for key, tokens in refilled.items()}
+        return wait, {key: (tokens, now) for key, tokens in refilled.items()}
+
+    def consume(self, buckets, now=None):
+        """
+        Take a token from each of ``buckets`` ({key: (rate, capacity)}).
+
+        Returns 0 when admitted, otherwise the seconds until a retry can
+        succeed. Nothing is taken from any bucket when the request is rejected.
+        """
+        now = time.time() if now is None else now
+        keys = {BUCKET_KEY.format(key): key for key in buckets}
+        # Idle buckets are full again after capacity / rate seconds
+        timeout = max(math.ceil(capacity / rate) for rate, capacity in buckets.values()) + 1
+        try:
+            cached = cache.get_many(list(keys))
+            states = {keys[cache_key]: state for cache_key, state in cached.items()}
+            wait, states = self._take(states, buckets, now)
+            cache.set_many(
+                {BUCKET_KEY.format(key): state for key, state in states.items()},
+                timeout=timeout
+            )
+            return wait
+        except Exception as e:
+            logger.warning(f"Rate limit cache unavailable, using local buckets: {e}")
+
+        with self._lock:
+            wait, states = self._take(self._local, buckets, now)
+            self._local.update(states)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+
+_bucket_store = TokenBucketStore()
+
+
+def get_bucket_store():
+    """Return the process-wide bucket store"""
+    return _bucket_store
+
+
+def admission_wait(name, get_caller):
+    """
+    Take tokens for a request to the endpoint named ``name``.
+
+    Returns 0 when admitted, otherwise the seconds to wait. ``get_caller`` is
+    only called when the endpoint has per-serial buckets.
+    """
+    rates = settings.TMS_AGENT_ADMISSION['RATES'].get(name)
+    if not rates:
+        return 0
+
+    buckets = {}
+    if rates.get('GLOBAL'):
+        rate, burst = rates['GLOBAL']
+        buckets[f'{name}:*'] = (parse_rate(rate), burst)
+    if rates.get('PER_SERIAL'):
+        rate, burst = rates['PER_SERIAL']
+        buckets[f'{name}:{get_caller()}'] = (parse_rate(rate), burst)
+    if not buckets:
+        return 0
+
+    return get_bucket_store().consume(buckets)
+
+
+class AgentAdmissionThrottle(BaseThrottle):
+    """Per-serial and per-endpoint token buckets for agent endpoints"""
+
+    def get_serial(self, request):
+        serial_number = request.META.get('HTTP_X_TERMINAL_SERIAL')
+        if serial_number:
+            return serial_number
+        # Parse errors propagate so the client gets 400/415, not an empty body
+        data = request.data
+        if hasattr(data, 'get'):
+            return data.get('serial_number')
+        return None
+
+    def allow_request(self, request, view):
+        name = request.resolver_match.url_name if request.resolver_match else None
+        self.wait_time = admission_wait(
+            name, lambda: self.get_serial(request) or self.get_ident(request)
+        )
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
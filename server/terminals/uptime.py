@@ -0,0 +1,170 @@
+"""
+Terminal uptime from status transitions.
+
+``TerminalStatusChange`` gets a row only when a terminal's status changes:
+
+- heartbeats: ``LivenessStore.flush`` compares the flushed status with the
+  database row it replaces, at the flushed heartbeat (``record_heartbeat_changes``)
+- the offline sweeper: swept terminals go offline at their last heartbeat
+
+Edits through the API save the database row without the buffered liveness
+values, so the flush still sees (and dates) the heartbeat's status change.
+
+Uptime over any window is then a range scan on ``(terminal, at)`` over a
+handful of rows per terminal: the status at the window start is the last
+change before it, and every change inside the window splits it.
+``sla_report`` compares the uptime of each ``Customer.contract_type`` with
+``settings.TMS_SLA_TARGETS``.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .availability import day_start
+from .counters import terminals_changed
+from .models import Customer, Terminal, TerminalStatusChange
+
+UP_STATUSES = ('online',)
+
+
+def record_changes(changes, customers, batch_size=500):
+    """
+    Write ``TerminalStatusChange`` instances and move the fleet counters (see
+    ``terminals.counters``); ``customers`` maps their terminals to customers.
+    Returns how many were written.
+    """
+    terminals_changed([
+        ((customers[change.terminal_id], change.from_status), (customers[change.terminal_id], change.to_status))
+        for change in changes
+    ])
+    return len(TerminalStatusChange.objects.bulk_create(changes, batch_size=batch_size))
+
+
+def record_heartbeat_changes(pending, batch_size=500):
+    """
+    Record the status changes of flushed heartbeats (``{terminal_id:
+    liveness values}``) against the database rows they are about to replace.
+    """
+    rows = Terminal.objects.filter(id__in=list(pending)).order_by().values_list('id', 'customer_id', 'status')
+    changes = []
+    customers = {}
+    for terminal_id, customer_id, previous in rows:
+        values = pending[terminal_id]
+        current, heartbeat = values.get('status'), values.get('last_heartbeat')
+        if current and heartbeat is not None and current != previous:
+            changes.append(TerminalStatusChange(
+                terminal_id=terminal_id, from_status=previous, to_status=current, at=heartbeat
+            ))
+            customers[terminal_id] = customer_id
+    return record_changes(changes, customers, batch_size)
+
+
+def uptime(terminals, start, end, fields=()):
+    """
+    Seconds online out of seconds expected in ``[start, end)`` for each
+    terminal of the ``terminals`` queryset, in two queries.
+
+    Expected time starts when the terminal was created and stops now.
+    Returns ``{terminal_id: {'online_seconds', 'expected_seconds', **fields}}``
+    where ``fields`` are extra ``values()`` lookups of the terminal.
+    """
+    end = min(end, timezone.now())
+    status_at_start = TerminalStatusChange.objects.filter(
+        terminal=OuterRef('pk'), at__lt=start
+    ).order_by('-at').values('to_status')[:1]
+    rows = terminals.order_by().annotate(status_at_start=Subquery(status_at_start)).values(
+        'id', 'status', 'created_at', 'status_at_start', *fields
+    )
+    changes = {}
+    for terminal_id, from_status, to_status, at in TerminalStatusChange.objects.filter(
+        terminal__in=terminals.order_by().values('pk'), at__gte=start, at__lt=end
+    ).order_by('terminal_id', 'at').values_list('terminal_id', 'from_status', 'to_status', 'at'):
+        changes.setdefault(terminal_id, []).append((from_status, to_status, at))
+
+    result = {}
+    for row in rows:
+        terminal_changes = changes.get(row['id'], [])
+        # Without earlier history the first change tells the starting status
+        status = row['status_at_start'] or (terminal_changes[0][0] if terminal_changes else row['status'])
+        cursor = max(start, row['created_at'])
+        online = timedelta()
+        for _, to_status, at in terminal_changes:
+            if at > cursor:
+                if status in UP_STATUSES:
+                    online += at - cursor
+                cursor = at
+            status = to_status
+        if status in UP_STATUSES and end > cursor:
+            online += end - cursor
+        expected = max(end - max(start, row['created_at']), timedelta())
+        result[row['id']] = {
+            'online_seconds': round(online.total_seconds()),
+            'expected_seconds': round(expected.total_seconds()),
+            **{field: row[field] for field in fields},
+        }
+    return result
+
+
+def _uptime_rate(online, expected):
+    return round(online / expected * 100, 3) if expected else None
+
+
+def sla_report(start, end, customer_id=None):
+    """
+    Uptime per contract type and customer between the ``start`` and ``end``
+    days (inclusive), against the SLA target of each contract type.
+    """
+    terminals = Terminal.objects.all()
+    if customer_id is not None:
+        terminals = terminals.filter(customer_id=customer_id)
+    per_terminal = uptime(
+        terminals, day_start(start), day_start(end + timedelta(days=1)),
+        fields=('customer_id', 'customer__company_name', 'customer__contract_type')
+    )
+
+    customers = {}
+    for values in per_terminal.values():
+        entry = customers.setdefault(values['customer_id'], {
+            'customer_id': values['customer_id'],
+            'company_name': values['customer__company_name'],
+            'contract_type': values['customer__contract_type'],
+            'terminals': 0, 'terminals_below_target': 0, 'online_seconds': 0, 'expected_seconds': 0,
+        })
+        target = settings.TMS_SLA_TARGETS.get(entry['contract_type'])
+        rate = _uptime_rate(values['online_seconds'], values['expected_seconds'])
+        entry['terminals'] += 1
+        entry['terminals_below_target'] += int(target is not None and rate is not None and rate < target)
+        entry['online_seconds'] += values['online_seconds']
+        entry['expected_seconds'] += values['expected_seconds']
+
+    by_contract = {}
+    for entry in sorted(customers.values(), key=lambda entry: entry['company_name']):
+        by_contract.setdefault(entry.pop('contract_type'), []).append(entry)
+
+    data = []
+    for contract_type, _ in Customer.CONTRACT_TYPE_CHOICES:
+        members = by_contract.get(contract_type)
+        if not members:
+            continue
+        target = settings.TMS_SLA_TARGETS.get(contract_type)
+        for entry in members:
+            entry['uptime'] = _uptime_rate(entry['online_seconds'], entry['expected_seconds'])
+            entry['met'] = None if target is None or entry['uptime'] is None else entry['uptime'] >= target
+        online = sum(entry['online_seconds'] for entry in members)
+        expected = sum(entry['expected_seconds'] for entry in members)
+        rate = _uptime_rate(online, expected)
+        data.append({
+            'contract_type': contract_type,
+            'target': target,
+            'uptime': rate,
+            'met': None if target is None or rate is None else rate >= target,
+            'terminals': sum(entry['terminals'] for entry in members),
+            'terminals_below_target': sum(entry['terminals_below_target'] for entry in members),
+            'customers_below_target': sum(1 for entry in members if entry['met'] is False),
+            'online_seconds': online,
+            'expected_seconds': expected,
+            'customers': members,
+        })
+    return data
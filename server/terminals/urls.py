@@ -1,12 +1,17 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
+
+# Agent ingestion endpoints; the async variants are meant for ASGI servers
+agent_views = async_views if settings.TMS_AGENT_ASYNC_VIEWS else views
 
 router = DefaultRouter()
 router.register(r'terminals', views.TerminalViewSet, basename='terminal')
 router.register(r'alerts', views.AlertViewSet, basename='alert')
 router.register(r'customers', views.CustomerViewSet, basename='customer')
 router.register(r'firmware', views.FirmwareVersionViewSet, basename='firmware')
+router.register(r'deployments', views.DeploymentViewSet, basename='deployment')
 
 urlpatterns = [
     path('auth/login', views.login_view, name='login'),
@@ -14,12 +19,22 @@ urlpatterns = [
     path('auth/logout', views.logout_view, name='logout'),
     
     path('agent/register', views.agent_register_view, name='agent-register'),
-    path('agent/heartbeat', views.agent_heartbeat_view, name='agent-heartbeat'),
-    path('agent/logs', views.agent_logs_view, name='agent-logs'),
-    path('agent/commands/<int:command_id>/result', views.agent_command_result_view, name='agent-command-result'),
+    path('agent/heartbeat', agent_views.agent_heartbeat_view, name='agent-heartbeat'),
+    path('agent/heartbeat/batch', views.agent_heartbeat_batch_view, name='agent-heartbeat-batch'),
+    path('agent/logs', agent_views.agent_logs_view, name='agent-logs'),
+    # Long-polls park a coroutine; a WSGI worker thread would be held for the whole wait
+    *([path('agent/commands/wait', async_views.agent_command_wait_view, name='agent-command-wait')]
+      if settings.TMS_AGENT_ASYNC_VIEWS else []),
+    path('agent/commands/<int:command_id>/result', agent_views.agent_command_result_view, name='agent-command-result'),
+    path('agent/firmware/<int:firmware_id>/download', views.agent_firmware_download_view,
+         name='agent-firmware-download'),
+    path('agent/firmware/patches/<int:patch_id>/download', views.agent_firmware_patch_download_view,
+         name='agent-firmware-patch-download'),
+    path('agent/resolver/stats', views.agent_resolver_stats_view, name='agent-resolver-stats'),
     
     path('reports/summary', views.reports_summary_view, name='reports-summary'),
     path('reports/availability', views.reports_availability_view, name='reports-availability'),
+    path('reports/sla', views.reports_sla_view, name='reports-sla'),
     
     path('', include(router.urls)),
 ]
@@ -1,21 +1,46 @@
 from rest_framework import viewsets, status, generics
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, parser_classes, permission_classes, throttle_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db import IntegrityError, transaction
 from django.db.models import Q, Count
+import time
 from datetime import timedelta
+from .alerting import raise_alerts
+from .availability import GRANULARITIES as AVAILABILITY_GRANULARITIES, availability_report
+from .deployments import (
+    annotate_progress, create_deployment, materialize_for, pause_deployment, record_task_result,
+    resume_deployment, wave_count
+)
+from .counters import fleet_counts
+from .dispatch import claim_commands, mark_pending_on_commit
+from .blobstore import get_blob_store
+from .downloads import serve_file, serve_firmware
+from .liveness import get_store as get_liveness_store
+from .metrics import build_sample, metric_history, sample_time
+from .parsers import AGENT_PARSER_CLASSES
+from .resolver import get_resolver
+from .scheduling import get_scheduler
+from .stats import rate
+from .throttling import AgentAdmissionThrottle
+from .uptime import sla_report
 from .models import (
-    TMSUser, Customer, Terminal, Alert, FirmwareVersion,
-    UpdateTask, TerminalLog, AuditLog
+    TMSUser, Customer, Terminal, Alert, FirmwareVersion, FirmwarePatch,
+    Deployment, UpdateTask, TerminalLog, TerminalMetricSample, AuditLog
 )
 from .serializers import (
     TMSUserSerializer, LoginSerializer, CustomerSerializer,
     TerminalListSerializer, TerminalDetailSerializer, AlertSerializer,
-    FirmwareVersionSerializer, UpdateTaskSerializer, TerminalLogSerializer,
-    AgentRegisterSerializer, AgentHeartbeatSerializer, AgentLogsSerializer,
+    FirmwareVersionSerializer, FirmwareDeploySerializer, DeploymentSerializer,
+    UpdateTaskSerializer, TerminalLogSerializer,
+    AgentRegisterSerializer, AgentHeartbeatSerializer, AgentHeartbeatDeltaSerializer,
+    AgentHeartbeatBatchSerializer,
+    AgentLogSerializer, AgentLogsEnvelopeSerializer,
     CommandResultSerializer, TerminalConfigUpdateSerializer, TerminalCommandSerializer
 )
 
@@ -26,6 +51,86 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 100
 
 
+# Rarely changing columns reported by heartbeats; written only when they differ
+HEARTBEAT_IDENTITY_FIELDS = ['firmware_version', 'agent_version', 'ip_address']
+HEARTBEAT_METRIC_FIELDS = ['cpu_usage', 'memory_usage', 'disk_usage', 'temperature']
+
+
+def _liveness_values(data, now):
+    """Heartbeat values buffered in the liveness store"""
+    return {
+        'last_heartbeat': now,
+        'status': data['status'],
+        'cpu_usage': data['metrics']['cpu_usage'],
+        'memory_usage': data['metrics']['memory_usage'],
+        'disk_usage': data['metrics']['disk_usage'],
+        'temperature': data['metrics'].get('temperature'),
+    }
+
+
+def _identity_values(data):
+    return {field: data.get(field) for field in HEARTBEAT_IDENTITY_FIELDS}
+
+
+def _identity_changed(previous, identity):
+    """Compare with the last recorded heartbeat; unknown counts as changed"""
+    return any(field not in previous or previous[field] != value for field, value in identity.items())
+
+
+def _is_delta(request_data):
+    """Delta heartbeats are marked with an explicit ``"full": false``"""
+    return hasattr(request_data, 'get') and request_data.get('full') is False
+
+
+def _apply_delta(previous, delta):
+    """
+    Rebuild a full heartbeat from the last recorded values and a delta
+
+    Metrics are merged field by field, so an agent only sends the ones that
+    moved beyond its deadband.
+    """
+    data = {field: previous.get(field) for field in HEARTBEAT_IDENTITY_FIELDS}
+    data['status'] = previous.get('status')
+    data['metrics'] = {field: previous.get(field) for field in HEARTBEAT_METRIC_FIELDS}
+    data.update({field: value for field, value in delta.items() if field != 'metrics'})
+    data['metrics'].update(delta.get('metrics', {}))
+    return data
+
+
+def _resync_required(serial_number, expected):
+    return Response({
+        'error': {
+            'code': 'SYNC_001',
+            'message': 'Full heartbeat required',
+            'details': f'No heartbeat state for {serial_number} continues this delta'
+                       + (f' (expected seq {expected})' if expected is not None else '')
+        }
+    }, status=status.HTTP_409_CONFLICT)
+
+
+def _terminal_not_found(serial_number):
+    return Response({
+        'error': {
+            'code': 'RES_001',
+            'message': 'Terminal not found',
+            'details': f'Terminal with serial number {serial_number} does not exist'
+        }
+    }, status=status.HTTP_404_NOT_FOUND)
+
+
+def _parse_datetime_param(value, default):
+    """Parse an ISO 8601 query parameter; None if invalid"""
+    if not value:
+        return default
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def login_view(request):
@@ -101,6 +206,8 @@ def logout_view(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AgentAdmissionThrottle])
+@parser_classes(AGENT_PARSER_CLASSES)
 def agent_register_view(request):
     """Agent registration endpoint"""
     serializer = AgentRegisterSerializer(data=request.data)
@@ -148,9 +255,25 @@ def agent_register_view(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AgentAdmissionThrottle])
+@parser_classes(AGENT_PARSER_CLASSES)
 def agent_heartbeat_view(request):
-    """Agent heartbeat endpoint"""
-    serializer = AgentHeartbeatSerializer(data=request.data)
+    """
+    Agent heartbeat endpoint
+
+    Agents that send ``seq`` may follow a full heartbeat with deltas
+    (``"full": false``) carrying only changed fields. A delta must continue
+    the last recorded seq, otherwise 409 ``SYNC_001`` asks for a full
+    heartbeat. Deltas without metrics do not write a metric sample.
+
+    The seq lives in the liveness store, so with the ``local`` backend a
+    delta only continues in the process that took the previous heartbeat;
+    other processes answer ``SYNC_001`` (see ``terminals.liveness``).
+    """
+    started = time.monotonic()
+    delta = _is_delta(request.data)
+    serializer_class = AgentHeartbeatDeltaSerializer if delta else AgentHeartbeatSerializer
+    serializer = serializer_class(data=request.data)
     if not serializer.is_valid():
         return Response({
             'error': {
@@ -163,80 +286,228 @@ def agent_heartbeat_view(request):
     data = serializer.validated_data
     serial_number = data['serial_number']
     
-    try:
-        terminal = Terminal.objects.get(serial_number=serial_number)
-    except Terminal.DoesNotExist:
+    resolver = get_resolver()
+    ref = resolver.resolve(serial_number)
+    if ref is None:
+        return _terminal_not_found(serial_number)
+    
+    now = timezone.now()
+    store = get_liveness_store()
+    previous = store.get_many([ref.terminal_id]).get(ref.terminal_id, {})
+    write_sample = True
+    if delta:
+        expected = previous.get('heartbeat_seq')
+        if expected is None or data['seq'] != expected + 1:
+            return _resync_required(serial_number, None if expected is None else expected + 1)
+        write_sample = 'metrics' in data
+        data = _apply_delta(previous, data)
+    
+    identity = _identity_values(data)
+    identity_changed = _identity_changed(previous, identity)
+    if identity_changed or write_sample:
+        try:
+            with transaction.atomic():
+                if identity_changed:
+                    Terminal.objects.filter(pk=ref.terminal_id).update(**identity)
+                if write_sample:
+                    build_sample(ref.terminal_id, data['metrics'], now).save()
+        except IntegrityError:
+            # Deleted in another process before the invalidation reached this one
+            resolver.invalidate(serial_number)
+            return _terminal_not_found(serial_number)
+    
+    store.record(ref.terminal_id, {
+        **_liveness_values(data, now), **identity, 'heartbeat_seq': data.get('seq')
+    })
+    
+    materialize_for([ref], now)
+    commands = claim_commands([ref.terminal_id], now)[ref.terminal_id]
+    
+    scheduler = get_scheduler()
+    scheduler.record_latency(time.monotonic() - started)
+    
+    return Response({
+        'status': 'acknowledged',
+        'server_time': timezone.now().isoformat(),
+        'commands': commands,
+        'next_heartbeat': scheduler.next_delay(ref.terminal_id, ref.heartbeat_interval, now.timestamp())
+    })
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([AgentAdmissionThrottle])
+@parser_classes(AGENT_PARSER_CLASSES)
+def agent_heartbeat_batch_view(request):
+    """
+    Agent batched heartbeat endpoint (constant query count per batch)
+
+    Batched heartbeats are full heartbeats: each records its ``seq``, or
+    clears the recorded one, like ``agent_heartbeat_view``. A replaying agent
+    may send several for one terminal: every one is kept as a metric sample
+    at its reported time, and the newest sets the terminal's liveness state.
+    """
+    serializer = AgentHeartbeatBatchSerializer(data=request.data)
+    if not serializer.is_valid():
         return Response({
             'error': {
-                'code': 'RES_001',
-                'message': 'Terminal not found',
-                'details': f'Terminal with serial number {serial_number} does not exist'
+                'code': 'VAL_001',
+                'message': 'Validation error',
+                'field_errors': serializer.errors
             }
-        }, status=status.HTTP_404_NOT_FOUND)
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
     
-    terminal.status = data['status']
-    terminal.last_heartbeat = timezone.now()
-    terminal.cpu_usage = data['metrics']['cpu_usage']
-    terminal.memory_usage = data['metrics']['memory_usage']
-    terminal.disk_usage = data['metrics']['disk_usage']
-    terminal.temperature = data['metrics'].get('temperature')
-    terminal.firmware_version = data['firmware_version']
-    terminal.agent_version = data['agent_version']
-    terminal.ip_address = data.get('ip_address')
-    terminal.save()
-    
-    TerminalLog.objects.create(
-        terminal=terminal,
-        log_type='heartbeat',
-        log_level='INFO',
-        message=f'Heartbeat received from {serial_number}',
-        details={
-            'cpu_usage': data['metrics']['cpu_usage'],
-            'memory_usage': data['metrics']['memory_usage'],
-            'disk_usage': data['metrics']['disk_usage']
-        }
-    )
+    heartbeats = serializer.validated_data['heartbeats']
+    max_size = settings.TMS_HEARTBEAT_BATCH_MAX_SIZE
+    if len(heartbeats) > max_size:
+        return Response({
+            'error': {
+                'code': 'VAL_002',
+                'message': 'Batch too large',
+                'details': f'At most {max_size} heartbeats are accepted per request'
+            }
+        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
     
-    pending_commands = UpdateTask.objects.filter(
-        terminal=terminal,
-        status='pending'
-    ).order_by('priority', 'scheduled_at')[:5]
+    latest = {}
+    for heartbeat in heartbeats:
+        current = latest.get(heartbeat['serial_number'])
+        if current is None or heartbeat['timestamp'] >= current['timestamp']:
+            latest[heartbeat['serial_number']] = heartbeat
     
-    commands = []
-    for task in pending_commands:
-        command = {
-            'id': task.id,
-            'type': task.task_type,
-            'priority': 'high' if task.priority <= 3 else 'normal',
-            'parameters': task.parameters or {}
+    resolver = get_resolver()
+    now = timezone.now()
+    store = get_liveness_store()
+    for _ in range(2):
+        refs = resolver.resolve_many(list(latest))
+        identities = {serial_number: _identity_values(latest[serial_number]) for serial_number in refs}
+        previous = store.get_many([ref.terminal_id for ref in refs.values()])
+        try:
+            with transaction.atomic():
+                changed = [
+                    Terminal(id=ref.terminal_id, **identities[serial_number])
+                    for serial_number, ref in refs.items()
+                    if _identity_changed(previous.get(ref.terminal_id, {}), identities[serial_number])
+                ]
+                if changed:
+                    Terminal.objects.bulk_update(changed, HEARTBEAT_IDENTITY_FIELDS)
+                
+                TerminalMetricSample.objects.bulk_create([
+                    build_sample(
+                        refs[heartbeat['serial_number']].terminal_id, heartbeat['metrics'],
+                        sample_time(heartbeat['timestamp'], now)
+                    )
+                    for heartbeat in heartbeats if heartbeat['serial_number'] in refs
+                ])
+            break
+        except IntegrityError:
+            # A terminal was deleted in another process before the invalidation
+            # reached this one; resolve the batch again without it
+            resolver.invalidate(*refs)
+    else:
+        return Response({
+            'error': {
+                'code': 'SYS_001',
+                'message': 'Server error',
+                'details': 'Terminals of this batch changed while it was written, please retry'
+            }
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    store.record_many({
+        ref.terminal_id: {
+            **_liveness_values(latest[serial_number], now), **identities[serial_number],
+            'heartbeat_seq': latest[serial_number].get('seq')
         }
-        
-        if task.task_type == 'firmware' and task.firmware_version:
-            command['parameters'].update({
-                'version': task.firmware_version.version,
-                'url': task.firmware_version.file_url,
-                'checksum': f'sha256:{task.firmware_version.file_hash}',
-                'size': task.firmware_version.file_size
+        for serial_number, ref in refs.items()
+    })
+    materialize_for(refs.values(), now)
+    commands = claim_commands([ref.terminal_id for ref in refs.values()], now)
+    
+    scheduler = get_scheduler()
+    results = []
+    for serial_number in latest:
+        ref = refs.get(serial_number)
+        if ref is None:
+            results.append({
+                'serial_number': serial_number,
+                'status': 'error',
+                'error': {
+                    'code': 'RES_001',
+                    'message': 'Terminal not found'
+                }
             })
-        
-        commands.append(command)
-        task.status = 'running'
-        task.started_at = timezone.now()
-        task.save()
+            continue
+        results.append({
+            'serial_number': serial_number,
+            'status': 'acknowledged',
+            'commands': commands[ref.terminal_id],
+            'next_heartbeat': scheduler.next_delay(ref.terminal_id, ref.heartbeat_interval, now.timestamp())
+        })
     
     return Response({
         'status': 'acknowledged',
         'server_time': timezone.now().isoformat(),
-        'commands': commands,
-        'next_heartbeat': terminal.heartbeat_interval
+        'accepted': len(refs),
+        'rejected': len(latest) - len(refs),
+        'results': results
     })
 
 
+def _store_agent_logs(terminal_id, raw_logs):
+    """
+    Validate and insert log entries chunk by chunk in one transaction
+
+    Returns ``(log_ids, None)``, or ``(None, field_errors)`` when an entry is
+    invalid (nothing is inserted then).
+    """
+    log_ids = []
+    chunk_size = settings.TMS_AGENT_LOGS_CHUNK_SIZE
+    with transaction.atomic():
+        for offset in range(0, len(raw_logs), chunk_size):
+            chunk = AgentLogSerializer(data=raw_logs[offset:offset + chunk_size], many=True)
+            if not chunk.is_valid():
+                transaction.set_rollback(True)
+                return None, {
+                    'logs': {
+                        str(offset + index): errors
+                        for index, errors in enumerate(chunk.errors) if errors
+                    }
+                }
+            
+            logs = []
+            alerts = []
+            for log_data in chunk.validated_data:
+                logs.append(TerminalLog(
+                    terminal_id=terminal_id,
+                    log_type=log_data['type'],
+                    log_level=log_data['level'],
+                    message=log_data['message'],
+                    details=log_data.get('details')
+                ))
+                
+                if log_data['level'] in ['ERROR', 'CRITICAL']:
+                    alerts.append(Alert(
+                        terminal_id=terminal_id,
+                        alert_type='error',
+                        severity='HIGH' if log_data['level'] == 'ERROR' else 'CRITICAL',
+                        title=f"{log_data['level']}: {log_data['type']}",
+                        message=log_data['message'],
+                        details=log_data.get('details')
+                    ))
+            
+            TerminalLog.objects.bulk_create(logs)
+            raise_alerts(alerts)
+            log_ids.extend(log.id for log in logs)
+    
+    return log_ids, None
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AgentAdmissionThrottle])
+@parser_classes(AGENT_PARSER_CLASSES)
 def agent_logs_view(request):
-    """Agent logs submission endpoint"""
-    serializer = AgentLogsSerializer(data=request.data)
+    """Agent logs submission endpoint (validated and inserted in chunks, one transaction)"""
+    serializer = AgentLogsEnvelopeSerializer(data=request.data)
     if not serializer.is_valid():
         return Response({
             'error': {
@@ -246,39 +517,38 @@ def agent_logs_view(request):
             }
         }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
     
-    data = serializer.validated_data
-    serial_number = data['serial_number']
+    serial_number = serializer.validated_data['serial_number']
+    raw_logs = serializer.validated_data['logs']
     
-    try:
-        terminal = Terminal.objects.get(serial_number=serial_number)
-    except Terminal.DoesNotExist:
+    max_size = settings.TMS_AGENT_LOGS_MAX_BATCH_SIZE
+    if len(raw_logs) > max_size:
         return Response({
             'error': {
-                'code': 'RES_001',
-                'message': 'Terminal not found'
+                'code': 'VAL_002',
+                'message': 'Batch too large',
+                'details': f'At most {max_size} log entries are accepted per request'
             }
-        }, status=status.HTTP_404_NOT_FOUND)
+        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
     
-    log_ids = []
-    for log_data in data['logs']:
-        log = TerminalLog.objects.create(
-            terminal=terminal,
-            log_type=log_data['type'],
-            log_level=log_data['level'],
-            message=log_data['message'],
-            details=log_data.get('details')
-        )
-        log_ids.append(log.id)
-        
-        if log_data['level'] in ['ERROR', 'CRITICAL']:
-            Alert.objects.create(
-                terminal=terminal,
-                alert_type='error',
-                severity='HIGH' if log_data['level'] == 'ERROR' else 'CRITICAL',
-                title=f"{log_data['level']}: {log_data['type']}",
-                message=log_data['message'],
-                details=log_data.get('details')
-            )
+    resolver = get_resolver()
+    ref = resolver.resolve(serial_number)
+    if ref is None:
+        return _terminal_not_found(serial_number)
+    
+    try:
+        log_ids, field_errors = _store_agent_logs(ref.terminal_id, raw_logs)
+    except IntegrityError:
+        resolver.invalidate(serial_number)
+        return _terminal_not_found(serial_number)
+    
+    if field_errors:
+        return Response({
+            'error': {
+                'code': 'VAL_001',
+                'message': 'Validation error',
+                'field_errors': field_errors
+            }
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
     
     return Response({
         'status': 'received',
@@ -287,8 +557,33 @@ def agent_logs_view(request):
     })
 
 
+def _apply_command_result(task, data):
+    """
+    Update ``task`` (unsaved) from a reported result
+
+    Returns the firmware version now installed on the terminal, if the
+    result completes a firmware update.
+    """
+    task.status = data['status']
+    task.started_at = data['started_at']
+    task.completed_at = data['completed_at']
+    
+    if data['status'] == 'completed':
+        task.progress = 100
+        if task.task_type == 'firmware' and task.firmware_version:
+            return task.firmware_version.version
+    elif data['status'] == 'failed':
+        task.error_message = data.get('result', {}).get('message', 'Unknown error')
+        if task.retry_count < task.max_retries:
+            task.retry_count += 1
+            task.status = 'pending'
+    return None
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AgentAdmissionThrottle])
+@parser_classes(AGENT_PARSER_CLASSES)
 def agent_command_result_view(request, command_id):
     """Agent command result endpoint"""
     serializer = CommandResultSerializer(data=request.data)
@@ -304,7 +599,7 @@ def agent_command_result_view(request, command_id):
     data = serializer.validated_data
     
     try:
-        task = UpdateTask.objects.get(id=command_id)
+        task = UpdateTask.objects.select_related('firmware_version', 'deployment').get(id=command_id)
     except UpdateTask.DoesNotExist:
         return Response({
             'error': {
@@ -313,26 +608,64 @@ def agent_command_result_view(request, command_id):
             }
         }, status=status.HTTP_404_NOT_FOUND)
     
-    task.status = data['status']
-    task.started_at = data['started_at']
-    task.completed_at = data['completed_at']
-    
-    if data['status'] == 'completed':
-        task.progress = 100
-        if task.task_type == 'firmware' and task.firmware_version:
-            task.terminal.firmware_version = task.firmware_version.version
-            task.terminal.save()
-    elif data['status'] == 'failed':
-        task.error_message = data.get('result', {}).get('message', 'Unknown error')
-        if task.retry_count < task.max_retries:
-            task.retry_count += 1
-            task.status = 'pending'
+    installed_version = _apply_command_result(task, data)
+    if installed_version:
+        Terminal.objects.filter(pk=task.terminal_id).update(firmware_version=installed_version)
     
     task.save()
+    if task.status == 'pending':
+        mark_pending_on_commit([task.terminal_id])
+    record_task_result(task)
     
     return Response({'status': 'acknowledged'})
 
 
+@api_view(['GET', 'HEAD'])
+@permission_classes([AllowAny])
+@throttle_classes([AgentAdmissionThrottle])
+def agent_firmware_download_view(request, firmware_id):
+    """
+    Agent firmware download endpoint
+    
+    Supports Range, If-Range and If-None-Match; the ETag is the image's
+    SHA-256 (see terminals.downloads).
+    """
+    firmware = FirmwareVersion.objects.filter(pk=firmware_id).first()
+    response = serve_firmware(request, firmware) if firmware else None
+    if response is None:
+        return Response({
+            'error': {
+                'code': 'RES_001',
+                'message': 'Firmware not found'
+            }
+        }, status=status.HTTP_404_NOT_FOUND)
+    return response
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([AllowAny])
+@throttle_classes([AgentAdmissionThrottle])
+def agent_firmware_patch_download_view(request, patch_id):
+    """Agent firmware patch download endpoint (see terminals.patches)"""
+    patch = FirmwarePatch.objects.filter(pk=patch_id, status='ready').first()
+    path = get_blob_store().path(patch.file_hash) if patch else None
+    if path is None or not path.is_file():
+        return Response({
+            'error': {
+                'code': 'RES_001',
+                'message': 'Firmware patch not found'
+            }
+        }, status=status.HTTP_404_NOT_FOUND)
+    return serve_file(request, path, f'"{patch.file_hash}"', f'patch-{patch.id}.delta')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def agent_resolver_stats_view(request):
+    """Serial resolution cache counters for this server process"""
+    return Response(get_resolver().stats())
+
+
 class TerminalViewSet(viewsets.ModelViewSet):
     """ViewSet for Terminal management"""
     queryset = Terminal.objects.all()
@@ -373,6 +706,51 @@ class TerminalViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def get_object(self):
+        terminal = super().get_object()
+        if self.request.method in SAFE_METHODS:
+            get_liveness_store().apply([terminal])
+        return terminal
+    
+    def perform_update(self, serializer):
+        # Edits save the database row without buffered heartbeat values: the
+        # flush writes those and records their status change at the heartbeat
+        serializer.save()
+        get_liveness_store().apply([serializer.instance])
+    
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            get_liveness_store().apply(page)
+        return page
+    
+    @action(detail=True, methods=['get'])
+    def metrics(self, request, pk=None):
+        """Metric history, served from the tier that fits the requested range"""
+        terminal = self.get_object()
+        
+        now = timezone.now()
+        start = _parse_datetime_param(request.query_params.get('from_date'), now - timedelta(hours=24))
+        end = _parse_datetime_param(request.query_params.get('to_date'), now)
+        resolution = request.query_params.get('resolution')
+        
+        if start is None or end is None or start >= end or resolution not in (None, 'raw', 'hour', 'day'):
+            return Response({
+                'error': {
+                    'code': 'VAL_001',
+                    'message': 'Invalid from_date, to_date or resolution'
+                }
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        history = metric_history(terminal.id, start, end, resolution)
+        
+        return Response({
+            'terminal_id': terminal.id,
+            'from_date': start,
+            'to_date': end,
+            **history
+        })
+    
     @action(detail=True, methods=['put'])
     def config(self, request, pk=None):
         """Update terminal configuration"""
@@ -407,6 +785,7 @@ class TerminalViewSet(viewsets.ModelViewSet):
             priority=5,
             created_by=request.user.username
         )
+        mark_pending_on_commit([terminal.id])
         
         return Response({
             'status': 'updated',
@@ -443,6 +822,7 @@ class TerminalViewSet(viewsets.ModelViewSet):
             scheduled_at=data.get('scheduled_at'),
             created_by=request.user.username
         )
+        mark_pending_on_commit([terminal.id])
         
         return Response({
             'command_id': task.id,
@@ -528,55 +908,93 @@ class FirmwareVersionViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def deploy(self, request, pk=None):
-        """Deploy firmware to terminals"""
+        """
+        Deploy firmware to terminals
+        
+        Records a Deployment; per-terminal tasks are created on contact or by
+        the materialize_deployments worker (see terminals.deployments).
+        """
         firmware = self.get_object()
         
-        target_terminals = request.data.get('target_terminals', 'all')
-        schedule = request.data.get('schedule', {})
-        
-        if target_terminals == 'all':
-            terminals = Terminal.objects.filter(status='online')
-        elif target_terminals == 'customer':
-            customer_ids = request.data.get('customer_ids', [])
-            terminals = Terminal.objects.filter(customer_id__in=customer_ids, status='online')
-        elif target_terminals == 'selected':
-            terminal_ids = request.data.get('terminal_ids', [])
-            terminals = Terminal.objects.filter(id__in=terminal_ids, status='online')
-        else:
+        serializer = FirmwareDeploySerializer(data=request.data)
+        if not serializer.is_valid():
             return Response({
                 'error': {
                     'code': 'VAL_001',
-                    'message': 'Invalid target_terminals value'
+                    'message': 'Invalid deployment request',
+                    'field_errors': serializer.errors
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        scheduled_at = schedule.get('start_at')
-        if schedule.get('type') == 'immediate':
-            scheduled_at = timezone.now()
-        
-        tasks = []
-        for terminal in terminals:
-            task = UpdateTask.objects.create(
-                terminal=terminal,
-                task_type='firmware',
-                firmware_version=firmware,
-                status='pending',
-                priority=3,
-                scheduled_at=scheduled_at,
-                created_by=request.user.username
-            )
-            tasks.append(task)
+        data = serializer.validated_data
+        target_ids = {
+            'customer': data['customer_ids'],
+            'selected': data['terminal_ids'],
+        }.get(data['target_terminals'], [])
+        deployment = create_deployment(
+            firmware,
+            data['target_terminals'],
+            target_ids,
+            schedule=data['schedule'],
+            created_by=request.user.username,
+            canary_percent=data.get('canary_percent'),
+            wave_growth=data.get('wave_growth'),
+            max_concurrent=data.get('max_concurrent', data['schedule'].get('batch_size')),
+            max_failure_rate=data.get('max_failure_rate')
+        )
+        scheduled_at = deployment.scheduled_at
         
         return Response({
-            'deployment_id': tasks[0].id if tasks else None,
+            'deployment_id': deployment.id,
             'firmware_id': firmware.id,
-            'total_terminals': len(tasks),
-            'status': 'scheduled',
+            'total_terminals': deployment.total_terminals,
+            'status': deployment.status,
+            'waves': wave_count(deployment),
             'scheduled_at': scheduled_at,
             'estimated_completion': scheduled_at + timedelta(hours=2) if scheduled_at else None
         }, status=status.HTTP_201_CREATED)
 
 
+class DeploymentViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for firmware deployments and their progress"""
+    serializer_class = DeploymentSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = StandardResultsSetPagination
+    
+    def get_queryset(self):
+        queryset = annotate_progress(Deployment.objects.select_related('firmware_version'))
+        
+        status_filter = self.request.query_params.get('status')
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        
+        return queryset.order_by('-created_at')
+    
+    @action(detail=True, methods=['post'])
+    def pause(self, request, pk=None):
+        """Stop handing out the rollout's remaining tasks"""
+        deployment = self.get_object()
+        if not pause_deployment(deployment, request.data.get('reason') or f'Paused by {request.user.username}'):
+            return self._invalid_state(deployment)
+        return Response(self.get_serializer(self.get_object()).data)
+    
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        """Continue a paused rollout, accepting the current wave's failures so far"""
+        deployment = self.get_object()
+        if not resume_deployment(deployment):
+            return self._invalid_state(deployment)
+        return Response(self.get_serializer(self.get_object()).data)
+    
+    def _invalid_state(self, deployment):
+        return Response({
+            'error': {
+                'code': 'VAL_001',
+                'message': f'Deployment is {deployment.status}'
+            }
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def reports_summary_view(request):
@@ -595,16 +1013,25 @@ def reports_summary_view(request):
     else:
         from_date = timezone.now().date() - timedelta(days=30)
     
-    terminals = Terminal.objects.all()
-    if customer_id:
-        terminals = terminals.filter(customer_id=customer_id)
+    try:
+        customer_id = int(customer_id) if customer_id else None
+    except ValueError:
+        return Response({
+            'error': {
+                'code': 'VAL_001',
+                'message': 'Invalid customer_id'
+            }
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    total_terminals = terminals.count()
-    online_terminals = terminals.filter(status='online').count()
-    offline_terminals = terminals.filter(status='offline').count()
-    error_terminals = terminals.filter(status='error').count()
+    customers = list(Customer.objects.all())
+    stats = fleet_counts(customer.id for customer in customers)
+    overall = stats.overall if customer_id is None else stats.customer(customer_id)
+    total_terminals = overall['total']
+    online_terminals = overall['online']
+    offline_terminals = overall['offline']
+    error_terminals = overall['error']
     
-    availability_rate = (online_terminals / total_terminals * 100) if total_terminals > 0 else 0
+    availability_rate = rate(online_terminals, total_terminals)
     
     alerts = Alert.objects.filter(created_at__gte=from_date)
     if customer_id:
@@ -622,17 +1049,14 @@ def reports_summary_view(request):
         issue['percentage'] = (issue['count'] / total_alerts * 100) if total_alerts > 0 else 0
     
     customer_breakdown = []
-    for customer in Customer.objects.all():
-        customer_terminals = terminals.filter(customer=customer)
-        customer_total = customer_terminals.count()
-        customer_online = customer_terminals.filter(status='online').count()
-        online_rate = (customer_online / customer_total * 100) if customer_total > 0 else 0
+    for customer in customers:
+        counts = stats.customer(customer.id)
         
         customer_breakdown.append({
             'customer_id': customer.id,
             'company_name': customer.company_name,
-            'total_terminals': customer_total,
-            'online_rate': round(online_rate, 1)
+            'total_terminals': counts['total'],
+            'online_rate': rate(counts['online'], counts['total'])
         })
     
     return Response({
@@ -644,7 +1068,7 @@ def reports_summary_view(request):
             'online_terminals': online_terminals,
             'offline_terminals': offline_terminals,
             'error_terminals': error_terminals,
-            'availability_rate': round(availability_rate, 1),
+            'availability_rate': availability_rate,
             'total_alerts': total_alerts,
             'resolved_alerts': resolved_alerts,
             'pending_alerts': pending_alerts,
@@ -661,10 +1085,12 @@ def reports_summary_view(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def reports_availability_view(request):
-    """Get availability report"""
+    """Availability report from the daily rollups (fleet, customer or terminal)"""
     from_date = request.query_params.get('from_date')
     to_date = request.query_params.get('to_date')
     granularity = request.query_params.get('granularity', 'daily')
+    customer_id = request.query_params.get('customer_id')
+    terminal_id = request.query_params.get('terminal_id')
     
     if not from_date or not to_date:
         return Response({
@@ -674,14 +1100,64 @@ def reports_availability_view(request):
             }
         }, status=status.HTTP_400_BAD_REQUEST)
     
+    try:
+        start, end = parse_date(from_date), parse_date(to_date)
+        customer_id = int(customer_id) if customer_id else None
+        terminal_id = int(terminal_id) if terminal_id else None
+    except ValueError:
+        start = None
+    if start is None or end is None or start > end or granularity not in AVAILABILITY_GRANULARITIES:
+        return Response({
+            'error': {
+                'code': 'VAL_001',
+                'message': 'Invalid from_date, to_date, granularity, customer_id or terminal_id'
+            }
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    report = availability_report(start, end, granularity, customer_id=customer_id, terminal_id=terminal_id)
+    
     return Response({
-        'from_date': from_date,
-        'to_date': to_date,
+        'from_date': start,
+        'to_date': end,
         'granularity': granularity,
-        'data': [],
-        'summary': {
-            'average_availability': 96.2,
-            'min_availability': 94.5,
-            'max_availability': 98.1
-        }
+        'customer_id': customer_id,
+        'terminal_id': terminal_id,
+        **report
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def reports_sla_view(request):
+    """Uptime per contract type and customer against the SLA targets"""
+    from_date = request.query_params.get('from_date')
+    to_date = request.query_params.get('to_date')
+    customer_id = request.query_params.get('customer_id')
+    
+    if not from_date or not to_date:
+        return Response({
+            'error': {
+                'code': 'VAL_001',
+                'message': 'from_date and to_date are required'
+            }
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        start, end = parse_date(from_date), parse_date(to_date)
+        customer_id = int(customer_id) if customer_id else None
+    except ValueError:
+        start = None
+    if start is None or end is None or start > end:
+        return Response({
+            'error': {
+                'code': 'VAL_001',
+                'message': 'Invalid from_date, to_date or customer_id'
+            }
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'from_date': start,
+        'to_date': end,
+        'customer_id': customer_id,
+        'data': sla_report(start, end, customer_id=customer_id)
     })
@@ -1,11 +1,19 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
 from django.db.models import Q, Count, Avg
 from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from datetime import timedelta
+from .availability import availability_report
+from .blobstore import BlobUploadHandler, UploadedBlob, discard, get_blob_store
+from .counters import alert_counts as unresolved_alert_counts, fleet_counts
+from .liveness import get_store as get_liveness_store
 from .models import Terminal, Customer, Alert, FirmwareVersion, TMSUser, TerminalLog
+from .stats import rate
 import json
 
 
@@ -31,23 +39,25 @@ def logout_view(request):
 
 @login_required
 def dashboard_view(request):
-    total_terminals = Terminal.objects.count()
-    online_terminals = Terminal.objects.filter(status='online').count()
-    offline_terminals = Terminal.objects.filter(status='offline').count()
-    error_terminals = Terminal.objects.filter(status='error').count()
+    customers = list(Customer.objects.all()[:5])
+    stats = fleet_counts(customer.id for customer in customers)
+    total_terminals = stats.overall['total']
+    online_terminals = stats.overall['online']
+    offline_terminals = stats.overall['offline']
+    error_terminals = stats.overall['error']
     
-    online_percentage = round((online_terminals / total_terminals * 100) if total_terminals > 0 else 0, 1)
-    offline_percentage = round((offline_terminals / total_terminals * 100) if total_terminals > 0 else 0, 1)
-    error_percentage = round((error_terminals / total_terminals * 100) if total_terminals > 0 else 0, 1)
+    online_percentage = rate(online_terminals, total_terminals)
+    offline_percentage = rate(offline_terminals, total_terminals)
+    error_percentage = rate(error_terminals, total_terminals)
     
     recent_alerts = Alert.objects.filter(is_resolved=False).select_related('terminal').order_by('-created_at')[:5]
     
     customer_stats = []
-    for customer in Customer.objects.all()[:5]:
-        terminals = Terminal.objects.filter(customer=customer)
-        total = terminals.count()
-        online = terminals.filter(status='online').count()
-        availability_rate = round((online / total * 100) if total > 0 else 0, 1)
+    for customer in customers:
+        counts = stats.customer(customer.id)
+        total = counts['total']
+        online = counts['online']
+        availability_rate = rate(online, total)
         
         if availability_rate >= 99:
             availability_class = 'success'
@@ -65,12 +75,14 @@ def dashboard_view(request):
             'availability_class': availability_class
         })
     
-    chart_labels = []
-    chart_data = []
-    for i in range(6, -1, -1):
-        date = timezone.now().date() - timedelta(days=i)
-        chart_labels.append(date.strftime('%m/%d'))
-        chart_data.append(95 + (i % 3))
+    today = timezone.localdate()
+    days = [today - timedelta(days=i) for i in range(6, -1, -1)]
+    daily = {
+        point['period']: point['availability']
+        for point in availability_report(days[0], today)['data']
+    }
+    chart_labels = [day.strftime('%m/%d') for day in days]
+    chart_data = [daily.get(day) for day in days]
     
     context = {
         'total_terminals': total_terminals,
@@ -113,6 +125,7 @@ def terminal_list_view(request):
     paginator = Paginator(terminals, 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    get_liveness_store().apply(page_obj.object_list)
     
     customers = Customer.objects.all()
     
@@ -128,6 +141,7 @@ def terminal_list_view(request):
 @login_required
 def terminal_detail_view(request, terminal_id):
     terminal = get_object_or_404(Terminal.objects.select_related('customer'), id=terminal_id)
+    get_liveness_store().apply([terminal])
     recent_logs = TerminalLog.objects.filter(terminal=terminal).order_by('-created_at')[:10]
     active_alerts = Alert.objects.filter(terminal=terminal, is_resolved=False).order_by('-created_at')
     
@@ -206,13 +220,7 @@ def customer_detail_view(request, customer_id):
     customer = get_object_or_404(Customer, id=customer_id)
     terminals = Terminal.objects.filter(customer=customer).order_by('-last_heartbeat')[:10]
     
-    all_terminals = Terminal.objects.filter(customer=customer)
-    terminal_stats = {
-        'total': all_terminals.count(),
-        'online': all_terminals.filter(status='online').count(),
-        'offline': all_terminals.filter(status='offline').count(),
-        'error': all_terminals.filter(status='error').count(),
-    }
+    terminal_stats = fleet_counts([customer.id]).customer(customer.id)
     
     context = {
         'customer': customer,
@@ -247,22 +255,70 @@ def firmware_list_view(request):
     return render(request, 'terminals/firmware_list.html', context)
 
 
+@csrf_exempt
 @login_required
 def firmware_upload_view(request):
+    # The CSRF check reads request.POST, so it runs once the streaming handler is in place
     if request.method == 'POST':
-        pass
-    
+        request.upload_handlers = [BlobUploadHandler(request)]
+    return _firmware_upload(request)
+
+
+@csrf_protect
+def _firmware_upload(request):
+    """
+    Register a firmware image. The file is hashed while it streams into the
+    content-addressed blob store (see terminals.blobstore); the
+    FirmwareVersion row is created once the blob is in place.
+    """
+    if request.method != 'POST':
+        return redirect('firmware_list')
+    
+    upload = request.FILES.get('file')
+    version = request.POST.get('version', '').strip()
+    for name, uploaded in request.FILES.items():
+        if isinstance(uploaded, UploadedBlob) and (name != 'file' or not version):
+            discard(uploaded.pending.temp_path)
+    if not isinstance(upload, UploadedBlob) or not version:
+        messages.error(request, 'A version and a firmware file are required.')
+        return redirect('firmware_list')
+    
+    pending = upload.pending
+    store = get_blob_store()
+    created = store.commit(pending)
+    try:
+        with transaction.atomic():
+            firmware = FirmwareVersion.objects.create(
+                version=version,
+                model=request.POST.get('model') or 'TC-200',
+                file_name=upload.name,
+                file_size=pending.size,
+                file_hash=pending.sha256,
+                release_notes=request.POST.get('release_notes', ''),
+                released_date=timezone.now().date(),
+                created_by=request.user.username
+            )
+    except IntegrityError:
+        # Keep the blob only if another version already uses it
+        if created and not FirmwareVersion.objects.filter(file_hash=pending.sha256).exists():
+            store.delete(pending.sha256)
+        messages.error(request, f'Firmware version {version} already exists.')
+        return redirect('firmware_list')
+    
+    messages.success(request, f'Firmware {firmware.version} uploaded (sha256 {pending.sha256[:12]}...).')
     return redirect('firmware_list')
 
 
 @login_required
 def reports_view(request):
-    total_terminals = Terminal.objects.count()
-    online_terminals = Terminal.objects.filter(status='online').count()
-    total_alerts = Alert.objects.filter(is_resolved=False).count()
-    total_customers = Customer.objects.count()
+    customers = list(Customer.objects.all())
+    stats = fleet_counts(customer.id for customer in customers)
+    total_terminals = stats.overall['total']
+    online_terminals = stats.overall['online']
+    total_alerts = unresolved_alert_counts()['total']
+    total_customers = len(customers)
     
-    online_percentage = round((online_terminals / total_terminals * 100) if total_terminals > 0 else 0, 1)
+    online_percentage = rate(online_terminals, total_terminals)
     
     summary = {
         'total_terminals': total_terminals,
@@ -273,11 +329,10 @@ def reports_view(request):
     }
     
     availability_by_customer = []
-    for customer in Customer.objects.all():
-        terminals = Terminal.objects.filter(customer=customer)
-        total = terminals.count()
-        online = terminals.filter(status='online').count()
-        availability = round((online / total * 100) if total > 0 else 0, 1)
+    for customer in customers:
+        counts = stats.customer(customer.id)
+        total = counts['total']
+        availability = rate(counts['online'], total)
         
         availability_by_customer.append({
             'customer_name': customer.company_name,
@@ -292,7 +347,7 @@ def reports_view(request):
     firmware_distribution = []
     firmware_counts = Terminal.objects.values('firmware_version').annotate(count=Count('id'))
     for item in firmware_counts:
-        percentage = round((item['count'] / total_terminals * 100) if total_terminals > 0 else 0, 1)
+        percentage = rate(item['count'], total_terminals)
         firmware_distribution.append({
             'version': item['firmware_version'] or 'Unknown',
             'count': item['count'],
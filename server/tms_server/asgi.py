@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tms_server.settings')
+# Agent ingestion endpoints run as async views under ASGI (see terminals.async_views)
+os.environ.setdefault('TMS_AGENT_ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
+
+from terminals.liveness import start_flusher  # noqa: E402
+
+start_flusher()
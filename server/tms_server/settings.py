@@ -55,6 +55,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'terminals.middleware.AuditLoggingMiddleware',
     'terminals.middleware.SecurityHeadersMiddleware',
+    'terminals.middleware.AgentConcurrencyLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'tms_server.urls'
@@ -70,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'terminals.context_processors.alert_badge',
             ],
         },
     },
@@ -137,6 +139,7 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
+    'EXCEPTION_HANDLER': 'terminals.exceptions.api_exception_handler',
 }
 
 # JWT Configuration
@@ -156,6 +159,161 @@ CORS_ALLOWED_ORIGINS = [
 ]
 CORS_ALLOW_CREDENTIALS = True
 
+# Cache
+# Shared Redis cache when REDIS_URL is set, per-process memory cache otherwise
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Agent ingestion
+TMS_HEARTBEAT_BATCH_MAX_SIZE = int(os.environ.get('TMS_HEARTBEAT_BATCH_MAX_SIZE', '1000'))
+TMS_AGENT_LOGS_MAX_BATCH_SIZE = int(os.environ.get('TMS_AGENT_LOGS_MAX_BATCH_SIZE', '5000'))
+TMS_AGENT_LOGS_CHUNK_SIZE = int(os.environ.get('TMS_AGENT_LOGS_CHUNK_SIZE', '500'))
+# Largest agent request body accepted after gzip decompression
+TMS_AGENT_MAX_DECODED_BYTES = int(os.environ.get('TMS_AGENT_MAX_DECODED_BYTES', str(16 * 1024 * 1024)))
+
+# Seconds a "no pending commands" marker is trusted before the heartbeat re-checks the DB
+TMS_PENDING_MARKER_IDLE_TTL = int(os.environ.get('TMS_PENDING_MARKER_IDLE_TTL', '900'))
+
+# Long-poll command delivery: longest a request is parked, and how often other
+# processes' markers are re-checked while parked. The endpoint is only routed
+# with TMS_AGENT_ASYNC_VIEWS (ASGI); agents opt in with command_wait_timeout.
+TMS_COMMAND_WAIT = {
+    'MAX_WAIT': int(os.environ.get('TMS_COMMAND_WAIT_MAX', '55')),
+    'POLL_INTERVAL': int(os.environ.get('TMS_COMMAND_WAIT_POLL_INTERVAL', '2')),
+}
+
+# Deployments: tasks are materialized on contact and by deployment passes (BATCH_SIZE
+# rows per INSERT, every INTERVAL seconds), which rollout waves wait for. The server
+# runs them without Redis; with Redis run the materialize_deployments --loop worker.
+# Rollout defaults for deploy requests that do not set them: canary wave size,
+# wave growth factor, concurrent downloads and the failure rate (%) that pauses
+# a rollout once MIN_WAVE_SAMPLE tasks of the wave have finished. Terminals
+# waiting for a download slot re-check every SLOT_RETRY seconds.
+TMS_DEPLOYMENTS = {
+    'BATCH_SIZE': int(os.environ.get('TMS_DEPLOYMENT_BATCH_SIZE', '1000')),
+    'INTERVAL': int(os.environ.get('TMS_DEPLOYMENT_INTERVAL', '30')),
+    'CACHE_TTL': 10,
+    'CONTACT_MARKER_TTL': 86400,
+    'CANARY_PERCENT': float(os.environ.get('TMS_DEPLOYMENT_CANARY_PERCENT', '5')),
+    'WAVE_GROWTH': float(os.environ.get('TMS_DEPLOYMENT_WAVE_GROWTH', '2')),
+    'MAX_CONCURRENT': int(os.environ.get('TMS_DEPLOYMENT_MAX_CONCURRENT', '200')),
+    'MAX_FAILURE_RATE': float(os.environ.get('TMS_DEPLOYMENT_MAX_FAILURE_RATE', '10')),
+    'MIN_WAVE_SAMPLE': 5,
+    'SLOT_RETRY': 60,
+    # Seconds a claimed rollout task may run without a result before the
+    # worker requeues it (or fails it once its retries are used up)
+    'TASK_TIMEOUT': int(os.environ.get('TMS_DEPLOYMENT_TASK_TIMEOUT', '3600')),
+    # Seconds a wave may stay unfinished: past it the rollout moves on when
+    # WAVE_COMPLETION_PERCENT of the wave finished, and pauses otherwise
+    'WAVE_TIMEOUT': int(os.environ.get('TMS_DEPLOYMENT_WAVE_TIMEOUT', '86400')),
+    'WAVE_COMPLETION_PERCENT': float(os.environ.get('TMS_DEPLOYMENT_WAVE_COMPLETION_PERCENT', '95')),
+}
+
+# Firmware images served by /agent/firmware/<id>/download: uploaded blobs under
+# ROOT/sha256/, or images copied by hand as ROOT/<file_name>.
+# ACCEL_REDIRECT: internal nginx location aliased to ROOT, to let nginx send the files.
+TMS_FIRMWARE_DOWNLOADS = {
+    'ROOT': os.environ.get('TMS_FIRMWARE_ROOT', str(BASE_DIR / 'firmware')),
+    'ACCEL_REDIRECT': os.environ.get('TMS_FIRMWARE_ACCEL_REDIRECT', ''),
+}
+
+# Largest firmware image accepted by the streaming upload (bytes)
+TMS_FIRMWARE_MAX_UPLOAD_BYTES = int(os.environ.get('TMS_FIRMWARE_MAX_UPLOAD_BYTES', str(2 * 1024 ** 3)))
+
+# Firmware patches larger than this fraction of the full image are not offered
+TMS_FIRMWARE_PATCH_MAX_RATIO = float(os.environ.get('TMS_FIRMWARE_PATCH_MAX_RATIO', '0.8'))
+
+# Serve heartbeat/logs/command-result through the async views (terminals.async_views).
+# tms_server.asgi turns this on; WSGI deployments keep the sync DRF views.
+TMS_AGENT_ASYNC_VIEWS = os.environ.get('TMS_AGENT_ASYNC_VIEWS', 'False') == 'True'
+
+# Liveness store: heartbeat fields are coalesced and flushed every FLUSH_INTERVAL seconds.
+# The local backend serves one process, which holds LOCK_FILE (see terminals.liveness).
+TMS_LIVENESS = {
+    'BACKEND': os.environ.get('TMS_LIVENESS_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'local'),
+    'REDIS_ALIAS': 'default',
+    'FLUSH_INTERVAL': int(os.environ.get('TMS_LIVENESS_FLUSH_INTERVAL', '10')),
+    'FLUSH_BATCH_SIZE': 500,
+    'TTL': 86400,
+    'LOCK_FILE': os.environ.get('TMS_LIVENESS_LOCK_FILE', str(BASE_DIR / 'liveness.lock')),
+}
+
+# Admission control for agent endpoints, keyed by URL name. RATES are token
+# buckets as (rate, burst) per serial number and shared by all callers;
+# CONCURRENCY caps in-flight requests per server process.
+TMS_AGENT_ADMISSION = {
+    'RATES': {
+        'agent-register': {'PER_SERIAL': ('6/min', 3), 'GLOBAL': ('50/s', 200)},
+        'agent-heartbeat': {'PER_SERIAL': ('2/min', 5), 'GLOBAL': ('500/s', 1000)},
+        'agent-heartbeat-batch': {'PER_SERIAL': None, 'GLOBAL': ('50/s', 100)},
+        'agent-logs': {'PER_SERIAL': ('100/min', 100), 'GLOBAL': ('200/s', 400)},
+        'agent-command-result': {'PER_SERIAL': None, 'GLOBAL': ('200/s', 400)},
+        'agent-command-wait': {'PER_SERIAL': ('6/min', 3), 'GLOBAL': ('200/s', 400)},
+    },
+    'CONCURRENCY': {
+        'agent-logs': int(os.environ.get('TMS_AGENT_LOGS_CONCURRENCY', '4')),
+        'agent-heartbeat-batch': int(os.environ.get('TMS_AGENT_BATCH_CONCURRENCY', '4')),
+        'agent-command-wait': int(os.environ.get('TMS_AGENT_COMMAND_WAIT_CONCURRENCY', '2000')),
+    },
+}
+
+# Heartbeat scheduling: intervals stretch (up to MAX_STRETCH) while the ingest
+# latency EWMA is above TARGET_LATENCY_MS. Keep MAX_STRETCH x 1.25 below
+# TMS_OFFLINE_SWEEP['MISSED_HEARTBEATS'] so stretched terminals are not swept.
+TMS_HEARTBEAT_SCHEDULE = {
+    'TARGET_LATENCY_MS': int(os.environ.get('TMS_HEARTBEAT_TARGET_LATENCY_MS', '200')),
+    'MAX_STRETCH': float(os.environ.get('TMS_HEARTBEAT_MAX_STRETCH', '2.0')),
+    'EWMA_ALPHA': 0.1,
+}
+
+# Offline sweeper: a terminal silent for MISSED_HEARTBEATS x heartbeat_interval is marked offline
+TMS_OFFLINE_SWEEP = {
+    'MISSED_HEARTBEATS': int(os.environ.get('TMS_OFFLINE_MISSED_HEARTBEATS', '3')),
+    'INTERVAL': int(os.environ.get('TMS_OFFLINE_SWEEP_INTERVAL', '60')),
+    'BATCH_SIZE': 1000,
+}
+
+# Cached fleet counters (terminals.counters): seconds between verify_counters --loop runs
+# with a shared cache, or lifetime of the counters in a per-process cache
+TMS_COUNTERS = {
+    'VERIFY_INTERVAL': int(os.environ.get('TMS_COUNTERS_VERIFY_INTERVAL', '300')),
+}
+
+# Uptime percentage promised per Customer.contract_type (SLA report)
+TMS_SLA_TARGETS = {
+    'basic': 95.0,
+    'standard': 99.0,
+    'premium': 99.5,
+}
+
+# Serial number -> terminal resolution cache for agent endpoints (SHARED_TIMEOUT=0 disables the shared tier)
+TMS_SERIAL_CACHE = {
+    'MAX_SIZE': int(os.environ.get('TMS_SERIAL_CACHE_MAX_SIZE', '20000')),
+    'LOCAL_TTL': int(os.environ.get('TMS_SERIAL_CACHE_LOCAL_TTL', '60')),
+    'SHARED_TIMEOUT': int(os.environ.get('TMS_SERIAL_CACHE_SHARED_TIMEOUT', '3600')),
+}
+
+# Heartbeat metric time series retention per tier (compact_metrics command)
+TMS_METRICS = {
+    'RAW_RETENTION_DAYS': int(os.environ.get('TMS_METRICS_RAW_RETENTION_DAYS', '2')),
+    'HOURLY_RETENTION_DAYS': int(os.environ.get('TMS_METRICS_HOURLY_RETENTION_DAYS', '35')),
+    'DAILY_RETENTION_DAYS': int(os.environ.get('TMS_METRICS_DAILY_RETENTION_DAYS', '400')),
+}
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
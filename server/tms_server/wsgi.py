@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tms_server.settings')
 
 application = get_wsgi_application()
+
+from terminals.liveness import start_flusher  # noqa: E402
+
+start_flusher()